@@ -1,28 +1,58 @@
-import boto3
 import base64
 import json
+import os
+import sys
+from typing import Optional
 
-def categorize_receipt_with_bedrock(image_path: str, categories: list[str]) -> str:
+import aws_clients
+import expense_model
+import model_router
+import vendor_index
+
+def categorize_from_vendor_index(vendor: str, categories: list[str], user_id: Optional[str] = None) -> Optional[str]:
+    """
+    The category learned for a vendor from saved and corrected expenses,
+    spelled as in ``categories``, or None if the index has no answer.
+    """
+    match = vendor_index.lookup(vendor, user_id)
+    if match is None:
+        return None
+    for category in categories:
+        if expense_model.parse_category(category).value == match.category:
+            return category
+    return None
+
+def categorize_receipt_with_bedrock(image_path: str, categories: list[str],
+                                    vendor: Optional[str] = None, user_id: Optional[str] = None) -> str:
     """
-    Categorizes a receipt image using AWS Bedrock (Anthropic Claude 3 Haiku).
+    Categorizes a receipt image using AWS Bedrock (Anthropic Claude 3 Haiku by default).
 
     Args:
         image_path: The path to the receipt image file (e.g., "receipt.jpg").
         categories: A list of categories to classify the receipt into.
+        vendor: The vendor, if already known; a vendor the index has learned
+            is answered without calling the model.
+        user_id: Whose corrections to prefer over the global index.
 
     Returns:
         The categorized receipt as a string.
     """
+    if vendor:
+        category = categorize_from_vendor_index(vendor, categories, user_id)
+        if category is not None:
+            return category
+
     try:
-        # Initialize Bedrock runtime client
-        bedrock_runtime = boto3.client(
-            service_name="bedrock-runtime",
+        # Shared Bedrock runtime client, reused across calls
+        bedrock_runtime = aws_clients.client(
+            "bedrock-runtime",
             region_name="us-east-1" # You might need to change this to your region
         )
 
         # Read the image file and encode it in base64
         with open(image_path, "rb") as image_file:
-            encoded_image = base64.b64encode(image_file.read()).decode("utf-8")
+            image_bytes = image_file.read()
+        encoded_image = base64.b64encode(image_bytes).decode("utf-8")
 
         # Construct the prompt for Claude 3 Haiku
         # The prompt instructs the model to analyze the image and categorize it.
@@ -54,14 +84,13 @@ def categorize_receipt_with_bedrock(image_path: str, categories: list[str]) -> s
             ]
         })
 
-        model_id = "anthropic.claude-3-haiku-20240307-v1:0" # Or other free Claude 3 model if available
-
-        response = bedrock_runtime.invoke_model(
+        # The model comes from BEDROCK_MODELS; throttling is retried and fails over.
+        response, _ = model_router.invoke(lambda model_id: bedrock_runtime.invoke_model(
             body=body,
             modelId=model_id,
             accept="application/json",
             contentType="application/json"
-        )
+        ), len(image_bytes))
 
         response_body = json.loads(response.get("body").read())
         
@@ -104,9 +133,9 @@ if __name__ == "__main__":
         "Other"
     ]
     
-    # IMPORTANT: Replace 'path/to/your/receipt.jpg' with the actual path to your receipt image.
-    # For this example, I'm assuming 'receipt.jpg' is in the 'backend' directory.
-    receipt_image_path = "/Users/telesoft/SmartReceipts/smartReceiptsTracker/backend/images/receipt5.jpg" 
+    # Pass a receipt image path, or use one of the sample receipts.
+    receipt_image_path = (sys.argv[1] if len(sys.argv) > 1
+                          else os.path.join(os.path.dirname(os.path.abspath(__file__)), 'images', 'receipt5.jpg'))
     
     print(f"Attempting to categorize: {receipt_image_path}")
     categorized_result = categorize_receipt_with_bedrock(receipt_image_path, categories)
@@ -0,0 +1,132 @@
+import threading
+
+import boto3
+from botocore.config import Config
+
+import instrumentation
+
+# Per-service botocore settings. Pools are sized for the batch workers,
+# keep-alive avoids re-handshaking on warm containers, and timeouts are
+# tight for DynamoDB/S3 but long enough for a full Bedrock completion.
+SERVICE_CONFIGS = {
+    'dynamodb': Config(
+        max_pool_connections=50,
+        tcp_keepalive=True,
+        connect_timeout=2,
+        read_timeout=5,
+        retries={'mode': 'standard', 'max_attempts': 5},
+    ),
+    's3': Config(
+        max_pool_connections=50,
+        tcp_keepalive=True,
+        connect_timeout=2,
+        read_timeout=15,
+        retries={'mode': 'standard', 'max_attempts': 3},
+        # SigV4 signs Content-Type and Content-Length into presigned
+        # upload URLs, so S3 enforces them.
+        signature_version='s3v4',
+    ),
+    'bedrock-runtime': Config(
+        max_pool_connections=32,
+        tcp_keepalive=True,
+        connect_timeout=3,
+        read_timeout=60,
+        # Throttling is retried with jittered backoff by the caller.
+        retries={'mode': 'standard', 'total_max_attempts': 1},
+    ),
+    'sqs': Config(
+        max_pool_connections=20,
+        tcp_keepalive=True,
+        connect_timeout=2,
+        # Longer than the 20 second long-poll receive.
+        read_timeout=25,
+        retries={'mode': 'standard', 'max_attempts': 5},
+    ),
+    'ses': Config(
+        max_pool_connections=20,
+        tcp_keepalive=True,
+        connect_timeout=2,
+        read_timeout=10,
+        retries={'mode': 'standard', 'max_attempts': 5},
+    ),
+}
+
+_lock = threading.Lock()
+_clients = {}
+_resources = {}
+_tables = {}
+_overrides = {}
+_boto_session = None
+
+
+def _session():
+    # One explicit session for every client and resource, created on first
+    # use. Callers hold _lock: creating a session is not thread-safe.
+    global _boto_session
+    if _boto_session is None:
+        _boto_session = boto3.session.Session()
+    return _boto_session
+
+
+def client(service_name, region_name=None):
+    """Return a shared, lazily created boto3 client for ``service_name``."""
+    key = ('client', service_name, region_name)
+    if key in _overrides:
+        return _overrides[key]
+    cached = _clients.get(key)
+    if cached is not None:
+        return cached
+    # Session and client creation are not thread-safe, and the batch
+    # workers may race to create the first client.
+    with _lock:
+        if key not in _clients:
+            _clients[key] = instrumentation.instrument_botocore(_session().client(
+                service_name, region_name=region_name, config=SERVICE_CONFIGS.get(service_name)))
+        return _clients[key]
+
+
+def resource(service_name, region_name=None):
+    """Return a shared, lazily created boto3 resource for ``service_name``."""
+    key = ('resource', service_name, region_name)
+    if key in _overrides:
+        return _overrides[key]
+    cached = _resources.get(key)
+    if cached is not None:
+        return cached
+    with _lock:
+        if key not in _resources:
+            _resources[key] = _session().resource(
+                service_name, region_name=region_name, config=SERVICE_CONFIGS.get(service_name))
+            instrumentation.instrument_botocore(_resources[key].meta.client)
+        return _resources[key]
+
+
+def table(table_name):
+    """Return a cached DynamoDB ``Table`` object."""
+    cached = _tables.get(table_name)
+    if cached is None:
+        cached = _tables[table_name] = resource('dynamodb').Table(table_name)
+    return cached
+
+
+def override_client(service_name, replacement, region_name=None):
+    """Serve ``replacement`` instead of a real client (local runs and benchmarks)."""
+    _overrides[('client', service_name, region_name)] = instrumentation.instrument_stand_in(replacement, service_name)
+
+
+def override_resource(service_name, replacement, region_name=None):
+    """Serve ``replacement`` instead of a real resource (local runs and benchmarks)."""
+    _overrides[('resource', service_name, region_name)] = instrumentation.instrument_stand_in(
+        replacement, service_name)
+    _tables.clear()
+
+
+def reset():
+    """Forget the session and every cached client, resource, table and override."""
+    global _boto_session
+    with _lock:
+        _clients.clear()
+        _resources.clear()
+        _tables.clear()
+        _overrides.clear()
+        _boto_session = None
@@ -0,0 +1,178 @@
+import base64
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import aws_clients
+import instrumentation
+import model_router
+import receipt_extraction as extraction
+import expense_aggregates
+import receipt_fingerprints
+import recurring_expenses
+import search_index
+import vendor_index
+from expense_model import Expense
+from receipt_storage import store_receipt_image
+
+TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
+
+# Concurrent Bedrock calls per invocation. Keep this at or under the
+# account's Bedrock throughput and the botocore connection pool size.
+MAX_CONCURRENCY = int(os.environ.get('BATCH_MAX_CONCURRENCY', 8))
+MAX_BATCH_SIZE = int(os.environ.get('BATCH_MAX_ITEMS', 500))
+# Stop starting new receipts when the invocation is this close to timing out.
+DEADLINE_MARGIN_MS = int(os.environ.get('BATCH_DEADLINE_MARGIN_MS', 15000))
+
+def _remaining_ms(context):
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return float('inf')
+    return context.get_remaining_time_in_millis()
+
+def process_receipt(index, receipt, deadline):
+    """
+    Upload (if needed) and extract one receipt. Runs on a worker thread, so it
+    only touches thread-safe boto3 clients, never the DynamoDB table.
+    """
+    result = {'index': index}
+    try:
+        if time.monotonic() >= deadline:
+            result.update(status='skipped', error='Batch ran out of time; resubmit this receipt.')
+            return result
+
+        s3_key = receipt.get('s3_key')
+        if not s3_key:
+            image_bytes = base64.b64decode(receipt['image_data'])
+            s3_key, _ = store_receipt_image(image_bytes, receipt.get('file_name'))
+        result['s3_key'] = s3_key
+
+        image_bytes, media_type = extraction.get_inference_image(s3_key)
+        if not image_bytes:
+            result.update(status='failed', error='Could not retrieve image from S3.')
+            return result
+
+        if receipt_fingerprints.index is not None:
+            # Hashed here, off the main thread; matched there.
+            result['hashes'] = receipt_fingerprints.fingerprint(image_bytes)
+        extracted_data, cache_tier, _, _ = extraction.extract_receipt([s3_key], [(image_bytes, media_type)])
+        if extracted_data == extraction.NOT_APPLICABLE_RESULT:
+            result.update(status='failed', error='Could not extract receipt data.')
+            return result
+
+        result.update(status='extracted', extracted_data=extracted_data, cached=cache_tier is not None)
+    except KeyError as e:
+        result.update(status='failed', error=f'Missing key in receipt: {e}')
+    except Exception as e:
+        result.update(status='failed', error=str(e))
+    return result
+
+def check_duplicate(user_id, result, hashes):
+    """
+    Flag a receipt whose vendor/amount/date match one of the user's earlier
+    receipts. A copy of the image of a receipt that is already saved is not
+    saved again, which would count it twice in the aggregates; a retake is
+    saved and left to the user.
+    """
+    if hashes:
+        receipt_fingerprints.check(user_id, result['s3_key'], hashes=hashes)
+    match = receipt_fingerprints.record_extraction(user_id, result['s3_key'], result['extracted_data'])
+    if match is None:
+        return
+    result['duplicateOf'] = receipt_fingerprints.describe(match)
+    if match.distance <= receipt_fingerprints.MAX_DISTANCE and match.entry.get('expenseId'):
+        result['status'] = 'duplicate'
+
+def build_expense_item(user_id, s3_key, extracted_data):
+    # Model output is best effort: keep what parses rather than rejecting the receipt.
+    expense = Expense.from_event(dict(extracted_data, userId=user_id, s3_key=s3_key), strict=False)
+    expense.new_id()
+    return expense.to_item()
+
+@instrumentation.traced
+def lambda_handler(event, context):
+    try:
+        user_id = event.get('userId')
+        receipts = event.get('receipts')
+
+        if not user_id or not isinstance(receipts, list) or not receipts:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'userId and a non-empty receipts list are required.'})
+            }
+        if len(receipts) > MAX_BATCH_SIZE:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': f'At most {MAX_BATCH_SIZE} receipts per batch.'})
+            }
+
+        save = event.get('save', True)
+        try:
+            concurrency = int(event.get('concurrency', MAX_CONCURRENCY))
+        except (TypeError, ValueError):
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'concurrency must be an integer.'})
+            }
+        concurrency = max(1, min(concurrency, MAX_CONCURRENCY))
+        deadline = time.monotonic() + (_remaining_ms(context) - DEADLINE_MARGIN_MS) / 1000.0
+        model_router.set_deadline(context)
+
+        table = aws_clients.table(TABLE_NAME)
+        results = []
+        saved_items = []
+        # Workers extract in parallel; results are written from this thread
+        # as they complete, batched 25 at a time by batch_writer.
+        with ThreadPoolExecutor(max_workers=concurrency) as pool, table.batch_writer() as writer:
+            # A copy of this context each, so Bedrock calls keep the invocation's deadline.
+            futures = [pool.submit(contextvars.copy_context().run, process_receipt, i, receipt, deadline)
+                       for i, receipt in enumerate(receipts)]
+            for future in futures:
+                result = future.result()
+                hashes = result.pop('hashes', None)
+                if result['status'] == 'extracted':
+                    result['extracted_data'] = extraction.apply_vendor_index(result['extracted_data'], user_id)
+                    check_duplicate(user_id, result, hashes)
+                if save and result['status'] == 'extracted':
+                    item = build_expense_item(user_id, result['s3_key'], result['extracted_data'])
+                    writer.put_item(Item=item)
+                    saved_items.append(item)
+                    result.update(status='saved', expenseId=item['expenseId'])
+                    receipt_fingerprints.record_expense(user_id, result['s3_key'], item['expenseId'])
+                results.append(result)
+
+        # One counter update per touched bucket for the whole batch.
+        if saved_items:
+            try:
+                expense_aggregates.apply_changes(user_id, [(None, item) for item in saved_items])
+            except Exception as e:
+                print(f"Error updating spending aggregates for {user_id}: {e}")
+            search_index.record_changes(user_id, [(None, item) for item in saved_items])
+            recurring_expenses.record_changes(user_id, [(None, item) for item in saved_items])
+            # Like a save, each vendor/category pair is a vote, but once per
+            # import, so one large import does not outvote the user's edits.
+            seen = set()
+            for item in saved_items:
+                pair = (vendor_index.normalize_vendor(item.get('vendor')), item.get('category'))
+                if pair not in seen:
+                    seen.add(pair)
+                    vendor_index.record_change(user_id, None, item)
+
+        counts = {}
+        for result in results:
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Batch processed',
+                'counts': counts,
+                'results': results
+            })
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
@@ -1,107 +1,139 @@
 import json
-import os
-import boto3
-import base64
+from urllib.parse import unquote_plus
 
-s3_client = boto3.client('s3')
-bedrock_runtime = boto3.client('bedrock-runtime')
+import aws_clients
+import instrumentation
+import extraction_jobs
+import model_router
+import receipt_extraction as extraction
+import receipt_fingerprints
+import receipt_segments
+import job_queue
+from image_preprocessing import derivative_key, prepare_inference_image
+from receipt_storage import store_view_images
 
-S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
+# With a jobs table and queue configured, extractions can run on the
+# ExtractionWorkerLambda instead of inside the caller's request.
+_queue = job_queue.from_environment()
+extraction_jobs_store = (extraction_jobs.ExtractionJobs(queue=_queue)
+                         if extraction_jobs.JOBS_TABLE_NAME and _queue is not None else None)
 
-def get_image_from_s3(s3_key):
-    try:
-        response = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
-        image_bytes = response['Body'].read()
-        return base64.b64encode(image_bytes).decode('utf-8')
-    except Exception as e:
-        print(f"Error getting image from S3: {e}")
-        return None
-
-def invoke_bedrock_model(image_base64):
-    try:
-        # Define the prompt for Bedrock to extract information
-        prompt = "Extract the vendor name, amount, category (e.g., Food, Transport, Utilities, Entertainment, Groceries, Shopping, Health, Education, Travel, Other), description, and date from this receipt image. If any information is missing or unreadable, use 'Not Applicable'. Provide the output in a JSON format with keys: vendor, amount, category, description, date."
-
-        body = json.dumps({
-            "anthropic_version": "bedrock-2023-05-31",
-            "max_tokens": 2000,
-            "messages": [
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": "image/jpeg", # Assuming JPEG, adjust if other types are supported
-                                "data": image_base64
-                            }
-                        },
-                        {
-                            "type": "text",
-                            "text": prompt
-                        }
-                    ]
-                }
-            ]
-        })
+def handle_object_created(event):
+    """
+    Preprocess and pre-extract receipts as soon as they land in S3, and
+    store their view variants.
 
-        response = bedrock_runtime.invoke_model(
-            body=body,
-            modelId="anthropic.claude-3-haiku-20240307-v1:0", # Using Haiku as per architecture.md
-            accept='application/json',
-            contentType='application/json'
-        )
-
-        response_body = json.loads(response.get('body').read())
-        # Extract the text content from the response
-        bedrock_output = response_body['content'][0]['text']
-
-        # Attempt to parse the JSON output from Bedrock
+    Triggered by s3:ObjectCreated:* on the receipts/ prefix (uploads made
+    straight to S3 with presigned URLs). The derivative is stored for later
+    reads and the extraction is cached, so the client's follow-up call with
+    the s3_key is answered from the cache. With the job queue configured the
+    extraction is queued as a job instead, which the client can poll.
+    """
+    processed = []
+    for record in event['Records']:
+        s3_key = unquote_plus(record['s3']['object']['key'])
+        if not s3_key.startswith('receipts/'):
+            continue
         try:
-            extracted_data = json.loads(bedrock_output)
-        except json.JSONDecodeError:
-            print(f"Bedrock output is not valid JSON: {bedrock_output}")
-            extracted_data = {
-                "vendor": "Not Applicable",
-                "amount": "Not Applicable",
-                "category": "Not Applicable",
-                "description": "Not Applicable",
-                "date": "Not Applicable"
-            }
+            image_bytes = extraction.get_image_from_s3(s3_key)
+            if not image_bytes:
+                continue
+            with instrumentation.phase('preprocess'):
+                inference_bytes, media_type = prepare_inference_image(image_bytes)
+            aws_clients.client('s3').put_object(
+                Bucket=extraction.S3_BUCKET_NAME,
+                Key=derivative_key(s3_key, 'inference'),
+                Body=inference_bytes,
+                ContentType=media_type
+            )
+            store_view_images(s3_key, image_bytes)
+            if extraction_jobs_store is not None:
+                extraction_jobs_store.submit(s3_key)
+            else:
+                extraction.extract_receipt([s3_key], [(inference_bytes, media_type)], originals={s3_key: image_bytes})
+            processed.append(s3_key)
+        except Exception as e:
+            print(f"Error processing uploaded receipt {s3_key}: {e}")
+    return processed
 
-        return extracted_data
-
-    except Exception as e:
-        print(f"Error invoking Bedrock model: {e}")
+@instrumentation.traced
+def lambda_handler(event, context):
+    model_router.set_deadline(context)
+    if 'Records' in event:
+        processed = handle_object_created(event)
         return {
-            "vendor": "Not Applicable",
-            "amount": "Not Applicable",
-            "category": "Not Applicable",
-            "description": "Not Applicable",
-            "date": "Not Applicable"
+            'statusCode': 200,
+            'body': json.dumps({'message': f'Processed {len(processed)} uploaded receipts.', 's3_keys': processed})
         }
 
-def lambda_handler(event, context):
     try:
-        # When invoked directly, the payload is the event itself
-        s3_key = event['s3_key']
+        # When invoked directly, the payload is the event itself. A receipt
+        # photographed in parts is given as 's3_keys', in reading order.
+        s3_keys = event['s3_keys'] if 's3_keys' in event else [event['s3_key']]
+        if (not isinstance(s3_keys, list) or not 1 <= len(s3_keys) <= receipt_segments.MAX_PAGES
+                or not all(isinstance(key, str) and key for key in s3_keys)):
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': f's3_keys must be a list of 1 to {receipt_segments.MAX_PAGES} keys.'})
+            }
+        s3_key = s3_keys[0]
+
+        # 'async' returns a job at once instead of waiting on the model;
+        # poll GetExtractionJobLambda for the result.
+        if event.get('async') and extraction_jobs_store is not None:
+            if len(s3_keys) > 1:
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps({'error': 'async takes a single s3_key.'})
+                }
+            priority = event.get('priority', 'high')
+            if priority not in job_queue.PRIORITIES:
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps({'error': f"priority must be one of {', '.join(job_queue.PRIORITIES)}."})
+                }
+            job, created = extraction_jobs_store.submit(
+                s3_key, priority=priority, refresh=bool(event.get('refresh')), user_id=event.get('userId'))
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': 'Extraction job queued' if created else 'Extraction job already exists',
+                    'job': extraction_jobs.to_response(job)
+                })
+            }
 
-        image_base64 = get_image_from_s3(s3_key)
-        if not image_base64:
+        pages = [extraction.get_inference_image(key) for key in s3_keys]
+        if not all(page[0] for page in pages):
             return {
                 'statusCode': 500,
                 'body': json.dumps({'error': 'Could not retrieve image from S3.'})
             }
 
-        extracted_data = invoke_bedrock_model(image_base64)
+        user_id = event.get('userId')
+        refresh = bool(event.get('refresh'))
+        policy = event.get('duplicates', receipt_fingerprints.DUPLICATE_POLICY)
+        if policy not in receipt_fingerprints.POLICIES:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': f"duplicates must be one of {', '.join(receipt_fingerprints.POLICIES)}."})
+            }
+        # 'refresh' lets the client force a fresh extraction for a bad result.
+        extracted_data, cache_tier, segment_count, items, duplicate = extraction.extract_for_user(
+            user_id, s3_keys, pages, policy=policy, refresh=refresh)
 
+        body = {
+            'message': 'Data extracted successfully',
+            'extracted_data': extracted_data,
+            'cached': cache_tier is not None
+        }
+        if items is not None:
+            body['segments'] = segment_count
+            body['line_items'] = items
+        if duplicate is not None:
+            body['duplicateOf'] = duplicate
         return {
             'statusCode': 200,
-            'body': json.dumps({
-                'message': 'Data extracted successfully',
-                'extracted_data': extracted_data
-            })
+            'body': json.dumps(body)
         }
     except KeyError as e:
         return {
@@ -0,0 +1,9 @@
+"""Offline benchmarks for the Smart Receipts Lambda handlers.
+
+Run a benchmark from the ``backend`` directory, e.g.::
+
+    python -m benchmarks.bench_get_expenses
+
+The handlers are imported in-process and pointed at the in-memory AWS
+stand-ins from ``benchmarks.local_aws``, so no AWS account is needed.
+"""
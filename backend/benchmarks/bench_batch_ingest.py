@@ -0,0 +1,95 @@
+"""Benchmark BatchIngestLambda at different worker pool sizes.
+
+Each run extracts ``--receipts`` distinct receipts that are already in S3
+against a fake Bedrock runtime that takes ``--model-latency`` seconds per call
+and throttles above ``--bedrock-limit`` concurrent calls, then saves them with
+the DynamoDB batch writer. Concurrency 1 approximates today's one-receipt-at-
+a-time flow.
+
+    python -m benchmarks.bench_batch_ingest [--receipts 100] [--concurrency 1 4 8 16]
+"""
+import argparse
+import json
+import os
+import time
+
+from benchmarks.common import BACKEND_DIR, FakeContext, print_table, setup_environment
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import batch_ingest_lambda  # noqa: E402
+import receipt_extraction as extraction  # noqa: E402
+from benchmarks.local_aws import FakeBedrockRuntime, LocalDynamoDB, LocalS3  # noqa: E402
+from extraction_cache import ExtractionCache  # noqa: E402
+from image_preprocessing import derivative_key  # noqa: E402
+
+SAMPLE_IMAGE = os.path.join(BACKEND_DIR, 'images', 'receipt5.jpg')
+
+
+def seed_receipts(s3, count):
+    with open(SAMPLE_IMAGE, 'rb') as f:
+        sample = f.read()
+    keys = []
+    for i in range(count):
+        key = f'receipts/batch-{i:05d}.jpg'
+        # Bytes after the JPEG end marker make every receipt a cache miss.
+        body = sample + f'batch-{i}'.encode()
+        s3.put_object(Bucket=extraction.S3_BUCKET_NAME, Key=key, Body=body, ContentType='image/jpeg')
+        s3.put_object(Bucket=extraction.S3_BUCKET_NAME, Key=derivative_key(key, 'inference'),
+                      Body=body, ContentType='image/jpeg')
+        keys.append(key)
+    return keys
+
+
+def run(receipts, concurrencies, model_latency, bedrock_limit):
+    rows = []
+    for concurrency in concurrencies:
+        s3 = LocalS3()
+        bedrock = FakeBedrockRuntime(latency=model_latency, max_concurrency=bedrock_limit)
+        dynamodb = LocalDynamoDB()
+        table = dynamodb.create_table(batch_ingest_lambda.TABLE_NAME, 'userId', 'expenseId')
+        aws_clients.override_client('s3', s3)
+        aws_clients.override_client('bedrock-runtime', bedrock)
+        aws_clients.override_resource('dynamodb', dynamodb)
+        extraction.extraction_cache = ExtractionCache()
+        keys = seed_receipts(s3, receipts)
+
+        start = time.perf_counter()
+        response = batch_ingest_lambda.lambda_handler({
+            'userId': 'shoebox@example.com',
+            'receipts': [{'s3_key': key} for key in keys],
+            'concurrency': concurrency,
+        }, FakeContext())
+        elapsed = time.perf_counter() - start
+        body = json.loads(response['body'])
+        rows.append({
+            'concurrency': concurrency,
+            'receipts': receipts,
+            'saved': body['counts'].get('saved', 0),
+            'failed': body['counts'].get('failed', 0),
+            'throttles': bedrock.throttles,
+            'peak_in_flight': bedrock.peak_in_flight,
+            'dynamodb_requests': table.request_count,
+            'seconds': round(elapsed, 2),
+            'receipts_per_s': round(receipts / elapsed, 1),
+        })
+
+    print_table(rows, ['concurrency', 'receipts', 'saved', 'failed', 'throttles', 'peak_in_flight',
+                       'dynamodb_requests', 'seconds', 'receipts_per_s'])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--receipts', type=int, default=100)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8, 16])
+    parser.add_argument('--model-latency', type=float, default=0.2)
+    parser.add_argument('--bedrock-limit', type=int, default=10)
+    args = parser.parse_args()
+    batch_ingest_lambda.MAX_CONCURRENCY = max(args.concurrency)
+    run(args.receipts, args.concurrency, args.model_latency, args.bedrock_limit)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Benchmark BulkExpensesLambda against one handler call per expense.
+
+A user with ``--expenses`` stored expenses recategorizes ``--operations`` of
+them, then deletes them, either through UpdateExpenseLambda and
+DeleteExpenseLambda once per expense or through one BulkExpensesLambda call
+(one conditional write per expense, or ``atomic`` TransactWriteItems
+chunks). The table counts one request per DynamoDB call, so the request
+column is what each path would cost against the real service. ``dynamodb_requests`` adds the
+aggregates and vendor index writes, which are one per touched bucket and
+vendor either way.
+
+More checks:
+
+- concurrent edits: every tenth expense is changed through
+  UpdateExpenseLambda after the bulk call read it and before it writes.
+  Those operations should come back as ``conflict`` and the aggregates
+  should still match.
+- throttled: the bulk recategorization against a table that hands back
+  ``--unprocessed-rate`` of every batch as unprocessed. Every operation
+  should still land, after retries.
+- retried creates: ``--operations`` new expenses are sent twice, as a client
+  does when the first response is lost. With idempotency keys the second
+  call creates nothing.
+
+Every scenario checks the stored aggregates against the expenses left.
+
+    python -m benchmarks.bench_bulk_expenses [--expenses 2000] [--operations 1000]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import time
+
+from boto3.dynamodb.conditions import Key
+
+from benchmarks.common import print_table, setup_environment, synthetic_expenses
+
+setup_environment()
+os.environ.setdefault('DYNAMODB_AGGREGATES_TABLE_NAME', 'SmartReceiptsAggregates')
+
+import aws_clients  # noqa: E402
+import bulk_expenses_lambda  # noqa: E402
+import delete_expense_lambda  # noqa: E402
+import expense_aggregates  # noqa: E402
+import save_expense_lambda  # noqa: E402
+import update_expense_lambda  # noqa: E402
+import vendor_index  # noqa: E402
+from benchmarks.local_aws import LocalDynamoDB  # noqa: E402
+
+USER_ID = 'bulk.user@example.com'
+INDEX_TABLE_NAME = 'SmartReceiptsVendorIndex'
+
+
+class Environment:
+    """Fresh tables with ``expenses`` stored expenses and their aggregates."""
+
+    def __init__(self, expenses, unprocessed_rate=0.0, seed=0):
+        self.dynamodb = LocalDynamoDB(unprocessed_rate=unprocessed_rate, seed=seed)
+        self.expenses = self.dynamodb.create_table(save_expense_lambda.TABLE_NAME, 'userId', 'expenseId')
+        self.aggregates = self.dynamodb.create_table(expense_aggregates.AGGREGATES_TABLE_NAME, 'userId', 'bucket')
+        self.index = self.dynamodb.create_table(INDEX_TABLE_NAME, 'scope', 'vendorKey')
+        aws_clients.reset()
+        aws_clients.override_resource('dynamodb', self.dynamodb)
+        vendor_index.index = vendor_index.VendorIndex(INDEX_TABLE_NAME)
+
+        self.items = list(synthetic_expenses(USER_ID, expenses, seed=seed))
+        for item in self.items:
+            self.expenses.put_item(Item=item)
+        expense_aggregates.rebuild_user_aggregates(USER_ID, self.items)
+        for table in (self.expenses, self.aggregates, self.index):
+            table.request_count = 0
+
+    def requests(self):
+        return self.expenses.request_count + self.aggregates.request_count + self.index.request_count
+
+    def aggregates_match(self):
+        """Whether every stored bucket agrees with the expenses in the table."""
+        stored = {item['bucket']: item for item in expense_aggregates.query_buckets(USER_ID)}
+        items = self.expenses.query(KeyConditionExpression=Key('userId').eq(USER_ID))['Items']
+        expected = expense_aggregates.compute_deltas((None, item) for item in items)
+        for bucket in set(stored) | set(expected):
+            item = stored.get(bucket, {})
+            delta = expected.get(bucket, {'total': 0, 'count': 0})
+            if item.get('total', 0) != delta['total'] or item.get('count', 0) != delta['count']:
+                return False
+        return True
+
+
+def recategorized(item):
+    return {'expenseId': item['expenseId'], 'vendor': item['vendor'], 'amount': item['amount'],
+            'category': 'Other', 'description': item['description'], 'date': item['date'],
+            's3_key': item['s3_key']}
+
+
+def run_path(env, name, calls):
+    """Run ``calls`` (a list of (handler, event)) and summarize the outcome."""
+    start = time.perf_counter()
+    statuses = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for handler, event in calls:
+            response = handler(event, None)
+            assert response['statusCode'] == 200, response
+            body = json.loads(response['body'])
+            for status, count in body.get('counts', {'ok': 1}).items():
+                statuses[status] = statuses.get(status, 0) + count
+    return {'scenario': name, 'handler_calls': len(calls), 'expense_table_requests': env.expenses.request_count,
+            'dynamodb_requests': env.requests(),
+            'seconds': round(time.perf_counter() - start, 3), 'statuses': statuses,
+            'stored': len(env.expenses), 'aggregates_ok': env.aggregates_match()}
+
+
+def bulk_event(operations, atomic=False):
+    return {'userId': USER_ID, 'operations': operations, 'atomic': atomic}
+
+
+@contextlib.contextmanager
+def edited_after_read(items):
+    """Change ``items`` through UpdateExpenseLambda right after the bulk call reads them."""
+    read_items = bulk_expenses_lambda.read_items
+    pending = {item['expenseId']: item for item in items}
+
+    def read_then_edit(client, user_id, expense_ids):
+        found, unread = read_items(client, user_id, expense_ids)
+        for expense_id in expense_ids:
+            item = pending.pop(expense_id, None)
+            if item is not None:
+                update_expense_lambda.lambda_handler(dict(recategorized(item), userId=USER_ID, amount='1.00'), None)
+        return found, unread
+
+    bulk_expenses_lambda.read_items = read_then_edit
+    try:
+        yield
+    finally:
+        bulk_expenses_lambda.read_items = read_items
+
+
+def mutation_scenarios(expenses, operations, unprocessed_rate):
+    rows = []
+    for mode in ('per expense', 'bulk', 'bulk atomic', 'bulk, concurrent edits', 'bulk, throttled'):
+        env = Environment(expenses, unprocessed_rate if mode == 'bulk, throttled' else 0.0)
+        targets = env.items[:operations]
+        if mode == 'per expense':
+            updates = [(update_expense_lambda.lambda_handler, dict(recategorized(item), userId=USER_ID))
+                       for item in targets]
+            deletes = [(delete_expense_lambda.lambda_handler, {'userId': USER_ID, 'expenseId': item['expenseId']})
+                       for item in targets]
+        else:
+            atomic = mode == 'bulk atomic'
+            updates = [(bulk_expenses_lambda.lambda_handler,
+                        bulk_event([dict(recategorized(item), op='update') for item in targets], atomic))]
+            deletes = [(bulk_expenses_lambda.lambda_handler,
+                        bulk_event([{'op': 'delete', 'expenseId': item['expenseId']} for item in targets], atomic))]
+        if mode == 'bulk, concurrent edits':
+            with edited_after_read(targets[::10]):
+                row = run_path(env, f'recategorize, {mode}', updates)
+        else:
+            row = run_path(env, f'recategorize, {mode}', updates)
+        stored = [env.expenses.get_item(Key={'userId': USER_ID, 'expenseId': item['expenseId']})['Item']
+                  for item in targets]
+        row['statuses']['category is Other'] = sum(item['category'] == 'Other' for item in stored)
+        if mode == 'bulk, throttled':
+            row['statuses']['unprocessed, retried'] = env.dynamodb.meta.client.unprocessed
+        rows.append(row)
+        for table in (env.expenses, env.aggregates, env.index):
+            table.request_count = 0
+        rows.append(run_path(env, f'delete, {mode}', deletes))
+    return rows
+
+
+def retry_scenarios(expenses, operations):
+    rows = []
+    for keyed in (False, True):
+        env = Environment(expenses)
+        new = [{'op': 'create', 'vendor': 'Starbucks', 'amount': f'{4 + i % 100 / 100:.2f}',
+                'category': 'Food & Dining', 'description': f'Coffee {i}', 'date': '2024-05-01'}
+               for i in range(operations)]
+        if keyed:
+            new = [dict(operation, idempotencyKey=f'import-2024-05#{i}') for i, operation in enumerate(new)]
+        event = bulk_event(new)
+        rows.append(run_path(env, f"create twice, {'with' if keyed else 'without'} idempotency keys",
+                             [(bulk_expenses_lambda.lambda_handler, event)] * 2))
+    return rows
+
+
+def run(expenses, operations, unprocessed_rate):
+    print(f'{expenses} stored expenses, {operations} operations, '
+          f'{unprocessed_rate:.0%} of batch items unprocessed when throttled')
+    rows = mutation_scenarios(expenses, operations, unprocessed_rate) + retry_scenarios(expenses, operations)
+    print_table(rows, ['scenario', 'handler_calls', 'expense_table_requests', 'dynamodb_requests', 'seconds', 'stored', 'aggregates_ok'])
+    print()
+    for row in rows:
+        print(f"{row['scenario']}: {row['statuses']}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--expenses', type=int, default=2000)
+    parser.add_argument('--operations', type=int, default=1000)
+    parser.add_argument('--unprocessed-rate', type=float, default=0.2)
+    args = parser.parse_args()
+    run(args.expenses, args.operations, args.unprocessed_rate)
+
+
+if __name__ == '__main__':
+    main()
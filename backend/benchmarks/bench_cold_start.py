@@ -0,0 +1,163 @@
+"""Benchmark handler cold starts: module import plus the first invocation.
+
+Every sample runs in a fresh interpreter, so it pays the same import and
+client-construction cost a new Lambda container does. Requests never leave
+the process: a ``before-send`` hook on boto3's default session answers them
+with canned responses, so the numbers are client setup and handler code
+only, with no network time.
+
+``--ref`` runs the same handlers from another commit (checked out with
+``git archive`` into a temporary directory) for a before/after comparison.
+
+    python -m benchmarks.bench_cold_start [--runs 15] [--ref ca3b421]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from benchmarks.common import BACKEND_DIR, print_table, setup_environment
+
+# (handler module, event for the first invocation or None to only import it)
+HANDLERS = [
+    ('get_expenses_lambda', {'userId': 'cold@example.com'}),
+    ('save_expense_lambda', {'userId': 'cold@example.com', 'vendor': 'Shell', 'amount': '41.20'}),
+    ('get_user_preferences_lambda', {'userId': 'cold@example.com'}),
+    ('get_presigned_url_lambda', {'s3_key': 'receipts/cold.jpg'}),
+    ('send_notification_lambda', {}),
+    ('bedrock_categorization_lambda', None),
+]
+
+# Runs inside the child interpreter with the handler directory on sys.path.
+CHILD = r'''
+import json, sys, time
+
+start = time.perf_counter()
+import boto3
+import botocore.client
+from botocore.awsrequest import AWSResponse
+
+module_name, event = sys.argv[1], json.loads(sys.argv[2])
+stats = {'clients_created': 0, 'requests': 0}
+
+create_client = botocore.client.ClientCreator.create_client
+def counting_create_client(self, *args, **kwargs):
+    stats['clients_created'] += 1
+    created = create_client(self, *args, **kwargs)
+    # aws_clients holds its own session, so answer on each client instead.
+    created.meta.events.register('before-send', canned_response)
+    return created
+botocore.client.ClientCreator.create_client = counting_create_client
+
+class Raw:
+    def __init__(self, body):
+        self.body = body
+    def stream(self, **kwargs):
+        yield self.body
+
+def canned_response(request, **kwargs):
+    stats['requests'] += 1
+    target = request.headers.get('X-Amz-Target', b'')
+    if isinstance(target, bytes):
+        target = target.decode()
+    body = b'{}'
+    if target.endswith(('.Query', '.Scan')):
+        body = b'{"Items": [], "Count": 0, "ScannedCount": 0}'
+    elif 'Action=GetSendQuota' in str(request.body):
+        # SES speaks the XML query protocol.
+        body = (b'<GetSendQuotaResponse><GetSendQuotaResult><MaxSendRate>14</MaxSendRate>'
+                b'</GetSendQuotaResult></GetSendQuotaResponse>')
+    return AWSResponse(request.url, 200, {'x-amzn-requestid': 'cold-start'}, Raw(body))
+
+boto3_ms = (time.perf_counter() - start) * 1000
+
+class Context:
+    def get_remaining_time_in_millis(self):
+        return 900000
+
+start = time.perf_counter()
+module = __import__(module_name)
+import_ms = (time.perf_counter() - start) * 1000
+import_clients = stats['clients_created']
+
+first_ms = warm_ms = None
+if event is not None:
+    start = time.perf_counter()
+    response = module.lambda_handler(event, Context())
+    first_ms = (time.perf_counter() - start) * 1000
+    assert response['statusCode'] == 200, response
+    start = time.perf_counter()
+    module.lambda_handler(event, Context())
+    warm_ms = (time.perf_counter() - start) * 1000
+
+print(json.dumps({
+    'boto3_ms': boto3_ms, 'import_ms': import_ms, 'first_ms': first_ms, 'warm_ms': warm_ms,
+    'import_clients': import_clients, 'clients_created': stats['clients_created'],
+    'requests': stats['requests'],
+}))
+'''
+
+
+def run_child(handler_dir, module_name, event):
+    output = subprocess.run(
+        [sys.executable, '-c', CHILD, module_name, json.dumps(event)],
+        cwd=handler_dir, env=dict(os.environ, PYTHONPATH=handler_dir),
+        check=True, capture_output=True, text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def measure(label, handler_dir, runs):
+    rows = []
+    for module_name, event in HANDLERS:
+        if not os.path.exists(os.path.join(handler_dir, module_name + '.py')):
+            continue
+        samples = [run_child(handler_dir, module_name, event) for _ in range(runs)]
+
+        def median(field):
+            values = [s[field] for s in samples if s[field] is not None]
+            return round(statistics.median(values), 2) if values else '-'
+
+        cold = [s['import_ms'] + (s['first_ms'] or 0) for s in samples]
+        rows.append({
+            'tree': label,
+            'handler': module_name,
+            'import_ms': median('import_ms'),
+            'first_call_ms': median('first_ms'),
+            'cold_total_ms': round(statistics.median(cold), 2),
+            'warm_call_ms': median('warm_ms'),
+            'clients_at_import': samples[0]['import_clients'],
+            'clients_total': samples[0]['clients_created'],
+        })
+    return rows
+
+
+def export_ref(ref, destination):
+    repo_dir = os.path.dirname(BACKEND_DIR)
+    archive = subprocess.run(['git', 'archive', ref, 'backend'], cwd=repo_dir,
+                             check=True, capture_output=True).stdout
+    subprocess.run(['tar', '-x', '-C', destination], input=archive, check=True)
+    return os.path.join(destination, 'backend')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--runs', type=int, default=15)
+    parser.add_argument('--ref', help='git ref to compare against, e.g. the baseline commit')
+    args = parser.parse_args()
+    setup_environment()
+
+    rows = []
+    if args.ref:
+        with tempfile.TemporaryDirectory() as tmp:
+            rows.extend(measure(args.ref, export_ref(args.ref, tmp), args.runs))
+    rows.extend(measure('working tree', BACKEND_DIR, args.runs))
+    print_table(rows, ['tree', 'handler', 'import_ms', 'first_call_ms', 'cold_total_ms',
+                       'warm_call_ms', 'clients_at_import', 'clients_total'])
+
+
+if __name__ == '__main__':
+    main()
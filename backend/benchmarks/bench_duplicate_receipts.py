@@ -0,0 +1,253 @@
+"""Benchmark near-duplicate receipt detection.
+
+Receipts are drawn as paper slips (a vendor, a random list of items and a
+total) and then "photographed": placed on a dark table at a random offset
+and scale, rotated slightly and saved as JPEG at a random quality. A copy
+of a receipt is one of:
+
+- resent: the same photo again, rescaled and re-encoded, as a chat app or
+  a second device hands it back;
+- screenshot: the same photo saved as PNG;
+- retake: the slip photographed again.
+
+Three parts:
+
+- hashes: hash distances between each kind of copy and its original and
+  between different receipts, with how many fall within
+  RECEIPT_HASH_MAX_DISTANCE.
+- lookup: nearest-hash search among ``--sizes`` stored 256-bit hashes,
+  BK-tree against a linear scan.
+- end to end: a user uploads ``--receipts`` receipts of which
+  ``--duplicate-share`` are copies of earlier ones. Each goes through
+  UploadImageLambda, BedrockCategorizationLambda (fake model, ``--model-latency``)
+  and, unless flagged as a copy of a saved expense, SaveExpenseLambda; run
+  without the index, with ``flag`` and with ``reuse``.
+
+    python -m benchmarks.bench_duplicate_receipts [--receipts 150] [--duplicate-share 0.2]
+"""
+import argparse
+import base64
+import contextlib
+import io
+import itertools
+import json
+import os
+import random
+import time
+
+from PIL import Image, ImageDraw, ImageFont
+
+from benchmarks.common import VENDORS, print_table, setup_environment, summarize
+
+setup_environment()
+os.environ.setdefault('DYNAMODB_AGGREGATES_TABLE_NAME', 'SmartReceiptsAggregates')
+
+import aws_clients  # noqa: E402
+import bedrock_categorization_lambda  # noqa: E402
+import expense_aggregates  # noqa: E402
+import receipt_extraction as extraction  # noqa: E402
+import receipt_fingerprints  # noqa: E402
+import save_expense_lambda  # noqa: E402
+import upload_image_lambda  # noqa: E402
+from benchmarks.local_aws import FakeBedrockRuntime, LocalDynamoDB, LocalS3  # noqa: E402
+from extraction_cache import ExtractionCache  # noqa: E402
+
+USER_ID = 'duplicates.user@example.com'
+HASH_TABLE_NAME = 'SmartReceiptsReceiptHashes'
+FONT = ImageFont.load_default(size=26)
+BITS = receipt_fingerprints.HASH_SIZE * receipt_fingerprints.HASH_SIZE
+
+
+def paper_slip(rng):
+    """A receipt's paper and the fields the model reads off it."""
+    vendor = rng.choice(VENDORS)
+    lines = [(f'{rng.choice(["Item", "Coffee", "Bread", "Fuel", "Misc", "Tax"])} {rng.randint(1, 999)}',
+              rng.randint(100, 5000)) for _ in range(rng.randint(3, 18))]
+    total = sum(cents for _, cents in lines)
+    day = f'2024-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}'
+    width = rng.randint(420, 640)
+    image = Image.new('L', (width, 260 + 36 * len(lines)), rng.randint(225, 255))
+    draw = ImageDraw.Draw(image)
+    draw.text((width // 2 - 12 * len(vendor) // 2, 30), vendor.upper(), fill=20, font=FONT)
+    draw.text((30, 80), day, fill=40, font=FONT)
+    y = 140
+    for name, cents in lines:
+        draw.text((30, y), name, fill=30, font=FONT)
+        draw.text((width - 130, y), f'{cents / 100:.2f}', fill=30, font=FONT)
+        y += 36
+    draw.line((30, y + 10, width - 30, y + 10), fill=60, width=2)
+    draw.text((30, y + 30), 'TOTAL', fill=10, font=FONT)
+    draw.text((width - 130, y + 30), f'{total / 100:.2f}', fill=10, font=FONT)
+    fields = {'vendor': vendor, 'amount': f'{total / 100:.2f}', 'category': 'Shopping',
+              'description': 'Receipt', 'date': day}
+    return image, fields
+
+
+def photograph(slip, rng):
+    """The slip on a table: random placement, scale, a slight rotation and JPEG noise."""
+    scale = rng.uniform(0.8, 1.3)
+    paper = slip.resize((int(slip.width * scale), int(slip.height * scale)))
+    paper = paper.rotate(rng.uniform(-2, 2), expand=True, fillcolor=rng.randint(40, 90))
+    table = Image.new('L', (int(paper.width * rng.uniform(1.2, 1.6)), int(paper.height * rng.uniform(1.15, 1.4))),
+                      rng.randint(40, 90))
+    table.paste(paper, (rng.randint(0, table.width - paper.width), rng.randint(0, table.height - paper.height)))
+    return encode(table.convert('RGB'), 'JPEG', quality=rng.randint(60, 92))
+
+
+def encode(image, image_format, **options):
+    output = io.BytesIO()
+    image.save(output, format=image_format, **options)
+    return output.getvalue()
+
+
+def copy_of(kind, slip, photo, rng):
+    if kind == 'retake':
+        return photograph(slip, rng)
+    with Image.open(io.BytesIO(photo)) as image:
+        if kind == 'screenshot':
+            return encode(image.convert('RGB'), 'PNG')
+        scale = rng.uniform(0.5, 0.9)
+        image = image.resize((int(image.width * scale), int(image.height * scale)))
+        return encode(image.convert('RGB'), 'JPEG', quality=rng.randint(50, 85))
+
+
+COPIES = ('resent', 'screenshot', 'retake')
+
+
+def hash_distances(receipts, seed):
+    rng = random.Random(seed)
+    slips = [paper_slip(rng)[0] for _ in range(receipts)]
+    photos = [photograph(slip, rng) for slip in slips]
+    start = time.perf_counter()
+    originals = [receipt_fingerprints.fingerprint(photo) for photo in photos]
+    per_image_ms = (time.perf_counter() - start) / receipts * 1000
+    pairs = {}
+    for kind in COPIES:
+        copies = [receipt_fingerprints.fingerprint(copy_of(kind, slip, photo, rng))
+                  for slip, photo in zip(slips, photos)]
+        pairs[f'{kind} copy'] = sorted(receipt_fingerprints.distance(a, b) for a, b in zip(originals, copies))
+    pairs['different receipts'] = sorted(receipt_fingerprints.distance(a, b)
+                                         for a, b in itertools.combinations(originals, 2))
+    limit = receipt_fingerprints.MAX_DISTANCE
+    rows = []
+    for name, values in pairs.items():
+        rows.append({'pairs': name, 'count': len(values), 'min': values[0], 'p50': values[len(values) // 2],
+                     'max': values[-1], f'within_{limit}': f'{sum(v <= limit for v in values) / len(values):.1%}'})
+    return rows, per_image_ms
+
+
+def lookup(sizes, seed, queries=200):
+    rng = random.Random(seed)
+    radius = receipt_fingerprints.MAX_DISTANCE
+    rows = []
+    for size in sizes:
+        values = [rng.getrandbits(BITS) for _ in range(size)]
+        tree = receipt_fingerprints.BKTree()
+        for i, value in enumerate(values):
+            tree.add(value, i)
+        # Half the queries are a few bits off a stored hash, half are new.
+        probes = []
+        for i in range(queries):
+            probe = rng.choice(values) if i % 2 == 0 else rng.getrandbits(BITS)
+            for bit in rng.sample(range(BITS), 3):
+                probe ^= 1 << bit
+            probes.append(probe)
+
+        start = time.perf_counter()
+        found_tree = [sorted(tree.search(probe, radius)) for probe in probes]
+        tree_us = (time.perf_counter() - start) / queries * 1e6
+        start = time.perf_counter()
+        found_scan = [sorted((d, i) for i, value in enumerate(values)
+                             if (d := receipt_fingerprints.hamming(probe, value)) <= radius) for probe in probes]
+        scan_us = (time.perf_counter() - start) / queries * 1e6
+        assert found_tree == found_scan
+        rows.append({'hashes': size, 'bk_tree_us': round(tree_us, 1), 'linear_scan_us': round(scan_us, 1),
+                     'speedup': f'{scan_us / tree_us:.1f}x'})
+    return rows
+
+
+def end_to_end(name, policy, receipts, duplicate_share, model_latency, seed):
+    rng = random.Random(seed)
+    dynamodb = LocalDynamoDB()
+    dynamodb.create_table(save_expense_lambda.TABLE_NAME, 'userId', 'expenseId')
+    dynamodb.create_table(expense_aggregates.AGGREGATES_TABLE_NAME, 'userId', 'bucket')
+    dynamodb.create_table(HASH_TABLE_NAME, 'userId', 's3_key')
+    aws_clients.reset()
+    aws_clients.override_resource('dynamodb', dynamodb)
+    aws_clients.override_client('s3', LocalS3())
+    current = {}
+    bedrock = FakeBedrockRuntime(responder=lambda request: json.dumps(current['fields']), latency=model_latency)
+    aws_clients.override_client('bedrock-runtime', bedrock)
+    extraction.extraction_cache = ExtractionCache()
+    extraction.local_extractor = None
+    receipt_fingerprints.index = receipt_fingerprints.ReceiptIndex(HASH_TABLE_NAME) if policy else None
+
+    receipts_seen = []
+    outcome = {'flagged': 0, 'same_image': 0, 'reused': 0, 'false_flags': 0, 'missed': 0}
+    seconds = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(receipts):
+            duplicate = bool(receipts_seen) and rng.random() < duplicate_share
+            if duplicate:
+                slip, photo, fields = rng.choice(receipts_seen)
+                image = copy_of(rng.choice(COPIES), slip, photo, rng)
+            else:
+                slip, fields = paper_slip(rng)
+                image = photograph(slip, rng)
+                receipts_seen.append((slip, image, fields))
+            current['fields'] = fields
+            began = time.perf_counter()
+            uploaded = json.loads(upload_image_lambda.lambda_handler(
+                {'image_data': base64.b64encode(image).decode(), 'userId': USER_ID}, None)['body'])
+            event = {'s3_key': uploaded['s3_key'], 'userId': USER_ID}
+            if policy:
+                event['duplicates'] = policy
+            body = json.loads(bedrock_categorization_lambda.lambda_handler(event, None)['body'])
+            match = body.get('duplicateOf')
+            if match is not None:
+                outcome['reused' if match['reused'] else 'flagged'] += 1
+                outcome['same_image'] += match['sameImage']
+                outcome['false_flags'] += not duplicate
+            elif duplicate:
+                outcome['missed'] += 1
+            if match is None or 'expenseId' not in match:
+                # The client skips saving a receipt it is told is already saved.
+                save_expense_lambda.lambda_handler(dict(body['extracted_data'], userId=USER_ID,
+                                                        s3_key=uploaded['s3_key']), None)
+            seconds.append(time.perf_counter() - began)
+
+    stats = summarize(seconds)
+    expenses = dynamodb.Table(save_expense_lambda.TABLE_NAME)
+    return dict({'scenario': name, 'receipts': receipts, 'distinct': len(receipts_seen), 'model_calls': bedrock.calls,
+                 'saved_rows': len(expenses), 'p50_ms': stats['p50_ms'], 'mean_ms': stats['mean_ms']}, **outcome)
+
+
+def run(receipts, duplicate_share, sizes, model_latency, seed):
+    rows, per_image_ms = hash_distances(min(receipts, 80), seed)
+    print(f'fingerprint: {per_image_ms:.1f} ms per photo')
+    print_table(rows, ['pairs', 'count', 'min', 'p50', 'max', f'within_{receipt_fingerprints.MAX_DISTANCE}'])
+    print()
+    print_table(lookup(sizes, seed), ['hashes', 'bk_tree_us', 'linear_scan_us', 'speedup'])
+    print()
+    print(f'{receipts} uploads, {duplicate_share:.0%} of them copies, model latency {model_latency * 1000:g} ms')
+    args = (receipts, duplicate_share, model_latency, seed)
+    rows = [end_to_end('no duplicate check', None, *args), end_to_end('flag', 'flag', *args),
+            end_to_end('reuse', 'reuse', *args)]
+    print_table(rows, ['scenario', 'receipts', 'distinct', 'model_calls', 'saved_rows', 'flagged', 'same_image', 'reused',
+                       'false_flags', 'missed', 'p50_ms', 'mean_ms'])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--receipts', type=int, default=150)
+    parser.add_argument('--duplicate-share', type=float, default=0.2)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--model-latency', type=float, default=0.05)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.receipts, args.duplicate_share, args.sizes, args.model_latency, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,154 @@
+"""Benchmark the Expense model against the old ad-hoc dict handling.
+
+Runs ``--records`` save payloads shaped like the frontend's and Bedrock's
+(string, float and '$1,234.50' amounts, ISO and US dates, short category
+names, 'Not Applicable' placeholders) through both paths:
+
+- parse: event -> DynamoDB item, as SaveExpenseLambda builds it
+- read: stored item -> API response, as GetExpensesLambda returns it
+- month total: sum one month from stored items, which the old string
+  amounts and free-form dates can only do by re-parsing every row
+- memory: 100k records held as dicts vs ``__slots__`` objects
+
+    python -m benchmarks.bench_expense_model [--records 100000]
+"""
+import argparse
+import json
+import random
+import time
+import tracemalloc
+from decimal import Decimal
+
+from benchmarks.common import CATEGORIES, VENDORS, print_table, setup_environment
+
+setup_environment()
+
+from benchmarks.local_aws import item_size  # noqa: E402
+from expense_model import Expense  # noqa: E402
+
+SHORT_CATEGORIES = ['Food', 'Transport', 'Health', 'groceries', 'Not Applicable']
+
+
+def synthetic_events(count, seed=0):
+    rng = random.Random(seed)
+    events = []
+    for i in range(count):
+        cents = rng.randint(100, 250000)
+        amount = rng.choice([
+            f'{cents / 100:.2f}', cents / 100, f'${cents // 100:,}.{cents % 100:02d}', 'Not Applicable'])
+        year, month, day = rng.randint(2019, 2024), rng.randint(1, 12), rng.randint(1, 28)
+        date = rng.choice([f'{year}-{month:02d}-{day:02d}'] * 3 + [f'{month:02d}/{day:02d}/{year}', 'Not Applicable'])
+        events.append({
+            'userId': 'bench@example.com',
+            'vendor': rng.choice(VENDORS),
+            'amount': amount,
+            'category': rng.choice(CATEGORIES + SHORT_CATEGORIES),
+            'description': f'Receipt {i}',
+            'date': date,
+            's3_key': f'receipts/{i}.jpg',
+        })
+    return events
+
+
+def legacy_item(event):
+    """SaveExpenseLambda before the model."""
+    return {
+        'userId': event.get('userId'),
+        'expenseId': 'id',
+        'vendor': event.get('vendor', 'Not Applicable'),
+        'amount': str(event.get('amount', 'Not Applicable')),
+        'category': event.get('category', 'Not Applicable'),
+        'description': event.get('description', 'Not Applicable'),
+        'date': event.get('date', 'Not Applicable'),
+        'createdAt': '12345',
+        's3_key': event.get('s3_key'),
+    }
+
+
+def model_item(event):
+    expense = Expense.from_event(event, strict=False)
+    expense.expense_id = 'id'
+    expense.created_at = '2024-01-01T00:00:00+00:00'
+    return expense.to_item()
+
+
+def legacy_month_total(items, month):
+    # Strings such as '$1,234.50' or '03/05/2024' silently drop out.
+    total = 0.0
+    for item in items:
+        if item['date'].startswith(month):
+            try:
+                total += float(item['amount'])
+            except ValueError:
+                pass
+    return total
+
+
+def model_month_total(items, month):
+    total = Decimal(0)
+    for item in items:
+        if item.get('date', '').startswith(month) and 'amount' in item:
+            total += item['amount']
+    return total
+
+
+def timed(call):
+    start = time.perf_counter()
+    result = call()
+    return result, time.perf_counter() - start
+
+
+def held_bytes(build):
+    tracemalloc.start()
+    records = build()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del records
+    return current
+
+
+def run(count):
+    events = synthetic_events(count)
+    legacy_items, legacy_parse = timed(lambda: [legacy_item(e) for e in events])
+    model_items, model_parse = timed(lambda: [model_item(e) for e in events])
+
+    _, legacy_read = timed(lambda: json.dumps({'expenses': legacy_items}))
+    _, model_read = timed(lambda: json.dumps(
+        {'expenses': [Expense.from_item(item).to_response() for item in model_items]}))
+
+    legacy_total, legacy_sum = timed(lambda: legacy_month_total(legacy_items, '2023-06'))
+    model_total, model_sum = timed(lambda: model_month_total(model_items, '2023-06'))
+
+    legacy_mem = held_bytes(lambda: [legacy_item(e) for e in events])
+    model_mem = held_bytes(lambda: [Expense.from_event(e, strict=False) for e in events])
+
+    counted = lambda items, month: sum(  # noqa: E731
+        1 for i in items if str(i.get('date', '')).startswith(month) and 'amount' in i
+        and i['amount'] != 'Not Applicable')
+    rows = [
+        {'path': 'legacy dicts', 'parse_ms': round(legacy_parse * 1000), 'read_ms': round(legacy_read * 1000),
+         'month_sum_ms': round(legacy_sum * 1000, 1), 'june_2023_total': f'{legacy_total:.2f}',
+         'june_rows': counted(legacy_items, '2023-06'),
+         'held_mb': round(legacy_mem / 1024 / 1024, 1),
+         'item_bytes': round(sum(item_size(i) for i in legacy_items) / count, 1)},
+        {'path': 'Expense model', 'parse_ms': round(model_parse * 1000), 'read_ms': round(model_read * 1000),
+         'month_sum_ms': round(model_sum * 1000, 1), 'june_2023_total': f'{model_total:.2f}',
+         'june_rows': counted(model_items, '2023-06'),
+         'held_mb': round(model_mem / 1024 / 1024, 1),
+         'item_bytes': round(sum(item_size(i) for i in model_items) / count, 1)},
+    ]
+    print(f'{count} records')
+    print_table(rows, ['path', 'parse_ms', 'read_ms', 'month_sum_ms', 'june_2023_total', 'june_rows',
+                       'held_mb', 'item_bytes'])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--records', type=int, default=100_000)
+    args = parser.parse_args()
+    run(args.records)
+
+
+if __name__ == '__main__':
+    main()
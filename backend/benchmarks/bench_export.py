@@ -0,0 +1,115 @@
+"""Benchmark ExportExpensesLambda's streaming export against a buffered one.
+
+The buffered variant is what an export looks like without streaming: read
+the whole date range into a list, render it into one string, gzip that and
+PutObject it. The streaming handler pipes DynamoDB pages through csv/json,
+gzip and a multipart upload. Peak Python heap is measured with tracemalloc
+(the in-memory table itself is allocated beforehand and not counted, but the
+S3 stand-in keeps uploaded parts in memory, so the streaming peak still grows
+by the compressed size of the export).
+
+    python -m benchmarks.bench_export [--sizes 100000 300000]
+"""
+import argparse
+import csv
+import gzip
+import io
+import json
+import time
+import tracemalloc
+
+from benchmarks.common import print_table, setup_environment, synthetic_expenses
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import export_expenses_lambda  # noqa: E402
+from benchmarks.local_aws import LocalDynamoDB, LocalS3  # noqa: E402
+from expense_pages import DATE_INDEX_NAME, iter_expenses  # noqa: E402
+
+USER_ID = 'heavy.user@example.com'
+
+
+def buffered_export(event):
+    table = aws_clients.table(export_expenses_lambda.TABLE_NAME)
+    expenses = list(iter_expenses(table, USER_ID, attributes=export_expenses_lambda.EXPORT_ATTRIBUTES,
+                                  start_date=event.get('startDate'), end_date=event.get('endDate')))
+    text = io.StringIO(newline='')
+    writer = csv.writer(text)
+    writer.writerow(export_expenses_lambda.CSV_HEADERS)
+    for expense in expenses:
+        writer.writerow([expense.get('date'), expense.get('vendor'), expense.get('amount'),
+                         expense.get('category'), expense.get('description'),
+                         'Yes' if expense.get('s3_key') else 'No', 'No'])
+    body = gzip.compress(text.getvalue().encode('utf-8'))
+    aws_clients.client('s3').put_object(Bucket=export_expenses_lambda.S3_BUCKET_NAME,
+                                        Key='exports/buffered.csv.gz', Body=body)
+    return {'rows': len(expenses), 'compressed_bytes': len(body), 's3_key': 'exports/buffered.csv.gz'}
+
+
+def streaming_export(event):
+    response = export_expenses_lambda.lambda_handler(dict(event, userId=USER_ID), None)
+    assert response['statusCode'] == 200, response
+    return json.loads(response['body'])
+
+
+def measure(name, size, s3, call):
+    start = time.perf_counter()
+    call()
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    result = call()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    stored = s3.objects[(export_expenses_lambda.S3_BUCKET_NAME, result['s3_key'])]['Body']
+    lines = gzip.decompress(stored).count(b'\n')
+    return {
+        'scenario': name,
+        'expenses': size,
+        'rows': result['rows'],
+        'lines': lines,
+        'gzip_kb': round(result['compressed_bytes'] / 1024, 1),
+        'peak_heap_mb': round(peak / 1024 / 1024, 1),
+        'seconds': round(seconds, 2),
+    }
+
+
+def run(sizes):
+    rows = []
+    for size in sizes:
+        dynamodb = LocalDynamoDB()
+        table = dynamodb.create_table(
+            export_expenses_lambda.TABLE_NAME, 'userId', 'expenseId',
+            indexes={DATE_INDEX_NAME: ('userId', 'date')})
+        for item in synthetic_expenses(USER_ID, size):
+            table.put_item(Item=item)
+        s3 = LocalS3()
+        aws_clients.override_resource('dynamodb', dynamodb)
+        aws_clients.override_client('s3', s3)
+
+        one_year = {'year': 2022}
+        scenarios = [
+            ('buffered csv, full history', lambda: buffered_export({})),
+            ('streaming csv, full history', lambda: streaming_export({})),
+            ('streaming jsonl, full history', lambda: streaming_export({'format': 'jsonl'})),
+            ('buffered csv, one year', lambda: buffered_export(
+                {'startDate': '2022-01-01', 'endDate': '2022-12-31'})),
+            ('streaming csv, one year', lambda: streaming_export(one_year)),
+        ]
+        for name, call in scenarios:
+            rows.append(measure(name, size, s3, call))
+    print_table(rows, ['scenario', 'expenses', 'rows', 'lines', 'gzip_kb', 'peak_heap_mb', 'seconds'])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100_000, 300_000])
+    args = parser.parse_args()
+    run(args.sizes)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Benchmark the Bedrock extraction cache in BedrockCategorizationLambda.
+
+Every sample image in ``backend/images`` is extracted four ways: a first
+upload (cache miss, model called), a duplicate upload in the same warm
+container (memory hit), a duplicate after a cold start (persistent hit) and
+an explicit ``refresh`` (model called again). The fake Bedrock runtime sleeps
+``--model-latency`` seconds per call.
+
+    python -m benchmarks.bench_extraction_cache [--model-latency 0.8]
+"""
+import argparse
+import json
+import os
+
+from benchmarks.common import BACKEND_DIR, Timer, print_table, setup_environment
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import bedrock_categorization_lambda as handler  # noqa: E402
+import receipt_extraction  # noqa: E402
+from benchmarks.local_aws import FakeBedrockRuntime, LocalDynamoDB, LocalS3  # noqa: E402
+from extraction_cache import DynamoDBCacheStore, ExtractionCache  # noqa: E402
+
+IMAGES_DIR = os.path.join(BACKEND_DIR, 'images')
+
+
+def load_images(s3):
+    keys = []
+    for name in sorted(os.listdir(IMAGES_DIR)):
+        with open(os.path.join(IMAGES_DIR, name), 'rb') as f:
+            key = f'receipts/{name}'
+            s3.put_object(Bucket=receipt_extraction.S3_BUCKET_NAME, Key=key, Body=f.read(), ContentType='image/jpeg')
+            keys.append(key)
+    return keys
+
+
+def run(model_latency):
+    s3 = LocalS3()
+    bedrock = FakeBedrockRuntime(latency=model_latency)
+    dynamodb = LocalDynamoDB()
+    dynamodb.create_table('SmartReceiptsExtractionCache', 'cacheKey')
+    aws_clients.override_client('s3', s3)
+    aws_clients.override_client('bedrock-runtime', bedrock)
+    aws_clients.override_resource('dynamodb', dynamodb)
+    receipt_extraction.extraction_cache = ExtractionCache(store=DynamoDBCacheStore('SmartReceiptsExtractionCache'))
+    keys = load_images(s3)
+
+    def cold_start():
+        receipt_extraction.extraction_cache = ExtractionCache(store=DynamoDBCacheStore('SmartReceiptsExtractionCache'))
+
+    scenarios = [
+        ('first upload (miss)', {}, None),
+        ('duplicate, warm (memory hit)', {}, None),
+        ('duplicate, cold (persistent hit)', {}, cold_start),
+        ('refresh (forced miss)', {'refresh': True}, None),
+    ]
+    rows = []
+    for name, extra, before in scenarios:
+        if before:
+            before()
+        calls, tokens = bedrock.calls, bedrock.input_tokens
+        timer = Timer()
+        cached = 0
+        for key in keys:
+            with timer:
+                response = handler.lambda_handler(dict(extra, s3_key=key), None)
+            cached += json.loads(response['body'])['cached']
+        summary = timer.summary()
+        rows.append({
+            'scenario': name,
+            'images': len(keys),
+            'cached': cached,
+            'model_calls': bedrock.calls - calls,
+            'input_tokens': bedrock.input_tokens - tokens,
+            'p50_ms': summary['p50_ms'],
+            'p95_ms': summary['p95_ms'],
+        })
+
+    print_table(rows, ['scenario', 'images', 'cached', 'model_calls', 'input_tokens', 'p50_ms', 'p95_ms'])
+    print(f"cache stats: {receipt_extraction.extraction_cache.stats}")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--model-latency', type=float, default=0.8)
+    args = parser.parse_args()
+    run(args.model_latency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,266 @@
+"""Benchmark asynchronous extraction jobs against the blocking Bedrock call.
+
+Receipts are already in S3 and the fake Bedrock runtime takes
+``--model-latency`` seconds per call. Scenarios:
+
+- sync: the client waits on BedrockCategorizationLambda for every upload;
+- async: the client submits a job (``"async": true``) and long-polls
+  GetExtractionJobLambda while ExtractionWorkerLambda drains the SQLite
+  queue with ``--workers`` threads;
+- priority: ``--uploads`` high-priority jobs submitted behind a backlog of
+  background (normal) jobs;
+- failures: receipts the model always fails on are dead-lettered after
+  EXTRACTION_JOB_MAX_ATTEMPTS, ones that fail once succeed on retry;
+- duplicates: every upload submitted three times (client, S3 trigger, retry).
+- crashed worker: a worker claims every job and dies. Once the visibility
+  timeout has passed, the redelivered messages must finish every job.
+
+    python -m benchmarks.bench_extraction_jobs [--uploads 40] [--workers 4]
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import BACKEND_DIR, FakeContext, print_table, setup_environment, summarize
+
+setup_environment()
+os.environ.setdefault('DYNAMODB_JOBS_TABLE_NAME', 'SmartReceiptsExtractionJobs')
+
+import aws_clients  # noqa: E402
+import bedrock_categorization_lambda  # noqa: E402
+import extraction_jobs  # noqa: E402
+import extraction_worker_lambda  # noqa: E402
+import get_extraction_job_lambda  # noqa: E402
+import job_queue  # noqa: E402
+import receipt_extraction as extraction  # noqa: E402
+from benchmarks.local_aws import DEFAULT_EXTRACTION, FakeBedrockRuntime, LocalDynamoDB, LocalS3  # noqa: E402
+from extraction_cache import ExtractionCache  # noqa: E402
+from image_preprocessing import derivative_key  # noqa: E402
+from job_queue import SQLiteJobQueue  # noqa: E402
+
+SAMPLE_IMAGE = os.path.join(BACKEND_DIR, 'images', 'receipt5.jpg')
+
+
+class Environment:
+    """Fresh stand-ins plus a worker pool draining the queue in the background."""
+
+    def __init__(self, model_latency, responder=None, clock=time.time, visibility_timeout=30):
+        self.s3 = LocalS3()
+        self.bedrock = FakeBedrockRuntime(responder=responder, latency=model_latency)
+        dynamodb = LocalDynamoDB()
+        self.table = dynamodb.create_table(extraction_jobs.JOBS_TABLE_NAME, 'jobId')
+        aws_clients.override_client('s3', self.s3)
+        aws_clients.override_client('bedrock-runtime', self.bedrock)
+        aws_clients.override_resource('dynamodb', dynamodb)
+        extraction.extraction_cache = ExtractionCache()
+        self.queue = SQLiteJobQueue(visibility_timeout=visibility_timeout, clock=clock)
+        self.jobs = extraction_jobs.ExtractionJobs(queue=self.queue, clock=clock)
+        bedrock_categorization_lambda.extraction_jobs_store = self.jobs
+        extraction_worker_lambda.jobs = self.jobs
+        get_extraction_job_lambda.jobs = self.jobs
+        self.finished_at = {}
+        succeed = self.jobs.succeed
+
+        def record_success(job_id, result, cached, duplicate=None):
+            succeed(job_id, result, cached, duplicate)
+            self.finished_at[job_id] = time.perf_counter()
+        self.jobs.succeed = record_success
+        with open(SAMPLE_IMAGE, 'rb') as f:
+            self.sample = f.read()
+
+    def seed(self, name):
+        key = f'receipts/{name}.jpg'
+        # Bytes after the JPEG end marker make every receipt a cache miss.
+        body = self.sample + name.encode()
+        self.s3.put_object(Bucket=extraction.S3_BUCKET_NAME, Key=key, Body=body, ContentType='image/jpeg')
+        self.s3.put_object(Bucket=extraction.S3_BUCKET_NAME, Key=derivative_key(key, 'inference'),
+                           Body=body, ContentType='image/jpeg')
+        return key
+
+    @contextlib.contextmanager
+    def workers(self, count):
+        stop = time.monotonic() + 3600
+        thread = threading.Thread(target=extraction_worker_lambda.drain, args=(self.queue, stop),
+                                  kwargs={'concurrency': count, 'idle_wait_seconds': 1.0})
+        thread.start()
+        try:
+            yield
+        finally:
+            thread.join()
+
+
+def invoke(handler, event):
+    response = handler(event, FakeContext())
+    assert response['statusCode'] == 200, response
+    return json.loads(response['body'])
+
+
+def submit_and_wait(s3_key):
+    start = time.perf_counter()
+    job = invoke(bedrock_categorization_lambda.lambda_handler, {'s3_key': s3_key, 'async': True})['job']
+    submitted = time.perf_counter() - start
+    while job['status'] not in extraction_jobs.FINISHED:
+        job = invoke(get_extraction_job_lambda.lambda_handler, {'jobId': job['jobId'], 'wait_seconds': 20})['job']
+    return submitted, time.perf_counter() - start, job
+
+
+def sync_scenario(uploads, model_latency):
+    env = Environment(model_latency)
+    keys = [env.seed(f'sync-{i}') for i in range(uploads)]
+    samples = []
+    for key in keys:
+        start = time.perf_counter()
+        invoke(bedrock_categorization_lambda.lambda_handler, {'s3_key': key})
+        samples.append(time.perf_counter() - start)
+    stats = summarize(samples)
+    return {'scenario': 'sync: client waits on Bedrock', 'jobs': uploads, 'request_p50_ms': stats['p50_ms'],
+            'request_p95_ms': stats['p95_ms'], 'result_p50_ms': stats['p50_ms'], 'result_p95_ms': stats['p95_ms'],
+            'model_calls': env.bedrock.calls, 'seconds': round(sum(samples), 2)}
+
+
+def async_scenario(uploads, model_latency, workers):
+    env = Environment(model_latency)
+    keys = [env.seed(f'async-{i}') for i in range(uploads)]
+    start = time.perf_counter()
+    with env.workers(workers), ThreadPoolExecutor(max_workers=uploads) as clients:
+        results = list(clients.map(submit_and_wait, keys))
+    seconds = time.perf_counter() - start
+    assert all(job['status'] == extraction_jobs.SUCCEEDED for _, _, job in results)
+    submit_stats = summarize([submitted for submitted, _, _ in results])
+    result_stats = summarize([total for _, total, _ in results])
+    return {'scenario': f'async: {workers} worker threads', 'jobs': uploads,
+            'request_p50_ms': submit_stats['p50_ms'], 'request_p95_ms': submit_stats['p95_ms'],
+            'result_p50_ms': result_stats['p50_ms'], 'result_p95_ms': result_stats['p95_ms'],
+            'model_calls': env.bedrock.calls, 'seconds': round(seconds, 2)}
+
+
+def priority_scenario(uploads, backlog, model_latency, workers):
+    env = Environment(model_latency)
+    background = [env.seed(f'backfill-{i}') for i in range(backlog)]
+    interactive = [env.seed(f'upload-{i}') for i in range(uploads)]
+    start = time.perf_counter()
+    for key in background:
+        env.jobs.submit(key, priority='normal')
+    for key in interactive:
+        env.jobs.submit(key, priority='high')
+    with env.workers(workers):
+        pass
+    done = {key: env.finished_at[extraction_jobs.job_id_for(key)] - start for key in background + interactive}
+    rows = []
+    for label, keys in (('high (uploads)', interactive), ('normal (backlog)', background)):
+        stats = summarize([done[key] for key in keys])
+        rows.append({'priority': label, 'jobs': len(keys), 'done_p50_ms': stats['p50_ms'],
+                     'done_p95_ms': stats['p95_ms']})
+    return rows
+
+
+def failure_scenario(uploads, model_latency, workers):
+    seen = set()
+    lock = threading.Lock()
+
+    def flaky(request):
+        image = base64.b64decode(request['messages'][0]['content'][0]['source']['data'])
+        if b'broken' in image:
+            return 'I could not read this receipt.'
+        if b'flaky' in image:
+            with lock:
+                first = image not in seen
+                seen.add(image)
+            if first:
+                return 'Service hiccup, not JSON.'
+        return json.dumps(DEFAULT_EXTRACTION)
+
+    env = Environment(model_latency, responder=flaky)
+    keys = ([env.seed(f'broken-{i}') for i in range(uploads // 4)]
+            + [env.seed(f'flaky-{i}') for i in range(uploads // 4)]
+            + [env.seed(f'fine-{i}') for i in range(uploads - 2 * (uploads // 4))])
+    for key in keys:
+        env.jobs.submit(key)
+    with env.workers(workers):
+        pass
+    statuses = {}
+    attempts = 0
+    for key in keys:
+        job = env.jobs.get(extraction_jobs.job_id_for(key))
+        statuses[job['status']] = statuses.get(job['status'], 0) + 1
+        attempts += int(job['attempts'])
+    return {'jobs': len(keys), 'succeeded': statuses.get(extraction_jobs.SUCCEEDED, 0),
+            'dead': statuses.get(extraction_jobs.DEAD, 0), 'dead_letters': len(env.queue.dead_letters()),
+            'attempts': attempts, 'model_calls': env.bedrock.calls, 'queue_left': len(env.queue)}
+
+
+def duplicate_scenario(uploads, model_latency, workers):
+    env = Environment(model_latency)
+    keys = [env.seed(f'dup-{i}') for i in range(uploads)]
+    created = 0
+    for key in keys * 3:
+        _, was_created = env.jobs.submit(key)
+        created += was_created
+    with env.workers(workers):
+        pass
+    return {'submissions': uploads * 3, 'jobs_created': created, 'jobs_in_table': len(env.table),
+            'model_calls': env.bedrock.calls}
+
+
+def crash_scenario(uploads, model_latency, workers):
+    now = [time.time()]
+    env = Environment(model_latency, clock=lambda: now[0], visibility_timeout=job_queue.VISIBILITY_TIMEOUT_SECONDS)
+    keys = [env.seed(f'crash-{i}') for i in range(uploads)]
+    for key in keys:
+        env.jobs.submit(key)
+    for message in env.queue.receive(max_messages=len(keys)):
+        env.jobs.claim(message.job_id, job_queue.VISIBILITY_TIMEOUT_SECONDS)
+    # The worker died holding every lease; its messages come back now.
+    now[0] += job_queue.VISIBILITY_TIMEOUT_SECONDS
+    with env.workers(workers):
+        pass
+    statuses = {}
+    for key in keys:
+        status = env.jobs.get(extraction_jobs.job_id_for(key))['status']
+        statuses[status] = statuses.get(status, 0) + 1
+    return {'jobs': len(keys), 'succeeded': statuses.get(extraction_jobs.SUCCEEDED, 0),
+            'running': statuses.get(extraction_jobs.RUNNING, 0), 'queue_left': len(env.queue)}
+
+
+def run(uploads, backlog, model_latency, workers):
+    # Retry failed jobs at once instead of after EXTRACTION_JOB_RETRY_SECONDS.
+    extraction_jobs.RETRY_BASE_SECONDS = 0
+    with contextlib.redirect_stdout(io.StringIO()):
+        latency_rows = [sync_scenario(uploads, model_latency), async_scenario(uploads, model_latency, workers)]
+        priority_rows = priority_scenario(uploads // 4 or 1, backlog, model_latency, workers)
+        failures = failure_scenario(uploads, model_latency, workers)
+        duplicates = duplicate_scenario(uploads, model_latency, workers)
+        crashed = crash_scenario(uploads, model_latency, workers)
+
+    print(f'model latency {model_latency * 1000:g} ms')
+    print_table(latency_rows, ['scenario', 'jobs', 'request_p50_ms', 'request_p95_ms', 'result_p50_ms',
+                               'result_p95_ms', 'model_calls', 'seconds'])
+    print()
+    print_table(priority_rows, ['priority', 'jobs', 'done_p50_ms', 'done_p95_ms'])
+    print()
+    print_table([failures], ['jobs', 'succeeded', 'dead', 'dead_letters', 'attempts', 'model_calls', 'queue_left'])
+    print()
+    print_table([duplicates], ['submissions', 'jobs_created', 'jobs_in_table', 'model_calls'])
+    print()
+    print_table([crashed], ['jobs', 'succeeded', 'running', 'queue_left'])
+    return latency_rows, priority_rows, failures, duplicates, crashed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uploads', type=int, default=40)
+    parser.add_argument('--backlog', type=int, default=80)
+    parser.add_argument('--model-latency', type=float, default=0.5)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    run(args.uploads, args.backlog, args.model_latency, args.workers)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,106 @@
+"""Benchmark GetExpensesLambda listing against an in-memory expenses table.
+
+Compares the old single-query handler with the paginated listing for users
+with 10k-100k expenses: latency and response bytes for the first dashboard
+page, a one-month date range, a date range plus category, and a full walk of
+the history through continuation tokens.
+
+    python -m benchmarks.bench_get_expenses [--sizes 10000 50000 100000]
+"""
+import argparse
+import json
+
+from boto3.dynamodb.conditions import Key
+
+from benchmarks.common import Timer, print_table, setup_environment, synthetic_expenses
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import get_expenses_lambda  # noqa: E402
+from benchmarks.local_aws import LocalDynamoDB  # noqa: E402
+from expense_pages import DATE_INDEX_NAME  # noqa: E402
+
+USER_ID = 'heavy.user@example.com'
+
+
+def legacy_list(table, user_id):
+    """The previous handler: one un-paginated query returning whole items."""
+    response = table.query(KeyConditionExpression=Key('userId').eq(user_id))
+    return {
+        'statusCode': 200,
+        'body': json.dumps({'message': 'Expenses fetched successfully', 'expenses': response['Items']}),
+    }
+
+
+def walk_all(event):
+    responses = []
+    token = None
+    while True:
+        response = get_expenses_lambda.lambda_handler(dict(event, nextToken=token), None)
+        responses.append(response)
+        token = json.loads(response['body'])['nextToken']
+        if not token:
+            return responses
+
+
+def measure(name, size, table, call, repeat):
+    timer = Timer()
+    call()  # warm the stand-in's index cache so it is not billed to the handler
+    for _ in range(repeat):
+        table.read_bytes = 0
+        with timer:
+            result = call()
+    responses = result if isinstance(result, list) else [result]
+    bodies = [json.loads(r['body']) for r in responses]
+    summary = timer.summary()
+    return {
+        'scenario': name,
+        'expenses': size,
+        'returned': sum(len(b['expenses']) for b in bodies),
+        'calls': len(responses),
+        'response_kb': round(sum(len(r['body']) for r in responses) / 1024, 1),
+        'read_kb': round(table.read_bytes / 1024, 1),
+        'p50_ms': summary['p50_ms'],
+        'p95_ms': summary['p95_ms'],
+    }
+
+
+def run(sizes, repeat):
+    rows = []
+    for size in sizes:
+        dynamodb = LocalDynamoDB()
+        table = dynamodb.create_table(
+            get_expenses_lambda.TABLE_NAME, 'userId', 'expenseId',
+            indexes={DATE_INDEX_NAME: ('userId', 'date')})
+        for item in synthetic_expenses(USER_ID, size):
+            table.put_item(Item=item)
+        aws_clients.override_resource('dynamodb', dynamodb)
+
+        base = {'userId': USER_ID}
+        month = dict(base, startDate='2023-03-01', endDate='2023-03-31')
+        scenarios = [
+            ('legacy single query', lambda: legacy_list(table, USER_ID)),
+            ('first page (100)', lambda: get_expenses_lambda.lambda_handler(base, None)),
+            ('one month', lambda: get_expenses_lambda.lambda_handler(dict(month, limit=1000), None)),
+            ('one month + category', lambda: get_expenses_lambda.lambda_handler(
+                dict(month, limit=1000, category='Groceries'), None)),
+            ('full history (1000/page)', lambda: walk_all(dict(base, limit=1000))),
+        ]
+        for name, call in scenarios:
+            rows.append(measure(name, size, table, call, repeat))
+
+    print_table(rows, ['scenario', 'expenses', 'returned', 'calls', 'response_kb', 'read_kb', 'p50_ms', 'p95_ms'])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 50_000, 100_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
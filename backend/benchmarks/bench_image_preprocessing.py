@@ -0,0 +1,71 @@
+"""Benchmark the receipt preprocessing stage on the sample images.
+
+For each image in ``backend/images`` this reports the original and inference
+derivative sizes, the base64 payload sent to Bedrock, estimated model input
+tokens before and after, and the time spent preprocessing.
+
+    python -m benchmarks.bench_image_preprocessing [--repeat 5]
+"""
+import argparse
+import base64
+import os
+
+from benchmarks.common import BACKEND_DIR, Timer, print_table, setup_environment
+
+setup_environment()
+
+from benchmarks.local_aws import estimate_image_tokens  # noqa: E402
+from image_preprocessing import Image, prepare_inference_image  # noqa: E402
+
+IMAGES_DIR = os.path.join(BACKEND_DIR, 'images')
+
+
+def run(repeat):
+    if Image is None:
+        print('Pillow is not installed; preprocessing passes images through unchanged.')
+    rows = []
+    totals = {'original': 0, 'derived': 0, 'tokens_before': 0, 'tokens_after': 0, 'ms': 0.0}
+    for name in sorted(os.listdir(IMAGES_DIR)):
+        with open(os.path.join(IMAGES_DIR, name), 'rb') as f:
+            original = f.read()
+        timer = Timer()
+        for _ in range(repeat):
+            with timer:
+                derived, media_type = prepare_inference_image(original)
+        tokens_before = estimate_image_tokens(original)
+        tokens_after = estimate_image_tokens(derived)
+        p50 = timer.summary()['p50_ms']
+        rows.append({
+            'image': name,
+            'original_kb': round(len(original) / 1024, 1),
+            'derived_kb': round(len(derived) / 1024, 1),
+            'b64_saved_kb': round((len(base64.b64encode(original)) - len(base64.b64encode(derived))) / 1024, 1),
+            'tokens_before': tokens_before,
+            'tokens_after': tokens_after,
+            'media_type': media_type,
+            'p50_ms': p50,
+        })
+        totals['original'] += len(original)
+        totals['derived'] += len(derived)
+        totals['tokens_before'] += tokens_before
+        totals['tokens_after'] += tokens_after
+        totals['ms'] += p50
+
+    print_table(rows, ['image', 'original_kb', 'derived_kb', 'b64_saved_kb', 'tokens_before',
+                       'tokens_after', 'media_type', 'p50_ms'])
+    print(f"\ntotal bytes: {totals['original']} -> {totals['derived']} "
+          f"({100 - 100 * totals['derived'] / totals['original']:.1f}% saved), "
+          f"input tokens: {totals['tokens_before']} -> {totals['tokens_after']}, "
+          f"preprocessing: {totals['ms']:.1f} ms")
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.repeat)
+
+
+if __name__ == '__main__':
+    main()
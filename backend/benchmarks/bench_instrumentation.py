@@ -0,0 +1,182 @@
+"""Benchmark the cost of the handler instrumentation and show what it records.
+
+Three parts:
+
+- primitives: the per-call cost of ``phase``, ``count`` and a traced no-op
+  handler, with the metric line printed to a buffer.
+- overhead: SaveExpenseLambda, GetExpensesLambda and a warm (cache hit)
+  BedrockCategorizationLambda run ``--invocations`` times each with
+  instrumentation off, with EMF metrics on, and with metrics plus the local
+  trace export. These handlers do little besides their AWS calls, so the
+  difference is the instrumentation's share at its most visible.
+- profile: every sample receipt is extracted through
+  BedrockCategorizationLambda against a fake Bedrock runtime (``--model-latency``
+  to the first token, ``--token-latency`` per token after it) with the trace
+  export on, then the exported traces are summarized per phase the way
+  ``python instrumentation.py traces.jsonl`` does.
+
+    python -m benchmarks.bench_instrumentation [--invocations 2000]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import tempfile
+import time
+
+from benchmarks.common import BACKEND_DIR, print_table, setup_environment, summarize, synthetic_expenses
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import bedrock_categorization_lambda  # noqa: E402
+import get_expenses_lambda  # noqa: E402
+import instrumentation  # noqa: E402
+import receipt_extraction as extraction  # noqa: E402
+import save_expense_lambda  # noqa: E402
+from benchmarks.local_aws import FakeBedrockRuntime, LocalDynamoDB, LocalS3  # noqa: E402
+from extraction_cache import ExtractionCache  # noqa: E402
+from receipt_storage import store_receipt_image  # noqa: E402
+
+IMAGES_DIR = os.path.join(BACKEND_DIR, 'images')
+USER_ID = 'traced.user@example.com'
+
+
+def configure(metrics, export_path, model_latency=0.0, token_latency=0.0):
+    """Set the instrumentation mode and install fresh stand-ins under it."""
+    instrumentation.METRICS_ENABLED = metrics
+    instrumentation.TRACE_EXPORT_PATH = export_path
+    dynamodb = LocalDynamoDB()
+    dynamodb.create_table(save_expense_lambda.TABLE_NAME, 'userId', 'expenseId')
+    table = dynamodb.Table(save_expense_lambda.TABLE_NAME)
+    for item in synthetic_expenses(USER_ID, 200):
+        table.put_item(Item=item)
+    bedrock = FakeBedrockRuntime(latency=model_latency, token_latency=token_latency)
+    aws_clients.reset()
+    aws_clients.override_resource('dynamodb', dynamodb)
+    aws_clients.override_client('s3', LocalS3())
+    aws_clients.override_client('bedrock-runtime', bedrock)
+    keys = []
+    for name in sorted(os.listdir(IMAGES_DIR)):
+        with open(os.path.join(IMAGES_DIR, name), 'rb') as f:
+            # With its inference derivative, as UploadImageLambda stores it.
+            keys.append(store_receipt_image(f.read(), name)[0])
+    extraction.extraction_cache = ExtractionCache()
+    extraction.local_extractor = None
+    return keys
+
+
+def per_call_us(function, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return round((time.perf_counter() - start) / repeat * 1e6, 2)
+
+
+def primitives(repeat):
+    configure(True, None)
+
+    def handler(event, context):
+        with instrumentation.phase('work'):
+            instrumentation.count('items')
+        return {'statusCode': 200, 'body': '{}'}
+
+    traced = instrumentation.traced(handler)
+    rows = [{'operation': 'plain handler call', 'us_per_call': per_call_us(lambda: handler({}, None), repeat)}]
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows.append({'operation': 'traced handler call, EMF printed',
+                     'us_per_call': per_call_us(lambda: traced({}, None), repeat)})
+
+    # phase and count inside an invocation.
+    trace = instrumentation.Trace('bench', False)
+    token = instrumentation._current.set(trace)
+    try:
+        def timed():
+            with instrumentation.phase('work'):
+                pass
+        rows.append({'operation': 'phase() in an invocation', 'us_per_call': per_call_us(timed, repeat)})
+        rows.append({'operation': 'count() in an invocation',
+                     'us_per_call': per_call_us(lambda: instrumentation.count('items'), repeat)})
+    finally:
+        instrumentation._current.reset(token)
+    return rows
+
+
+def overhead(invocations, export_dir):
+    scenarios = [
+        ('SaveExpenseLambda', lambda i, keys: save_expense_lambda.lambda_handler(
+            {'userId': USER_ID, 'vendor': 'Starbucks', 'amount': '4.50', 'category': 'Food & Dining',
+             'description': 'Coffee', 'date': '2024-05-01'}, None)),
+        ('GetExpensesLambda', lambda i, keys: get_expenses_lambda.lambda_handler(
+            {'userId': USER_ID, 'limit': 20}, None)),
+        ('BedrockCategorizationLambda, cache hit', lambda i, keys: bedrock_categorization_lambda.lambda_handler(
+            {'s3_key': keys[i % len(keys)]}, None)),
+    ]
+    modes = [('off', False, False), ('EMF metrics', True, False), ('metrics + trace export', True, True)]
+    rows = []
+    for scenario, call in scenarios:
+        baseline = None
+        for mode, metrics, export in modes:
+            path = os.path.join(export_dir, 'overhead.jsonl') if export else None
+            keys = configure(metrics, path)
+            with contextlib.redirect_stdout(io.StringIO()):
+                for i in range(len(keys)):
+                    call(i, keys)  # warm the extraction cache
+                seconds = []
+                for i in range(invocations):
+                    start = time.perf_counter()
+                    response = call(i, keys)
+                    seconds.append(time.perf_counter() - start)
+                    assert response['statusCode'] == 200, response
+            stats = summarize(seconds)
+            if baseline is None:
+                baseline = stats['mean_ms']
+            rows.append({'handler': scenario, 'mode': mode, 'p50_ms': stats['p50_ms'], 'p95_ms': stats['p95_ms'],
+                         'mean_ms': stats['mean_ms'],
+                         'overhead_us': round((stats['mean_ms'] - baseline) * 1000, 1)})
+    return rows
+
+
+def profile(repeat, model_latency, token_latency, export_dir):
+    path = os.path.join(export_dir, 'traces.jsonl')
+    keys = configure(True, path, model_latency, token_latency)
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        for _ in range(repeat):
+            for key in keys:
+                # A cold extraction cache, so every receipt reaches the model.
+                extraction.extraction_cache = ExtractionCache()
+                bedrock_categorization_lambda.lambda_handler({'s3_key': key}, None)
+    lines = [json.loads(line) for line in output.getvalue().splitlines() if line.startswith('{"FunctionName"')]
+    return instrumentation.profile(instrumentation.load_traces(path)), lines
+
+
+def run(invocations, repeat, model_latency, token_latency):
+    with tempfile.TemporaryDirectory() as export_dir:
+        print_table(primitives(invocations * 10), ['operation', 'us_per_call'])
+        print()
+        print_table(overhead(invocations, export_dir),
+                    ['handler', 'mode', 'p50_ms', 'p95_ms', 'mean_ms', 'overhead_us'])
+        print()
+        print(f'model latency {model_latency * 1000:g} ms to the first token, {token_latency * 1000:g} ms per token')
+        rows, lines = profile(repeat, model_latency, token_latency, export_dir)
+    print_table(rows, ['function', 'phase', 'count', 'total_ms', 'share', 'p50_ms', 'p95_ms', 'p99_ms'])
+    print()
+    print('metric line of the last invocation:')
+    print(json.dumps(lines[-1]))
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--invocations', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=4)
+    parser.add_argument('--model-latency', type=float, default=0.3)
+    parser.add_argument('--token-latency', type=float, default=0.002)
+    args = parser.parse_args()
+    run(args.invocations, args.repeat, args.model_latency, args.token_latency)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""Benchmark the local OCR fast path against Bedrock over ``backend/images``.
+
+Each sample receipt is extracted three ways:
+
+- fast path: OCR plus the rules in local_extraction, never calling the model;
+- model: every receipt goes to the fake Bedrock runtime, which sleeps
+  ``--model-latency`` seconds and answers with the labelled fields;
+- hybrid: extract_with_cache as deployed, where receipts the fast path
+  accepts (at ``--min-confidence``) skip the model.
+
+The labels and OCR text of each image are in ``ocr_samples.json``. OCR text
+is replayed from there unless ``--live-ocr`` is given, which runs Tesseract
+(needs pytesseract and the tesseract binary) and includes its time.
+Accuracy counts vendor, amount, category and date against the labels; the
+model's accuracy is the labels' by construction, so only its latency and
+calls are meaningful.
+
+    python -m benchmarks.bench_local_extraction [--repeat 5] [--live-ocr]
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import os
+import sys
+import time
+
+from benchmarks.common import BACKEND_DIR, print_table, setup_environment, summarize
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import expense_model  # noqa: E402
+import local_extraction  # noqa: E402
+import receipt_extraction as extraction  # noqa: E402
+from benchmarks.local_aws import FakeBedrockRuntime  # noqa: E402
+from extraction_cache import ExtractionCache  # noqa: E402
+
+IMAGES_DIR = os.path.join(BACKEND_DIR, 'images')
+OCR_SAMPLES = os.path.join(os.path.dirname(__file__), 'ocr_samples.json')
+FIELDS = ('vendor', 'amount', 'category', 'date')
+
+
+def load_samples():
+    with open(OCR_SAMPLES) as f:
+        samples = json.load(f)
+    for sample in samples:
+        with open(os.path.join(IMAGES_DIR, sample['image']), 'rb') as f:
+            sample['bytes'] = f.read()
+    return samples
+
+
+def correct_fields(result, expected):
+    correct = 0
+    for field in FIELDS:
+        value, label = result.get(field), expected[field]
+        if field == 'amount':
+            try:
+                correct += expense_model.parse_amount(value) == expense_model.parse_amount(label)
+            except ValueError:
+                pass
+        else:
+            correct += value == label
+    return correct
+
+
+def run_mode(name, samples, repeat, extract):
+    seconds, correct, complete = [], 0, 0
+    for _ in range(repeat):
+        for sample in samples:
+            start = time.perf_counter()
+            result = extract(sample)
+            seconds.append(time.perf_counter() - start)
+            fields = correct_fields(result, sample['expected'])
+            correct += fields
+            complete += fields == len(FIELDS)
+    stats = summarize(seconds)
+    return {'mode': name, 'receipts': len(seconds), 'field_accuracy': f'{correct / (len(seconds) * len(FIELDS)):.0%}',
+            'all_fields_right': complete, 'p50_ms': stats['p50_ms'], 'p95_ms': stats['p95_ms'],
+            'mean_ms': stats['mean_ms']}
+
+
+def run(repeat, model_latency, min_confidence, live_ocr):
+    samples = load_samples()
+    if live_ocr:
+        if not local_extraction.ocr_available():
+            sys.exit('--live-ocr needs pytesseract and the tesseract binary')
+        ocr = local_extraction.ocr_text
+    else:
+        transcripts = {hashlib.sha256(sample['bytes']).digest(): sample['ocr_text'] for sample in samples}
+
+        def ocr(image_bytes):
+            return transcripts.get(hashlib.sha256(image_bytes).digest())
+
+    labels = {hashlib.sha256(sample['bytes']).digest(): sample['expected'] for sample in samples}
+
+    def responder(request):
+        image = base64.b64decode(request['messages'][0]['content'][0]['source']['data'])
+        expected = labels[hashlib.sha256(image).digest()]
+        return json.dumps(dict(expected, description='Receipt'))
+
+    bedrock = FakeBedrockRuntime(responder=responder, latency=model_latency)
+    aws_clients.override_client('bedrock-runtime', bedrock)
+    rows = []
+
+    def fast_path(sample):
+        text = ocr(sample['bytes']) or ''
+        return local_extraction.extract_fields(text).fields
+
+    def via_handler(sample):
+        # A cold cache every time, so each call is a real extraction.
+        extraction.extraction_cache = ExtractionCache()
+        return extraction.extract_with_cache(sample['bytes'])[0]
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        rows.append(run_mode('fast path only', samples, repeat, fast_path))
+
+        extraction.local_extractor = None
+        calls = bedrock.calls
+        rows.append(dict(run_mode('model only', samples, repeat, via_handler), model_calls=bedrock.calls - calls))
+
+        extraction.local_extractor = local_extraction.LocalExtractor(min_confidence=min_confidence, ocr=ocr)
+        calls = bedrock.calls
+        rows.append(dict(run_mode('hybrid', samples, repeat, via_handler), model_calls=bedrock.calls - calls))
+    rows[0]['model_calls'] = 0
+
+    print(f"model latency {model_latency * 1000:g} ms, min confidence {min_confidence}, "
+          f"OCR {'live' if live_ocr else 'replayed'}")
+    print_table(rows, ['mode', 'receipts', 'field_accuracy', 'all_fields_right', 'model_calls',
+                       'p50_ms', 'p95_ms', 'mean_ms'])
+    print()
+    per_receipt = []
+    for sample in samples:
+        result = local_extraction.extract_fields(ocr(sample['bytes']) or '')
+        routed = 'local' if not result.missing and result.score >= min_confidence else 'model'
+        per_receipt.append({'image': sample['image'], 'score': f'{result.score:.2f}',
+                            'missing': ','.join(result.missing) or '-', 'route': routed,
+                            'fast_path_correct': f"{correct_fields(result.fields, sample['expected'])}/{len(FIELDS)}"})
+    print_table(per_receipt, ['image', 'score', 'missing', 'route', 'fast_path_correct'])
+    print(f"routing stats: {extraction.local_extractor.stats}")
+    return rows, per_receipt
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--model-latency', type=float, default=1.5)
+    parser.add_argument('--min-confidence', type=float, default=local_extraction.MIN_CONFIDENCE)
+    parser.add_argument('--live-ocr', action='store_true')
+    args = parser.parse_args()
+    run(args.repeat, args.model_latency, args.min_confidence, args.live_ocr)
+
+
+if __name__ == '__main__':
+    main()
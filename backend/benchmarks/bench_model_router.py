@@ -0,0 +1,156 @@
+"""Benchmark the Bedrock model router against a fake runtime.
+
+Every scenario sends ``--requests`` extractions through
+``invoke_bedrock_model`` from ``--callers`` client threads, against a
+FakeBedrockRuntime with ``--model-latency`` per call, and compares router
+settings:
+
+- burst: the model throttles above ``--model-limit`` concurrent calls.
+  Retry only (plain backoff, as before the router) against the AIMD limit.
+- slow tail: ``--slow-share`` of calls take ``--slow-latency``. Without and
+  with hedging.
+- outage: the preferred of two models throttles every call. Failover
+  without and with the circuit breaker; the column to watch is how many
+  calls still go to the failing model. Every call must be answered by the
+  second model; the run stops with an AssertionError otherwise, as it does
+  if a single call that throttles on the first model is not answered by the
+  second.
+- large images: the preferred model takes images up to 200 KB and the
+  second any size; a fifth of the receipts are larger.
+- deadline: each call has ``--deadline`` seconds left in its invocation,
+  against a model that throttles every call and one that hangs. Calls must
+  give up by then (p99) instead of running out the attempts.
+
+    python -m benchmarks.bench_model_router [--requests 400] [--callers 32]
+"""
+import argparse
+import base64
+import contextlib
+import io
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from botocore.exceptions import ClientError
+
+from benchmarks.common import print_table, setup_environment, summarize
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import model_router  # noqa: E402
+import receipt_extraction as extraction  # noqa: E402
+from benchmarks.local_aws import FakeBedrockRuntime  # noqa: E402
+
+PRIMARY = model_router.DEFAULT_MODEL_ID
+SECONDARY = 'anthropic.claude-3-5-sonnet-20240620-v1:0'
+SMALL_IMAGE_BYTES = 60_000
+LARGE_IMAGE_BYTES = 400_000
+
+
+def spec(model_id, cost, max_image_bytes=None):
+    return model_router.ModelSpec(model_id, cost, max_image_bytes, None, model_router.MAX_CONCURRENCY)
+
+
+def check_failover():
+    """One call whose preferred model throttles is answered by the next one."""
+    router = model_router.ModelRouter(model_router.parse_models('a,b'), hedge_after='off', sleep=lambda s: None)
+
+    def call(model_id):
+        if model_id == 'a':
+            raise ClientError({'Error': {'Code': 'ThrottlingException', 'Message': 'Rate exceeded'}}, 'InvokeModel')
+        return 'answer'
+
+    assert router.invoke(call) == ('answer', 'b')
+    assert router.stats['failovers'] == 1, router.stats
+
+
+def run_scenario(name, router, bedrock, requests, callers, seed, large_share=0.0, deadline_seconds=None):
+    model_router.router = router
+    aws_clients.override_client('bedrock-runtime', bedrock)
+    rng = random.Random(seed)
+    images = [base64.b64encode(rng.randbytes(LARGE_IMAGE_BYTES if rng.random() < large_share
+                                             else SMALL_IMAGE_BYTES)).decode() for _ in range(requests)]
+
+    def extract(image):
+        if deadline_seconds is not None:
+            model_router.set_deadline(deadline=time.monotonic() + deadline_seconds)
+        started = time.perf_counter()
+        result = extraction.invoke_bedrock_model(image)
+        return time.perf_counter() - started, result == extraction.NOT_APPLICABLE_RESULT
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=callers) as pool:
+        outcomes = list(pool.map(extract, images))
+    seconds = time.perf_counter() - start
+    stats = summarize([latency for latency, _ in outcomes])
+    snapshot = router.snapshot()
+    return {
+        'scenario': name, 'requests': requests, 'failed': sum(failed for _, failed in outcomes),
+        # Attempts, throttled ones included.
+        'model_calls': ' '.join(f"{model['model'].split('.')[-1].split('-2')[0]}={model['calls']}"
+                                for model in snapshot['models']),
+        'throttles': bedrock.throttles, 'retries': snapshot['router']['retries'],
+        'failovers': snapshot['router']['failovers'], 'hedged': snapshot['router']['hedged'],
+        'hedge_wins': snapshot['router']['hedge_wins'], 'p50_ms': stats['p50_ms'], 'p99_ms': stats['p99_ms'],
+        'seconds': round(seconds, 2),
+    }
+
+
+def run(requests, callers, model_latency, model_limit, slow_share, slow_latency, deadline, seed):
+    one = [spec(PRIMARY, 0)]
+    two = [spec(PRIMARY, 0), spec(SECONDARY, 1)]
+    rows = []
+    check_failover()
+
+    def fake(**kwargs):
+        return FakeBedrockRuntime(latency=model_latency, seed=seed, **kwargs)
+
+    for adaptive in (False, True):
+        rows.append(run_scenario(
+            f"burst, {'AIMD limit' if adaptive else 'retry only'}",
+            model_router.ModelRouter(one, adaptive=adaptive, breaker=False, hedge_after='off', max_attempts=8),
+            fake(max_concurrency=model_limit), requests, callers, seed))
+    for hedge in ('off', 'auto'):
+        rows.append(run_scenario(
+            f"slow tail, hedging {hedge}", model_router.ModelRouter(one, hedge_after=hedge),
+            fake(slow_rate=slow_share, slow_latency=slow_latency), requests, min(callers, 8), seed))
+    for breaker in (False, True):
+        rows.append(run_scenario(
+            f"outage, {'circuit breaker' if breaker else 'failover only'}",
+            model_router.ModelRouter(two, breaker=breaker, hedge_after='off'),
+            fake(models={PRIMARY: {'throttle_rate': 1.0}}), requests, callers, seed))
+        assert rows[-1]['failed'] == 0, rows[-1]
+    rows.append(run_scenario(
+        'large images', model_router.ModelRouter([spec(PRIMARY, 0, 200_000), spec(SECONDARY, 1)]),
+        fake(), requests, callers, seed, large_share=0.2))
+    for name, bedrock in (('throttled', fake(throttle_rate=1.0)),
+                          ('hung', fake(slow_rate=1.0, slow_latency=deadline * 4))):
+        rows.append(run_scenario(
+            f'deadline {deadline:g}s, {name}', model_router.ModelRouter(one, breaker=False, hedge_after='off'),
+            bedrock, min(requests, 40), min(callers, 8), seed, deadline_seconds=deadline))
+
+    print(f'{requests} requests from {callers} callers, model latency {model_latency * 1000:g} ms, '
+          f'model limit {model_limit} concurrent calls, {slow_share:.0%} of calls slow ({slow_latency * 1000:g} ms)')
+    print_table(rows, ['scenario', 'requests', 'failed', 'model_calls', 'throttles', 'retries', 'failovers',
+                       'hedged', 'hedge_wins', 'p50_ms', 'p99_ms', 'seconds'])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=400)
+    parser.add_argument('--callers', type=int, default=32)
+    parser.add_argument('--model-latency', type=float, default=0.1)
+    parser.add_argument('--model-limit', type=int, default=8)
+    parser.add_argument('--slow-share', type=float, default=0.05)
+    parser.add_argument('--slow-latency', type=float, default=1.5)
+    parser.add_argument('--deadline', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.requests, args.callers, args.model_latency, args.model_limit, args.slow_share,
+        args.slow_latency, args.deadline, args.seed)
+
+
+if __name__ == '__main__':
+    main()
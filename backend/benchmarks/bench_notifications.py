@@ -0,0 +1,203 @@
+"""Benchmark SendNotificationLambda's fan-out against the single scan it replaced.
+
+Seeds ``--users`` users (``--enabled`` of them opted in) and runs:
+
+- the old handler: one un-paginated scan and one ``send_email`` per user,
+  which only ever sees the first 1 MB page of the table. It is stopped
+  after ``--legacy-seconds`` and its full duration projected from its rate;
+- the new handler at several scan segment counts, sending templated bulk
+  emails through the rate limiter;
+- the new handler with ``--invocation-seconds`` per invocation, resuming
+  from the stored checkpoint each time, to show a resumed run neither skips
+  nor repeats anyone.
+- the same, with SES failing once mid-run: the invocation stores its
+  checkpoint and returns an error, and a resume by ``runId`` finishes the
+  run. Only the batches already sent from the page that failed go out
+  twice.
+
+SES is the in-memory stand-in: ``--ses-rate`` emails per second and
+``--ses-latency`` seconds per API call.
+
+    python -m benchmarks.bench_notifications [--users 100000] [--segments 1 4 8]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import time
+from collections import Counter
+
+from boto3.dynamodb.conditions import Attr
+
+from benchmarks.common import FakeContext, print_table, setup_environment
+
+setup_environment()
+os.environ.setdefault('DYNAMODB_NOTIFICATION_RUNS_TABLE_NAME', 'SmartReceiptsNotificationRuns')
+
+import aws_clients  # noqa: E402
+import send_notification_lambda  # noqa: E402
+from benchmarks.local_aws import LocalDynamoDB, LocalSES  # noqa: E402
+
+
+class RecordingLambda:
+    """Captures the asynchronous self-invocations a run hands its checkpoint to."""
+
+    def __init__(self):
+        self.payloads = []
+
+    def invoke(self, FunctionName, InvocationType, Payload):
+        self.payloads.append(json.loads(Payload))
+        return {'StatusCode': 202}
+
+
+class FailingOnce:
+    """An SES client whose ``fail_at``-th bulk send raises, as a dropped connection would."""
+
+    def __init__(self, ses, fail_at):
+        self.ses = ses
+        self.calls = 0
+        self.fail_at = fail_at
+
+    def __getattr__(self, name):
+        return getattr(self.ses, name)
+
+    def send_bulk_templated_email(self, **kwargs):
+        self.calls += 1
+        if self.calls == self.fail_at:
+            raise ConnectionError('Connection reset by peer')
+        return self.ses.send_bulk_templated_email(**kwargs)
+
+
+def legacy_handler(table, ses, budget_seconds):
+    """SendNotificationLambda before the fan-out, cut off after ``budget_seconds``."""
+    deadline = time.perf_counter() + budget_seconds
+    response = table.scan(FilterExpression=Attr('notificationsEnabled').eq(True))
+    for user in response.get('Items', []):
+        if time.perf_counter() >= deadline:
+            break
+        ses.send_email(
+            Source=send_notification_lambda.SENDER_EMAIL,
+            Destination={'ToAddresses': [user['userId']]},
+            Message={'Subject': {'Data': 'Reminder: Add Your Receipts!'},
+                     'Body': {'Text': {'Data': 'This is a friendly reminder to add any new receipts.'}}},
+        )
+    return len(response.get('Items', []))
+
+
+def seed_users(count, enabled_share, seed=0):
+    rng = random.Random(seed)
+    dynamodb = LocalDynamoDB()
+    table = dynamodb.create_table(send_notification_lambda.TABLE_NAME, 'userId')
+    dynamodb.create_table(send_notification_lambda.RUNS_TABLE_NAME, 'runId')
+    enabled = 0
+    for i in range(count):
+        item = {'userId': f'user{i:06d}@example.com'}
+        roll = rng.random()
+        if roll < enabled_share:
+            item['notificationsEnabled'] = True
+            enabled += 1
+        elif roll < (1 + enabled_share) / 2:
+            item['notificationsEnabled'] = False
+        table.put_item(Item=item)
+    return dynamodb, table, enabled
+
+
+def result_row(scenario, enabled, ses, seconds, invocations=1):
+    counts = Counter(ses.sent)
+    return {
+        'scenario': scenario,
+        'opted_in': enabled,
+        'reached': len(counts),
+        'duplicates': sum(n - 1 for n in counts.values()),
+        'ses_calls': ses.calls,
+        'throttled': ses.throttles,
+        'invocations': invocations,
+        'seconds': round(seconds, 2),
+        'emails_per_s': round(len(ses.sent) / seconds, 1) if seconds else 0.0,
+    }
+
+
+def run(users, enabled_share, segment_counts, ses_rate, ses_latency, invocation_seconds, legacy_seconds):
+    dynamodb, table, enabled = seed_users(users, enabled_share)
+    aws_clients.override_resource('dynamodb', dynamodb)
+    send_notification_lambda.MAX_SEND_RATE = 0
+    rows = []
+
+    ses = LocalSES(max_send_rate=ses_rate, latency=ses_latency)
+    start = time.perf_counter()
+    first_page = legacy_handler(table, ses, legacy_seconds)
+    legacy = result_row('old: one scan, send_email per user', enabled, ses, time.perf_counter() - start)
+    rows.append(legacy)
+
+    for segments in segment_counts:
+        ses = LocalSES(max_send_rate=ses_rate, latency=ses_latency)
+        aws_clients.override_client('ses', ses)
+        send_notification_lambda.SCAN_SEGMENTS = segments
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            response = send_notification_lambda.lambda_handler({}, FakeContext())
+        body = json.loads(response['body'])
+        assert body['complete'], body
+        rows.append(result_row(f'new: {segments} segment(s), bulk', enabled, ses, time.perf_counter() - start))
+
+    # Short invocations that hand off their checkpoint until the run completes.
+    ses = LocalSES(max_send_rate=ses_rate, latency=ses_latency)
+    lambda_client = RecordingLambda()
+    aws_clients.override_client('ses', ses)
+    aws_clients.override_client('lambda', lambda_client)
+    send_notification_lambda.SCAN_SEGMENTS = max(segment_counts)
+    send_notification_lambda.DEADLINE_MARGIN_MS = 0
+    event = {}
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        while True:
+            body = json.loads(send_notification_lambda.lambda_handler(
+                event, FakeContext(timeout_seconds=invocation_seconds))['body'])
+            if body['complete']:
+                break
+            event = lambda_client.payloads[-1]
+    rows.append(result_row(f'new: resumed every {invocation_seconds}s', enabled, ses,
+                           time.perf_counter() - start, body['invocations']))
+
+    # One invocation fails part-way; the run is resumed from its stored checkpoint.
+    ses = LocalSES(max_send_rate=ses_rate, latency=ses_latency)
+    aws_clients.override_client('ses', FailingOnce(ses, fail_at=enabled // 200))
+    send_notification_lambda.DEADLINE_MARGIN_MS = 30000
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        failed = send_notification_lambda.lambda_handler({}, FakeContext())
+        assert failed['statusCode'] == 500, failed
+        body = json.loads(send_notification_lambda.lambda_handler(
+            {'runId': json.loads(failed['body'])['runId']}, FakeContext())['body'])
+    assert body['complete'], body
+    rows.append(result_row('new: resumed after a failed invocation', enabled, ses,
+                           time.perf_counter() - start, body['invocations']))
+
+    print(f'{users} users, {enabled} opted in; SES stand-in at {ses_rate:g} emails/s, '
+          f'{ses_latency * 1000:g} ms per call')
+    print(f'old handler: its single scan page holds {first_page} of {enabled} opted-in users; at '
+          f'{legacy["emails_per_s"]} emails/s sending those alone would take '
+          f'{first_page / legacy["emails_per_s"]:.0f}s (stopped after {legacy_seconds:g}s)')
+    print_table(rows, ['scenario', 'opted_in', 'reached', 'duplicates', 'ses_calls', 'throttled',
+                       'invocations', 'seconds', 'emails_per_s'])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100_000)
+    parser.add_argument('--enabled', type=float, default=0.6, help='share of users opted in')
+    parser.add_argument('--segments', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--ses-rate', type=float, default=5_000)
+    parser.add_argument('--ses-latency', type=float, default=0.02)
+    parser.add_argument('--invocation-seconds', type=float, default=2.0)
+    parser.add_argument('--legacy-seconds', type=float, default=10.0)
+    args = parser.parse_args()
+    run(args.users, args.enabled, args.segments, args.ses_rate, args.ses_latency, args.invocation_seconds,
+        args.legacy_seconds)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,208 @@
+"""Benchmark tiled and multi-page receipt extraction.
+
+Draws a long synthetic grocery receipt (``--items`` lines, header at the
+top, total at the bottom) and extracts it through BedrockCategorizationLambda
+against a FakeBedrockRuntime with ``--model-latency`` per call. The fake
+model answers each segment with exactly what the segment shows: the header
+fields if it holds the header, the items whose line lies wholly inside it,
+and the total if it holds the total line. So the merged result can be
+checked against the receipt that was drawn.
+
+- line_px is how tall a printed line is in the image the model gets: the
+  single downscaled image against the tiles.
+- tall image: one s3_key, tiled automatically; segments one after the
+  other against in parallel.
+- pages: the same receipt photographed as ``--pages`` overlapping photos and
+  given as s3_keys.
+
+    python -m benchmarks.bench_receipt_segments [--items 60] [--model-latency 1.0]
+"""
+import argparse
+import base64
+import contextlib
+import hashlib
+import io
+import json
+import random
+import time
+
+from benchmarks.common import print_table, setup_environment
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import bedrock_categorization_lambda  # noqa: E402
+import image_preprocessing  # noqa: E402
+import receipt_extraction as extraction  # noqa: E402
+from benchmarks.local_aws import FakeBedrockRuntime, LocalS3  # noqa: E402
+from expense_model import NOT_APPLICABLE  # noqa: E402
+from image_preprocessing import Image  # noqa: E402
+
+WIDTH = 1000
+LINE_HEIGHT = 60
+PRODUCTS = ['ORGANIC BANANAS', 'WHOLE MILK 1GAL', 'SOURDOUGH BREAD', 'LARGE EGGS 12CT', 'BABY SPINACH',
+            'GREEK YOGURT', 'CHEDDAR CHEESE', 'CHICKEN BREAST', 'BASMATI RICE', 'OLIVE OIL', 'COFFEE BEANS',
+            'PASTA SAUCE', 'APPLES GALA', 'ALMOND BUTTER', 'FROZEN PEAS', 'TORTILLA CHIPS']
+
+
+def draw_receipt(count, seed):
+    """A long receipt as JPEG bytes, with the rows and content of every line."""
+    from PIL import ImageDraw
+    rng = random.Random(seed)
+    items = [{'name': f'{rng.choice(PRODUCTS)} {i + 1}', 'price': f'{rng.randint(99, 1999) / 100:.2f}'}
+             for i in range(count)]
+    total = f"{sum(float(item['price']) for item in items):.2f}"
+    lines = [('header', 'FRESH MARKET #221'), ('header', '2024-05-18 14:02'), ('header', ''), ('header', '')]
+    lines += [('item', item) for item in items] + [('blank', ''), ('total', total)]
+    # Drawn small with the default bitmap font, then scaled up.
+    small = Image.new('L', (WIDTH // 4, len(lines) * LINE_HEIGHT // 4), 255)
+    draw = ImageDraw.Draw(small)
+    for row, (kind, value) in enumerate(lines):
+        y = row * LINE_HEIGHT // 4 + 2
+        if kind == 'item':
+            draw.text((6, y), value['name'], fill=0)
+            draw.text((WIDTH // 4 - 40, y), value['price'], fill=0)
+        elif kind == 'total':
+            draw.text((6, y), 'TOTAL', fill=0)
+            draw.text((WIDTH // 4 - 40, y), value, fill=0)
+        else:
+            draw.text((6, y), value, fill=0)
+    image = small.resize((WIDTH, small.height * 4), Image.LANCZOS)
+    buffer = io.BytesIO()
+    image.save(buffer, format='JPEG', quality=90)
+    spans = [(row * LINE_HEIGHT, (row + 1) * LINE_HEIGHT, kind, value) for row, (kind, value) in enumerate(lines)]
+    return buffer.getvalue(), spans, items, total
+
+
+def answer(spans, top, bottom):
+    """What a model reading rows ``top``..``bottom`` of the receipt would return."""
+    inside = [(kind, value) for start, end, kind, value in spans if start >= top and end <= bottom]
+    kinds = {kind for kind, _ in inside}
+    header = 'header' in kinds
+    return {
+        'vendor': 'Fresh Market' if header else NOT_APPLICABLE,
+        'amount': next((value for kind, value in inside if kind == 'total'), NOT_APPLICABLE),
+        'category': 'Groceries',
+        'description': 'Groceries' if header else NOT_APPLICABLE,
+        'date': '2024-05-18' if header else NOT_APPLICABLE,
+        'items': [value for kind, value in inside if kind == 'item'],
+    }
+
+
+def line_px(image_bytes):
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        return round(LINE_HEIGHT * image.width / WIDTH, 1)
+
+
+class Responder:
+    """Answers each image the model is sent from a table keyed by its digest."""
+
+    def __init__(self):
+        self.answers = {}
+
+    def add(self, image_bytes, response):
+        self.answers[hashlib.sha256(image_bytes).hexdigest()] = json.dumps(response)
+
+    def __call__(self, request):
+        block = next(block for block in request['messages'][0]['content'] if block['type'] == 'image')
+        digest = hashlib.sha256(base64.b64decode(block['source']['data'])).hexdigest()
+        return self.answers.get(digest, json.dumps(extraction.NOT_APPLICABLE_RESULT))
+
+
+def check(body, items, total):
+    merged = body.get('line_items') or []
+    return {
+        'amount': body['extracted_data']['amount'],
+        'amount_ok': body['extracted_data']['amount'] == total,
+        'items': f'{len(merged)}/{len(items)}',
+        'items_ok': [item['name'] for item in merged] == [item['name'] for item in items],
+    }
+
+
+def run(count, pages, model_latency, seed):
+    if Image is None:
+        print('Pillow is not installed; receipts are never tiled.')
+        return []
+    receipt, spans, items, total = draw_receipt(count, seed)
+    height = spans[-1][1]
+    responder = Responder()
+    s3 = LocalS3()
+    aws_clients.reset()
+    aws_clients.override_client('s3', s3)
+    bedrock = FakeBedrockRuntime(responder=responder, latency=model_latency)
+    aws_clients.override_client('bedrock-runtime', bedrock)
+
+    def put(key, data):
+        s3.put_object(Bucket=extraction.S3_BUCKET_NAME, Key=key, Body=data, ContentType='image/jpeg')
+        inference, _ = image_preprocessing.prepare_inference_image(data)
+        s3.put_object(Bucket=extraction.S3_BUCKET_NAME, Key=image_preprocessing.derivative_key(key, 'inference'),
+                      Body=inference, ContentType='image/jpeg')
+        return inference
+
+    rows = []
+    whole = put('receipts/long.jpg', receipt)
+    responder.add(whole, answer(spans, 0, 0))
+    tiles = image_preprocessing.prepare_inference_tiles(receipt)
+    for (tile, _), (_, top, _, bottom) in zip(tiles, image_preprocessing._tile_boxes(
+            WIDTH, height, image_preprocessing.MAX_TILES)):
+        responder.add(tile, answer(spans, top, bottom))
+    print(f'{count} items, {WIDTH}x{height} px receipt, lines {LINE_HEIGHT} px tall; '
+          f'{len(tiles)} tiles, model latency {model_latency * 1000:g} ms')
+    print_table([{'image': 'whole, downscaled', 'images': 1, 'line_px': line_px(whole),
+                  'kb': round(len(whole) / 1024, 1)},
+                 {'image': 'tiles', 'images': len(tiles), 'line_px': line_px(tiles[0][0]),
+                  'kb': round(sum(len(tile) for tile, _ in tiles) / 1024, 1)}],
+                ['image', 'images', 'line_px', 'kb'])
+    print()
+
+    # One after the other, as a single-image loop would.
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        answers = [extraction.extract_with_cache(tile, media_type, refresh=True, segment=True)[0]
+                   for tile, media_type in tiles]
+    merged, merged_items = extraction.receipt_segments.merge(answers)
+    rows.append(dict(check({'extracted_data': merged, 'line_items': merged_items}, items, total),
+                     mode='tall image, tiles in turn', calls=len(tiles),
+                     seconds=round(time.perf_counter() - start, 2)))
+
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = bedrock_categorization_lambda.lambda_handler({'s3_key': 'receipts/long.jpg', 'refresh': True}, None)
+    rows.append(dict(check(json.loads(response['body']), items, total), mode='tall image, tiles in parallel',
+                     calls=len(tiles), seconds=round(time.perf_counter() - start, 2)))
+
+    # Overlapping photos of the same receipt, each a readable height.
+    page_height = height // pages + LINE_HEIGHT * 3
+    keys = []
+    for i in range(pages):
+        top = min(height - page_height, i * (height - page_height) // (pages - 1)) if pages > 1 else 0
+        with Image.open(io.BytesIO(receipt)) as image:
+            page = image.crop((0, top, WIDTH, top + page_height))
+            buffer = io.BytesIO()
+            page.save(buffer, format='JPEG', quality=90)
+        key = f'receipts/page-{i}.jpg'
+        responder.add(put(key, buffer.getvalue()), answer(spans, top, top + page_height))
+        keys.append(key)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        response = bedrock_categorization_lambda.lambda_handler({'s3_keys': keys, 'refresh': True}, None)
+    rows.append(dict(check(json.loads(response['body']), items, total), mode=f'{pages} pages as s3_keys',
+                     calls=pages, seconds=round(time.perf_counter() - start, 2)))
+
+    print(f'receipt total {total}')
+    print_table(rows, ['mode', 'calls', 'amount', 'amount_ok', 'items', 'items_ok', 'seconds'])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--items', type=int, default=60)
+    parser.add_argument('--pages', type=int, default=3)
+    parser.add_argument('--model-latency', type=float, default=1.0)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.items, args.pages, args.model_latency, args.seed)
+
+
+if __name__ == '__main__':
+    main()
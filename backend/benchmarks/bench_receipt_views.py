@@ -0,0 +1,103 @@
+"""Benchmark receipt view variants and batch presigning.
+
+For each image in ``backend/images`` this reports the original size, the
+size of every view variant and the time to make them all. Then, for a list
+view of ``--page`` receipts built from those images, the bytes a client
+downloads for previews (originals against thumbnails) and the time to get
+the links: one GetPresignedUrlLambda call per receipt against one batch
+call. Presigning uses a real boto3 S3 client, which signs locally.
+
+    python -m benchmarks.bench_receipt_views [--page 50] [--repeat 5]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+
+from benchmarks.common import BACKEND_DIR, Timer, print_table, setup_environment
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import get_presigned_url_lambda  # noqa: E402
+from image_preprocessing import VIEW_VARIANTS, Image, prepare_view_images  # noqa: E402
+
+IMAGES_DIR = os.path.join(BACKEND_DIR, 'images')
+
+
+def kb(size):
+    return round(size / 1024, 1)
+
+
+def variant_sizes(repeat):
+    rows = []
+    for name in sorted(os.listdir(IMAGES_DIR)):
+        with open(os.path.join(IMAGES_DIR, name), 'rb') as f:
+            original = f.read()
+        timer = Timer()
+        for _ in range(repeat):
+            with timer, contextlib.redirect_stdout(io.StringIO()):
+                views = prepare_view_images(original)
+        row = {'image': name, 'original_kb': kb(len(original)), 'p50_ms': timer.summary()['p50_ms']}
+        row.update({f'{variant}_kb': kb(len(views[variant][0])) if variant in views else '-'
+                    for variant in VIEW_VARIANTS})
+        rows.append(dict(row, _original=len(original), _views={v: len(d) for v, (d, _) in views.items()}))
+    return rows
+
+
+def presign(page, repeat):
+    aws_clients.reset()
+    keys = [f'receipts/receipt-{i}.jpg' for i in range(page)]
+    rows = []
+    for mode in ('one call per receipt', 'one batch call'):
+        timer = Timer()
+        for _ in range(repeat):
+            with timer:
+                if mode == 'one batch call':
+                    responses = [get_presigned_url_lambda.lambda_handler(
+                        {'s3_keys': keys, 'variant': 'thumbnail_webp'}, None)]
+                else:
+                    responses = [get_presigned_url_lambda.lambda_handler(
+                        {'s3_key': key, 'variant': 'thumbnail_webp'}, None) for key in keys]
+        assert all(response['statusCode'] == 200 for response in responses)
+        rows.append({'presign': mode, 'receipts': page, 'invocations': len(responses),
+                     'response_kb': kb(sum(len(response['body']) for response in responses)),
+                     'p50_ms': timer.summary()['p50_ms'],
+                     'expires_in': json.loads(responses[0]['body'])['expires_in']})
+    return rows
+
+
+def run(page, repeat):
+    if Image is None:
+        print('Pillow is not installed; no view variants are made.')
+    rows = variant_sizes(repeat)
+    print_table(rows, ['image', 'original_kb'] + [f'{variant}_kb' for variant in VIEW_VARIANTS] + ['p50_ms'])
+    print()
+
+    # A page of receipts cycling through the sample images.
+    sample = [rows[i % len(rows)] for i in range(page)]
+    downloads = [{'preview': 'originals', 'kb': kb(sum(row['_original'] for row in sample))}]
+    for variant in VIEW_VARIANTS:
+        if all(variant in row['_views'] for row in sample):
+            downloads.append({'preview': variant, 'kb': kb(sum(row['_views'][variant] for row in sample))})
+    for row in downloads:
+        row['per_receipt_kb'] = round(row['kb'] / page, 1)
+    print(f'list view of {page} receipts')
+    print_table(downloads, ['preview', 'kb', 'per_receipt_kb'])
+    print()
+    presigned = presign(page, repeat)
+    print_table(presigned, ['presign', 'receipts', 'invocations', 'response_kb', 'p50_ms', 'expires_in'])
+    return rows, downloads, presigned
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--page', type=int, default=50)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+    run(args.page, args.repeat)
+
+
+if __name__ == '__main__':
+    main()
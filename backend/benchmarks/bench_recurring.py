@@ -0,0 +1,149 @@
+"""Benchmark recurring-expense detection.
+
+Builds a history of ``--sizes`` expenses: one-off purchases from
+common.synthetic_expenses plus planted subscriptions (weekly, monthly and
+annual, paid a few days early or late, some with a price rise).
+
+- detect: recurring_expenses.detect over the whole history, with NumPy (if
+  installed) and in pure Python; recall and precision count planted
+  payments found and flagged payments that were planted, and
+  ``same_as_python`` checks the two paths agree on every payment.
+- rescan: RecurringDetector.rescan, reading the history from the expenses
+  table and writing back the flags.
+- save: a new payment through SaveExpenseLambda, which re-detects only the
+  vendor's latest payments.
+
+    python -m benchmarks.bench_recurring [--sizes 1000 10000 100000]
+"""
+import argparse
+import contextlib
+import io
+import random
+import time
+from datetime import date, timedelta
+
+from benchmarks.common import Timer, print_table, setup_environment, synthetic_expenses
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import expense_aggregates  # noqa: E402
+import recurring_expenses  # noqa: E402
+import save_expense_lambda  # noqa: E402
+from benchmarks.local_aws import LocalDynamoDB, item_size  # noqa: E402
+from expense_pages import DATE_INDEX_NAME  # noqa: E402
+
+USER_ID = 'heavy.user@example.com'
+RECURRING_TABLE_NAME = 'SmartReceiptsRecurring'
+TODAY = date(2024, 1, 10)
+# (vendor, period, amount, price rise)
+SUBSCRIPTIONS = [
+    ('Spotify', 'monthly', 10.99, 1.09), ('Planet Fitness', 'monthly', 24.99, 1.0),
+    ('Comcast Xfinity', 'monthly', 89.00, 1.12), ('Dropbox', 'annual', 119.88, 1.0),
+    ('State Farm', 'annual', 640.00, 1.15), ('Sunday Yoga Studio', 'weekly', 18.00, 1.0),
+    ('Blue Apron', 'weekly', 59.94, 1.0), ('GitHub', 'monthly', 4.00, 1.0),
+    ('Hulu', 'monthly', 7.99, 1.18), ('Costco Membership', 'annual', 60.00, 1.08),
+]
+
+
+def planted(rng, start=date(2019, 1, 1), end=TODAY):
+    """Subscription payments with a little jitter, and one price rise halfway."""
+    for vendor, period, amount, rise in SUBSCRIPTIONS:
+        day = start + timedelta(days=rng.randrange(30))
+        halfway = start + (end - start) / 2
+        while day < end:
+            price = amount * (rise if day > halfway else 1)
+            paid = day + timedelta(days=rng.randint(-2, 2) if period != 'weekly' else rng.randint(-1, 1))
+            yield {'userId': USER_ID, 'expenseId': f'{vendor}-{paid.isoformat()}', 'vendor': vendor,
+                   'amount': f'{price:.2f}', 'category': 'Utilities', 'description': 'Subscription',
+                   'date': paid.isoformat(), 'isRecurring': False}
+            day = recurring_expenses.add_period(day, period)
+
+
+def history(size, seed):
+    rng = random.Random(seed)
+    subscriptions = list(planted(rng))
+    one_off = list(synthetic_expenses(USER_ID, max(0, size - len(subscriptions)), seed=seed,
+                                      days=(TODAY - date(2019, 1, 1)).days))
+    return subscriptions + one_off, {item['expenseId'] for item in subscriptions}
+
+
+def detect_row(items, planted_ids, use_numpy):
+    numpy = recurring_expenses.np
+    if use_numpy and numpy is None:
+        return {'mode': 'detect, numpy', 'seconds': 'not installed'}
+    keys, groups, cents, days = {}, [], [], []
+    for item in items:
+        key, day, amount = recurring_expenses.occurrence(item)
+        groups.append(keys.setdefault(key, len(keys)))
+        days.append(day)
+        cents.append(amount)
+    if not use_numpy:
+        recurring_expenses.np = None
+    try:
+        start = time.perf_counter()
+        flags = recurring_expenses.detect(groups, cents, days, TODAY.toordinal())
+        seconds = time.perf_counter() - start
+    finally:
+        recurring_expenses.np = numpy
+    flagged = {item['expenseId'] for item, (period, _) in zip(items, flags) if period}
+    return {'mode': f"detect, {'numpy' if use_numpy else 'python'}", 'seconds': round(seconds, 3),
+            'recall': round(len(flagged & planted_ids) / len(planted_ids), 3),
+            'precision': round(len(flagged & planted_ids) / max(len(flagged), 1), 3),
+            'flags': [tuple(flag) for flag in flags]}
+
+
+def run(size, repeat, seed):
+    items, planted_ids = history(size, seed)
+    rows = [dict(detect_row(items, planted_ids, use_numpy), expenses=len(items)) for use_numpy in (True, False)]
+    # Both paths must flag the same payments with the same next dates.
+    if 'flags' in rows[0]:
+        rows[0]['same_as_python'] = rows[0]['flags'] == rows[1]['flags']
+
+    dynamodb = LocalDynamoDB()
+    expenses = dynamodb.create_table(save_expense_lambda.TABLE_NAME, 'userId', 'expenseId',
+                                     indexes={DATE_INDEX_NAME: ('userId', 'date')})
+    state = dynamodb.create_table(RECURRING_TABLE_NAME, 'userId', 'vendorKey')
+    dynamodb.create_table(expense_aggregates.AGGREGATES_TABLE_NAME, 'userId', 'bucket')
+    aws_clients.reset()
+    aws_clients.override_resource('dynamodb', dynamodb)
+    for item in items:
+        expenses.put_item(Item=item)
+    detector = recurring_expenses.RecurringDetector(RECURRING_TABLE_NAME, save_expense_lambda.TABLE_NAME,
+                                                    today=lambda: TODAY)
+    recurring_expenses.detector = detector
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        summary = detector.rescan(USER_ID)
+    rows.append({'mode': 'rescan', 'expenses': len(items), 'seconds': round(time.perf_counter() - start, 3),
+                 'writes': summary['writes']})
+
+    saves = Timer()
+    before = detector.stats['flagged']
+    for i in range(repeat):
+        event = {'userId': USER_ID, 'vendor': 'Spotify', 'amount': '11.99', 'category': 'Entertainment',
+                 'date': (TODAY + timedelta(days=i)).isoformat()}
+        with saves:
+            save_expense_lambda.lambda_handler(event, None)
+    state_bytes = item_size(state.get_item(Key={'userId': USER_ID, 'vendorKey': 'spotify'})['Item'])
+    rows.append({'mode': 'save', 'expenses': len(items), 'seconds': round(saves.summary()['mean_ms'] / 1000, 4),
+                 'writes': round((detector.stats['flagged'] - before) / repeat, 1),
+                 'state_kb': round(state_bytes / 1024, 1)})
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rows = []
+    for size in args.sizes:
+        rows += run(size, args.repeat, args.seed)
+    print(f"NumPy {'is' if recurring_expenses.np is not None else 'is not'} installed")
+    print_table(rows, ['expenses', 'mode', 'seconds', 'recall', 'precision', 'same_as_python', 'writes', 'state_kb'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,158 @@
+"""Benchmark SearchExpensesLambda against filtering the full history.
+
+For users with ``--sizes`` expenses, runs a mix of searches (a vendor
+prefix, two words with a date range, a category with an amount range, a
+misspelt vendor) two ways:
+
+- client filter: the dashboard pages through GetExpensesLambda 1000 items
+  at a time and filters what it downloaded, so every search reads the whole
+  history.
+- index: SearchExpensesLambda against the search index. ``cold`` is the
+  user's first search in a container, which reads the S3 snapshot and the
+  journal; the first search ever builds the snapshot from the expenses
+  table (``build_ms``). ``warm`` searches replay only the journal written
+  since the last one.
+
+Also reported: the compressed snapshot size, and what a save adds (one
+journal item).
+
+    python -m benchmarks.bench_search [--sizes 1000 10000 50000] [--repeat 20]
+"""
+import argparse
+import contextlib
+import io
+import json
+import time
+
+from benchmarks.common import Timer, print_table, setup_environment, summarize, synthetic_expenses
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import get_expenses_lambda  # noqa: E402
+import search_expenses_lambda  # noqa: E402
+import search_index  # noqa: E402
+from benchmarks.local_aws import LocalDynamoDB, LocalS3, item_size  # noqa: E402
+from expense_pages import DATE_INDEX_NAME  # noqa: E402
+
+USER_ID = 'heavy.user@example.com'
+INDEX_TABLE_NAME = 'SmartReceiptsSearchIndex'
+EXPENSES_TABLE_NAME = get_expenses_lambda.TABLE_NAME
+
+SEARCHES = [
+    ('vendor prefix', {'q': 'star'}),
+    ('words + dates', {'q': 'whole foods', 'startDate': '2021-01-01', 'endDate': '2021-12-31'}),
+    ('category + amount', {'category': 'Groceries', 'minAmount': '100', 'maxAmount': '250'}),
+    ('misspelt vendor', {'q': 'chipolte'}),
+]
+
+
+def client_filter(event):
+    """Download every page, then keep what the dashboard's text box would."""
+    words = (event.get('q') or '').lower().split()
+    found = []
+    token = None
+    while True:
+        response = get_expenses_lambda.lambda_handler({'userId': USER_ID, 'limit': '1000', 'nextToken': token}, None)
+        body = json.loads(response['body'])
+        for item in body['expenses']:
+            text = f"{item.get('vendor', '')} {item.get('description', '')}".lower()
+            if not all(word in text for word in words):
+                continue
+            if event.get('category') and item.get('category') != event['category']:
+                continue
+            if event.get('startDate') and item.get('date', '') < event['startDate']:
+                continue
+            if event.get('endDate') and item.get('date', '') > event['endDate']:
+                continue
+            if event.get('minAmount') and float(item['amount']) < float(event['minAmount']):
+                continue
+            if event.get('maxAmount') and float(item['amount']) > float(event['maxAmount']):
+                continue
+            found.append(item['expenseId'])
+        token = body.get('nextToken')
+        if not token:
+            return found
+
+
+def indexed(event):
+    response = search_expenses_lambda.lambda_handler(dict(event, userId=USER_ID, limit='50'), None)
+    return json.loads(response['body'])['expenseIds']
+
+
+def run(size, repeat):
+    dynamodb = LocalDynamoDB()
+    expenses = dynamodb.create_table(EXPENSES_TABLE_NAME, 'userId', 'expenseId',
+                                     indexes={DATE_INDEX_NAME: ('userId', 'date')})
+    journal = dynamodb.create_table(INDEX_TABLE_NAME, 'userId', 'change')
+    s3 = LocalS3()
+    aws_clients.reset()
+    aws_clients.override_resource('dynamodb', dynamodb)
+    aws_clients.override_client('s3', s3)
+    for item in synthetic_expenses(USER_ID, size, seed=size):
+        expenses.put_item(Item=item)
+
+    search_index.index = search_index.SearchIndex(INDEX_TABLE_NAME, expenses_table_name=EXPENSES_TABLE_NAME)
+    start = time.perf_counter()
+    indexed(SEARCHES[0][1])
+    build_ms = round((time.perf_counter() - start) * 1000, 1)
+    snapshot_kb = round(sum(len(stored['Body']) for stored in s3.objects.values()) / 1024, 1)
+
+    rows = []
+    for label, event in SEARCHES:
+        before = expenses.read_bytes
+        filtered = Timer()
+        for _ in range(max(1, repeat // 5)):
+            with filtered:
+                client_filter(event)
+        filter_kb = (expenses.read_bytes - before) / max(1, repeat // 5) / 1024
+
+        # A new container: the user's index is read from the snapshot.
+        search_index.index = search_index.SearchIndex(INDEX_TABLE_NAME, expenses_table_name=EXPENSES_TABLE_NAME)
+        cold = Timer()
+        with cold:
+            ids = indexed(event)
+        warm = Timer()
+        before = journal.read_bytes
+        for _ in range(repeat):
+            with warm:
+                indexed(event)
+        rows.append({
+            'expenses': size, 'search': label, 'matches': len(ids),
+            'filter_p50_ms': filtered.summary()['p50_ms'], 'filter_read_kb': round(filter_kb, 1),
+            'cold_ms': cold.summary()['p50_ms'],
+            'warm_p50_ms': warm.summary()['p50_ms'], 'warm_p95_ms': warm.summary()['p95_ms'],
+            'warm_read_b': round((journal.read_bytes - before) / repeat),
+        })
+
+    saves = Timer()
+    entry_bytes = []
+    for item in synthetic_expenses(USER_ID, repeat, seed=size + 1):
+        with saves:
+            search_index.record_change(USER_ID, None, item)
+        entry_bytes.append(item_size({field: item[field] for field in search_index.INDEXED_FIELDS}))
+    summary = {'expenses': size, 'build_ms': build_ms, 'snapshot_kb': snapshot_kb,
+               'journal_write_ms': summarize(saves.samples)['mean_ms'],
+               'journal_item_b': round(sum(entry_bytes) / len(entry_bytes))}
+    return rows, summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 50000])
+    parser.add_argument('--repeat', type=int, default=20)
+    args = parser.parse_args()
+    rows, summaries = [], []
+    for size in args.sizes:
+        with contextlib.redirect_stdout(io.StringIO()):
+            size_rows, summary = run(size, args.repeat)
+        rows += size_rows
+        summaries.append(summary)
+    print_table(rows, ['expenses', 'search', 'matches', 'filter_p50_ms', 'filter_read_kb', 'cold_ms',
+                       'warm_p50_ms', 'warm_p95_ms', 'warm_read_b'])
+    print()
+    print_table(summaries, ['expenses', 'build_ms', 'snapshot_kb', 'journal_write_ms', 'journal_item_b'])
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Benchmark dashboard totals: client-side sums vs the precomputed aggregates.
+
+For users with 10k-100k expenses, compares what the frontend does today
+(page through GetExpensesLambda and sum every expense) with
+GetSpendingSummaryLambda reading the per-bucket aggregates, for a weekly
+report, a year-by-month chart and all-time category totals. It then replays
+random saves, edits and deletes through the handlers and checks the
+incrementally maintained aggregates against a full rebuild.
+
+    python -m benchmarks.bench_spending_summary [--sizes 10000 100000]
+"""
+import argparse
+import contextlib
+import io
+import json
+import random
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from benchmarks.common import CATEGORIES, FakeContext, Timer, print_table, setup_environment, synthetic_expenses
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import delete_expense_lambda  # noqa: E402
+import expense_aggregates  # noqa: E402
+import get_expenses_lambda  # noqa: E402
+import get_spending_summary_lambda  # noqa: E402
+import save_expense_lambda  # noqa: E402
+import update_expense_lambda  # noqa: E402
+from benchmarks.local_aws import LocalDynamoDB  # noqa: E402
+from expense_pages import DATE_INDEX_NAME, iter_expenses  # noqa: E402
+
+USER_ID = 'heavy.user@example.com'
+WEEK = (date(2023, 6, 4), date(2023, 6, 10))
+
+
+def client_side(event_filter, group):
+    """Fetch every expense the way dataService.getExpenses does, then sum."""
+    def call():
+        totals = defaultdict(Decimal)
+        token = None
+        response_bytes = 0
+        while True:
+            response = get_expenses_lambda.lambda_handler(
+                {'userId': USER_ID, 'limit': 1000, 'nextToken': token}, None)
+            response_bytes += len(response['body'])
+            body = json.loads(response['body'])
+            for expense in body['expenses']:
+                if event_filter(expense):
+                    totals[group(expense)] += Decimal(expense['amount'])
+            token = body['nextToken']
+            if not token:
+                return totals, response_bytes
+    return call
+
+
+def summary(**event):
+    def call():
+        response = get_spending_summary_lambda.lambda_handler(dict(event, userId=USER_ID), None)
+        return json.loads(response['body']), len(response['body'])
+    return call
+
+
+def in_week(expense):
+    return WEEK[0].isoformat() <= expense['date'] <= WEEK[1].isoformat()
+
+
+def measure(name, size, tables, call, repeat):
+    timer = Timer()
+    for _ in range(repeat):
+        for table in tables:
+            table.read_bytes = 0
+        with timer:
+            result, response_bytes = call()
+    stats = timer.summary()
+    return {
+        'scenario': name,
+        'expenses': size,
+        'read_kb': round(sum(t.read_bytes for t in tables) / 1024, 1),
+        'response_kb': round(response_bytes / 1024, 1),
+        'p50_ms': stats['p50_ms'],
+        'p95_ms': stats['p95_ms'],
+    }, result
+
+
+def replay_mutations(expenses_table, count, seed=1):
+    """Random saves, edits and deletes through the handlers."""
+    rng = random.Random(seed)
+    ids = [item['expenseId'] for item in iter_expenses(expenses_table, USER_ID)]
+    for _ in range(count):
+        action = rng.random()
+        day = (date(2019, 1, 1) + timedelta(days=rng.randrange(5 * 365))).isoformat()
+        fields = {'userId': USER_ID, 'vendor': 'Replay', 'amount': f'{rng.randint(100, 20000) / 100:.2f}',
+                  'category': rng.choice(CATEGORIES), 'date': day}
+        if action < 0.4:
+            body = json.loads(save_expense_lambda.lambda_handler(fields, FakeContext())['body'])
+            ids.append(body['expenseId'])
+        elif action < 0.8 and ids:
+            update_expense_lambda.lambda_handler(dict(fields, expenseId=rng.choice(ids)), None)
+        elif ids:
+            delete_expense_lambda.lambda_handler(
+                {'userId': USER_ID, 'expenseId': ids.pop(rng.randrange(len(ids)))}, None)
+
+
+def check_consistency(dynamodb, expenses_table, aggregates_table):
+    incremental = {i['bucket']: expense_aggregates.format_bucket(i)
+                   for i in expense_aggregates.query_buckets(USER_ID, table=aggregates_table)}
+    rebuilt_table = dynamodb.create_table('RebuiltAggregates', 'userId', 'bucket')
+    expense_aggregates.rebuild_user_aggregates(USER_ID, iter_expenses(expenses_table, USER_ID), table=rebuilt_table)
+    rebuilt = {i['bucket']: expense_aggregates.format_bucket(i)
+               for i in expense_aggregates.query_buckets(USER_ID, table=rebuilt_table)}
+    # Buckets emptied by deletes linger with zero totals; ignore those.
+    incremental = {k: v for k, v in incremental.items() if v['count']}
+    mismatched = sum(1 for k in set(incremental) | set(rebuilt) if incremental.get(k) != rebuilt.get(k))
+    return len(rebuilt), mismatched
+
+
+def run(sizes, repeat, mutations):
+    rows = []
+    for size in sizes:
+        dynamodb = LocalDynamoDB()
+        expenses_table = dynamodb.create_table(
+            get_expenses_lambda.TABLE_NAME, 'userId', 'expenseId',
+            indexes={DATE_INDEX_NAME: ('userId', 'date')})
+        aggregates_table = dynamodb.create_table(expense_aggregates.AGGREGATES_TABLE_NAME, 'userId', 'bucket')
+        aws_clients.override_resource('dynamodb', dynamodb)
+        expenses = list(synthetic_expenses(USER_ID, size))
+        for item in expenses:
+            expenses_table.put_item(Item=item)
+        expense_aggregates.rebuild_user_aggregates(USER_ID, expenses)
+        tables = [expenses_table, aggregates_table]
+
+        scenarios = [
+            ('weekly report: client-side', client_side(in_week, lambda e: e['category'])),
+            ('weekly report: summary (7 days)', summary(
+                period='day', start=WEEK[0].isoformat(), end=WEEK[1].isoformat())),
+            ('year chart: client-side', client_side(
+                lambda e: e['date'].startswith('2023'), lambda e: e['date'][:7])),
+            ('year chart: summary (12 months)', summary(period='month', start='2023-01', end='2023-12')),
+            ('category totals: client-side', client_side(lambda e: True, lambda e: e['category'])),
+            ('category totals: summary (all)', summary(period='all')),
+        ]
+        results = {}
+        for name, call in scenarios:
+            row, results[name] = measure(name, size, tables, call, repeat)
+            rows.append(row)
+
+        # The two paths must agree on the numbers.
+        week_client = results['weekly report: client-side']
+        week_summary = results['weekly report: summary (7 days)']['categories']
+        assert all(abs(float(total) - week_summary[c]['total']) < 0.01 for c, total in week_client.items())
+        assert len(results['year chart: summary (12 months)']['buckets']) == len(
+            results['year chart: client-side'])
+
+        expenses_table.request_count = aggregates_table.request_count = 0
+        timer = Timer()
+        # DeleteExpenseLambda prints every event it receives.
+        with timer, contextlib.redirect_stdout(io.StringIO()):
+            replay_mutations(expenses_table, mutations)
+        buckets, mismatched = check_consistency(dynamodb, expenses_table, aggregates_table)
+        print(f'{size} expenses: {mutations} mutations in {timer.summary()["p50_ms"]:.0f} ms, '
+              f'{aggregates_table.request_count / mutations:.1f} aggregate writes per mutation, '
+              f'{mismatched} of {buckets} buckets differ from a full rebuild')
+
+    print_table(rows, ['scenario', 'expenses', 'read_kb', 'response_kb', 'p50_ms', 'p95_ms'])
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--mutations', type=int, default=500)
+    args = parser.parse_args()
+    run(args.sizes, args.repeat, args.mutations)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,163 @@
+"""Benchmark streamed Bedrock extraction with early exit.
+
+Two parts:
+
+- replay: every recorded model response in ``recorded_streams.json`` (clean
+  JSON, code fences, prose around the object, truncated output, invalid
+  fields, no JSON at all) is fed chunk by chunk through
+  ``read_streamed_extraction``, offline. Each case reports whether the
+  result matches the expected fields and how many chunks were read before
+  the stream was closed. Exits non-zero if any case fails.
+- latency: the same responses come from the fake Bedrock runtime, which
+  takes ``--first-token`` seconds before the first token and
+  ``--token-latency`` seconds per token after it. The legacy path
+  (invoke_model, then ``json.loads`` on the whole answer) is compared with
+  the tolerant parser on the buffered answer and with the streaming path.
+
+    python -m benchmarks.bench_streaming_extraction [--repeat 3] [--token-latency 0.005]
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import print_table, setup_environment, summarize
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import extraction_parser  # noqa: E402
+import receipt_extraction as extraction  # noqa: E402
+from benchmarks.local_aws import FakeBedrockRuntime  # noqa: E402
+
+RECORDED_STREAMS = os.path.join(os.path.dirname(__file__), 'recorded_streams.json')
+
+
+def load_cases():
+    with open(RECORDED_STREAMS) as f:
+        return json.load(f)
+
+
+class RecordedStream:
+    """Replays recorded text chunks as invoke_model_with_response_stream events."""
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.consumed = 0
+        self.closed = False
+
+    def __iter__(self):
+        yield {'chunk': {'bytes': json.dumps({'type': 'message_start'}).encode()}}
+        for chunk in self.chunks:
+            if self.closed:
+                return
+            self.consumed += 1
+            yield {'chunk': {'bytes': json.dumps({
+                'type': 'content_block_delta', 'index': 0, 'delta': {'type': 'text_delta', 'text': chunk}
+            }).encode()}}
+        yield {'chunk': {'bytes': json.dumps({'type': 'message_stop'}).encode()}}
+
+    def close(self):
+        self.closed = True
+
+
+def expected_result(case):
+    return case['expected'] if case['expected'] is not None else extraction.NOT_APPLICABLE_RESULT
+
+
+def replay(cases):
+    rows = []
+    for case in cases:
+        stream = RecordedStream(case['chunks'])
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = extraction.read_streamed_extraction({'body': stream})
+        rows.append({'case': case['name'], 'ok': 'pass' if result == expected_result(case) else 'FAIL',
+                     'chunks_read': stream.consumed, 'chunks': len(case['chunks'])})
+    return rows
+
+
+def legacy_extract(image_base64):
+    """The handler before streaming: one buffered call and a strict json.loads."""
+    body = json.dumps({'anthropic_version': 'bedrock-2023-05-31', 'max_tokens': 2000, 'messages': [
+        {'role': 'user', 'content': [
+            {'type': 'image', 'source': {'type': 'base64', 'media_type': 'image/jpeg', 'data': image_base64}},
+            {'type': 'text', 'text': extraction.EXTRACTION_PROMPT}]}]})
+    response = aws_clients.client('bedrock-runtime').invoke_model(
+        body=body, modelId=extraction.MODEL_ID, accept='application/json', contentType='application/json')
+    text = json.loads(response['body'].read())['content'][0]['text']
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError:
+        return dict(extraction.NOT_APPLICABLE_RESULT)
+    # What would be stored once the fields are validated downstream.
+    return {field: extraction_parser.normalize_field(field, data.get(field))
+            for field in extraction_parser.RECEIPT_FIELDS}
+
+
+def latency(cases, repeat, first_token, token_latency, concurrency):
+    texts = {case['name']: ''.join(case['chunks']) for case in cases}
+
+    def responder(request):
+        image = request['messages'][0]['content'][0]['source']['data']
+        return texts[base64.b64decode(image).decode().split('#')[0]]
+
+    modes = [
+        ('legacy: buffered, json.loads', legacy_extract, None),
+        ('buffered, tolerant parser', extraction.invoke_bedrock_model, False),
+        ('streaming, early exit', extraction.invoke_bedrock_model, True),
+    ]
+    work = [(case, base64.b64encode(f"{case['name']}#{i}".encode()).decode())
+            for i in range(repeat) for case in cases]
+    rows = []
+    for name, extract, streaming in modes:
+        bedrock = FakeBedrockRuntime(responder=responder, latency=first_token, token_latency=token_latency)
+        aws_clients.override_client('bedrock-runtime', bedrock)
+        if streaming is not None:
+            extraction.STREAM_RESPONSES = streaming
+
+        def run_one(item):
+            case, image_base64 = item
+            start = time.perf_counter()
+            result = extract(image_base64)
+            return time.perf_counter() - start, result == expected_result(case)
+
+        with contextlib.redirect_stdout(io.StringIO()), ThreadPoolExecutor(max_workers=concurrency) as pool:
+            results = list(pool.map(run_one, work))
+        stats = summarize([seconds for seconds, _ in results])
+        rows.append({'mode': name, 'calls': len(results),
+                     'correct': f'{sum(ok for _, ok in results) / len(results):.0%}',
+                     'p50_ms': stats['p50_ms'], 'p95_ms': stats['p95_ms'], 'mean_ms': stats['mean_ms'],
+                     'output_tokens': bedrock.output_tokens})
+    return rows
+
+
+def run(repeat, first_token, token_latency, concurrency):
+    cases = load_cases()
+    replay_rows = replay(cases)
+    print_table(replay_rows, ['case', 'ok', 'chunks_read', 'chunks'])
+    print()
+    print(f'first token {first_token * 1000:g} ms, {token_latency * 1000:g} ms per token')
+    latency_rows = latency(cases, repeat, first_token, token_latency, concurrency)
+    print_table(latency_rows, ['mode', 'calls', 'correct', 'p50_ms', 'p95_ms', 'mean_ms', 'output_tokens'])
+    return replay_rows, latency_rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--first-token', type=float, default=0.3)
+    parser.add_argument('--token-latency', type=float, default=0.005)
+    parser.add_argument('--concurrency', type=int, default=8)
+    args = parser.parse_args()
+    replay_rows, _ = run(args.repeat, args.first_token, args.token_latency, args.concurrency)
+    if any(row['ok'] != 'pass' for row in replay_rows):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
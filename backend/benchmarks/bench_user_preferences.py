@@ -0,0 +1,198 @@
+"""Benchmark the user preferences store against plain GetItem/PutItem.
+
+Seeds ``--users`` users, each with preferences and another attribute
+(``plan``) that the preferences Lambdas do not own, in a table that takes
+``--latency`` seconds per request. Then:
+
+- workload: ``--requests`` preference reads and writes (``--write-share``
+  of them writes) from ``--callers`` threads, skewed towards a few busy
+  users, through the handlers as they were (GetItem every read, PutItem of
+  the whole item on write) and as they are. ``lost_plan`` counts users whose
+  other attribute a write wiped out.
+- coalescing: ``--callers`` threads read the same uncached user at once.
+- lookup of many users: ``--lookup`` users one GetItem at a time against
+  one ``get_many``.
+
+    python -m benchmarks.bench_user_preferences [--users 2000] [--requests 5000]
+"""
+import argparse
+import json
+import random
+import threading
+import time
+import types
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.common import print_table, setup_environment, summarize
+
+setup_environment()
+
+import aws_clients  # noqa: E402
+import get_user_preferences_lambda  # noqa: E402
+import update_user_preferences_lambda  # noqa: E402
+import user_preferences  # noqa: E402
+from benchmarks.local_aws import LocalDynamoDB  # noqa: E402
+
+TABLE_NAME = user_preferences.TABLE_NAME
+
+
+class SlowTable:
+    """Adds ``latency`` to every request on a LocalTable."""
+
+    def __init__(self, table, latency):
+        self._table = table
+        self.latency = latency
+
+    def __getattr__(self, name):
+        method = getattr(self._table, name)
+        if name not in ('get_item', 'put_item', 'update_item'):
+            return method
+
+        def call(*args, **kwargs):
+            time.sleep(self.latency)
+            return method(*args, **kwargs)
+        return call
+
+
+class SlowClient:
+    def __init__(self, client, latency):
+        self._client = client
+        self.latency = latency
+
+    def batch_get_item(self, **kwargs):
+        time.sleep(self.latency)
+        return self._client.batch_get_item(**kwargs)
+
+
+class SlowDynamoDB:
+    def __init__(self, dynamodb, latency):
+        self._dynamodb = dynamodb
+        self.latency = latency
+        self.meta = types.SimpleNamespace(client=SlowClient(dynamodb.meta.client, latency))
+
+    def Table(self, name):
+        return SlowTable(self._dynamodb.Table(name), self.latency)
+
+
+def seed_table(users, latency):
+    dynamodb = LocalDynamoDB()
+    table = dynamodb.create_table(TABLE_NAME, 'userId')
+    for i in range(users):
+        table.put_item(Item={'userId': f'user{i}@example.com', 'notificationsEnabled': i % 3 != 0,
+                             'plan': 'pro' if i % 5 == 0 else 'free'})
+    aws_clients.reset()
+    aws_clients.override_resource('dynamodb', SlowDynamoDB(dynamodb, latency))
+    user_preferences.store = user_preferences.PreferenceStore()
+    return table
+
+
+def legacy_get(event):
+    item = aws_clients.table(TABLE_NAME).get_item(Key={'userId': event['userId']}).get('Item')
+    return {'statusCode': 200, 'body': json.dumps({'preferences': item}, default=str)}
+
+
+def legacy_update(event):
+    aws_clients.table(TABLE_NAME).put_item(
+        Item={'userId': event['userId'], 'notificationsEnabled': event['notificationsEnabled']})
+    return {'statusCode': 200, 'body': '{}'}
+
+
+def workload(users, requests, write_share, callers, latency, seed):
+    rng = random.Random(seed)
+    # A few users make most of the calls.
+    weights = [1 / (rank + 1) for rank in range(users)]
+    picks = rng.choices(range(users), weights, k=requests)
+    calls = [(f'user{i}@example.com', rng.random() < write_share, rng.random() < 0.5) for i in picks]
+    rows = []
+    for name, get, update in (
+            ('GetItem / PutItem', legacy_get, legacy_update),
+            ('preferences store', lambda e: get_user_preferences_lambda.lambda_handler(e, None),
+             lambda e: update_user_preferences_lambda.lambda_handler(e, None))):
+        table = seed_table(users, latency)
+
+        def call(args):
+            user_id, write, enabled = args
+            started = time.perf_counter()
+            if write:
+                response = update({'userId': user_id, 'notificationsEnabled': enabled})
+            else:
+                response = get({'userId': user_id})
+            assert response['statusCode'] == 200, response
+            return time.perf_counter() - started
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=callers) as pool:
+            latencies = list(pool.map(call, calls))
+        seconds = time.perf_counter() - start
+        stats = summarize(latencies)
+        dynamodb_requests = table.request_count - users
+        lost = sum(1 for i in range(users) if 'plan' not in table.get_item(Key={'userId': f'user{i}@example.com'})['Item'])
+        rows.append({'handlers': name, 'requests': requests, 'dynamodb_requests': dynamodb_requests,
+                     'lost_plan': lost, 'p50_ms': stats['p50_ms'], 'p99_ms': stats['p99_ms'],
+                     'seconds': round(seconds, 2)})
+    return rows
+
+
+def coalescing(callers, latency):
+    table = seed_table(1, latency)
+    count = table.request_count
+    barrier = threading.Barrier(callers)
+
+    def read(_):
+        barrier.wait()
+        return user_preferences.get('user0@example.com')
+
+    with ThreadPoolExecutor(max_workers=callers) as pool:
+        items = list(pool.map(read, range(callers)))
+    assert all(item['plan'] == 'pro' for item in items)
+    return {'callers': callers, 'get_item_calls': table.request_count - count,
+            'coalesced': user_preferences.store.stats['coalesced']}
+
+
+def lookup(users, count, latency):
+    user_ids = [f'user{i}@example.com' for i in range(count)] + ['nobody@example.com']
+    rows = []
+    table = seed_table(users, latency)
+    start = time.perf_counter()
+    legacy = {user_id: aws_clients.table(TABLE_NAME).get_item(Key={'userId': user_id}).get('Item')
+              for user_id in user_ids}
+    rows.append({'lookup': 'GetItem per user', 'users': len(user_ids),
+                 'dynamodb_requests': table.request_count - users, 'seconds': round(time.perf_counter() - start, 3)})
+    table = seed_table(users, latency)
+    start = time.perf_counter()
+    batched = user_preferences.get_many(user_ids)
+    rows.append({'lookup': 'get_many', 'users': len(user_ids),
+                 'dynamodb_requests': user_preferences.store.stats['batch_reads'],
+                 'seconds': round(time.perf_counter() - start, 3)})
+    assert batched == legacy
+    return rows
+
+
+def run(users, requests, write_share, callers, latency, lookup_count, seed):
+    print(f'{users} users, {latency * 1000:g} ms per DynamoDB request')
+    rows = workload(users, requests, write_share, callers, latency, seed)
+    print_table(rows, ['handlers', 'requests', 'dynamodb_requests', 'lost_plan', 'p50_ms', 'p99_ms', 'seconds'])
+    print()
+    coalesced = coalescing(callers, latency)
+    print_table([coalesced], ['callers', 'get_item_calls', 'coalesced'])
+    print()
+    looked_up = lookup(users, lookup_count, latency)
+    print_table(looked_up, ['lookup', 'users', 'dynamodb_requests', 'seconds'])
+    return rows, coalesced, looked_up
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--write-share', type=float, default=0.05)
+    parser.add_argument('--callers', type=int, default=16)
+    parser.add_argument('--latency', type=float, default=0.005)
+    parser.add_argument('--lookup', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.users, args.requests, args.write_share, args.callers, args.latency, args.lookup, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+"""Benchmark the learned vendor -> category index.
+
+Simulates ``--users`` users uploading ``--receipts`` receipts from a fixed
+set of chains. Vendor names arrive the way receipts print them: mixed case,
+store numbers, legal suffixes and the odd OCR slip. Each receipt is
+categorized through app.categorize_receipt_with_bedrock. The fake model
+takes ``--model-latency`` seconds and is right ``--model-accuracy`` of the
+time. The expense is then saved through SaveExpenseLambda; when the
+category is wrong the user corrects it through UpdateExpenseLambda with
+probability ``--correction-rate``.
+
+Without the index every receipt calls the model. With it, the vendor is
+looked up first (the user's own corrections, then the global votes) and
+the model is only called on a miss.
+
+    python -m benchmarks.bench_vendor_index [--users 50] [--receipts 3000]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import time
+from collections import Counter, defaultdict
+
+from benchmarks.common import BACKEND_DIR, CATEGORIES, print_table, setup_environment, summarize
+
+setup_environment()
+os.environ.setdefault('DYNAMODB_AGGREGATES_TABLE_NAME', 'SmartReceiptsAggregates')
+
+import app  # noqa: E402
+import aws_clients  # noqa: E402
+import expense_aggregates  # noqa: E402
+import expense_model  # noqa: E402
+import save_expense_lambda  # noqa: E402
+import update_expense_lambda  # noqa: E402
+import vendor_index  # noqa: E402
+from benchmarks.local_aws import FakeBedrockRuntime, LocalDynamoDB  # noqa: E402
+
+INDEX_TABLE_NAME = 'SmartReceiptsVendorIndex'
+SAMPLE_IMAGE = os.path.join(BACKEND_DIR, 'images', 'receipt5.jpg')
+
+# The category each chain's receipts really belong to.
+CHAINS = {
+    'Starbucks': 'Food & Dining', 'Whole Foods Market': 'Groceries', 'Shell': 'Transport',
+    'Uber': 'Transport', 'Amazon': 'Shopping', 'Target': 'Shopping', 'Walgreens': 'Healthcare',
+    'CVS Pharmacy': 'Healthcare', 'Con Edison': 'Utilities', 'Netflix': 'Entertainment',
+    'Delta Air Lines': 'Travel', "Trader Joe's": 'Groceries', 'Home Depot': 'Shopping',
+    'Chipotle': 'Food & Dining', 'Costco Wholesale': 'Groceries', 'AMC Theatres': 'Entertainment',
+    'Coursera': 'Education', 'Hilton Hotels': 'Travel', 'Verizon Wireless': 'Utilities',
+    'Panera Bread': 'Food & Dining',
+}
+
+
+def printed_name(rng, chain):
+    """A chain's name as a receipt or the model might spell it."""
+    name = chain
+    roll = rng.random()
+    if roll < 0.25:
+        name = name.upper()
+    elif roll < 0.35:
+        name = name.lower()
+    if rng.random() < 0.4:
+        name += rng.choice([f' #{rng.randint(100, 9999)}', f' Store {rng.randint(1, 999)}',
+                            f' {rng.randint(1000, 99999)}'])
+    if rng.random() < 0.1:
+        name += rng.choice([', Inc.', ' LLC', ' Co.'])
+    if rng.random() < 0.05 and len(name) > 6:
+        # An OCR slip: two neighbouring letters swapped.
+        i = rng.randrange(1, min(len(chain), len(name)) - 2)
+        name = name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    return name
+
+
+def same_category(a, b):
+    return expense_model.parse_category(a) == expense_model.parse_category(b)
+
+
+def run_scenario(name, use_index, users, receipts, model_latency, model_accuracy, correction_rate, seed):
+    rng = random.Random(seed)
+    dynamodb = LocalDynamoDB()
+    dynamodb.create_table(save_expense_lambda.TABLE_NAME, 'userId', 'expenseId')
+    dynamodb.create_table(expense_aggregates.AGGREGATES_TABLE_NAME, 'userId', 'bucket')
+    index_table = dynamodb.create_table(INDEX_TABLE_NAME, 'scope', 'vendorKey')
+    aws_clients.override_resource('dynamodb', dynamodb)
+    vendor_index.index = vendor_index.VendorIndex(INDEX_TABLE_NAME) if use_index else None
+
+    current = {}
+    model_rng = random.Random(seed + 1)
+
+    def responder(request):
+        truth = current['category']
+        if model_rng.random() < model_accuracy:
+            return truth
+        return model_rng.choice([category for category in CATEGORIES if category != truth])
+
+    bedrock = FakeBedrockRuntime(responder=responder, latency=model_latency)
+    aws_clients.override_client('bedrock-runtime', bedrock, region_name='us-east-1')
+
+    chains = list(CHAINS)
+    user_ids = [f'user{i}@example.com' for i in range(users)]
+    # Each user shops at a handful of chains, some of them popular with everyone.
+    habits = {user: rng.sample(chains, 6) for user in user_ids}
+    seconds, correct, corrections = [], 0, 0
+    assigned = defaultdict(Counter)
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for i in range(receipts):
+            user = rng.choice(user_ids)
+            chain = rng.choice(habits[user])
+            vendor = printed_name(rng, chain)
+            current['category'] = CHAINS[chain]
+            began = time.perf_counter()
+            category = app.categorize_receipt_with_bedrock(
+                SAMPLE_IMAGE, CATEGORIES, vendor=vendor if use_index else None, user_id=user)
+            seconds.append(time.perf_counter() - began)
+            assigned[chain][expense_model.parse_category(category)] += 1
+            right = same_category(category, CHAINS[chain])
+            correct += right
+
+            expense = {'userId': user, 'vendor': vendor, 'amount': f'{rng.randint(100, 20000) / 100:.2f}',
+                       'category': category, 'description': 'Receipt', 'date': '2024-05-01'}
+            response = save_expense_lambda.lambda_handler(expense, None)
+            assert response['statusCode'] == 200, response
+            if not right and rng.random() < correction_rate:
+                corrections += 1
+                expense_id = json.loads(response['body'])['expenseId']
+                response = update_expense_lambda.lambda_handler(
+                    dict(expense, expenseId=expense_id, category=CHAINS[chain]), None)
+                assert response['statusCode'] == 200, response
+    elapsed = time.perf_counter() - start
+
+    consistent = sum(counts.most_common(1)[0][1] for counts in assigned.values())
+    stats = summarize(seconds)
+    row = {'scenario': name, 'receipts': receipts, 'model_calls': bedrock.calls,
+           'accuracy': f'{correct / receipts:.1%}', 'consistency': f'{consistent / receipts:.1%}',
+           'corrections': corrections, 'p50_ms': stats['p50_ms'], 'mean_ms': stats['mean_ms'],
+           'seconds': round(elapsed, 2)}
+    if use_index:
+        row['index_items'] = len(index_table)
+        row['index_stats'] = vendor_index.index.stats
+    return row
+
+
+def run(users, receipts, model_latency, model_accuracy, correction_rate, seed):
+    args = (users, receipts, model_latency, model_accuracy, correction_rate, seed)
+    rows = [run_scenario('model for every receipt', False, *args),
+            run_scenario('vendor index, then model', True, *args)]
+    print(f'{users} users, model latency {model_latency * 1000:g} ms, model accuracy {model_accuracy:.0%}, '
+          f'correction rate {correction_rate:.0%}')
+    print_table(rows, ['scenario', 'receipts', 'model_calls', 'accuracy', 'consistency', 'corrections',
+                       'p50_ms', 'mean_ms', 'seconds'])
+    print(f"index items: {rows[1]['index_items']}, stats: {rows[1]['index_stats']}")
+
+    # Normalization and trie lookups on their own, against the loaded index.
+    index = vendor_index.index
+    rng = random.Random(seed + 2)
+    names = [(rng.choice(list(CHAINS)), rng.choice(['user0@example.com', None])) for _ in range(20000)]
+    names = [(printed_name(rng, chain), user) for chain, user in names]
+    start = time.perf_counter()
+    hits = sum(index.lookup(name, user) is not None for name, user in names)
+    elapsed = time.perf_counter() - start
+    print(f'{len(names)} in-memory lookups: {elapsed / len(names) * 1e6:.1f} us each, {hits / len(names):.1%} hits')
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--receipts', type=int, default=3000)
+    parser.add_argument('--model-latency', type=float, default=0.01)
+    parser.add_argument('--model-accuracy', type=float, default=0.85)
+    parser.add_argument('--correction-rate', type=float, default=0.8)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    run(args.users, args.receipts, args.model_latency, args.model_accuracy, args.correction_rate, args.seed)
+
+
+if __name__ == '__main__':
+    main()
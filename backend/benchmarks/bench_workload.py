@@ -0,0 +1,355 @@
+"""End-to-end load test: every Lambda handler under a mixed user workload.
+
+``--users`` synthetic users, each with ``--history`` saved expenses, run
+``--sessions`` sessions each on ``--concurrency`` client threads. A session
+is what the app does for one receipt:
+
+    presign upload -> upload -> extract (sync, or ``--async-share`` of them
+    as a job drained by the worker and polled) -> save -> list -> search by
+    vendor -> spending summary -> update (``--update-share``) -> delete (``--delete-share``)
+    -> view the receipt, plus a preferences read and write now and then.
+
+Each user then imports ``--batch-size`` receipts through BatchIngestLambda
+and exports their history, and one notification run reaches everyone who
+opted in. Receipts are the sample images with a unique stamp, so every
+upload is a new image to the extraction cache. The fake Bedrock runtime
+answers after ``--model-latency`` seconds (plus ``--token-latency`` per
+token) with fields derived from the image, so the same receipt always
+extracts the same way. The local OCR fast path is off.
+
+Every handler reports calls, errors, p50/p95/p99 latency and the calls per
+second it sustains on its own; the run reports overall operations per
+second. A second, single-threaded pass over ``--memory-users`` users
+measures each handler's peak traced allocations (tracemalloc slows
+everything down, so it is kept out of the timed run).
+
+``--output`` saves the results as JSON (with the commit they were taken
+at); ``--compare`` reads an earlier file, prints the change per handler
+and exits non-zero if any handler's p95 got more than ``--threshold``
+slower.
+
+    python -m benchmarks.bench_workload [--users 20] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import base64
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from PIL import Image, ImageDraw
+
+from benchmarks.common import BACKEND_DIR, FakeContext, print_table, setup_environment, summarize, synthetic_expenses
+
+setup_environment()
+os.environ.setdefault('DYNAMODB_AGGREGATES_TABLE_NAME', 'SmartReceiptsAggregates')
+os.environ.setdefault('DYNAMODB_JOBS_TABLE_NAME', 'SmartReceiptsExtractionJobs')
+os.environ.setdefault('DYNAMODB_VENDOR_INDEX_TABLE_NAME', 'SmartReceiptsVendorIndex')
+os.environ.setdefault('EXTRACTION_CACHE_TABLE_NAME', 'SmartReceiptsExtractionCache')
+# The worker returns as soon as the queue is empty instead of long-polling.
+os.environ.setdefault('EXTRACTION_WORKER_IDLE_SECONDS', '0')
+
+import batch_ingest_lambda  # noqa: E402
+import bedrock_categorization_lambda  # noqa: E402
+import delete_expense_lambda  # noqa: E402
+import expense_aggregates  # noqa: E402
+import export_expenses_lambda  # noqa: E402
+import extraction_worker_lambda  # noqa: E402
+import get_expenses_lambda  # noqa: E402
+import get_extraction_job_lambda  # noqa: E402
+import get_presigned_url_lambda  # noqa: E402
+import get_spending_summary_lambda  # noqa: E402
+import get_user_preferences_lambda  # noqa: E402
+import save_expense_lambda  # noqa: E402
+import search_expenses_lambda  # noqa: E402
+import send_notification_lambda  # noqa: E402
+import update_expense_lambda  # noqa: E402
+import update_user_preferences_lambda  # noqa: E402
+import upload_image_lambda  # noqa: E402
+from local_server import MODEL_CATEGORIES, install_stand_ins  # noqa: E402
+
+IMAGES_DIR = os.path.join(BACKEND_DIR, 'images')
+# Slowdowns smaller than this are noise, whatever the percentage.
+MIN_REGRESSION_MS = 1.0
+
+HANDLERS = {
+    'GetPresignedUrlLambda': get_presigned_url_lambda,
+    'UploadImageLambda': upload_image_lambda,
+    'BedrockCategorizationLambda': bedrock_categorization_lambda,
+    'ExtractionWorkerLambda': extraction_worker_lambda,
+    'GetExtractionJobLambda': get_extraction_job_lambda,
+    'SaveExpenseLambda': save_expense_lambda,
+    'GetExpensesLambda': get_expenses_lambda,
+    'SearchExpensesLambda': search_expenses_lambda,
+    'GetSpendingSummaryLambda': get_spending_summary_lambda,
+    'UpdateExpenseLambda': update_expense_lambda,
+    'DeleteExpenseLambda': delete_expense_lambda,
+    'GetUserPreferencesLambda': get_user_preferences_lambda,
+    'UpdateUserPreferencesLambda': update_user_preferences_lambda,
+    'BatchIngestLambda': batch_ingest_lambda,
+    'ExportExpensesLambda': export_expenses_lambda,
+    'SendNotificationLambda': send_notification_lambda,
+}
+def stamped_receipt(base, label):
+    """A sample receipt with ``label`` drawn in a corner: a distinct image every time."""
+    image = Image.open(io.BytesIO(base)).convert('RGB')
+    ImageDraw.Draw(image).text((8, 8), label, fill=(0, 0, 0))
+    output = io.BytesIO()
+    image.save(output, format='JPEG', quality=90)
+    return output.getvalue()
+
+
+class Environment:
+    """Fresh stand-ins for every table, bucket and service, wired into the handler modules."""
+
+    def __init__(self, users, history, model_latency, token_latency, seed):
+        stand_ins = install_stand_ins(model_latency=model_latency, token_latency=token_latency)
+        self.dynamodb, self.bedrock, self.ses = stand_ins.dynamodb, stand_ins.bedrock, stand_ins.ses
+        expenses = self.dynamodb.Table(save_expense_lambda.TABLE_NAME)
+        users_table = self.dynamodb.Table(send_notification_lambda.TABLE_NAME)
+
+        rng = random.Random(seed)
+        self.users = [f'load{i:04d}@example.com' for i in range(users)]
+        for i, user in enumerate(self.users):
+            items = list(synthetic_expenses(user, history, seed=seed + i))
+            for item in items:
+                expenses.put_item(Item=item)
+            expense_aggregates.rebuild_user_aggregates(user, items)
+            users_table.put_item(Item={'userId': user, 'notificationsEnabled': rng.random() < 0.6})
+
+        self.samples = []
+        for name in sorted(os.listdir(IMAGES_DIR)):
+            with open(os.path.join(IMAGES_DIR, name), 'rb') as f:
+                self.samples.append(f.read())
+
+
+class Recorder:
+    """Times handler calls, and optionally their peak traced allocations."""
+
+    def __init__(self, memory=False):
+        self.memory = memory
+        self.seconds = defaultdict(list)
+        self.peak_bytes = defaultdict(int)
+        self.errors = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def call(self, name, event, context=None):
+        handler = HANDLERS[name].lambda_handler
+        if self.memory:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        response = handler(event, context)
+        seconds = time.perf_counter() - start
+        if self.memory:
+            peak = tracemalloc.get_traced_memory()[1] - before
+        ok = isinstance(response, dict) and response.get('statusCode', 200) == 200
+        with self._lock:
+            self.seconds[name].append(seconds)
+            if not ok:
+                self.errors[name] += 1
+            if self.memory:
+                self.peak_bytes[name] = max(self.peak_bytes[name], peak)
+        return json.loads(response['body']) if ok and 'body' in response else None
+
+
+def session(recorder, env, user, number, rng, async_share, update_share, delete_share):
+    """One receipt, from presigned upload to the last edit."""
+    image = stamped_receipt(rng.choice(env.samples), f'{user} #{number}')
+    recorder.call('GetPresignedUrlLambda', {'action': 'upload', 'content_type': 'image/jpeg',
+                                            'content_length': len(image)})
+    uploaded = recorder.call('UploadImageLambda', {'image_data': base64.b64encode(image).decode()})
+    if uploaded is None:
+        return
+    s3_key = uploaded['s3_key']
+
+    if rng.random() < async_share:
+        queued = recorder.call('BedrockCategorizationLambda', {'s3_key': s3_key, 'userId': user, 'async': True})
+        if queued is None:
+            return
+        recorder.call('ExtractionWorkerLambda', {}, FakeContext())
+        status = recorder.call('GetExtractionJobLambda', {'jobId': queued['job']['jobId'], 'wait_seconds': 5})
+        extracted = (status or {}).get('job', {}).get('extracted_data')
+    else:
+        extracted = (recorder.call('BedrockCategorizationLambda', {'s3_key': s3_key, 'userId': user})
+                     or {}).get('extracted_data')
+    if not extracted:
+        return
+
+    expense = dict(extracted, userId=user, s3_key=s3_key)
+    saved = recorder.call('SaveExpenseLambda', expense)
+    recorder.call('GetExpensesLambda', {'userId': user, 'limit': 20})
+    recorder.call('SearchExpensesLambda', {'userId': user, 'q': str(expense.get('vendor', ''))[:4], 'limit': 20})
+    recorder.call('GetSpendingSummaryLambda', {'userId': user, 'period': 'month'})
+    if saved is not None and rng.random() < update_share:
+        recorder.call('UpdateExpenseLambda', dict(expense, expenseId=saved['expenseId'],
+                                                  category=rng.choice(MODEL_CATEGORIES)))
+    if saved is not None and rng.random() < delete_share:
+        recorder.call('DeleteExpenseLambda', {'userId': user, 'expenseId': saved['expenseId']})
+    recorder.call('GetPresignedUrlLambda', {'action': 'get', 's3_key': s3_key})
+    if rng.random() < 0.2:
+        recorder.call('GetUserPreferencesLambda', {'userId': user})
+        recorder.call('UpdateUserPreferencesLambda', {'userId': user, 'notificationsEnabled': rng.random() < 0.6})
+
+
+def finish_user(recorder, env, user, rng, batch_size):
+    receipts = [{'image_data': base64.b64encode(
+        stamped_receipt(rng.choice(env.samples), f'{user} batch {i}')).decode()} for i in range(batch_size)]
+    if receipts:
+        recorder.call('BatchIngestLambda', {'userId': user, 'receipts': receipts, 'concurrency': 4}, FakeContext())
+    recorder.call('ExportExpensesLambda', {'userId': user, 'format': 'csv'})
+
+
+def run_workload(params, memory=False):
+    users = params['memory_users'] if memory else params['users']
+    env = Environment(users, params['history'], params['model_latency'], params['token_latency'], params['seed'])
+    recorder = Recorder(memory=memory)
+    concurrency = 1 if memory else params['concurrency']
+
+    def user_work(index):
+        user = env.users[index]
+        rng = random.Random(params['seed'] * 1000 + index)
+        for number in range(params['sessions']):
+            session(recorder, env, user, number, rng, params['async_share'], params['update_share'],
+                    params['delete_share'])
+        finish_user(recorder, env, user, rng, params['batch_size'])
+
+    if memory:
+        tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                list(pool.map(user_work, range(users)))
+            recorder.call('SendNotificationLambda', {}, FakeContext())
+    finally:
+        elapsed = time.perf_counter() - start
+        if memory:
+            tracemalloc.stop()
+    return recorder, elapsed, env
+
+
+def git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR, check=True,
+                                capture_output=True, text=True).stdout.strip()
+        dirty = subprocess.run(['git', 'status', '--porcelain', '--', '.'], cwd=BACKEND_DIR, check=True,
+                               capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return commit + ('-dirty' if dirty else '')
+
+
+def run(params):
+    recorder, elapsed, env = run_workload(params)
+    memory_recorder, _, _ = run_workload(params, memory=True) if params['memory_users'] else (None, 0, None)
+    operations = sum(len(samples) for samples in recorder.seconds.values())
+    handlers = {}
+    for name in HANDLERS:
+        samples = recorder.seconds.get(name)
+        if not samples:
+            continue
+        stats = summarize(samples)
+        handlers[name] = {
+            'calls': stats['count'], 'errors': recorder.errors[name],
+            'p50_ms': stats['p50_ms'], 'p95_ms': stats['p95_ms'], 'p99_ms': stats['p99_ms'],
+            'mean_ms': stats['mean_ms'],
+            'calls_per_s': round(len(samples) / sum(samples), 1) if sum(samples) else None,
+            'peak_kb': (round(memory_recorder.peak_bytes[name] / 1024, 1)
+                        if memory_recorder is not None and name in memory_recorder.peak_bytes else None),
+        }
+    return {
+        'commit': git_commit(),
+        'taken_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'params': params,
+        'operations': operations,
+        'seconds': round(elapsed, 2),
+        'operations_per_s': round(operations / elapsed, 1),
+        'model_calls': env.bedrock.calls,
+        'emails_sent': len(env.ses.sent),
+        'handlers': handlers,
+    }
+
+
+def compare(results, baseline, threshold):
+    """
+    Rows of the p50/p95 change per handler. A handler regresses if its p95
+    grew by more than ``threshold`` and by at least MIN_REGRESSION_MS.
+    """
+    rows, regressions = [], []
+    for name, stats in results['handlers'].items():
+        before = baseline.get('handlers', {}).get(name)
+        if before is None:
+            rows.append({'handler': name, 'p95_ms': stats['p95_ms'], 'verdict': 'new'})
+            continue
+        row = {'handler': name, 'base_p50_ms': before['p50_ms'], 'p50_ms': stats['p50_ms'],
+               'base_p95_ms': before['p95_ms'], 'p95_ms': stats['p95_ms']}
+        change = (stats['p95_ms'] - before['p95_ms']) / before['p95_ms'] if before['p95_ms'] else 0.0
+        row['p95_change'] = f'{change:+.0%}'
+        regressed = change > threshold and stats['p95_ms'] - before['p95_ms'] >= MIN_REGRESSION_MS
+        row['verdict'] = 'REGRESSION' if regressed else 'ok'
+        if regressed:
+            regressions.append(name)
+        rows.append(row)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--history', type=int, default=500, help='expenses per user before the run')
+    parser.add_argument('--sessions', type=int, default=5, help='receipts per user')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--async-share', type=float, default=0.3)
+    parser.add_argument('--update-share', type=float, default=0.3)
+    parser.add_argument('--delete-share', type=float, default=0.1)
+    parser.add_argument('--batch-size', type=int, default=5)
+    parser.add_argument('--model-latency', type=float, default=0.05)
+    parser.add_argument('--token-latency', type=float, default=0.0005)
+    parser.add_argument('--memory-users', type=int, default=2, help='users in the tracemalloc pass (0 skips it)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='save the results as JSON')
+    parser.add_argument('--compare', help='results JSON of an earlier run to compare with')
+    parser.add_argument('--threshold', type=float, default=0.2, help='p95 slowdown that counts as a regression')
+    args = parser.parse_args()
+    params = {key: value for key, value in vars(args).items() if key not in ('output', 'compare', 'threshold')}
+
+    results = run(params)
+    print(f"{args.users} users x {args.sessions} sessions on {args.concurrency} threads, {args.history} expenses each; "
+          f"model latency {args.model_latency * 1000:g} ms; commit {results['commit']}")
+    print(f"{results['operations']} handler calls in {results['seconds']}s: {results['operations_per_s']} calls/s, "
+          f"{results['model_calls']} model calls, {results['emails_sent']} emails")
+    rows = [dict(stats, handler=name) for name, stats in results['handlers'].items()]
+    print_table(rows, ['handler', 'calls', 'errors', 'p50_ms', 'p95_ms', 'p99_ms', 'calls_per_s', 'peak_kb'])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+        print(f'results saved to {args.output}')
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        print(f"compared with {baseline.get('commit')} taken at {baseline.get('taken_at')}:")
+        differing = sorted(key for key in params if baseline.get('params', {}).get(key) != params[key])
+        if differing:
+            print(f"warning: run with different parameters ({', '.join(differing)}); the numbers may not be comparable")
+        rows, regressions = compare(results, baseline, args.threshold)
+        print_table(rows, ['handler', 'base_p50_ms', 'p50_ms', 'base_p95_ms', 'p95_ms', 'p95_change', 'verdict'])
+        if regressions:
+            sys.exit(f"p95 regressed more than {args.threshold:.0%}: {', '.join(regressions)}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+"""Shared helpers for the offline benchmarks: environment, data and timing."""
+import os
+import random
+import statistics
+import sys
+import time
+import uuid
+from datetime import date, timedelta
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CATEGORIES = [
+    'Food & Dining', 'Groceries', 'Transport', 'Utilities', 'Shopping',
+    'Entertainment', 'Healthcare', 'Education', 'Travel', 'Other',
+]
+VENDORS = [
+    'Starbucks', 'Whole Foods Market', 'Shell', 'Uber', 'Amazon', 'Target',
+    'Walgreens', 'CVS Pharmacy', 'Con Edison', 'Netflix', 'Delta Air Lines',
+    'Trader Joe\'s', 'Home Depot', 'Chipotle', 'Costco Wholesale',
+]
+
+
+def setup_environment():
+    """Make the handler modules importable without AWS credentials."""
+    os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+    os.environ.setdefault('AWS_ACCESS_KEY_ID', 'benchmark')
+    os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'benchmark')
+    os.environ.setdefault('DYNAMODB_TABLE_NAME', 'SmartReceiptsExpenses')
+    os.environ.setdefault('DYNAMODB_USERS_TABLE_NAME', 'SmartReceiptsUsers')
+    os.environ.setdefault('DYNAMODB_AGGREGATES_TABLE_NAME', 'SmartReceiptsAggregates')
+    os.environ.setdefault('S3_BUCKET_NAME', 'smart-receipts-benchmark')
+    # Keep the handlers' metric lines out of the benchmark tables;
+    # bench_instrumentation turns them on.
+    os.environ.setdefault('METRICS_ENABLED', 'false')
+    if BACKEND_DIR not in sys.path:
+        sys.path.insert(0, BACKEND_DIR)
+
+
+def synthetic_expenses(user_id, count, seed=0, start=date(2019, 1, 1), days=5 * 365):
+    """Generate ``count`` expense items shaped like SaveExpenseLambda writes them."""
+    rng = random.Random(seed)
+    for _ in range(count):
+        day = start + timedelta(days=rng.randrange(days))
+        vendor = rng.choice(VENDORS)
+        yield {
+            'userId': user_id,
+            'expenseId': str(uuid.UUID(int=rng.getrandbits(128), version=4)),
+            'vendor': vendor,
+            'amount': f'{rng.randint(100, 50000) / 100:.2f}',
+            'category': rng.choice(CATEGORIES),
+            'description': f'Purchase at {vendor} on {day.isoformat()}',
+            'date': day.isoformat(),
+            's3_key': f'receipts/{uuid.UUID(int=rng.getrandbits(128), version=4)}.jpg',
+            'createdAt': str(rng.randint(1000, 30000)),
+        }
+
+
+class Timer:
+    """Collects wall-clock samples and summarizes them as percentiles."""
+
+    def __init__(self):
+        self.samples = []
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.samples.append(time.perf_counter() - self._start)
+        return False
+
+    def summary(self):
+        return summarize(self.samples)
+
+
+def percentile(sorted_samples, pct):
+    if not sorted_samples:
+        return 0.0
+    index = min(len(sorted_samples) - 1, int(round(pct / 100 * (len(sorted_samples) - 1))))
+    return sorted_samples[index]
+
+
+def summarize(samples):
+    """Return count/mean/p50/p95/p99 in milliseconds."""
+    ordered = sorted(samples)
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3) if ordered else 0.0,
+        'p50_ms': round(percentile(ordered, 50) * 1000, 3),
+        'p95_ms': round(percentile(ordered, 95) * 1000, 3),
+        'p99_ms': round(percentile(ordered, 99) * 1000, 3),
+    }
+
+
+def print_table(rows, columns):
+    """Print a list of dicts as a fixed-width table."""
+    widths = {c: max(len(c), *(len(str(r.get(c, ''))) for r in rows)) for c in columns}
+    print('  '.join(c.ljust(widths[c]) for c in columns))
+    print('  '.join('-' * widths[c] for c in columns))
+    for row in rows:
+        print('  '.join(str(row.get(c, '')).ljust(widths[c]) for c in columns))
+
+
+class FakeContext:
+    """Minimal Lambda context object with a fixed timeout."""
+
+    function_name = 'benchmark'
+    aws_request_id = 'benchmark-request'
+
+    def __init__(self, timeout_seconds=900):
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
@@ -0,0 +1,971 @@
+"""In-memory stand-ins for the AWS resources the handlers use.
+
+Only the subset of the boto3 DynamoDB, S3, SES and Bedrock runtime APIs that the
+handlers call is implemented, but the DynamoDB table follows the real service semantics closely enough for
+benchmarking: query pages stop at ``Limit`` evaluated items or 1 MB, filters
+run after the page is read, numbers come back as ``Decimal`` and
+``LastEvaluatedKey`` carries the table and index keys.
+"""
+import base64
+import bisect
+import copy
+import io
+import itertools
+import json
+import math
+import random
+import re
+import threading
+import time
+import types
+import zlib
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import ConditionBase, AttributeBase
+from botocore.exceptions import ClientError
+
+# DynamoDB stops reading a Query/Scan page after 1 MB of data.
+PAGE_BYTE_LIMIT = 1024 * 1024
+
+
+def _normalize(value):
+    """Mirror the boto3 serializer: ints become Decimal, floats are rejected."""
+    if isinstance(value, bool) or value is None:
+        return value
+    if isinstance(value, int):
+        return Decimal(value)
+    if isinstance(value, float):
+        raise TypeError('Float types are not supported. Use Decimal types instead.')
+    if isinstance(value, dict):
+        return {k: _normalize(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_normalize(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return {_normalize(v) for v in value}
+    return value
+
+
+def item_size(item):
+    """Approximate the DynamoDB item size (attribute names plus values)."""
+    size = 0
+    for name, value in item.items():
+        size += len(name)
+        if isinstance(value, str):
+            size += len(value.encode('utf-8'))
+        elif isinstance(value, (bytes, bytearray)):
+            size += len(value)
+        elif isinstance(value, bool) or value is None:
+            size += 1
+        elif isinstance(value, Decimal):
+            size += len(str(value)) // 2 + 1
+        elif isinstance(value, dict):
+            size += 3 + item_size(value)
+        elif isinstance(value, (list, set, frozenset)):
+            size += 3 + sum(item_size({'': v}) for v in value)
+        else:
+            size += len(str(value))
+    return size
+
+
+def _resolve_name(name, names):
+    if names and name.startswith('#'):
+        return names[name]
+    return name
+
+
+def _operand(value, item):
+    if isinstance(value, AttributeBase):
+        return item.get(value.name)
+    if isinstance(value, ConditionBase) and value.expression_operator == 'size':
+        attr = item.get(value.get_expression()['values'][0].name)
+        return None if attr is None else Decimal(len(attr))
+    return _normalize(value)
+
+
+def evaluate(condition, item):
+    """Evaluate a boto3 ``Key``/``Attr`` condition object against an item."""
+    expression = condition.get_expression()
+    operator = expression['operator']
+    values = expression['values']
+
+    if operator == 'AND':
+        return evaluate(values[0], item) and evaluate(values[1], item)
+    if operator == 'OR':
+        return evaluate(values[0], item) or evaluate(values[1], item)
+    if operator == 'NOT':
+        return not evaluate(values[0], item)
+    if operator == 'attribute_exists':
+        return values[0].name in item
+    if operator == 'attribute_not_exists':
+        return values[0].name not in item
+
+    left = _operand(values[0], item)
+    if left is None:
+        return operator == '<>'
+    try:
+        if operator == '=':
+            return left == _operand(values[1], item)
+        if operator == '<>':
+            return left != _operand(values[1], item)
+        if operator == '<':
+            return left < _operand(values[1], item)
+        if operator == '<=':
+            return left <= _operand(values[1], item)
+        if operator == '>':
+            return left > _operand(values[1], item)
+        if operator == '>=':
+            return left >= _operand(values[1], item)
+        if operator == 'IN':
+            return left in [_normalize(v) for v in values[1]]
+        if operator == 'BETWEEN':
+            return _operand(values[1], item) <= left <= _operand(values[2], item)
+        if operator == 'begins_with':
+            return isinstance(left, str) and left.startswith(values[1])
+        if operator == 'contains':
+            return values[1] in left
+    except TypeError:
+        # Comparing mismatched types never matches in DynamoDB.
+        return False
+    raise NotImplementedError(f'Unsupported condition operator: {operator}')
+
+
+def _project(item, projection, names):
+    if not projection:
+        return copy.deepcopy(item)
+    projected = {}
+    for raw in projection.split(','):
+        name = _resolve_name(raw.strip(), names)
+        if name in item:
+            projected[name] = copy.deepcopy(item[name])
+    return projected
+
+
+class LocalTable:
+    """A single DynamoDB table with optional global secondary indexes."""
+
+    def __init__(self, name, hash_key, range_key=None, indexes=None):
+        self.name = name
+        self.hash_key = hash_key
+        self.range_key = range_key
+        # {index_name: (hash_key, range_key)}
+        self.indexes = dict(indexes or {})
+        self._partitions = {}
+        self._sort_keys = {}
+        self._index_cache = {}
+        # {(index_name, total_segments, segment): (rows, {key tuple: position})}
+        self._scan_cache = {}
+        # Writes are atomic per item, so conditional updates from worker
+        # threads behave as they do against DynamoDB.
+        self._write_lock = threading.RLock()
+        self.read_bytes = 0
+        self.request_count = 0
+
+    # -- key helpers -------------------------------------------------------
+
+    def _key_of(self, item):
+        key = {self.hash_key: item[self.hash_key]}
+        if self.range_key:
+            key[self.range_key] = item[self.range_key]
+        return key
+
+    def _sort_value(self, item):
+        return item[self.range_key] if self.range_key else ''
+
+    def _check_condition(self, old, kwargs, operation):
+        """Apply a boto3 ``Attr`` ConditionExpression to the current item, as DynamoDB does."""
+        condition = kwargs.get('ConditionExpression')
+        if condition is not None and not evaluate(condition, old or {}):
+            raise ClientError({'Error': {'Code': 'ConditionalCheckFailedException',
+                                         'Message': 'The conditional request failed'}}, operation)
+
+    def _invalidate(self, item):
+        """Drop the cached orderings that ``item`` belongs to."""
+        self._scan_cache.clear()
+        self._index_cache.pop((None, item[self.hash_key]), None)
+        for index_name, (index_hash, _) in self.indexes.items():
+            self._index_cache.pop((index_name, item.get(index_hash)), None)
+
+    # -- writes ------------------------------------------------------------
+
+    def put_item(self, Item, **kwargs):
+        with self._write_lock:
+            return self._put_item(Item, **kwargs)
+
+    def _put_item(self, Item, **kwargs):
+        self.request_count += 1
+        item = _normalize(copy.deepcopy(Item))
+        pk = item[self.hash_key]
+        sk = self._sort_value(item)
+        self._check_condition(self._partitions.get(pk, {}).get(sk), kwargs, 'PutItem')
+        partition = self._partitions.setdefault(pk, {})
+        if sk not in partition:
+            bisect.insort(self._sort_keys.setdefault(pk, []), sk)
+        if sk in partition:
+            self._invalidate(partition[sk])
+        partition[sk] = item
+        self._invalidate(item)
+        return {}
+
+    def delete_item(self, Key, **kwargs):
+        with self._write_lock:
+            return self._delete_item(Key, **kwargs)
+
+    def _delete_item(self, Key, **kwargs):
+        self.request_count += 1
+        pk = Key[self.hash_key]
+        sk = Key[self.range_key] if self.range_key else ''
+        partition = self._partitions.get(pk, {})
+        self._check_condition(partition.get(sk), kwargs, 'DeleteItem')
+        old = partition.pop(sk, None)
+        if old is not None:
+            keys = self._sort_keys[pk]
+            del keys[bisect.bisect_left(keys, sk)]
+            self._invalidate(old)
+        response = {}
+        if old is not None and kwargs.get('ReturnValues') == 'ALL_OLD':
+            response['Attributes'] = copy.deepcopy(old)
+        return response
+
+    def update_item(self, Key, UpdateExpression, **kwargs):
+        """
+        Supports the ``SET a = :v, ...`` (including ``if_not_exists(a, :v)``)
+        and ``ADD a :v, ...`` clauses the handlers use (no other functions or
+        nested paths), creating the item if needed.
+        """
+        with self._write_lock:
+            return self._update_item(Key, UpdateExpression, **kwargs)
+
+    def _update_item(self, Key, UpdateExpression, **kwargs):
+        names = kwargs.get('ExpressionAttributeNames')
+        values = _normalize(copy.deepcopy(kwargs.get('ExpressionAttributeValues', {})))
+        pk = Key[self.hash_key]
+        sk = Key[self.range_key] if self.range_key else ''
+        old = self._partitions.get(pk, {}).get(sk)
+        self._check_condition(old, kwargs, 'UpdateItem')
+        item = copy.deepcopy(old) if old is not None else _normalize(copy.deepcopy(Key))
+
+        updated = set()
+        for action, clause in re.findall(r'(SET|ADD|REMOVE)\s+(.*?)(?=\s+(?:SET|ADD|REMOVE)\s|$)',
+                                         UpdateExpression.strip()):
+            for part in (p.strip() for p in re.split(r',(?![^(]*\))', clause)):
+                if action == 'SET':
+                    name, value = (t.strip() for t in part.split('=', 1))
+                    name = _resolve_name(name, names)
+                    function = re.match(r'if_not_exists\(\s*([^,\s]+)\s*,\s*(\S+?)\s*\)$', value)
+                    if function:
+                        existing = item.get(_resolve_name(function.group(1), names))
+                        item[name] = existing if existing is not None else values[function.group(2)]
+                    else:
+                        item[name] = values[value]
+                elif action == 'ADD':
+                    name, value = part.split()
+                    name = _resolve_name(name, names)
+                    item[name] = item.get(name, Decimal(0)) + values[value]
+                else:
+                    name = _resolve_name(part, names)
+                    item.pop(name, None)
+                updated.add(name)
+
+        self.put_item(Item=item)
+        return_values = kwargs.get('ReturnValues', 'NONE')
+        if return_values == 'ALL_OLD':
+            return {'Attributes': copy.deepcopy(old)} if old is not None else {}
+        if return_values == 'ALL_NEW':
+            return {'Attributes': copy.deepcopy(item)}
+        if return_values == 'UPDATED_NEW':
+            return {'Attributes': {k: copy.deepcopy(item[k]) for k in updated if k in item}}
+        return {}
+
+    # -- reads -------------------------------------------------------------
+
+    def get_item(self, Key, **kwargs):
+        self.request_count += 1
+        pk = Key[self.hash_key]
+        sk = Key[self.range_key] if self.range_key else ''
+        item = self._partitions.get(pk, {}).get(sk)
+        if item is None:
+            return {}
+        self.read_bytes += item_size(item)
+        return {'Item': _project(item, kwargs.get('ProjectionExpression'),
+                                 kwargs.get('ExpressionAttributeNames'))}
+
+    def _ordered_partition(self, pk, index_name):
+        """
+        Return the items of one partition in (index) sort-key order, along
+        with the parallel list of sort values used for bisecting.
+        """
+        cache_key = (index_name, pk)
+        if cache_key in self._index_cache:
+            return self._index_cache[cache_key]
+        if index_name is None:
+            partition = self._partitions.get(pk, {})
+            keys = self._sort_keys.get(pk, [])
+            self._index_cache[cache_key] = ([partition[sk] for sk in keys], [(sk,) for sk in keys])
+        else:
+            index_hash, index_range = self.indexes[index_name]
+            rows = [item for partition in self._partitions.values()
+                    for item in partition.values()
+                    if item.get(index_hash) == pk and index_range in item]
+            rows.sort(key=lambda i: (i[index_range], self._sort_value(i)))
+            self._index_cache[cache_key] = (
+                rows, [(i[index_range], self._sort_value(i)) for i in rows])
+        return self._index_cache[cache_key]
+
+    def _index_keys(self, index_name):
+        if index_name is None:
+            return self.hash_key, self.range_key
+        return self.indexes[index_name]
+
+    def _last_key(self, item, index_name):
+        key = self._key_of(item)
+        if index_name is not None:
+            index_hash, index_range = self.indexes[index_name]
+            key[index_hash] = item[index_hash]
+            key[index_range] = item[index_range]
+        return key
+
+    def _sort_tuple(self, key, index_name):
+        if index_name is None:
+            return (self._sort_value(key),)
+        return (key[self.indexes[index_name][1]], self._sort_value(key))
+
+    @staticmethod
+    def _split_key_condition(condition, hash_key):
+        """Split a key condition into the partition value and the sort-key condition."""
+        expression = condition.get_expression()
+        parts = expression['values'] if expression['operator'] == 'AND' else (condition,)
+        partition_value, sort_condition = None, None
+        for part in parts:
+            values = part.get_expression()['values']
+            if part.get_expression()['operator'] == '=' and values[0].name == hash_key:
+                partition_value = values[1]
+            else:
+                sort_condition = part
+        return partition_value, sort_condition
+
+    @staticmethod
+    def _sort_bounds(sort_condition, sort_values):
+        """Bisect the slice of sort values that satisfies the sort-key condition."""
+        if sort_condition is None:
+            return 0, len(sort_values)
+        expression = sort_condition.get_expression()
+        operator = expression['operator']
+        values = [_normalize(v) for v in expression['values'][1:]]
+        low, high = 0, len(sort_values)
+        try:
+            if operator in ('=', '>=', 'BETWEEN'):
+                low = bisect.bisect_left(sort_values, (values[0],))
+            elif operator == '>':
+                low = bisect.bisect_right(sort_values, (values[0], chr(0x10FFFF)))
+            elif operator == 'begins_with':
+                low = bisect.bisect_left(sort_values, (values[0],))
+                high = bisect.bisect_left(sort_values, (values[0] + chr(0x10FFFF),))
+            upper = {'=': 0, '<=': 0, 'BETWEEN': 1}.get(operator)
+            if upper is not None:
+                high = bisect.bisect_right(sort_values, (values[upper], chr(0x10FFFF)))
+            elif operator == '<':
+                high = bisect.bisect_left(sort_values, (values[0],))
+        except TypeError:
+            return 0, 0
+        return low, high
+
+    def query(self, KeyConditionExpression, **kwargs):
+        self.request_count += 1
+        index_name = kwargs.get('IndexName')
+        hash_key, _ = self._index_keys(index_name)
+        pk, sort_condition = self._split_key_condition(KeyConditionExpression, hash_key)
+        if pk is None:
+            raise ValueError('Query key condition must include an equality on the partition key')
+        rows, sort_values = self._ordered_partition(pk, index_name)
+        low, high = self._sort_bounds(sort_condition, sort_values)
+
+        forward = kwargs.get('ScanIndexForward', True)
+        start_key = kwargs.get('ExclusiveStartKey')
+        if start_key:
+            position = self._sort_tuple(start_key, index_name)
+            if forward:
+                low = max(low, bisect.bisect_right(sort_values, position))
+            else:
+                high = min(high, bisect.bisect_left(sort_values, position))
+        indices = range(low, high) if forward else range(high - 1, low - 1, -1)
+        return self._page((rows[i] for i in indices), len(indices), index_name, kwargs)
+
+    def _scan_rows(self, index_name, total_segments, segment):
+        cache_key = (index_name, total_segments, segment)
+        if cache_key not in self._scan_cache:
+            rows = []
+            for pk in sorted(self._partitions, key=str):
+                rows.extend(self._ordered_partition(pk, index_name)[0])
+            if total_segments:
+                # Segments split the table by hash key, like DynamoDB's.
+                rows = [row for row in rows
+                        if zlib.crc32(str(row[self.hash_key]).encode()) % total_segments == segment]
+            positions = {tuple(self._key_of(row).values()): i for i, row in enumerate(rows)}
+            self._scan_cache[cache_key] = (rows, positions)
+        return self._scan_cache[cache_key]
+
+    def scan(self, **kwargs):
+        self.request_count += 1
+        index_name = kwargs.get('IndexName')
+        rows, positions = self._scan_rows(index_name, kwargs.get('TotalSegments'), kwargs.get('Segment'))
+        start = 0
+        start_key = kwargs.get('ExclusiveStartKey')
+        if start_key:
+            start = positions.get(tuple(self._key_of(start_key).values()), len(rows) - 1) + 1
+        return self._page(itertools.islice(rows, start, None), len(rows) - start, index_name, kwargs)
+
+    def _page(self, rows, available, index_name, kwargs):
+        limit = kwargs.get('Limit')
+        condition = kwargs.get('FilterExpression')
+        projection = kwargs.get('ProjectionExpression')
+        names = kwargs.get('ExpressionAttributeNames')
+
+        items = []
+        scanned = 0
+        read = 0
+        last = None
+        for row in rows:
+            if limit is not None and scanned >= limit:
+                break
+            if read >= PAGE_BYTE_LIMIT:
+                break
+            scanned += 1
+            read += item_size(row)
+            last = row
+            if condition is None or evaluate(condition, row):
+                items.append(_project(row, projection, names))
+        self.read_bytes += read
+
+        response = {'Items': items, 'Count': len(items), 'ScannedCount': scanned}
+        if last is not None and scanned < available:
+            response['LastEvaluatedKey'] = self._last_key(last, index_name)
+        return response
+
+    def batch_writer(self, overwrite_by_pkeys=None):
+        return LocalBatchWriter(self)
+
+    def __len__(self):
+        return sum(len(p) for p in self._partitions.values())
+
+
+class LocalBatchWriter:
+    """Buffers writes and flushes them 25 at a time, like boto3's BatchWriter."""
+
+    def __init__(self, table, flush_amount=25):
+        self.table = table
+        self.flush_amount = flush_amount
+        self.buffer = []
+
+    def put_item(self, Item):
+        self.buffer.append(('put', Item))
+        if len(self.buffer) >= self.flush_amount:
+            self.flush()
+
+    def delete_item(self, Key):
+        self.buffer.append(('delete', Key))
+        if len(self.buffer) >= self.flush_amount:
+            self.flush()
+
+    def flush(self):
+        if not self.buffer:
+            return
+        for action, payload in self.buffer:
+            if action == 'put':
+                self.table.put_item(Item=payload)
+            else:
+                self.table.delete_item(Key=payload)
+        # One BatchWriteItem request, not one request per item.
+        self.table.request_count -= len(self.buffer) - 1
+        self.buffer = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.flush()
+        return False
+
+
+_EXISTS_CONDITION = re.compile(r'\s*(attribute_exists|attribute_not_exists)\((\w+)\)\s*$')
+
+
+def _validation_error(message, operation):
+    return ClientError({'Error': {'Code': 'ValidationException', 'Message': message}}, operation)
+
+
+class LocalDynamoDBClient:
+    """
+    Stand-in for ``resource.meta.client``, the low-level client behind the
+    DynamoDB resource, which takes and returns plain Python values. Covers
+    BatchGetItem, BatchWriteItem and TransactWriteItems with their request
+    limits. ``unprocessed_rate`` hands that share of each batch back as
+    unprocessed, the way a throttled table does.
+    """
+
+    def __init__(self, resource, unprocessed_rate=0.0, seed=0):
+        self.resource = resource
+        self.unprocessed_rate = unprocessed_rate
+        self.unprocessed = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _unprocessed(self):
+        if not self.unprocessed_rate:
+            return False
+        with self._lock:
+            skipped = self._random.random() < self.unprocessed_rate
+            self.unprocessed += skipped
+            return skipped
+
+    @staticmethod
+    def _check_unique(table, keys, operation):
+        seen = set()
+        for key in keys:
+            marker = (key[table.hash_key], key[table.range_key] if table.range_key else '')
+            if marker in seen:
+                raise _validation_error('Provided list of item keys contains duplicates', operation)
+            seen.add(marker)
+
+    def batch_get_item(self, RequestItems, **kwargs):
+        if sum(len(request['Keys']) for request in RequestItems.values()) > 100:
+            raise _validation_error('Too many items requested for the BatchGetItem call', 'BatchGetItem')
+        responses, unprocessed = {}, {}
+        for name, request in RequestItems.items():
+            table = self.resource.tables[name]
+            self._check_unique(table, request['Keys'], 'BatchGetItem')
+            count = table.request_count
+            items = responses.setdefault(name, [])
+            for key in request['Keys']:
+                if self._unprocessed():
+                    unprocessed.setdefault(name, dict(request, Keys=[]))['Keys'].append(key)
+                    continue
+                item = table.get_item(Key=key).get('Item')
+                if item is not None:
+                    items.append(item)
+            table.request_count = count + 1
+        return {'Responses': responses, 'UnprocessedKeys': unprocessed}
+
+    def batch_write_item(self, RequestItems, **kwargs):
+        if sum(len(requests) for requests in RequestItems.values()) > 25:
+            raise _validation_error('Too many items requested for the BatchWriteItem call', 'BatchWriteItem')
+        unprocessed = {}
+        for name, requests in RequestItems.items():
+            table = self.resource.tables[name]
+            self._check_unique(table, [request['PutRequest']['Item'] if 'PutRequest' in request
+                                       else request['DeleteRequest']['Key'] for request in requests],
+                               'BatchWriteItem')
+            with table._write_lock:
+                count = table.request_count
+                for request in requests:
+                    if self._unprocessed():
+                        unprocessed.setdefault(name, []).append(request)
+                    elif 'PutRequest' in request:
+                        table._put_item(request['PutRequest']['Item'])
+                    else:
+                        table.delete_item(Key=request['DeleteRequest']['Key'])
+                table.request_count = count + 1
+        return {'UnprocessedItems': unprocessed}
+
+    def transact_write_items(self, TransactItems, **kwargs):
+        """Put, Delete and ConditionCheck actions, checked and applied under every table's lock."""
+        if len(TransactItems) > 100:
+            raise _validation_error('Member must have length less than or equal to 100', 'TransactWriteItems')
+        actions = []
+        for entry in TransactItems:
+            (action, request), = entry.items()
+            table = self.resource.tables[request['TableName']]
+            key = table._key_of(request['Item']) if action == 'Put' else request['Key']
+            actions.append((action, request, table, key))
+        for table in {table.name: table for _, _, table, _ in actions}.values():
+            self._check_unique(table, [key for _, _, t, key in actions if t is table], 'TransactWriteItems')
+
+        locks = [table._write_lock for table in sorted({t.name: t for _, _, t, _ in actions}.values(),
+                                                       key=lambda t: t.name)]
+        for lock in locks:
+            lock.acquire()
+        try:
+            reasons, cancelled = [], False
+            for action, request, table, key in actions:
+                current = table._partitions.get(key[table.hash_key], {}).get(
+                    key[table.range_key] if table.range_key else '')
+                condition = request.get('ConditionExpression')
+                if isinstance(condition, str):
+                    # Only the attribute_exists/attribute_not_exists forms.
+                    function, name = _EXISTS_CONDITION.match(condition).groups()
+                    failed = (name in (current or {})) != (function == 'attribute_exists')
+                else:
+                    failed = condition is not None and not evaluate(condition, current or {})
+                if failed:
+                    reasons.append({'Code': 'ConditionalCheckFailed',
+                                    'Message': 'The conditional request failed'})
+                    cancelled = True
+                else:
+                    reasons.append({'Code': 'None'})
+            if cancelled:
+                codes = ', '.join(reason['Code'] for reason in reasons)
+                raise ClientError({'Error': {'Code': 'TransactionCanceledException',
+                                             'Message': f'Transaction cancelled, please refer cancellation '
+                                                        f'reasons for specific reasons [{codes}]'},
+                                   'CancellationReasons': reasons}, 'TransactWriteItems')
+            for table in {t.name: t for _, _, t, _ in actions}.values():
+                count = table.request_count
+                for action, request, t, key in actions:
+                    if t is not table:
+                        continue
+                    if action == 'Put':
+                        table._put_item(request['Item'])
+                    elif action == 'Delete':
+                        table.delete_item(Key=key)
+                table.request_count = count + 1
+        finally:
+            for lock in reversed(locks):
+                lock.release()
+        return {}
+
+
+class LocalDynamoDB:
+    """
+    Stand-in for ``boto3.resource('dynamodb')``; ``meta.client`` is a
+    LocalDynamoDBClient over the same tables.
+    """
+
+    def __init__(self, unprocessed_rate=0.0, seed=0):
+        self.tables = {}
+        self.meta = types.SimpleNamespace(client=LocalDynamoDBClient(self, unprocessed_rate, seed))
+
+    def create_table(self, name, hash_key, range_key=None, indexes=None):
+        table = LocalTable(name, hash_key, range_key, indexes)
+        self.tables[name] = table
+        return table
+
+    def Table(self, name):
+        return self.tables[name]
+
+
+class _Body(io.BytesIO):
+    """A StreamingBody look-alike."""
+
+
+class LocalS3:
+    """Stand-in for ``boto3.client('s3')`` holding objects in memory."""
+
+    def __init__(self):
+        self.objects = {}
+        self.uploads = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def put_object(self, Bucket, Key, Body, ContentType='binary/octet-stream', **kwargs):
+        data = Body if isinstance(Body, (bytes, bytearray)) else Body.read()
+        self.bytes_in += len(data)
+        self.objects[(Bucket, Key)] = {'Body': bytes(data), 'ContentType': ContentType,
+                                       'Metadata': kwargs.get('Metadata', {}),
+                                       'CacheControl': kwargs.get('CacheControl')}
+        return {'ETag': '"local"'}
+
+    def get_object(self, Bucket, Key, **kwargs):
+        try:
+            stored = self.objects[(Bucket, Key)]
+        except KeyError:
+            raise KeyError(f'NoSuchKey: {Key}')
+        self.bytes_out += len(stored['Body'])
+        return {'Body': _Body(stored['Body']), 'ContentType': stored['ContentType'],
+                'ContentLength': len(stored['Body']), 'Metadata': stored['Metadata']}
+
+    def head_object(self, Bucket, Key, **kwargs):
+        stored = self.objects[(Bucket, Key)]
+        return {'ContentType': stored['ContentType'], 'ContentLength': len(stored['Body']),
+                'Metadata': stored['Metadata']}
+
+    def delete_object(self, Bucket, Key, **kwargs):
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def create_multipart_upload(self, Bucket, Key, **kwargs):
+        upload_id = f'upload-{len(self.uploads) + len(self.objects)}-{Key}'
+        self.uploads[upload_id] = {'Key': (Bucket, Key), 'Parts': {}, 'Args': kwargs}
+        return {'UploadId': upload_id, 'Bucket': Bucket, 'Key': Key}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body, **kwargs):
+        data = Body if isinstance(Body, (bytes, bytearray)) else Body.read()
+        self.bytes_in += len(data)
+        etag = f'"{UploadId}-{PartNumber}"'
+        self.uploads[UploadId]['Parts'][PartNumber] = (etag, bytes(data))
+        return {'ETag': etag}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload, **kwargs):
+        upload = self.uploads.pop(UploadId)
+        parts = MultipartUpload['Parts']
+        if [p['PartNumber'] for p in parts] != sorted(upload['Parts']):
+            raise ValueError('InvalidPart: parts do not match the uploaded parts')
+        for part in parts[:-1]:
+            if len(upload['Parts'][part['PartNumber']][1]) < 5 * 1024 * 1024:
+                raise ValueError('EntityTooSmall: every part but the last must be at least 5 MB')
+        body = b''.join(upload['Parts'][p['PartNumber']][1] for p in parts)
+        args = upload['Args']
+        self.objects[(Bucket, Key)] = {'Body': body, 'ContentType': args.get('ContentType', 'binary/octet-stream'),
+                                       'Metadata': args.get('Metadata', {})}
+        return {'Bucket': Bucket, 'Key': Key}
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId, **kwargs):
+        self.uploads.pop(UploadId, None)
+        return {}
+
+    def generate_presigned_url(self, ClientMethod, Params=None, ExpiresIn=3600, **kwargs):
+        params = Params or {}
+        return (f"https://{params.get('Bucket')}.s3.local/{params.get('Key')}"
+                f"?X-Amz-Method={ClientMethod}&X-Amz-Expires={ExpiresIn}")
+
+
+def estimate_image_tokens(image_bytes):
+    """Anthropic bills images at roughly width * height / 750 tokens."""
+    try:
+        from PIL import Image
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            width, height = image.size
+    except Exception:
+        # Without Pillow, assume a 1.15 megapixel image (the model's cap).
+        width, height = 1092, 1092
+    scale = min(1.0, math.sqrt(1_150_000 / (width * height)))
+    return math.ceil(width * scale * height * scale / 750)
+
+
+DEFAULT_EXTRACTION = {
+    'vendor': 'Whole Foods Market',
+    'amount': '42.17',
+    'category': 'Groceries',
+    'description': 'Weekly groceries',
+    'date': '2024-05-18',
+}
+
+
+class FakeBedrockRuntime:
+    """
+    Stand-in for ``boto3.client('bedrock-runtime')``.
+
+    ``responder`` maps the decoded request body to the model's text output;
+    by default it answers with ``DEFAULT_EXTRACTION`` as JSON. ``latency``
+    (seconds) is slept on every call to mimic model time, plus
+    ``token_latency`` per output token generated; output is cut off at the
+    request's ``max_tokens``. ``max_concurrency`` and ``throttle_rate``
+    inject ThrottlingException errors when too many calls are in flight or
+    at random, and ``slow_rate`` of calls take ``slow_latency`` instead of
+    ``latency``, a long tail. ``models`` overrides any of ``latency``,
+    ``slow_rate``, ``max_concurrency`` and ``throttle_rate`` per model id,
+    with concurrency counted per model; ``model_calls`` counts finished
+    calls by model id.
+
+    ``invoke_model_with_response_stream`` yields the output a token at a
+    time; closing the stream early stops generation, and only the tokens
+    streamed so far count towards ``output_tokens``.
+    """
+
+    def __init__(self, responder=None, latency=0.0, max_concurrency=None, throttle_rate=0.0, seed=0,
+                 token_latency=0.0, slow_rate=0.0, slow_latency=0.0, models=None):
+        self.responder = responder or (lambda request: json.dumps(DEFAULT_EXTRACTION))
+        self.latency = latency
+        self.token_latency = token_latency
+        self.max_concurrency = max_concurrency
+        self.throttle_rate = throttle_rate
+        self.slow_rate = slow_rate
+        self.slow_latency = slow_latency
+        self.models = models or {}
+        self.model_calls = {}
+        self.model_in_flight = {}
+        self.calls = 0
+        self.throttles = 0
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def _throttle(self, operation):
+        self.throttles += 1
+        raise ClientError(
+            {'Error': {'Code': 'ThrottlingException', 'Message': 'Too many requests, please wait before trying again.'}},
+            operation)
+
+    def _usage(self, request, text):
+        input_tokens = 0
+        for message in request.get('messages', []):
+            for block in message.get('content', []):
+                if block.get('type') == 'image':
+                    input_tokens += estimate_image_tokens(base64.b64decode(block['source']['data']))
+                elif block.get('type') == 'text':
+                    input_tokens += len(block['text']) // 4
+        return {'input_tokens': input_tokens, 'output_tokens': max(1, len(text) // 4)}
+
+    def _setting(self, model_id, name):
+        return self.models.get(model_id, {}).get(name, getattr(self, name))
+
+    def _start(self, operation, model_id):
+        with self._lock:
+            max_concurrency = self._setting(model_id, 'max_concurrency')
+            in_flight = self.model_in_flight.get(model_id, 0) if model_id in self.models else self.in_flight
+            if max_concurrency is not None and in_flight >= max_concurrency:
+                self._throttle(operation)
+            throttle_rate = self._setting(model_id, 'throttle_rate')
+            if throttle_rate and self._random.random() < throttle_rate:
+                self._throttle(operation)
+            self.in_flight += 1
+            self.model_in_flight[model_id] = self.model_in_flight.get(model_id, 0) + 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            slow_rate = self._setting(model_id, 'slow_rate')
+            slow = slow_rate and self._random.random() < slow_rate
+        return self.slow_latency if slow else self._setting(model_id, 'latency')
+
+    def _finish(self, model_id):
+        with self._lock:
+            self.in_flight -= 1
+            self.model_in_flight[model_id] -= 1
+            self.model_calls[model_id] = self.model_calls.get(model_id, 0) + 1
+
+    def _generate(self, request):
+        """The (possibly truncated) output tokens and stop reason for a request."""
+        tokens = _OUTPUT_TOKEN.findall(self.responder(request))
+        max_tokens = request.get('max_tokens')
+        if max_tokens is not None and len(tokens) > max_tokens:
+            return tokens[:max_tokens], 'max_tokens'
+        return tokens, 'end_turn'
+
+    def invoke_model(self, body, modelId, **kwargs):
+        request = json.loads(body)
+        latency = self._start('InvokeModel', modelId)
+        try:
+            if latency:
+                time.sleep(latency)
+            tokens, stop_reason = self._generate(request)
+            if self.token_latency:
+                time.sleep(self.token_latency * len(tokens))
+            text = ''.join(tokens)
+            usage = self._usage(request, text)
+        finally:
+            self._finish(modelId)
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += usage['input_tokens']
+            self.output_tokens += usage['output_tokens']
+        payload = {'content': [{'type': 'text', 'text': text}], 'usage': usage,
+                   'stop_reason': stop_reason, 'model': modelId}
+        return {'body': _Body(json.dumps(payload).encode('utf-8')), 'contentType': 'application/json'}
+
+    def invoke_model_with_response_stream(self, body, modelId, **kwargs):
+        request = json.loads(body)
+        latency = self._start('InvokeModelWithResponseStream', modelId)
+        return {'body': _EventStream(self, request, modelId, latency), 'contentType': 'application/json'}
+
+    def _stream_events(self, request, modelId, stream, latency):
+        if latency:
+            time.sleep(latency)
+        tokens, stop_reason = self._generate(request)
+        stream.input_tokens = self._usage(request, '')['input_tokens']
+        yield _event({'type': 'message_start', 'message': {
+            'model': modelId, 'role': 'assistant', 'usage': {'input_tokens': stream.input_tokens}}})
+        yield _event({'type': 'content_block_start', 'index': 0, 'content_block': {'type': 'text', 'text': ''}})
+        for token in tokens:
+            if self.token_latency:
+                time.sleep(self.token_latency)
+            stream.output_tokens += 1
+            yield _event({'type': 'content_block_delta', 'index': 0,
+                          'delta': {'type': 'text_delta', 'text': token}})
+        yield _event({'type': 'content_block_stop', 'index': 0})
+        yield _event({'type': 'message_delta', 'delta': {'stop_reason': stop_reason},
+                      'usage': {'output_tokens': stream.output_tokens}})
+        yield _event({'type': 'message_stop'})
+
+    def _stream_closed(self, stream):
+        self._finish(stream.model_id)
+        with self._lock:
+            self.calls += 1
+            self.input_tokens += stream.input_tokens
+            self.output_tokens += stream.output_tokens
+
+
+# Roughly one token per word piece of up to four characters.
+_OUTPUT_TOKEN = re.compile(r'\s*\S{1,4}|\s+')
+
+
+def _event(message):
+    return {'chunk': {'bytes': json.dumps(message).encode('utf-8')}}
+
+
+class _EventStream:
+    """An EventStream look-alike; iterating it runs the model lazily."""
+
+    def __init__(self, runtime, request, model_id, latency):
+        self.input_tokens = 0
+        self.output_tokens = 0
+        self.model_id = model_id
+        self._runtime = runtime
+        self._events = runtime._stream_events(request, model_id, self, latency)
+        self._closed = False
+
+    def __iter__(self):
+        try:
+            yield from self._events
+        finally:
+            self.close()
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._events.close()
+        self._runtime._stream_closed(self)
+
+
+class LocalSES:
+    """
+    Stand-in for ``boto3.client('ses')``.
+
+    Every call sleeps ``latency`` seconds. Recipients are metered against
+    ``max_send_rate`` per second with a one-second burst, and a call that
+    would exceed it fails with SES's Throttling error, as the real quota does.
+    """
+
+    def __init__(self, max_send_rate=14.0, latency=0.0, max_24_hour_send=1_000_000):
+        self.max_send_rate = float(max_send_rate)
+        self.max_24_hour_send = max_24_hour_send
+        self.latency = latency
+        self.calls = 0
+        self.throttles = 0
+        self.sent = []
+        self._allowance = self.max_send_rate
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def get_send_quota(self):
+        return {'Max24HourSend': float(self.max_24_hour_send), 'MaxSendRate': self.max_send_rate,
+                'SentLast24Hours': float(len(self.sent))}
+
+    def _meter(self, recipients, operation):
+        with self._lock:
+            self.calls += 1
+            now = time.monotonic()
+            self._allowance = min(self.max_send_rate, self._allowance + (now - self._updated) * self.max_send_rate)
+            self._updated = now
+            # A little slack for clock jitter between the caller's limiter and ours.
+            if len(recipients) > self._allowance + 1:
+                self.throttles += 1
+                raise ClientError({'Error': {'Code': 'Throttling', 'Message': 'Maximum sending rate exceeded.'}},
+                                  operation)
+            self._allowance -= len(recipients)
+            self.sent.extend(recipients)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def send_email(self, Source, Destination, Message, **kwargs):
+        self._meter(Destination['ToAddresses'], 'SendEmail')
+        return {'MessageId': f'local-{self.calls}'}
+
+    def send_bulk_templated_email(self, Source, Template, Destinations, **kwargs):
+        if len(Destinations) > 50:
+            raise ClientError({'Error': {'Code': 'InvalidParameterValue',
+                                         'Message': 'Up to 50 destinations are allowed.'}},
+                              'SendBulkTemplatedEmail')
+        recipients = [address for d in Destinations for address in d['Destination']['ToAddresses']]
+        self._meter(recipients, 'SendBulkTemplatedEmail')
+        return {'Status': [{'Status': 'Success', 'MessageId': f'local-{self.calls}-{i}'}
+                           for i in range(len(Destinations))]}
@@ -0,0 +1,373 @@
+import json
+import os
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import aws_clients
+import instrumentation
+import expense_aggregates
+import receipt_fingerprints
+import recurring_expenses
+import search_index
+import vendor_index
+from expense_model import EDITABLE_ATTRIBUTES, Expense, ExpenseValidationError
+
+TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
+
+MAX_OPERATIONS = int(os.environ.get('BULK_MAX_OPERATIONS', 5000))
+# Concurrent BatchGetItem/PutItem/UpdateItem/DeleteItem/TransactWriteItems
+# requests per invocation; keep it under the DynamoDB client's connection pool size.
+MAX_CONCURRENCY = int(os.environ.get('BULK_MAX_CONCURRENCY', 8))
+
+# DynamoDB's per-request limits.
+BATCH_GET_SIZE = 100
+TRANSACTION_SIZE = 100
+
+# Unprocessed keys, throttling and transaction conflicts are retried with
+# exponential backoff and full jitter.
+RETRYABLE_ERROR_CODES = {'ProvisionedThroughputExceededException', 'ThrottlingException',
+                         'RequestLimitExceeded', 'InternalServerError', 'TransactionInProgressException'}
+RETRYABLE_CANCELLATION_CODES = {'None', 'TransactionConflict', 'ProvisionedThroughputExceeded',
+                                'ThrottlingError'}
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 0.05
+BACKOFF_MAX_SECONDS = 2.0
+
+OPERATIONS = ('create', 'update', 'delete')
+DONE_STATUSES = {'create': 'created', 'update': 'updated', 'delete': 'deleted'}
+
+def _backoff(attempt):
+    time.sleep(random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))))
+
+def _chunks(values, size):
+    return [values[i:i + size] for i in range(0, len(values), size)]
+
+def _error_code(error):
+    return error.response.get('Error', {}).get('Code')
+
+def parse_operation(index, operation, user_id):
+    """
+    Validate one entry of ``operations``. Returns a plan dict carrying the
+    result so far; invalid entries already have their final status.
+    """
+    plan = {'index': index, 'result': {'index': index}}
+    if not isinstance(operation, dict):
+        plan['result'].update(status='invalid', error='Each operation must be an object.')
+        return plan
+    op = operation.get('op')
+    plan['op'] = op
+    plan['result']['op'] = op
+    if op not in OPERATIONS:
+        plan['result'].update(status='invalid', error=f"op must be one of {', '.join(OPERATIONS)}.")
+        return plan
+
+    if operation.get('idempotencyKey'):
+        plan['result']['idempotencyKey'] = operation['idempotencyKey']
+    if op != 'create' and not operation.get('expenseId'):
+        plan['result'].update(status='invalid', error='expenseId is required.')
+        return plan
+    if op == 'delete':
+        plan['expenseId'] = operation['expenseId']
+        plan['result']['expenseId'] = plan['expenseId']
+        return plan
+
+    try:
+        expense = Expense.from_event(dict(operation, userId=user_id))
+    except ExpenseValidationError as e:
+        plan['result'].update(status='invalid', error=str(e), fields=e.errors)
+        return plan
+    if op == 'create':
+        expense.new_id(operation.get('idempotencyKey'))
+        # Only keyed creates can already exist.
+        plan['keyed'] = bool(operation.get('idempotencyKey'))
+    plan['expenseId'] = expense.expense_id
+    plan['result']['expenseId'] = expense.expense_id
+    plan['item'] = expense.to_item()
+    return plan
+
+def merged_item(old, item):
+    """The stored item after an update: editable attributes replaced, the rest kept."""
+    merged = {key: value for key, value in old.items() if key not in EDITABLE_ATTRIBUTES}
+    merged.update((key, item[key]) for key in EDITABLE_ATTRIBUTES if key in item)
+    if 's3_key' in item:
+        merged['s3_key'] = item['s3_key']
+    return merged
+
+def read_items(client, user_id, expense_ids):
+    """
+    One BatchGetItem of up to 100 expenses, resending UnprocessedKeys with
+    backoff. Consistent reads, so a keyed create written moments ago is seen.
+    Returns ``(found, unread)``: the stored items by expenseId, and the ids
+    that could not be read.
+    """
+    found = {}
+    keys = [{'userId': user_id, 'expenseId': expense_id} for expense_id in expense_ids]
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            response = client.batch_get_item(RequestItems={TABLE_NAME: {'Keys': keys, 'ConsistentRead': True}})
+            for item in response.get('Responses', {}).get(TABLE_NAME, []):
+                found[item['expenseId']] = item
+            keys = response.get('UnprocessedKeys', {}).get(TABLE_NAME, {}).get('Keys', [])
+        except ClientError as e:
+            if _error_code(e) not in RETRYABLE_ERROR_CODES:
+                raise
+        if not keys:
+            break
+        if attempt < MAX_ATTEMPTS:
+            _backoff(attempt)
+    return found, {key['expenseId'] for key in keys}
+
+def unchanged(old):
+    """
+    A condition that the stored item still has the fields it was read with,
+    so the aggregates and indexes move from what is actually replaced.
+    """
+    condition = Attr('expenseId').exists()
+    for key in EDITABLE_ATTRIBUTES + ('s3_key',):
+        condition &= Attr(key).eq(old[key]) if key in old else Attr(key).not_exists()
+    return condition
+
+def write_item(table, user_id, plan):
+    """
+    One conditional PutItem, UpdateItem or DeleteItem: creates must not
+    exist yet, and updates and deletes must find the item as it was read.
+    Throttling is retried with backoff. Returns ``({index: (status, error)}, retries)``
+    for a write that did not go through; an update's ``change`` gets the item
+    as stored.
+    """
+    old, item = plan['change']
+    key = {'userId': user_id, 'expenseId': plan['expenseId']}
+    retries = 0
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            if plan['op'] == 'create':
+                table.put_item(Item=item, ConditionExpression=Attr('expenseId').not_exists())
+            elif plan['op'] == 'delete':
+                table.delete_item(Key=key, ConditionExpression=unchanged(old))
+            else:
+                names, values, sets, removes = {}, {}, [], []
+                for i, attribute in enumerate(EDITABLE_ATTRIBUTES + ('s3_key',)):
+                    names[f'#a{i}'] = attribute
+                    if attribute in item:
+                        values[f':v{i}'] = item[attribute]
+                        sets.append(f'#a{i} = :v{i}')
+                    else:
+                        removes.append(f'#a{i}')
+                expression = 'SET ' + ', '.join(sets) + (' REMOVE ' + ', '.join(removes) if removes else '')
+                response = table.update_item(Key=key, UpdateExpression=expression,
+                                             ExpressionAttributeNames=names, ExpressionAttributeValues=values,
+                                             ConditionExpression=unchanged(old), ReturnValues='ALL_NEW')
+                plan['change'] = (old, response['Attributes'])
+            return {}, retries
+        except ClientError as e:
+            code = _error_code(e)
+            if code == 'ConditionalCheckFailedException':
+                if plan['op'] == 'create':
+                    return {plan['index']: ('exists', None)}, retries
+                return {plan['index']: ('conflict', 'The expense changed after it was read; retry it.')}, retries
+            if code not in RETRYABLE_ERROR_CODES or attempt == MAX_ATTEMPTS:
+                return {plan['index']: ('failed', str(e))}, retries
+            retries += 1
+            _backoff(attempt)
+
+def write_transaction(client, user_id, writes):
+    """
+    Up to 100 planned writes as one TransactWriteItems, so they
+    are applied all together or not at all. Creates must not exist yet and
+    updates and deletes must still find their item. A conflict with another
+    write is retried with backoff; a failed condition cancels the whole
+    chunk. Returns ``({index: (status, error)}, retries)``.
+    """
+    # Plain expression strings: boto3's condition builder does not reach into
+    # TransactItems.
+    items = []
+    for plan in writes:
+        if plan['op'] == 'delete':
+            items.append({'Delete': {'TableName': TABLE_NAME,
+                                     'Key': {'userId': user_id, 'expenseId': plan['expenseId']},
+                                     'ConditionExpression': 'attribute_exists(expenseId)'}})
+        else:
+            condition = 'attribute_not_exists(expenseId)' if plan['op'] == 'create' else 'attribute_exists(expenseId)'
+            items.append({'Put': {'TableName': TABLE_NAME, 'Item': plan['change'][1],
+                                  'ConditionExpression': condition}})
+    retries = 0
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            client.transact_write_items(TransactItems=items)
+            return {}, retries
+        except ClientError as e:
+            code = _error_code(e)
+            reasons = [reason.get('Code') for reason in e.response.get('CancellationReasons') or []]
+            if code == 'TransactionCanceledException' and 'ConditionalCheckFailed' in reasons:
+                failures = {}
+                for plan, reason in zip(writes, reasons):
+                    if reason != 'ConditionalCheckFailed':
+                        failures[plan['index']] = ('failed', 'Cancelled with the rest of its transaction.')
+                    elif plan['op'] == 'create':
+                        failures[plan['index']] = ('exists', None)
+                    else:
+                        failures[plan['index']] = ('not_found', None)
+                return failures, retries
+            retryable = code in RETRYABLE_ERROR_CODES or (
+                code == 'TransactionCanceledException' and set(reasons) <= RETRYABLE_CANCELLATION_CODES)
+            if not retryable or attempt == MAX_ATTEMPTS:
+                return {plan['index']: ('failed', str(e)) for plan in writes}, retries
+            retries += 1
+            _backoff(attempt)
+
+def record_side_effects(user_id, changes):
+    """
+    Move the aggregates once for the whole request, journal the changes for
+    search in one batch, re-detect recurring payments once per touched
+    vendor, point receipt fingerprints at the expenses now saved from them,
+    and learn from the vendor/category pairs the user set. A bulk
+    recategorization of a thousand rows is one decision, so each distinct
+    change is one vote.
+    """
+    if not changes:
+        return
+    try:
+        expense_aggregates.apply_changes(user_id, changes)
+    except Exception as e:
+        print(f"Error updating spending aggregates for {user_id}: {e}")
+    search_index.record_changes(user_id, changes)
+    recurring_expenses.record_changes(user_id, changes)
+
+    for old, new in changes:
+        old_key = old.get('s3_key') if old else None
+        new_key = new.get('s3_key') if new else None
+        if old_key == new_key:
+            continue
+        expense_id = (new or old)['expenseId']
+        receipt_fingerprints.forget_expense(user_id, old_key, expense_id)
+        receipt_fingerprints.record_expense(user_id, new_key, expense_id)
+
+    seen = set()
+    for old, new in changes:
+        if new is None:
+            continue
+        signature = tuple(None if expense is None else
+                          (vendor_index.normalize_vendor(expense.get('vendor')), expense.get('category'))
+                          for expense in (old, new))
+        if signature not in seen:
+            seen.add(signature)
+            vendor_index.record_change(user_id, old, new)
+
+@instrumentation.traced
+def lambda_handler(event, context):
+    try:
+        user_id = event.get('userId')
+        operations = event.get('operations')
+
+        if not user_id or not isinstance(operations, list) or not operations:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'userId and a non-empty operations list are required.'})
+            }
+        if len(operations) > MAX_OPERATIONS:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': f'At most {MAX_OPERATIONS} operations per request.'})
+            }
+
+        atomic = bool(event.get('atomic', False))
+        plans = [parse_operation(i, operation, user_id) for i, operation in enumerate(operations)]
+
+        # One operation per expense: a batch or transaction may not touch an
+        # item twice. A create repeated with the same idempotency key is the
+        # same create.
+        targets = {}
+        for plan in plans:
+            if 'status' in plan['result']:
+                continue
+            first = targets.setdefault(plan['expenseId'], plan)
+            if first is plan:
+                continue
+            if plan['op'] == 'create' and first['op'] == 'create' and plan.get('keyed'):
+                plan['result']['status'] = 'exists'
+            else:
+                plan['result'].update(status='invalid', error=f"expenseId is already used by operation {first['index']}.")
+
+        # Updates and deletes need the stored item to move the aggregates;
+        # keyed creates need to know whether an earlier attempt landed.
+        client = aws_clients.resource('dynamodb').meta.client
+        lookups = [expense_id for expense_id, plan in targets.items() if plan['op'] != 'create' or plan.get('keyed')]
+        live = [plan for plan in targets.values() if 'status' not in plan['result']]
+        stored, unread = {}, set()
+        with ThreadPoolExecutor(max_workers=MAX_CONCURRENCY) as pool:
+            with instrumentation.phase('bulk.read'):
+                for found, missed in pool.map(lambda chunk: read_items(client, user_id, chunk),
+                                              _chunks(lookups, BATCH_GET_SIZE)):
+                    stored.update(found)
+                    unread.update(missed)
+
+            writes = []
+            for plan in live:
+                old = stored.get(plan['expenseId'])
+                if plan['expenseId'] in unread:
+                    plan['result'].update(status='failed', error='Could not read the stored expense; retry it.')
+                elif plan['op'] == 'create':
+                    if old is not None:
+                        plan['result']['status'] = 'exists'
+                        continue
+                    plan['change'] = (None, plan['item'])
+                    writes.append(plan)
+                elif old is None:
+                    plan['result']['status'] = 'not_found'
+                elif plan['op'] == 'update':
+                    plan['change'] = (old, merged_item(old, plan['item']))
+                    writes.append(plan)
+                else:
+                    plan['change'] = (old, None)
+                    writes.append(plan)
+
+            failures = {}
+            retries = 0
+            with instrumentation.phase('bulk.write'):
+                # BatchWriteItem cannot carry a condition, so without
+                # ``atomic`` each expense is its own conditional write.
+                if atomic:
+                    results = pool.map(lambda chunk: write_transaction(client, user_id, chunk),
+                                       _chunks(writes, TRANSACTION_SIZE))
+                else:
+                    table = aws_clients.table(TABLE_NAME)
+                    results = pool.map(lambda plan: write_item(table, user_id, plan), writes)
+                for chunk_failures, chunk_retries in results:
+                    failures.update(chunk_failures)
+                    retries += chunk_retries
+        instrumentation.count('bulk.write_retries', retries)
+
+        changes = []
+        for plan in writes:
+            if plan['index'] in failures:
+                status, error = failures[plan['index']]
+                plan['result']['status'] = status
+                if error:
+                    plan['result']['error'] = error
+            else:
+                plan['result']['status'] = DONE_STATUSES[plan['op']]
+                changes.append(plan['change'])
+        record_side_effects(user_id, changes)
+
+        results = [plan['result'] for plan in plans]
+        counts = {}
+        for result in results:
+            counts[result['status']] = counts.get(result['status'], 0) + 1
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Bulk operations processed',
+                'counts': counts,
+                'results': results
+            })
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
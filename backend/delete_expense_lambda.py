@@ -1,13 +1,16 @@
 import json
 import os
-import boto3
-
-dynamodb = boto3.resource('dynamodb')
+import aws_clients
+import instrumentation
+import expense_aggregates
+import receipt_fingerprints
+import recurring_expenses
+import search_index
 
 TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
 
+@instrumentation.traced
 def lambda_handler(event, context):
-    print(f"Received event: {event}") # Add this line for debugging
     try:
         user_id = event.get('userId')
         expense_id = event.get('expenseId')
@@ -18,14 +21,20 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'userId and expenseId are required.'})
             }
 
-        table = dynamodb.Table(TABLE_NAME)
+        table = aws_clients.table(TABLE_NAME)
         
-        table.delete_item(
+        response = table.delete_item(
             Key={
                 'userId': user_id,
                 'expenseId': expense_id
-            }
+            },
+            ReturnValues='ALL_OLD'
         )
+        if 'Attributes' in response:
+            expense_aggregates.record_change(user_id, response['Attributes'], None)
+            receipt_fingerprints.forget_expense(user_id, response['Attributes'].get('s3_key'), expense_id)
+            search_index.record_change(user_id, response['Attributes'], None)
+            recurring_expenses.record_change(user_id, response['Attributes'], None)
 
         return {
             'statusCode': 200,
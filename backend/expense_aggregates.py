@@ -0,0 +1,215 @@
+import os
+from collections import defaultdict
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import Key
+
+import aws_clients
+import expense_model
+
+# HASH userId, RANGE bucket. One item per user and bucket, e.g.
+# 'day#2024-03-05', 'week#2024-W10', 'month#2024-03', 'year#2024' or 'all'.
+# Without a table, writes keep no aggregates and summaries are unavailable.
+AGGREGATES_TABLE_NAME = os.environ.get('DYNAMODB_AGGREGATES_TABLE_NAME')
+
+PERIODS = ('day', 'week', 'month', 'year', 'all')
+
+# Per-category figures are top-level attributes so ADD can create them; a
+# nested map path would have to exist before it could be incremented.
+CATEGORY_TOTAL_PREFIX = 'category#'
+CATEGORY_COUNT_PREFIX = 'categoryCount#'
+
+
+def parse_amount(value):
+    """Missing or unparseable amounts (e.g. on old string items) count as zero."""
+    try:
+        amount = expense_model.parse_amount(value)
+    except ValueError:
+        return Decimal(0)
+    return amount if amount is not None else Decimal(0)
+
+
+def bucket_keys(date_value):
+    """Every bucket an expense dated ``date_value`` contributes to."""
+    try:
+        day = expense_model.parse_date(date_value)
+    except ValueError:
+        day = None
+    if day is None:
+        # Placeholder dates such as 'Not Applicable' only count towards 'all'.
+        return ['all']
+    iso_year, iso_week, _ = day.isocalendar()
+    return [
+        f'day#{day.isoformat()}',
+        f'week#{iso_year}-W{iso_week:02d}',
+        f'month#{day.year}-{day.month:02d}',
+        f'year#{day.year}',
+        'all',
+    ]
+
+
+def compute_deltas(changes):
+    """
+    Fold (old, new) expense pairs into per-bucket counter deltas.
+
+    ``old`` is None for a new expense and ``new`` is None for a deleted one.
+    Buckets whose deltas cancel out (e.g. an edit that only changes the
+    description) are dropped, so they cost no writes.
+    """
+    deltas = defaultdict(lambda: {'total': Decimal(0), 'count': 0, 'categories': defaultdict(lambda: [Decimal(0), 0])})
+    for old, new in changes:
+        for expense, sign in ((old, -1), (new, 1)):
+            if not expense:
+                continue
+            amount = parse_amount(expense.get('amount')) * sign
+            # Bucket legacy names ('Transport') under the canonical ones reads return.
+            category = expense_model.parse_category(expense.get('category')).value
+            for bucket in bucket_keys(expense.get('date')):
+                delta = deltas[bucket]
+                delta['total'] += amount
+                delta['count'] += sign
+                delta['categories'][category][0] += amount
+                delta['categories'][category][1] += sign
+
+    result = {}
+    for bucket, delta in deltas.items():
+        categories = {name: (total, count) for name, (total, count) in delta['categories'].items()
+                      if total or count}
+        if delta['total'] or delta['count'] or categories:
+            result[bucket] = {'total': delta['total'], 'count': delta['count'], 'categories': categories}
+    return result
+
+
+def _update_bucket(table, user_id, bucket, delta):
+    names = {'#total': 'total', '#count': 'count', '#period': 'period'}
+    values = {':total': delta['total'], ':count': delta['count'], ':period': bucket.split('#', 1)[0]}
+    adds = ['#total :total', '#count :count']
+    for i, (category, (total, count)) in enumerate(sorted(delta['categories'].items())):
+        names[f'#ct{i}'] = CATEGORY_TOTAL_PREFIX + category
+        names[f'#cc{i}'] = CATEGORY_COUNT_PREFIX + category
+        values[f':ct{i}'] = total
+        values[f':cc{i}'] = count
+        adds.append(f'#ct{i} :ct{i}')
+        adds.append(f'#cc{i} :cc{i}')
+
+    # ADD is applied atomically by DynamoDB, so concurrent saves to the same
+    # bucket never lose an increment.
+    table.update_item(
+        Key={'userId': user_id, 'bucket': bucket},
+        UpdateExpression='SET #period = :period ADD ' + ', '.join(adds),
+        ExpressionAttributeNames=names,
+        ExpressionAttributeValues=values,
+    )
+
+
+def _table(table):
+    if table is not None:
+        return table
+    if not AGGREGATES_TABLE_NAME:
+        raise RuntimeError('Spending aggregates are not configured (DYNAMODB_AGGREGATES_TABLE_NAME).')
+    return aws_clients.table(AGGREGATES_TABLE_NAME)
+
+
+def apply_changes(user_id, changes, table=None):
+    """Apply the aggregate deltas for a list of (old, new) expense pairs; a no-op without a table."""
+    if table is None and not AGGREGATES_TABLE_NAME:
+        return 0
+    table = _table(table)
+    deltas = compute_deltas(changes)
+    for bucket, delta in deltas.items():
+        _update_bucket(table, user_id, bucket, delta)
+    return len(deltas)
+
+
+def record_change(user_id, old, new):
+    """
+    Keep the aggregates in step with one expense write.
+
+    The expense itself is already stored by the time this runs, so a failure
+    here is logged rather than failing the request; rebuild_user_aggregates
+    repairs any drift.
+    """
+    try:
+        apply_changes(user_id, [(old, new)])
+    except Exception as e:
+        print(f"Error updating spending aggregates for {user_id}: {e}")
+
+
+def rebuild_user_aggregates(user_id, expenses, table=None):
+    """Recompute a user's aggregates from scratch, e.g. to backfill existing expenses."""
+    table = _table(table)
+    deltas = compute_deltas((None, expense) for expense in expenses)
+
+    existing = query_buckets(user_id, table=table)
+    with table.batch_writer() as writer:
+        for item in existing:
+            if item['bucket'] not in deltas:
+                writer.delete_item(Key={'userId': user_id, 'bucket': item['bucket']})
+        for bucket, delta in deltas.items():
+            item = {
+                'userId': user_id,
+                'bucket': bucket,
+                'period': bucket.split('#', 1)[0],
+                'total': delta['total'],
+                'count': delta['count'],
+            }
+            for category, (total, count) in delta['categories'].items():
+                item[CATEGORY_TOTAL_PREFIX + category] = total
+                item[CATEGORY_COUNT_PREFIX + category] = count
+            writer.put_item(Item=item)
+    return len(deltas)
+
+
+def query_buckets(user_id, period=None, start=None, end=None, table=None):
+    """
+    Read raw aggregate items for one period, optionally limited to bucket
+    labels between ``start`` and ``end`` inclusive (e.g. '2024-01'..'2024-03').
+    """
+    table = _table(table)
+    condition = Key('userId').eq(user_id)
+    if period == 'all':
+        condition = condition & Key('bucket').eq('all')
+    elif period and (start or end):
+        condition = condition & Key('bucket').between(f'{period}#{start or ""}', f'{period}#{end or "~"}')
+    elif period:
+        condition = condition & Key('bucket').begins_with(f'{period}#')
+
+    kwargs = {'KeyConditionExpression': condition}
+    items = []
+    while True:
+        response = table.query(**kwargs)
+        items.extend(response.get('Items', []))
+        if 'LastEvaluatedKey' not in response:
+            return items
+        kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+
+def format_bucket(item):
+    """Shape a stored aggregate item for the summary response."""
+    categories = {}
+    for name, value in item.items():
+        if name.startswith(CATEGORY_TOTAL_PREFIX):
+            category = name[len(CATEGORY_TOTAL_PREFIX):]
+            count = int(item.get(CATEGORY_COUNT_PREFIX + category, 0))
+            if value or count:
+                categories[category] = {'total': float(value), 'count': count}
+    bucket = item['bucket']
+    return {
+        'period': bucket.split('#', 1)[0],
+        'bucket': bucket.split('#', 1)[1] if '#' in bucket else bucket,
+        'total': float(item.get('total', 0)),
+        'count': int(item.get('count', 0)),
+        'categories': categories,
+    }
+
+
+if __name__ == '__main__':
+    # Backfill: python expense_aggregates.py user@example.com [...]
+    import sys
+
+    from expense_pages import iter_expenses
+
+    expenses_table = aws_clients.table(os.environ.get('DYNAMODB_TABLE_NAME'))
+    for user_id in sys.argv[1:]:
+        buckets = rebuild_user_aggregates(user_id, iter_expenses(expenses_table, user_id))
+        print(f"Rebuilt {buckets} aggregate buckets for {user_id}")
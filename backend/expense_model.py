@@ -0,0 +1,339 @@
+import re
+import uuid
+from datetime import date as Date, datetime, timezone
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+from enum import Enum
+
+NOT_APPLICABLE = 'Not Applicable'
+CENT = Decimal('0.01')
+# Attributes an update replaces; ones the new expense leaves out are removed.
+EDITABLE_ATTRIBUTES = ('vendor', 'amount', 'category', 'description', 'date', 'isRecurring')
+
+
+class Category(str, Enum):
+    FOOD_AND_DINING = 'Food & Dining'
+    GROCERIES = 'Groceries'
+    TRANSPORTATION = 'Transportation'
+    UTILITIES = 'Utilities'
+    SHOPPING = 'Shopping'
+    ENTERTAINMENT = 'Entertainment'
+    HEALTHCARE = 'Healthcare'
+    EDUCATION = 'Education'
+    TRAVEL = 'Travel'
+    OTHER = 'Other'
+    NOT_APPLICABLE = NOT_APPLICABLE
+
+
+# Lower-cased names, plus the short forms the extraction prompt and older
+# clients use, mapped to the canonical category.
+_CATEGORY_LOOKUP = {category.value.lower(): category for category in Category}
+_CATEGORY_LOOKUP.update({
+    'food': Category.FOOD_AND_DINING,
+    'dining': Category.FOOD_AND_DINING,
+    'restaurant': Category.FOOD_AND_DINING,
+    'transport': Category.TRANSPORTATION,
+    'health': Category.HEALTHCARE,
+    'medical': Category.HEALTHCARE,
+    'grocery': Category.GROCERIES,
+    '': Category.NOT_APPLICABLE,
+})
+
+_CATEGORY_BY_VALUE = {category.value: category for category in Category}
+
+_ISO_DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+_US_DATE = re.compile(r'(\d{1,2})/(\d{1,2})/(\d{4})$')
+# Tried in order after ISO; month-first wins for ambiguous numeric dates.
+_DATE_FORMATS = (
+    '%m/%d/%Y', '%m/%d/%y', '%Y/%m/%d', '%d.%m.%Y',
+    '%b %d, %Y', '%B %d, %Y', '%d %b %Y', '%d %B %Y',
+)
+_AMOUNT_NOISE = re.compile(r'[\s$€£,]|USD|EUR|GBP')
+# Expense ids derived from a client's idempotency key live in their own namespace.
+_IDEMPOTENCY_NAMESPACE = uuid.uuid5(uuid.NAMESPACE_URL, 'smart-receipts/expenses')
+
+
+class ExpenseValidationError(ValueError):
+    """Raised with every invalid field at once, e.g. {'amount': '...'}."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__('; '.join(f'{field}: {message}' for field, message in errors.items()))
+
+
+_MISSING = frozenset(('', NOT_APPLICABLE))
+
+
+def _missing(value):
+    return value is None or (value.__class__ is str and (value in _MISSING or value.strip() in _MISSING))
+
+
+def parse_amount(value):
+    """Amount as a Decimal rounded to cents, or None if it is missing."""
+    if _missing(value):
+        return None
+    if isinstance(value, bool):
+        raise ValueError('must be a number')
+    if isinstance(value, Decimal):
+        amount = value
+    elif isinstance(value, int):
+        amount = Decimal(value)
+    elif isinstance(value, float):
+        amount = Decimal(repr(value))
+    else:
+        try:
+            amount = Decimal(value)
+        except (InvalidOperation, TypeError):
+            # Currency symbols and thousands separators, e.g. '$1,234.50'.
+            try:
+                amount = Decimal(_AMOUNT_NOISE.sub('', str(value)))
+            except InvalidOperation:
+                raise ValueError(f'{value!r} is not a number')
+    if not amount.is_finite():
+        raise ValueError(f'{value!r} is not a number')
+    return amount.quantize(CENT, rounding=ROUND_HALF_UP)
+
+
+def parse_date(value):
+    """A datetime.date, or None if it is missing."""
+    if _missing(value):
+        return None
+    if isinstance(value, Date):
+        return value
+    text = str(value).strip()
+    # Fast path: what the date picker and stored items use, optionally
+    # followed by a time.
+    if len(text) >= 10 and text[4] == '-' and _ISO_DATE.match(text):
+        try:
+            return Date.fromisoformat(text[:10])
+        except ValueError:
+            raise ValueError(f'{value!r} is not a valid date')
+    # Receipts mostly print month-first dates; strptime is ~10x slower.
+    match = _US_DATE.match(text)
+    if match:
+        month, day, year = match.groups()
+        try:
+            return Date(int(year), int(month), int(day))
+        except ValueError:
+            raise ValueError(f'{value!r} is not a valid date')
+    for date_format in _DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+    raise ValueError(f'{value!r} is not a recognised date')
+
+
+def parse_category(value):
+    if value is None:
+        return Category.NOT_APPLICABLE
+    if isinstance(value, Category):
+        return value
+    category = _CATEGORY_BY_VALUE.get(value)
+    if category is None:
+        category = _CATEGORY_LOOKUP.get(str(value).strip().lower(), Category.OTHER)
+    return category
+
+
+def parse_bool(value):
+    """True or False from a boolean or 'true'/'false'; missing is False."""
+    if value is None:
+        return False
+    if isinstance(value, bool):
+        return value
+    if isinstance(value, str) and value.strip().lower() in ('true', 'false'):
+        return value.strip().lower() == 'true'
+    raise ValueError(f'{value!r} is not true or false')
+
+
+def _text(value):
+    if value is None:
+        return None
+    value = str(value).strip()
+    return None if value in _MISSING else value
+
+
+class Expense:
+    """
+    One expense, parsed and normalized once at the edge of a handler.
+
+    ``amount`` is a Decimal in cents precision, ``date`` a datetime.date and
+    ``category`` a Category; missing values are None (or
+    Category.NOT_APPLICABLE). Items are stored with a numeric amount and an
+    ISO date so DynamoDB can range-query and sum them; the API keeps
+    returning 'Not Applicable' for missing fields.
+    """
+
+    __slots__ = ('user_id', 'expense_id', 'vendor', 'amount', 'category', 'description',
+                 'date', 's3_key', 'is_recurring', 'created_at')
+
+    # (event/item attribute, parser) for the editable fields.
+    FIELDS = (
+        ('vendor', _text),
+        ('amount', parse_amount),
+        ('category', parse_category),
+        ('description', _text),
+        ('date', parse_date),
+    )
+
+    def __init__(self, user_id, expense_id=None, vendor=None, amount=None, category=Category.NOT_APPLICABLE,
+                 description=None, date=None, s3_key=None, is_recurring=False, created_at=None):
+        self.user_id = user_id
+        self.expense_id = expense_id
+        self.vendor = vendor
+        self.amount = amount
+        self.category = category
+        self.description = description
+        self.date = date
+        self.s3_key = s3_key
+        self.is_recurring = is_recurring
+        self.created_at = created_at
+
+    @classmethod
+    def from_event(cls, event, strict=True):
+        """
+        Parse a handler payload (or a Bedrock extraction merged with one).
+
+        In strict mode every unparseable field is reported together in one
+        ExpenseValidationError; otherwise unparseable values become missing.
+        """
+        errors = {}
+        values = {}
+        for field, parser in cls.FIELDS:
+            try:
+                values[field] = parser(event.get(field))
+            except ValueError as e:
+                if strict:
+                    errors[field] = str(e)
+                values[field] = None
+        try:
+            is_recurring = parse_bool(event.get('isRecurring'))
+        except ValueError as e:
+            if strict:
+                errors['isRecurring'] = str(e)
+            is_recurring = False
+        if not event.get('userId'):
+            errors['userId'] = 'is required'
+        if errors and strict:
+            raise ExpenseValidationError(errors)
+        return cls(
+            event.get('userId'),
+            expense_id=event.get('expenseId'),
+            s3_key=event.get('s3_key') or None,
+            is_recurring=is_recurring,
+            **values,
+        )
+
+    @classmethod
+    def from_item(cls, item):
+        """Load a stored item, including ones written before amounts were numeric."""
+        def lenient(parser, value):
+            try:
+                return parser(value)
+            except ValueError:
+                return None
+
+        return cls(
+            item.get('userId'),
+            expense_id=item.get('expenseId'),
+            vendor=_text(item.get('vendor')),
+            amount=lenient(parse_amount, item.get('amount')),
+            category=parse_category(item.get('category')),
+            description=_text(item.get('description')),
+            date=lenient(parse_date, item.get('date')),
+            s3_key=item.get('s3_key'),
+            is_recurring=lenient(parse_bool, item.get('isRecurring')) or False,
+            created_at=item.get('createdAt'),
+        )
+
+    def new_id(self, idempotency_key=None):
+        """
+        Assign a fresh expense id. With a client's idempotency key the id is
+        derived from the user and key instead, so a retried create lands on
+        the same item.
+        """
+        if idempotency_key:
+            self.expense_id = str(uuid.uuid5(_IDEMPOTENCY_NAMESPACE, f'{self.user_id}#{idempotency_key}'))
+        else:
+            self.expense_id = str(uuid.uuid4())
+        self.created_at = datetime.now(timezone.utc).isoformat()
+        return self.expense_id
+
+    def to_item(self):
+        """DynamoDB item; missing amount/date are left out so the date index stays sparse."""
+        item = {
+            'userId': self.user_id,
+            'expenseId': self.expense_id,
+            'vendor': self.vendor or NOT_APPLICABLE,
+            'category': self.category.value,
+            'description': self.description or NOT_APPLICABLE,
+            'isRecurring': self.is_recurring,
+        }
+        if self.amount is not None:
+            item['amount'] = self.amount
+        if self.date is not None:
+            item['date'] = self.date.isoformat()
+        if self.s3_key:
+            item['s3_key'] = self.s3_key
+        if self.created_at:
+            item['createdAt'] = self.created_at
+        return item
+
+    def to_response(self):
+        """JSON-safe dict in the shape the frontend already reads."""
+        response = {
+            'userId': self.user_id,
+            'expenseId': self.expense_id,
+            'vendor': self.vendor or NOT_APPLICABLE,
+            'amount': float(self.amount) if self.amount is not None else NOT_APPLICABLE,
+            'category': self.category.value,
+            'description': self.description or NOT_APPLICABLE,
+            'date': self.date.isoformat() if self.date is not None else NOT_APPLICABLE,
+            'isRecurring': self.is_recurring,
+        }
+        if self.s3_key:
+            response['s3_key'] = self.s3_key
+        return response
+
+    def __eq__(self, other):
+        if not isinstance(other, Expense):
+            return NotImplemented
+        return all(getattr(self, name) == getattr(other, name) for name in self.__slots__)
+
+    def __repr__(self):
+        return f'Expense({self.expense_id!r}, {self.vendor!r}, {self.amount!r}, {self.date!r})'
+
+
+if __name__ == '__main__':
+    # Rewrite items stored before this model (string amounts, free-form
+    # dates, createdAt placeholders) in the normalized form:
+    #   DYNAMODB_TABLE_NAME=SmartReceiptsExpenses python expense_model.py
+    # Then rebuild the spending aggregates, since normalized dates can move
+    # expenses into date buckets they were missing from.
+    import os
+
+    import aws_clients
+
+    _MODEL_ATTRIBUTES = ('userId', 'expenseId', 'vendor', 'amount', 'category', 'description', 'date',
+                         's3_key', 'isRecurring', 'createdAt')
+    table = aws_clients.table(os.environ.get('DYNAMODB_TABLE_NAME'))
+    scanned = rewritten = 0
+    scan_kwargs = {}
+    with table.batch_writer() as writer:
+        while True:
+            response = table.scan(**scan_kwargs)
+            for item in response.get('Items', []):
+                scanned += 1
+                expense = Expense.from_item(item)
+                if not (expense.created_at or '').endswith('+00:00'):
+                    expense.created_at = None
+                # Only the attributes the model owns are replaced; anything
+                # else on the item (view variants, recurrence, ...) is kept.
+                normalized = {key: value for key, value in item.items() if key not in _MODEL_ATTRIBUTES}
+                normalized.update(expense.to_item())
+                if normalized != item:
+                    writer.put_item(Item=normalized)
+                    rewritten += 1
+            if 'LastEvaluatedKey' not in response:
+                break
+            scan_kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+    print(f"Rewrote {rewritten} of {scanned} expenses")
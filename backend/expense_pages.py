@@ -0,0 +1,143 @@
+import base64
+import binascii
+import json
+import os
+
+from boto3.dynamodb.conditions import Attr, Key
+
+# GSI on the expenses table: HASH userId, RANGE date (ISO YYYY-MM-DD string).
+DATE_INDEX_NAME = os.environ.get('DYNAMODB_DATE_INDEX_NAME', 'userId-date-index')
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+# Only the attributes the dashboard, details and report views render.
+LIST_ATTRIBUTES = (
+    'userId', 'expenseId', 'vendor', 'amount', 'category',
+    'description', 'date', 's3_key', 'isRecurring', 'recurrence', 'nextExpectedDate',
+)
+
+# Bounds used for open-ended date ranges. Digits sort before letters, so
+# placeholder dates such as 'Not Applicable' fall outside any range.
+MIN_DATE = '0000-01-01'
+MAX_DATE = '9999-12-31'
+
+
+class InvalidContinuationToken(ValueError):
+    pass
+
+
+def encode_continuation_token(last_evaluated_key, index_name=None):
+    """Wrap a DynamoDB LastEvaluatedKey in an opaque, URL-safe token."""
+    payload = json.dumps({'k': last_evaluated_key, 'i': index_name}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_continuation_token(token, user_id, index_name=None):
+    """Turn a token back into an ExclusiveStartKey for the same user and index."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+        start_key = payload['k']
+        token_index = payload['i']
+    except (binascii.Error, ValueError, TypeError, KeyError, UnicodeError):
+        raise InvalidContinuationToken('nextToken is malformed.')
+
+    if not isinstance(start_key, dict) or start_key.get('userId') != user_id:
+        raise InvalidContinuationToken('nextToken does not belong to this user.')
+    if token_index != index_name:
+        raise InvalidContinuationToken('nextToken does not match the requested filters.')
+    return start_key
+
+
+def parse_page_size(value):
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    try:
+        page_size = int(value)
+    except (TypeError, ValueError):
+        raise ValueError('limit must be an integer.')
+    if page_size < 1:
+        raise ValueError('limit must be at least 1.')
+    return min(page_size, MAX_PAGE_SIZE)
+
+
+def build_expense_query(user_id, start_date=None, end_date=None, categories=None,
+                        attributes=LIST_ATTRIBUTES):
+    """
+    Build the table.query arguments for a user's expenses.
+
+    Date ranges are answered by the date GSI so only matching items are read;
+    the category filter is applied server-side on top of that.
+
+    Returns:
+        A (query_kwargs, index_name) tuple.
+    """
+    query_kwargs = {}
+    index_name = None
+
+    key_condition = Key('userId').eq(user_id)
+    if start_date or end_date:
+        index_name = DATE_INDEX_NAME
+        key_condition = key_condition & Key('date').between(start_date or MIN_DATE, end_date or MAX_DATE)
+        query_kwargs['IndexName'] = index_name
+    query_kwargs['KeyConditionExpression'] = key_condition
+
+    if categories:
+        if isinstance(categories, str):
+            categories = [categories]
+        if len(categories) == 1:
+            query_kwargs['FilterExpression'] = Attr('category').eq(categories[0])
+        else:
+            query_kwargs['FilterExpression'] = Attr('category').is_in(list(categories))
+
+    if attributes:
+        # 'date' is a reserved keyword in DynamoDB, so every attribute goes
+        # through an expression attribute name.
+        names = {f'#p{i}': name for i, name in enumerate(attributes)}
+        query_kwargs['ProjectionExpression'] = ', '.join(names)
+        query_kwargs['ExpressionAttributeNames'] = names
+
+    return query_kwargs, index_name
+
+
+def query_expenses_page(table, user_id, page_size=DEFAULT_PAGE_SIZE, next_token=None,
+                        start_date=None, end_date=None, categories=None,
+                        attributes=LIST_ATTRIBUTES):
+    """
+    Fetch one page of a user's expenses.
+
+    A filtered DynamoDB page can come back short (the filter runs after the
+    read), so this keeps querying until the page is full or the partition is
+    exhausted.
+
+    Returns:
+        A (items, next_token) tuple; next_token is None on the last page.
+    """
+    query_kwargs, index_name = build_expense_query(
+        user_id, start_date, end_date, categories, attributes)
+    start_key = decode_continuation_token(next_token, user_id, index_name) if next_token else None
+
+    items = []
+    while True:
+        if start_key:
+            query_kwargs['ExclusiveStartKey'] = start_key
+        response = table.query(Limit=page_size - len(items), **query_kwargs)
+        items.extend(response.get('Items', []))
+        start_key = response.get('LastEvaluatedKey')
+        if not start_key or len(items) >= page_size:
+            break
+
+    token = encode_continuation_token(start_key, index_name) if start_key else None
+    return items, token
+
+
+def iter_expenses(table, user_id, page_size=MAX_PAGE_SIZE, **filters):
+    """Yield every matching expense, one DynamoDB page at a time."""
+    next_token = None
+    while True:
+        items, next_token = query_expenses_page(
+            table, user_id, page_size=page_size, next_token=next_token, **filters)
+        yield from items
+        if not next_token:
+            return
@@ -0,0 +1,171 @@
+import csv
+import gzip
+import io
+import json
+import os
+import uuid
+from datetime import date
+from decimal import Decimal
+
+import aws_clients
+import instrumentation
+from expense_aggregates import parse_amount
+from expense_pages import iter_expenses
+from multipart_upload import MultipartUploadWriter
+
+TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
+S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
+
+DOWNLOAD_URL_EXPIRY_SECONDS = int(os.environ.get('EXPORT_URL_EXPIRY_SECONDS', 3600))
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'jsonl': 'application/x-ndjson',
+}
+EXPORT_ATTRIBUTES = ('date', 'vendor', 'amount', 'category', 'description', 's3_key', 'isRecurring')
+CSV_HEADERS = ['Date', 'Vendor', 'Amount', 'Category', 'Description', 'Receipt Available', 'Recurring']
+
+def _blank(value):
+    return '' if value in (None, 'Not Applicable') else value
+
+def _date_range(event):
+    year = event.get('year')
+    if year is not None:
+        year = int(year)
+        return f'{year:04d}-01-01', f'{year:04d}-12-31', str(year)
+
+    start_date = event.get('startDate')
+    end_date = event.get('endDate')
+    for value in (start_date, end_date):
+        if value is not None:
+            date.fromisoformat(value)
+    return start_date, end_date, f"{start_date or 'start'}_{end_date or 'end'}"
+
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+def write_csv(text, expenses):
+    """Same columns and trailing summary as the browser export used to build."""
+    writer = csv.writer(text)
+    writer.writerow(CSV_HEADERS)
+    total = Decimal(0)
+    by_category = {}
+    rows = 0
+    for expense in expenses:
+        amount = parse_amount(expense.get('amount'))
+        writer.writerow([
+            expense.get('date', ''),
+            _blank(expense.get('vendor')),
+            f'{amount:.2f}',
+            _blank(expense.get('category')),
+            _blank(expense.get('description')),
+            'Yes' if expense.get('s3_key') else 'No',
+            'Yes' if expense.get('isRecurring') else 'No',
+        ])
+        rows += 1
+        total += amount
+        category_total, count = by_category.get(expense.get('category'), (Decimal(0), 0))
+        by_category[expense.get('category')] = (category_total + amount, count + 1)
+
+    if rows:
+        writer.writerows([[], ['--- SUMMARY ---'], ['Total Expenses', f'{total:.2f}'], ['Total Receipts', rows], []])
+        writer.writerows([['--- BY CATEGORY ---'], ['Category', 'Amount', 'Count']])
+        for category, (amount, count) in sorted(by_category.items(), key=lambda entry: -entry[1][0]):
+            writer.writerow([_blank(category) or 'Uncategorized', f'{amount:.2f}', count])
+    return rows
+
+def write_jsonl(text, expenses):
+    rows = 0
+    for expense in expenses:
+        text.write(json.dumps(expense, default=_json_default, separators=(',', ':')))
+        text.write('\n')
+        rows += 1
+    return rows
+
+WRITERS = {'csv': write_csv, 'jsonl': write_jsonl}
+
+def stream_export(table, s3_client, user_id, export_format, s3_key, **filters):
+    """
+    Query -> serialize -> gzip -> multipart upload, one DynamoDB page and at
+    most one S3 part in memory at a time.
+
+    Returns:
+        A (rows, compressed_bytes) tuple; nothing is stored if rows is 0.
+    """
+    expenses = iter_expenses(table, user_id, attributes=EXPORT_ATTRIBUTES, **filters)
+    with MultipartUploadWriter(s3_client, S3_BUCKET_NAME, s3_key,
+                               ContentType=FORMATS[export_format], ContentEncoding='gzip') as upload:
+        # mtime=0 keeps the output byte-identical for identical data.
+        with gzip.GzipFile(fileobj=upload, mode='wb', compresslevel=6, mtime=0) as compressed, \
+                io.TextIOWrapper(compressed, encoding='utf-8', newline='') as text:
+            rows = WRITERS[export_format](text, expenses)
+        if not rows:
+            upload.abort()
+        return rows, upload.bytes_written
+
+@instrumentation.traced
+def lambda_handler(event, context):
+    try:
+        user_id = event.get('userId')
+        export_format = event.get('format', 'csv')
+
+        if not user_id:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'userId is required.'})
+            }
+        if export_format not in FORMATS:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': f"format must be one of: {', '.join(FORMATS)}."})
+            }
+        try:
+            start_date, end_date, label = _date_range(event)
+        except (TypeError, ValueError):
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'year must be an integer and startDate/endDate YYYY-MM-DD dates.'})
+            }
+
+        file_name = f'tax-data-{label}.{export_format}'
+        s3_key = f'exports/{uuid.uuid4()}/{file_name}.gz'
+
+        rows, compressed_bytes = stream_export(
+            aws_clients.table(TABLE_NAME), aws_clients.client('s3'), user_id, export_format, s3_key,
+            start_date=start_date, end_date=end_date, categories=event.get('category'))
+
+        if not rows:
+            return {
+                'statusCode': 200,
+                'body': json.dumps({'message': 'No expenses found for this range', 'rows': 0})
+            }
+
+        # The object is stored gzipped with Content-Encoding: gzip, so browsers
+        # decompress it on the fly and save a plain .csv/.jsonl file.
+        download_url = aws_clients.client('s3').generate_presigned_url(
+            'get_object',
+            Params={
+                'Bucket': S3_BUCKET_NAME,
+                'Key': s3_key,
+                'ResponseContentDisposition': f'attachment; filename="{file_name}"',
+            },
+            ExpiresIn=DOWNLOAD_URL_EXPIRY_SECONDS
+        )
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Export created successfully',
+                'download_url': download_url,
+                's3_key': s3_key,
+                'rows': rows,
+                'compressed_bytes': compressed_bytes,
+                'expires_in': DOWNLOAD_URL_EXPIRY_SECONDS
+            })
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
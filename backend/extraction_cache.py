@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from decimal import Decimal
+
+import aws_clients
+
+DEFAULT_TTL_SECONDS = int(os.environ.get('EXTRACTION_CACHE_TTL_SECONDS', 30 * 24 * 3600))
+DEFAULT_MAX_ENTRIES = int(os.environ.get('EXTRACTION_CACHE_SIZE', 256))
+
+
+def extraction_cache_key(image_bytes, prompt, model_id):
+    """
+    Key a cached extraction by the image content plus the prompt and model
+    that produced it, so changing either one naturally misses the cache.
+    """
+    digest = hashlib.sha256()
+    digest.update(hashlib.sha256(image_bytes).digest())
+    digest.update(model_id.encode('utf-8'))
+    digest.update(b'\0')
+    digest.update(prompt.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class MemoryCache:
+    """A small thread-safe LRU with per-entry expiry, kept for the life of a warm container."""
+
+    def __init__(self, max_entries=DEFAULT_MAX_ENTRIES, clock=time.time):
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= self._clock():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value, ttl_seconds):
+        with self._lock:
+            self._entries[key] = (value, self._clock() + ttl_seconds)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class DynamoDBCacheStore:
+    """
+    Persistent cache tier backed by a DynamoDB table keyed on ``cacheKey``.
+
+    ``expiresAt`` doubles as the table's TTL attribute; it is also checked on
+    read because DynamoDB deletes expired items lazily.
+    """
+
+    def __init__(self, table_name, clock=time.time):
+        self.table_name = table_name
+        self._clock = clock
+
+    @property
+    def table(self):
+        return aws_clients.table(self.table_name)
+
+    def get(self, key):
+        item = self.table.get_item(Key={'cacheKey': key}).get('Item')
+        if not item or int(item.get('expiresAt', 0)) <= self._clock():
+            return None
+        return json.loads(item['result'])
+
+    def put(self, key, value, ttl_seconds):
+        self.table.put_item(Item={
+            'cacheKey': key,
+            'result': json.dumps(value),
+            'expiresAt': Decimal(int(self._clock() + ttl_seconds)),
+        })
+
+    def delete(self, key):
+        self.table.delete_item(Key={'cacheKey': key})
+
+
+class ExtractionCache:
+    """
+    Two-tier cache for Bedrock extraction results.
+
+    Lookups try the in-process LRU first, then the persistent store; a
+    persistent hit is promoted into memory. ``stats`` counts hits per tier
+    and misses for the life of the container.
+    """
+
+    def __init__(self, memory=None, store=None, ttl_seconds=DEFAULT_TTL_SECONDS):
+        self.memory = memory if memory is not None else MemoryCache()
+        self.store = store
+        self.ttl_seconds = ttl_seconds
+        self.stats = {'memory_hits': 0, 'persistent_hits': 0, 'misses': 0, 'errors': 0}
+
+    def get(self, key):
+        """
+        Returns:
+            A (value, tier) tuple, where tier is 'memory', 'persistent' or
+            None on a miss.
+        """
+        value = self.memory.get(key)
+        if value is not None:
+            self.stats['memory_hits'] += 1
+            return value, 'memory'
+
+        if self.store is not None:
+            try:
+                value = self.store.get(key)
+            except Exception as e:
+                # A broken cache must never fail the extraction itself.
+                self.stats['errors'] += 1
+                print(f"Error reading extraction cache: {e}")
+                value = None
+            if value is not None:
+                self.stats['persistent_hits'] += 1
+                self.memory.put(key, value, self.ttl_seconds)
+                return value, 'persistent'
+
+        self.stats['misses'] += 1
+        return None, None
+
+    def put(self, key, value):
+        self.memory.put(key, value, self.ttl_seconds)
+        if self.store is not None:
+            try:
+                self.store.put(key, value, self.ttl_seconds)
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Error writing extraction cache: {e}")
+
+    def invalidate(self, key):
+        self.memory.delete(key)
+        if self.store is not None:
+            self.store.delete(key)
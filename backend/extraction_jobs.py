@@ -0,0 +1,243 @@
+import hashlib
+import json
+import os
+import time
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import aws_clients
+import job_queue
+
+JOBS_TABLE_NAME = os.environ.get('DYNAMODB_JOBS_TABLE_NAME')
+# Attempts per job before it is dead-lettered.
+MAX_ATTEMPTS = int(os.environ.get('EXTRACTION_JOB_MAX_ATTEMPTS', 3))
+# Finished jobs are deleted by the table's TTL on ``expiresAt``.
+JOB_TTL_SECONDS = int(os.environ.get('EXTRACTION_JOB_TTL_SECONDS', 7 * 24 * 3600))
+# Retries wait RETRY_BASE_SECONDS, then twice that, and so on.
+RETRY_BASE_SECONDS = int(os.environ.get('EXTRACTION_JOB_RETRY_SECONDS', 5))
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+DEAD = 'dead'
+FINISHED = (SUCCEEDED, DEAD)
+
+
+def job_id_for(s3_key):
+    """One job per S3 object, so repeated submissions (client, S3 trigger, retries) share it."""
+    return hashlib.sha256(s3_key.encode('utf-8')).hexdigest()[:32]
+
+
+def _is_conditional_failure(error):
+    return error.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'
+
+
+class ExtractionJobs:
+    """
+    Extraction job records in a DynamoDB table keyed on ``jobId``.
+
+    A job moves queued -> running -> succeeded, or back to queued after a
+    failed attempt until ``MAX_ATTEMPTS`` is reached and it is marked dead.
+    Every transition is a conditional write, so duplicate queue deliveries
+    and concurrent workers cannot run the same attempt twice.
+    """
+
+    def __init__(self, table_name=JOBS_TABLE_NAME, queue=None, clock=time.time):
+        self.table_name = table_name
+        self.queue = queue
+        self._clock = clock
+
+    @property
+    def table(self):
+        return aws_clients.table(self.table_name)
+
+    def _expires_at(self):
+        return Decimal(int(self._clock() + JOB_TTL_SECONDS))
+
+    def get(self, job_id):
+        return self.table.get_item(Key={'jobId': job_id}, ConsistentRead=True).get('Item')
+
+    def submit(self, s3_key, priority=job_queue.DEFAULT_PRIORITY, refresh=False, user_id=None):
+        """
+        Create and enqueue the job for ``s3_key``, or return the existing one.
+
+        ``refresh`` re-runs a finished job (e.g. to retry a dead one or force
+        a fresh extraction); a job that is still queued or running is left
+        alone, except that a queued job is promoted to a higher ``priority``.
+
+        Returns:
+            A (job, created) tuple.
+        """
+        job_id = job_id_for(s3_key)
+        now = Decimal(int(self._clock()))
+        job = {
+            'jobId': job_id,
+            's3Key': s3_key,
+            'status': QUEUED,
+            'priority': priority,
+            'refresh': bool(refresh),
+            'attempts': 0,
+            'createdAt': now,
+            'updatedAt': now,
+            'expiresAt': self._expires_at(),
+        }
+        if user_id:
+            job['userId'] = user_id
+        condition = Attr('jobId').not_exists()
+        if refresh:
+            condition = condition | Attr('status').is_in(list(FINISHED))
+        try:
+            self.table.put_item(Item=job, ConditionExpression=condition)
+        except ClientError as e:
+            if not _is_conditional_failure(e):
+                raise
+            existing = self._claim_owner(job_id, user_id) if user_id else self.get(job_id)
+            if existing is not None and existing['status'] == QUEUED and \
+                    job_queue.PRIORITIES[priority] < job_queue.PRIORITIES[existing.get('priority', priority)]:
+                self._promote(existing, priority)
+            return existing, False
+        try:
+            self.queue.send(job_id, priority)
+        except Exception:
+            # Without a message nobody would ever run it; let the next
+            # submission create it again.
+            self.table.delete_item(Key={'jobId': job_id})
+            raise
+        return job, True
+
+    def _claim_owner(self, job_id, user_id):
+        """
+        Record ``user_id`` on an existing job that has none yet (one the S3
+        trigger queued), so the worker checks it against the user's earlier
+        receipts. Returns the job, or None if it is gone.
+        """
+        try:
+            return self.table.update_item(
+                Key={'jobId': job_id},
+                UpdateExpression='SET userId = if_not_exists(userId, :user)',
+                ConditionExpression=Attr('jobId').exists(),
+                ExpressionAttributeValues={':user': user_id},
+                ReturnValues='ALL_NEW',
+            )['Attributes']
+        except ClientError as e:
+            if _is_conditional_failure(e):
+                return None
+            raise
+
+    def _promote(self, job, priority):
+        # The message already on the lower-priority queue stays; whichever
+        # copy is received first runs the job and the other is skipped.
+        try:
+            self.table.update_item(
+                Key={'jobId': job['jobId']},
+                UpdateExpression='SET #priority = :priority',
+                ConditionExpression=Attr('status').eq(QUEUED),
+                ExpressionAttributeNames={'#priority': 'priority'},
+                ExpressionAttributeValues={':priority': priority},
+            )
+        except ClientError as e:
+            if _is_conditional_failure(e):
+                return
+            raise
+        self.queue.send(job['jobId'], priority)
+        job['priority'] = priority
+
+    def claim(self, job_id, lease_seconds):
+        """
+        Start an attempt: mark the job running and count the attempt.
+
+        Returns the job, or None if it is finished or another worker holds
+        an unexpired lease on it. A lease ends when its message's visibility
+        timeout does, so a redelivered message can take over from a worker
+        that died.
+        """
+        now = int(self._clock())
+        try:
+            return self.table.update_item(
+                Key={'jobId': job_id},
+                UpdateExpression='SET #status = :running, leaseUntil = :lease, updatedAt = :now '
+                                 'ADD attempts :one',
+                ConditionExpression=Attr('status').eq(QUEUED) | (
+                    Attr('status').eq(RUNNING) & Attr('leaseUntil').lte(now)),
+                ExpressionAttributeNames={'#status': 'status'},
+                ExpressionAttributeValues={':running': RUNNING, ':lease': now + lease_seconds,
+                                           ':now': now, ':one': 1},
+                ReturnValues='ALL_NEW',
+            )['Attributes']
+        except ClientError as e:
+            if _is_conditional_failure(e):
+                return None
+            raise
+
+    def lease_remaining(self, job_id):
+        """
+        Seconds until another worker's lease on a running job ends (at least
+        1), or None if the job is not running.
+        """
+        job = self.get(job_id)
+        if job is None or job['status'] != RUNNING:
+            return None
+        return max(1, int(job.get('leaseUntil', 0)) - int(self._clock()))
+
+    def _finish(self, job_id, status, **attributes):
+        names = {'#status': 'status'}
+        values = {':status': status, ':now': int(self._clock()), ':expires': self._expires_at()}
+        assignments = ['#status = :status', 'updatedAt = :now', 'expiresAt = :expires']
+        for i, (name, value) in enumerate(attributes.items()):
+            names[f'#a{i}'] = name
+            values[f':v{i}'] = value
+            assignments.append(f'#a{i} = :v{i}')
+        try:
+            self.table.update_item(
+                Key={'jobId': job_id},
+                UpdateExpression='SET ' + ', '.join(assignments) + ' REMOVE leaseUntil',
+                ConditionExpression=Attr('status').eq(RUNNING),
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+            )
+        except ClientError as e:
+            if not _is_conditional_failure(e):
+                raise
+
+    def succeed(self, job_id, result, cached, duplicate=None):
+        fields = {'result': json.dumps(result), 'cached': bool(cached)}
+        if duplicate is not None:
+            fields['duplicateOf'] = json.dumps(duplicate)
+        self._finish(job_id, SUCCEEDED, **fields)
+
+    def fail(self, job, error):
+        """
+        Record a failed attempt.
+
+        Returns:
+            The seconds to wait before retrying, or None if the job is now dead.
+        """
+        attempts = int(job['attempts'])
+        if attempts >= MAX_ATTEMPTS:
+            self._finish(job['jobId'], DEAD, lastError=error)
+            return None
+        self._finish(job['jobId'], QUEUED, lastError=error)
+        return RETRY_BASE_SECONDS * 2 ** (attempts - 1)
+
+
+def to_response(job):
+    """The job as the status endpoint returns it."""
+    if job is None:
+        return None
+    response = {
+        'jobId': job['jobId'],
+        's3_key': job['s3Key'],
+        'status': job['status'],
+        'attempts': int(job.get('attempts', 0)),
+        'priority': job.get('priority', job_queue.DEFAULT_PRIORITY),
+    }
+    if job['status'] == SUCCEEDED:
+        response['extracted_data'] = json.loads(job['result'])
+        response['cached'] = bool(job.get('cached'))
+        if job.get('duplicateOf'):
+            response['duplicateOf'] = json.loads(job['duplicateOf'])
+    if job.get('lastError') and job['status'] != SUCCEEDED:
+        response['error'] = job['lastError']
+    return response
@@ -0,0 +1,236 @@
+import json
+
+import expense_model
+
+NOT_APPLICABLE = expense_model.NOT_APPLICABLE
+RECEIPT_FIELDS = ('vendor', 'amount', 'category', 'description', 'date')
+
+_WHITESPACE = ' \t\r\n'
+
+
+class IncrementalObjectParser:
+    """
+    Finds the first JSON object in streamed text and yields its top-level
+    members as soon as each value is complete.
+
+    Anything before the object (prose, a ```json fence) is skipped, and
+    nothing after it is read. Nested values are captured whole and decoded
+    with json.loads. If the text turns out not to be valid JSON the
+    members seen so far are dropped and the parser looks for the next '{'.
+    """
+
+    def __init__(self):
+        self.closed = False
+        self.errors = 0
+        self._reset()
+
+    def _reset(self):
+        self._state = 'seek'
+        self._buffer = []
+        self._key = None
+        self._escape = False
+        self._depth = 0
+        self._in_string = False
+        self.members = {}
+
+    def feed(self, text):
+        """Consume a chunk of text; returns the (key, value) pairs it completed."""
+        completed = []
+        i = 0
+        while i < len(text) and not self.closed:
+            char = text[i]
+            state = self._state
+            if state == 'seek':
+                if char == '{':
+                    self._state = 'key'
+            elif state == 'key':
+                # Between members: whitespace, a comma, the key's opening quote or the end.
+                if char == '"':
+                    self._state = 'key_string'
+                    self._buffer = ['"']
+                elif char == '}':
+                    self.closed = True
+                elif char not in _WHITESPACE and char != ',':
+                    self._malformed()
+            elif state == 'key_string':
+                self._buffer.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._key = self._decode(self._buffer)
+                    self._state = 'colon' if isinstance(self._key, str) else 'seek'
+            elif state == 'colon':
+                if char == ':':
+                    self._state = 'value'
+                elif char not in _WHITESPACE:
+                    self._malformed()
+            elif state == 'value':
+                if char in _WHITESPACE:
+                    pass
+                elif char == '"':
+                    self._state = 'string_value'
+                    self._buffer = ['"']
+                elif char in '{[':
+                    self._state = 'nested_value'
+                    self._buffer = [char]
+                    self._depth = 1
+                    self._in_string = False
+                else:
+                    self._state = 'scalar_value'
+                    self._buffer = [char]
+            elif state == 'string_value':
+                self._buffer.append(char)
+                if self._escape:
+                    self._escape = False
+                elif char == '\\':
+                    self._escape = True
+                elif char == '"':
+                    self._complete(completed)
+            elif state == 'nested_value':
+                self._buffer.append(char)
+                if self._in_string:
+                    if self._escape:
+                        self._escape = False
+                    elif char == '\\':
+                        self._escape = True
+                    elif char == '"':
+                        self._in_string = False
+                elif char == '"':
+                    self._in_string = True
+                elif char in '{[':
+                    self._depth += 1
+                elif char in '}]':
+                    self._depth -= 1
+                    if self._depth == 0:
+                        self._complete(completed)
+            elif state == 'scalar_value':
+                if char in ',}' or char in _WHITESPACE:
+                    self._complete(completed)
+                    # Re-read the delimiter in the 'after_value' state.
+                    continue
+                self._buffer.append(char)
+            elif state == 'after_value':
+                if char == ',':
+                    self._state = 'key'
+                elif char == '}':
+                    self.closed = True
+                elif char not in _WHITESPACE:
+                    self._malformed()
+            i += 1
+        return completed
+
+    def _decode(self, buffer):
+        try:
+            return json.loads(''.join(buffer))
+        except ValueError:
+            return _INVALID
+
+    def _complete(self, completed):
+        value = self._decode(self._buffer)
+        if value is _INVALID:
+            self._malformed()
+            return
+        self.members[self._key] = value
+        completed.append((self._key, value))
+        self._buffer = []
+        self._state = 'after_value'
+
+    def _malformed(self):
+        self.errors += 1
+        self._reset()
+
+
+_INVALID = object()
+
+
+def normalize_items(value):
+    """
+    The line items of a segment response as ``{'name', 'price'}`` dicts,
+    prices as strings; items without a name are dropped.
+    """
+    if not isinstance(value, list):
+        return []
+    items = []
+    for item in value:
+        if not isinstance(item, dict) or not isinstance(item.get('name'), str) or not item['name'].strip():
+            continue
+        price = normalize_field('amount', item.get('price'))
+        items.append({'name': item['name'].strip(), 'price': price})
+    return items
+
+
+def normalize_field(name, value):
+    """
+    Validate one extracted field, returning the value to keep or
+    'Not Applicable' if it is missing or unusable.
+    """
+    if name == 'items':
+        return normalize_items(value)
+    if value is None or isinstance(value, (dict, list, bool)):
+        return NOT_APPLICABLE
+    try:
+        if name == 'amount':
+            amount = expense_model.parse_amount(value)
+            return str(amount) if amount is not None else NOT_APPLICABLE
+        if name == 'date':
+            date = expense_model.parse_date(value)
+            return date.isoformat() if date is not None else NOT_APPLICABLE
+        if name == 'category':
+            return expense_model.parse_category(value).value
+    except ValueError:
+        return NOT_APPLICABLE
+    text = str(value).strip()
+    return text or NOT_APPLICABLE
+
+
+class ReceiptFieldParser:
+    """
+    Collects the receipt fields (by default the five of RECEIPT_FIELDS)
+    from a (streamed) model response.
+
+    ``complete`` turns true as soon as every field has arrived or the
+    object has closed, so a streaming caller can stop reading there.
+    """
+
+    def __init__(self, fields=RECEIPT_FIELDS):
+        self.fields = fields
+        self.values = {}
+        self.rejected = {}
+        self._parser = IncrementalObjectParser()
+
+    def feed(self, text):
+        errors = self._parser.errors
+        completed = self._parser.feed(text)
+        if self._parser.errors != errors:
+            # The object was abandoned; only members of the current one count.
+            self.values, self.rejected = {}, {}
+            completed = list(self._parser.members.items())
+        for key, value in completed:
+            if key not in self.fields or key in self.values:
+                continue
+            normalized = normalize_field(key, value)
+            if normalized == NOT_APPLICABLE and value not in (None, NOT_APPLICABLE):
+                self.rejected[key] = value
+            self.values[key] = normalized
+        return self.complete
+
+    @property
+    def complete(self):
+        return self._parser.closed or len(self.values) == len(self.fields)
+
+    @property
+    def found_object(self):
+        return bool(self.values) or self._parser.closed
+
+    def result(self):
+        """Every field, 'Not Applicable' for any that never arrived."""
+        return {field: self.values.get(field, NOT_APPLICABLE) for field in self.fields}
+
+
+def parse_receipt_fields(text, fields=RECEIPT_FIELDS):
+    """Parse a complete (non-streamed) model response the same tolerant way."""
+    parser = ReceiptFieldParser(fields)
+    parser.feed(text)
+    return parser.result() if parser.found_object else None
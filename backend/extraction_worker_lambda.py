@@ -0,0 +1,158 @@
+import contextvars
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import receipt_extraction as extraction
+import extraction_jobs
+import instrumentation
+import job_queue
+import model_router
+
+# Jobs extracted at once per invocation; keep within the Bedrock quota.
+WORKER_CONCURRENCY = int(os.environ.get('EXTRACTION_WORKER_CONCURRENCY', 4))
+# Stop taking jobs when the invocation is this close to timing out.
+DEADLINE_MARGIN_MS = int(os.environ.get('EXTRACTION_WORKER_DEADLINE_MARGIN_MS', 60000))
+# How long an idle pull-mode worker waits for new messages before returning.
+IDLE_WAIT_SECONDS = int(os.environ.get('EXTRACTION_WORKER_IDLE_SECONDS', 1))
+
+queue = job_queue.from_environment()
+jobs = extraction_jobs.ExtractionJobs(queue=queue)
+
+def _remaining_ms(context):
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return float('inf')
+    return context.get_remaining_time_in_millis()
+
+def run_job(job_id):
+    """
+    Make one attempt at a job.
+
+    Returns:
+        An (outcome, retry_delay_seconds) tuple; outcome is 'succeeded',
+        'retry', 'dead', 'busy' (running elsewhere; retry when its lease
+        ends) or 'skipped' (finished).
+    """
+    job = jobs.claim(job_id, job_queue.VISIBILITY_TIMEOUT_SECONDS)
+    if job is None:
+        # The message is all that brings the job back if that worker dies,
+        # so keep it until the lease has run out.
+        remaining = jobs.lease_remaining(job_id)
+        return ('skipped', None) if remaining is None else ('busy', remaining)
+    try:
+        image_bytes, media_type = extraction.get_inference_image(job['s3Key'])
+        if not image_bytes:
+            raise RuntimeError('Could not retrieve image from S3.')
+        # The same duplicate checks as a direct extraction, once a userId is
+        # known; jobs the S3 trigger queued get theirs from the client's call.
+        extracted_data, cache_tier, _, _, duplicate = extraction.extract_for_user(
+            job.get('userId'), [job['s3Key']], [(image_bytes, media_type)], refresh=bool(job.get('refresh')))
+        if extracted_data == extraction.NOT_APPLICABLE_RESULT:
+            raise RuntimeError('Could not extract receipt data.')
+    except Exception as e:
+        print(f"Extraction job {job_id} attempt {job['attempts']} failed: {e}")
+        delay = jobs.fail(job, str(e))
+        return ('dead', None) if delay is None else ('retry', delay)
+    jobs.succeed(job_id, extracted_data, cache_tier is not None, duplicate)
+    return 'succeeded', None
+
+def process_message(message, work_queue):
+    """Run the message's job and settle the message with the queue."""
+    try:
+        outcome, delay = run_job(message.job_id)
+    except Exception as e:
+        # The job record could not be updated; let the message come back
+        # after its visibility timeout.
+        print(f"Error processing extraction job {message.job_id}: {e}")
+        return 'error'
+    if outcome in ('retry', 'busy'):
+        work_queue.release(message, delay)
+    elif outcome == 'dead':
+        work_queue.dead_letter(message, f'Failed {extraction_jobs.MAX_ATTEMPTS} attempts')
+    else:
+        work_queue.delete(message)
+    return outcome
+
+def drain(work_queue, deadline, concurrency=WORKER_CONCURRENCY, idle_wait_seconds=IDLE_WAIT_SECONDS):
+    """
+    Pull mode: ``concurrency`` threads take messages, highest priority
+    first, until the queue stays empty for ``idle_wait_seconds`` or
+    ``deadline`` (a time.monotonic() value) is reached.
+    """
+    def worker():
+        counts = {}
+        while time.monotonic() < deadline:
+            messages = work_queue.receive(max_messages=1, wait_seconds=idle_wait_seconds)
+            if not messages:
+                break
+            outcome = process_message(messages[0], work_queue)
+            counts[outcome] = counts.get(outcome, 0) + 1
+        return counts
+
+    totals = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        # A copy of this context each, so Bedrock calls keep the invocation's deadline.
+        for future in [pool.submit(contextvars.copy_context().run, worker) for _ in range(concurrency)]:
+            for outcome, count in future.result().items():
+                totals[outcome] = totals.get(outcome, 0) + count
+    return totals
+
+def _queue_url(arn):
+    # arn:aws:sqs:<region>:<account>:<name>
+    _, _, _, region, account, name = arn.split(':')
+    return f'https://sqs.{region}.amazonaws.com/{account}/{name}'
+
+def handle_sqs_records(records):
+    """
+    SQS event source mode. Retries, and jobs running elsewhere, are reported
+    as batch item failures so Lambda leaves them on the queue (with the
+    retry delay set as their visibility timeout); everything else is
+    deleted by Lambda.
+    """
+    sqs_queue = queue if isinstance(queue, job_queue.SQSJobQueue) else job_queue.SQSJobQueue(
+        {'normal': _queue_url(records[0]['eventSourceARN'])},
+        dead_letter_url=os.environ.get('EXTRACTION_DEAD_LETTER_QUEUE_URL'))
+    messages = [
+        job_queue.SQSJobQueue.from_sqs(record['body'], record['receiptHandle'],
+                                       record.get('attributes', {}).get('ApproximateReceiveCount', 1),
+                                       _queue_url(record['eventSourceARN']))
+        for record in records
+    ]
+    with ThreadPoolExecutor(max_workers=max(1, min(WORKER_CONCURRENCY, len(messages)))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, process_message, message, sqs_queue)
+                   for message in messages]
+        outcomes = [future.result() for future in futures]
+
+    failures = [{'itemIdentifier': record['messageId']}
+                for record, outcome in zip(records, outcomes) if outcome in ('retry', 'busy', 'error')]
+    counts = {}
+    for outcome in outcomes:
+        counts[outcome] = counts.get(outcome, 0) + 1
+    return counts, failures
+
+@instrumentation.traced
+def lambda_handler(event, context):
+    model_router.set_deadline(context)
+    if event.get('Records'):
+        counts, failures = handle_sqs_records(event['Records'])
+        print(f"Extraction jobs: {counts}")
+        return {'batchItemFailures': failures}
+
+    try:
+        if queue is None:
+            return {
+                'statusCode': 500,
+                'body': json.dumps({'error': 'No job queue is configured.'})
+            }
+        deadline = time.monotonic() + (_remaining_ms(context) - DEADLINE_MARGIN_MS) / 1000.0
+        counts = drain(queue, deadline)
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'message': 'Queue drained', 'counts': counts})
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
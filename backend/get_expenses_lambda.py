@@ -1,12 +1,14 @@
 import json
 import os
-import boto3
-from boto3.dynamodb.conditions import Key
 
-dynamodb = boto3.resource('dynamodb')
+import aws_clients
+import instrumentation
+from expense_model import Expense
+from expense_pages import InvalidContinuationToken, parse_page_size, query_expenses_page
 
 TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
 
+@instrumentation.traced
 def lambda_handler(event, context):
     try:
         user_id = event.get('userId')
@@ -17,22 +19,42 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'userId is required.'})
             }
 
-        table = dynamodb.Table(TABLE_NAME)
-        
-        response = table.query(
-            KeyConditionExpression=Key('userId').eq(user_id)
-        )
-        items = response['Items']
+        try:
+            page_size = parse_page_size(event.get('limit'))
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': str(e)})
+            }
+
+        table = aws_clients.table(TABLE_NAME)
+
+        try:
+            items, next_token = query_expenses_page(
+                table,
+                user_id,
+                page_size=page_size,
+                next_token=event.get('nextToken'),
+                start_date=event.get('startDate'),
+                end_date=event.get('endDate'),
+                categories=event.get('category'),
+            )
+        except InvalidContinuationToken as e:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': str(e)})
+            }
 
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'message': 'Expenses fetched successfully',
-                'expenses': items
+                'expenses': [Expense.from_item(item).to_response() for item in items],
+                'nextToken': next_token
             })
         }
     except Exception as e:
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
@@ -0,0 +1,64 @@
+import json
+import os
+import time
+
+import extraction_jobs
+import instrumentation
+
+# Upper bound for long polling; stays well inside the function timeout.
+MAX_WAIT_SECONDS = int(os.environ.get('EXTRACTION_JOB_MAX_WAIT_SECONDS', 20))
+POLL_INITIAL_SECONDS = 0.25
+POLL_MAX_SECONDS = 2.0
+
+jobs = extraction_jobs.ExtractionJobs()
+
+def wait_for_job(job_id, wait_seconds):
+    """Re-read the job with growing intervals until it finishes or ``wait_seconds`` pass."""
+    deadline = time.monotonic() + wait_seconds
+    interval = POLL_INITIAL_SECONDS
+    job = jobs.get(job_id)
+    while job is not None and job['status'] not in extraction_jobs.FINISHED:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(interval, remaining))
+        interval = min(POLL_MAX_SECONDS, interval * 2)
+        job = jobs.get(job_id)
+    return job
+
+@instrumentation.traced
+def lambda_handler(event, context):
+    try:
+        job_id = event.get('jobId')
+        if not job_id and event.get('s3_key'):
+            job_id = extraction_jobs.job_id_for(event['s3_key'])
+        if not job_id:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'jobId or s3_key is required.'})
+            }
+
+        try:
+            wait_seconds = max(0.0, min(float(event.get('wait_seconds', 0)), MAX_WAIT_SECONDS))
+        except (TypeError, ValueError):
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'wait_seconds must be a number.'})
+            }
+
+        job = wait_for_job(job_id, wait_seconds)
+        if job is None:
+            return {
+                'statusCode': 404,
+                'body': json.dumps({'error': 'Extraction job not found.'})
+            }
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({'job': extraction_jobs.to_response(job)})
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
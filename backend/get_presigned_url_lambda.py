@@ -1,37 +1,210 @@
 import json
+import math
 import os
-import boto3
+import time
+import uuid
 
-s3_client = boto3.client('s3')
+import aws_clients
+import instrumentation
+from image_preprocessing import EXTENSIONS, VIEW_VARIANTS, derivative_key
 
 S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
 
-def lambda_handler(event, context):
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', 20 * 1024 * 1024))
+UPLOAD_URL_EXPIRY_SECONDS = int(os.environ.get('UPLOAD_URL_EXPIRY_SECONDS', 900))
+# S3 requires every multipart part except the last to be at least 5 MB.
+MULTIPART_PART_BYTES = max(5 * 1024 * 1024, int(os.environ.get('MULTIPART_PART_BYTES', 8 * 1024 * 1024)))
+ALLOWED_CONTENT_TYPES = set(EXTENSIONS)
+# Originals are full-resolution photos of a receipt: keep their links short.
+GET_URL_EXPIRY_SECONDS = int(os.environ.get('GET_URL_EXPIRY_SECONDS', 300))
+# View variants are small and never change, so their links live longer and
+# the browser may keep the image for as long as the link is valid. URLs
+# signed with the function's role credentials stop working when those
+# expire, whatever this says.
+VIEW_URL_EXPIRY_SECONDS = int(os.environ.get('VIEW_URL_EXPIRY_SECONDS', 3600))
+MAX_GET_KEYS = int(os.environ.get('PRESIGN_MAX_KEYS', 200))
+VARIANTS = ('original',) + tuple(VIEW_VARIANTS)
+
+def _validate_upload(event):
+    content_type = event.get('content_type')
+    content_length = event.get('content_length')
+
+    if content_type not in ALLOWED_CONTENT_TYPES:
+        raise ValueError(f"content_type must be one of: {', '.join(sorted(ALLOWED_CONTENT_TYPES))}.")
     try:
-        s3_key = event.get('s3_key')
+        content_length = int(content_length)
+    except (TypeError, ValueError):
+        raise ValueError('content_length is required and must be an integer.')
+    if not 0 < content_length <= MAX_UPLOAD_BYTES:
+        raise ValueError(f'content_length must be between 1 and {MAX_UPLOAD_BYTES} bytes.')
+
+    # Keys are always generated here, so clients can't overwrite other receipts.
+    s3_key = f"receipts/{uuid.uuid4()}{EXTENSIONS[content_type]}"
+    return s3_key, content_type, content_length
+
+def presign_get(event):
+    """
+    Presign GETs for one receipt (``s3_key``) or many (``s3_keys``), of the
+    original or of a view ``variant`` stored at upload.
+    """
+    variant = event.get('variant', 'original')
+    if variant not in VARIANTS:
+        raise ValueError(f"variant must be one of: {', '.join(VARIANTS)}.")
+    s3_keys = event.get('s3_keys')
+    if s3_keys is None:
+        if not event.get('s3_key'):
+            raise ValueError('s3_key or s3_keys is required.')
+        s3_keys = [event['s3_key']]
+    elif (not isinstance(s3_keys, list) or not s3_keys or len(s3_keys) > MAX_GET_KEYS
+          or not all(isinstance(s3_key, str) and s3_key for s3_key in s3_keys)):
+        raise ValueError(f's3_keys must be a list of 1 to {MAX_GET_KEYS} keys.')
+
+    expires_in = GET_URL_EXPIRY_SECONDS if variant == 'original' else VIEW_URL_EXPIRY_SECONDS
+    s3_client = aws_clients.client('s3')
+    # Presigning is local signing, no request to S3, so a batch costs one
+    # invocation whatever its size.
+    urls = {}
+    for s3_key in dict.fromkeys(s3_keys):
+        params = {'Bucket': S3_BUCKET_NAME, 'Key': s3_key}
+        if variant != 'original':
+            params.update(Key=derivative_key(s3_key, variant),
+                          ResponseCacheControl=f'private, max-age={expires_in}, immutable')
+        urls[s3_key] = s3_client.generate_presigned_url('get_object', Params=params, ExpiresIn=expires_in)
+
+    body = {
+        'message': 'Presigned URL generated successfully',
+        'variant': variant,
+        'expires_in': expires_in,
+        # Clients can reuse a link (and the cached image) until then.
+        'expires_at': int(time.time()) + expires_in,
+    }
+    if 's3_keys' in event:
+        body['urls'] = urls
+    else:
+        body['presigned_url'] = urls[event['s3_key']]
+    return body
+
+def presign_upload(event):
+    """Presign a single PUT for a server-generated key."""
+    s3_key, content_type, content_length = _validate_upload(event)
+    upload_url = aws_clients.client('s3').generate_presigned_url(
+        'put_object',
+        Params={
+            'Bucket': S3_BUCKET_NAME,
+            'Key': s3_key,
+            'ContentType': content_type,
+            'ContentLength': content_length,
+        },
+        ExpiresIn=UPLOAD_URL_EXPIRY_SECONDS
+    )
+    return {
+        'message': 'Upload URL generated successfully',
+        's3_key': s3_key,
+        'upload_url': upload_url,
+        'method': 'PUT',
+        'headers': {'Content-Type': content_type},
+        'expires_in': UPLOAD_URL_EXPIRY_SECONDS
+    }
+
+def presign_multipart(event):
+    """Start a multipart upload and presign one URL per fixed-size part."""
+    s3_key, content_type, content_length = _validate_upload(event)
+    s3_client = aws_clients.client('s3')
+    upload = s3_client.create_multipart_upload(
+        Bucket=S3_BUCKET_NAME,
+        Key=s3_key,
+        ContentType=content_type
+    )
+    upload_id = upload['UploadId']
+
+    part_count = math.ceil(content_length / MULTIPART_PART_BYTES)
+    parts = []
+    for part_number in range(1, part_count + 1):
+        part_size = min(MULTIPART_PART_BYTES, content_length - (part_number - 1) * MULTIPART_PART_BYTES)
+        parts.append({
+            'part_number': part_number,
+            'size': part_size,
+            'upload_url': s3_client.generate_presigned_url(
+                'upload_part',
+                Params={
+                    'Bucket': S3_BUCKET_NAME,
+                    'Key': s3_key,
+                    'UploadId': upload_id,
+                    'PartNumber': part_number,
+                    'ContentLength': part_size,
+                },
+                ExpiresIn=UPLOAD_URL_EXPIRY_SECONDS
+            )
+        })
+
+    return {
+        'message': 'Multipart upload started',
+        's3_key': s3_key,
+        'upload_id': upload_id,
+        'part_size': MULTIPART_PART_BYTES,
+        'parts': parts,
+        'expires_in': UPLOAD_URL_EXPIRY_SECONDS
+    }
 
-        if not s3_key:
+def complete_multipart(event):
+    s3_key = event.get('s3_key')
+    upload_id = event.get('upload_id')
+    parts = event.get('parts')
+    if not s3_key or not upload_id or not parts:
+        raise ValueError('s3_key, upload_id and parts are required.')
+
+    aws_clients.client('s3').complete_multipart_upload(
+        Bucket=S3_BUCKET_NAME,
+        Key=s3_key,
+        UploadId=upload_id,
+        MultipartUpload={'Parts': sorted(
+            ({'PartNumber': int(p['part_number']), 'ETag': p['etag']} for p in parts),
+            key=lambda p: p['PartNumber']
+        )}
+    )
+    return {'message': 'Multipart upload completed', 's3_key': s3_key}
+
+def abort_multipart(event):
+    s3_key = event.get('s3_key')
+    upload_id = event.get('upload_id')
+    if not s3_key or not upload_id:
+        raise ValueError('s3_key and upload_id are required.')
+
+    aws_clients.client('s3').abort_multipart_upload(Bucket=S3_BUCKET_NAME, Key=s3_key, UploadId=upload_id)
+    return {'message': 'Multipart upload aborted', 's3_key': s3_key}
+
+ACTIONS = {
+    'get': presign_get,
+    'upload': presign_upload,
+    'multipart': presign_multipart,
+    'complete_multipart': complete_multipart,
+    'abort_multipart': abort_multipart,
+}
+
+@instrumentation.traced
+def lambda_handler(event, context):
+    try:
+        action = ACTIONS.get(event.get('action', 'get'))
+        if action is None:
             return {
                 'statusCode': 400,
-                'body': json.dumps({'error': 's3_key is required.'})
+                'body': json.dumps({'error': f"action must be one of: {', '.join(ACTIONS)}."})
             }
 
-        # Generate a pre-signed URL for the S3 object
-        presigned_url = s3_client.generate_presigned_url(
-            'get_object',
-            Params={'Bucket': S3_BUCKET_NAME, 'Key': s3_key},
-            ExpiresIn=300 # URL valid for 5 minutes
-        )
+        try:
+            body = action(event)
+        except (ValueError, KeyError) as e:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': str(e)})
+            }
 
         return {
             'statusCode': 200,
-            'body': json.dumps({
-                'message': 'Presigned URL generated successfully',
-                'presigned_url': presigned_url
-            })
+            'body': json.dumps(body)
         }
     except Exception as e:
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
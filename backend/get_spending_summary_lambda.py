@@ -0,0 +1,52 @@
+import json
+
+import instrumentation
+from expense_aggregates import PERIODS, format_bucket, query_buckets
+
+@instrumentation.traced
+def lambda_handler(event, context):
+    try:
+        user_id = event.get('userId')
+        period = event.get('period', 'month')
+
+        if not user_id:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'userId is required.'})
+            }
+        if period not in PERIODS:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': f"period must be one of: {', '.join(PERIODS)}."})
+            }
+
+        # start/end are bucket labels for the period, e.g. '2024-03-01' for
+        # days, '2024-W10' for ISO weeks, '2024-03' for months, '2024' for years.
+        buckets = [format_bucket(item) for item in query_buckets(
+            user_id, period, start=event.get('start'), end=event.get('end'))]
+
+        categories = {}
+        for bucket in buckets:
+            for category, figures in bucket['categories'].items():
+                totals = categories.setdefault(category, {'total': 0.0, 'count': 0})
+                totals['total'] += figures['total']
+                totals['count'] += figures['count']
+        for totals in categories.values():
+            totals['total'] = round(totals['total'], 2)
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Spending summary fetched successfully',
+                'period': period,
+                'buckets': buckets,
+                'total': round(sum(b['total'] for b in buckets), 2),
+                'count': sum(b['count'] for b in buckets),
+                'categories': categories
+            })
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
@@ -1,14 +1,33 @@
 import json
-import os
-import boto3
+from decimal import Decimal
 
-dynamodb = boto3.resource('dynamodb')
+import instrumentation
+import user_preferences
 
-TABLE_NAME = os.environ.get('DYNAMODB_USERS_TABLE_NAME', 'SmartReceiptsUsers')
+def _json_default(value):
+    if isinstance(value, Decimal):
+        return str(value)
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
 
+@instrumentation.traced
 def lambda_handler(event, context):
     try:
         user_id = event.get('userId')
+        user_ids = event.get('userIds')
+
+        if user_ids is not None:
+            if not isinstance(user_ids, list) or not user_ids or not all(isinstance(u, str) and u for u in user_ids):
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps({'error': 'userIds must be a non-empty list of user ids.'})
+                }
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': 'User preferences fetched successfully',
+                    'preferences': user_preferences.get_many(user_ids)
+                }, default=_json_default)
+            }
 
         if not user_id:
             return {
@@ -16,22 +35,14 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'userId is required.'})
             }
 
-        table = dynamodb.Table(TABLE_NAME)
-        
-        response = table.get_item(
-            Key={
-                'userId': user_id
-            }
-        )
-        
-        item = response.get('Item')
+        item = user_preferences.get(user_id)
 
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'message': 'User preferences fetched successfully',
                 'preferences': item
-            })
+            }, default=_json_default)
         }
     except Exception as e:
         return {
@@ -0,0 +1,320 @@
+import io
+import math
+import os
+
+try:
+    from PIL import Image, ImageFilter, ImageOps, features
+except ImportError:  # Pillow is optional; without it images pass through untouched.
+    Image = None
+
+# Anthropic models downscale anything with a long edge over ~1568px anyway,
+# so larger inputs only cost bytes and latency.
+MAX_LONG_EDGE = int(os.environ.get('INFERENCE_MAX_LONG_EDGE', 1568))
+# Claude also rescales images above ~1.15 megapixels, and bills by area.
+MAX_PIXELS = int(os.environ.get('INFERENCE_MAX_PIXELS', 1_150_000))
+MAX_INFERENCE_BYTES = int(os.environ.get('INFERENCE_MAX_BYTES', 400 * 1024))
+JPEG_QUALITIES = (85, 75, 65, 50)
+
+# Crop only when the bright "paper" region is clearly smaller than the photo
+# but still large enough to be the whole receipt.
+MIN_CROP_AREA = 0.15
+MAX_CROP_AREA = 0.90
+CROP_MARGIN = 0.02
+
+# A cropped receipt at least this many times taller than wide is read in
+# overlapping tiles: downscaled whole, its text would be too small. Each
+# tile is TILE_ASPECT times taller than wide and shares TILE_OVERLAP of its
+# height with the next, so a line cut by one tile edge is whole in the other.
+TILE_MIN_ASPECT = float(os.environ.get('INFERENCE_TILE_MIN_ASPECT', 2.5))
+TILE_ASPECT = 1.4
+TILE_OVERLAP = 0.15
+MAX_TILES = int(os.environ.get('INFERENCE_MAX_TILES', 6))
+
+# Copies for viewing receipts, by variant name: the long edge in pixels and
+# the format. List views want the thumbnail, the details view the medium;
+# the WebP ones are about a third smaller where the browser takes them.
+VIEW_VARIANTS = {
+    'thumbnail': (int(os.environ.get('THUMBNAIL_LONG_EDGE', 320)), 'JPEG'),
+    'medium': (int(os.environ.get('MEDIUM_LONG_EDGE', 1280)), 'JPEG'),
+    'thumbnail_webp': (int(os.environ.get('THUMBNAIL_LONG_EDGE', 320)), 'WEBP'),
+    'medium_webp': (int(os.environ.get('MEDIUM_LONG_EDGE', 1280)), 'WEBP'),
+}
+VIEW_QUALITY = {'JPEG': 80, 'WEBP': 75}
+
+MEDIA_TYPES = {
+    'JPEG': 'image/jpeg',
+    'PNG': 'image/png',
+    'GIF': 'image/gif',
+    'WEBP': 'image/webp',
+}
+EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'image/heic': '.heic',
+}
+
+
+def detect_media_type(image_bytes):
+    """Detect the image format from its magic bytes rather than trusting the file name."""
+    header = image_bytes[:16]
+    if header.startswith(b'\xff\xd8\xff'):
+        return 'image/jpeg'
+    if header.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'image/png'
+    if header[:6] in (b'GIF87a', b'GIF89a'):
+        return 'image/gif'
+    if header[:4] == b'RIFF' and header[8:12] == b'WEBP':
+        return 'image/webp'
+    if header[4:8] == b'ftyp' and header[8:12] in (b'heic', b'heix', b'mif1', b'msf1'):
+        return 'image/heic'
+    return 'application/octet-stream'
+
+
+def derivative_key(s3_key, variant):
+    """Deterministic S3 key for a derived copy of an uploaded receipt."""
+    return f"derivatives/{variant}/{s3_key}"
+
+
+def _otsu_threshold(gray):
+    histogram = gray.histogram()
+    total = sum(histogram)
+    weighted_total = sum(i * count for i, count in enumerate(histogram))
+    background_count, background_sum = 0, 0
+    best_threshold, best_variance = 127, -1.0
+    for threshold, count in enumerate(histogram):
+        background_count += count
+        if background_count == 0:
+            continue
+        foreground_count = total - background_count
+        if foreground_count == 0:
+            break
+        background_sum += threshold * count
+        mean_background = background_sum / background_count
+        mean_foreground = (weighted_total - background_sum) / foreground_count
+        variance = background_count * foreground_count * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = threshold, variance
+    return best_threshold
+
+
+def find_document_box(gray):
+    """
+    Find the bounding box of the bright receipt paper against a darker
+    background, or None if no clear document edge is found.
+    """
+    probe = gray.copy()
+    probe.thumbnail((256, 256))
+    threshold = _otsu_threshold(probe)
+    # Erode the mask so specks of glare don't stretch the box.
+    mask = probe.point(lambda p: 255 if p > threshold else 0).filter(ImageFilter.MinFilter(5))
+    box = mask.getbbox()
+    if not box:
+        return None
+
+    area = (box[2] - box[0]) * (box[3] - box[1]) / float(probe.width * probe.height)
+    if not MIN_CROP_AREA <= area <= MAX_CROP_AREA:
+        return None
+
+    scale_x = gray.width / float(probe.width)
+    scale_y = gray.height / float(probe.height)
+    margin_x = int(gray.width * CROP_MARGIN)
+    margin_y = int(gray.height * CROP_MARGIN)
+    return (
+        max(0, int(box[0] * scale_x) - margin_x),
+        max(0, int(box[1] * scale_y) - margin_y),
+        min(gray.width, int(box[2] * scale_x) + margin_x),
+        min(gray.height, int(box[3] * scale_y) + margin_y),
+    )
+
+
+def _encode_jpeg(image, max_bytes):
+    data = b''
+    for quality in JPEG_QUALITIES:
+        buffer = io.BytesIO()
+        image.save(buffer, format='JPEG', quality=quality, optimize=True)
+        data = buffer.getvalue()
+        if len(data) <= max_bytes:
+            break
+    return data
+
+
+def _target_scale(size, max_long_edge, max_pixels):
+    width, height = size
+    return min(1.0, max_long_edge / float(max(width, height)), (max_pixels / float(width * height)) ** 0.5)
+
+
+def is_tall(image_bytes, max_long_edge=MAX_LONG_EDGE, max_pixels=MAX_PIXELS):
+    """
+    Whether an inference image is a tall receipt that was shrunk to fit,
+    in which case the original is worth tiling. Reads only the header.
+    """
+    if Image is None:
+        return False
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            width, height = image.size
+    except Exception:
+        return False
+    at_limit = max(width, height) >= 0.95 * max_long_edge or width * height >= 0.95 * max_pixels
+    return at_limit and height >= TILE_MIN_ASPECT * width
+
+
+def _tile_boxes(width, height, max_tiles):
+    """Overlapping full-width boxes covering the image from top to bottom."""
+    tile_height = int(width * TILE_ASPECT)
+    overlap = int(tile_height * TILE_OVERLAP)
+    count = math.ceil((height - overlap) / float(tile_height - overlap))
+    if count > max_tiles:
+        # Fewer, taller tiles: solve height = n * tile - (n - 1) * overlap.
+        count = max_tiles
+        tile_height = math.ceil(height / (count - (count - 1) * TILE_OVERLAP))
+    step = (height - tile_height) / float(count - 1) if count > 1 else 0
+    return [(0, int(round(i * step)), width, min(height, int(round(i * step)) + tile_height))
+            for i in range(count)]
+
+
+def prepare_inference_tiles(image_bytes, max_long_edge=MAX_LONG_EDGE, max_bytes=MAX_INFERENCE_BYTES,
+                            max_pixels=MAX_PIXELS, max_tiles=MAX_TILES):
+    """
+    Cut a receipt too tall to read downscaled whole into overlapping tiles,
+    top to bottom, each prepared like ``prepare_inference_image``.
+
+    Returns:
+        A list of (image_bytes, media_type) tuples; empty when the receipt is
+        not tall, tiles would not be sharper than the whole image, or it
+        can't be read.
+    """
+    if Image is None:
+        return []
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # Decode no smaller than twice the width a tile is sent at, which
+            # leaves room for the crop.
+            tile_width = min(max_long_edge / TILE_ASPECT, (max_pixels / TILE_ASPECT) ** 0.5)
+            scale = min(1.0, 2 * tile_width / float(min(image.size)))
+            if scale < 1:
+                image.draft('L', (int(image.width * scale) + 1, int(image.height * scale) + 1))
+            image = ImageOps.exif_transpose(image).convert('L')
+        box = find_document_box(image)
+        if box:
+            image = image.crop(box)
+        if image.height < TILE_MIN_ASPECT * image.width:
+            return []
+
+        boxes = _tile_boxes(image.width, image.height, max_tiles)
+        whole_scale = _target_scale(image.size, max_long_edge, max_pixels)
+        tile_scale = _target_scale((boxes[0][2], boxes[0][3] - boxes[0][1]), max_long_edge, max_pixels)
+        if tile_scale < 1.25 * whole_scale:
+            return []
+
+        tiles = []
+        for box in boxes:
+            tile = image.crop(box)
+            if tile_scale < 1:
+                tile.thumbnail((int(tile.width * tile_scale), int(tile.height * tile_scale)),
+                               Image.LANCZOS, reducing_gap=3.0)
+            tiles.append((_encode_jpeg(tile, max_bytes), 'image/jpeg'))
+        return tiles
+    except Exception as e:
+        print(f"Error tiling image: {e}")
+        return []
+
+
+def prepare_inference_image(image_bytes, max_long_edge=MAX_LONG_EDGE, max_bytes=MAX_INFERENCE_BYTES,
+                            grayscale=True, crop=True, max_pixels=MAX_PIXELS):
+    """
+    Shrink a receipt photo into the image sent to the model.
+
+    The pipeline fixes EXIF orientation, converts to grayscale, crops to the
+    document, downscales to ``max_long_edge`` and ``max_pixels`` and
+    re-encodes as JPEG under ``max_bytes``. Without Pillow, or for formats
+    Pillow can't read, the original bytes are returned with their detected
+    media type.
+
+    Returns:
+        An (image_bytes, media_type) tuple.
+    """
+    media_type = detect_media_type(image_bytes)
+    if Image is None:
+        return image_bytes, media_type
+
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # Let the JPEG decoder downscale by DCT scaling while decoding,
+            # which is far cheaper than decoding full size and resizing.
+            scale = _target_scale(image.size, max_long_edge, max_pixels)
+            if scale < 1:
+                image.draft('L' if grayscale else 'RGB',
+                            (int(image.width * scale) + 1, int(image.height * scale) + 1))
+            image = ImageOps.exif_transpose(image)
+            image = image.convert('L' if grayscale else 'RGB')
+
+            if crop and grayscale:
+                box = find_document_box(image)
+                if box:
+                    image = image.crop(box)
+
+            scale = _target_scale(image.size, max_long_edge, max_pixels)
+            if scale < 1:
+                # reducing_gap does a cheap integer reduce before the LANCZOS pass.
+                image.thumbnail((int(image.width * scale), int(image.height * scale)),
+                                Image.LANCZOS, reducing_gap=3.0)
+            data = _encode_jpeg(image, max_bytes)
+    except Exception as e:
+        print(f"Error preprocessing image: {e}")
+        return image_bytes, media_type
+
+    # Never hand back something bigger than what we started with.
+    if len(data) >= len(image_bytes) and media_type in MEDIA_TYPES.values():
+        return image_bytes, media_type
+    return data, 'image/jpeg'
+
+
+def prepare_view_images(image_bytes, variants=VIEW_VARIANTS):
+    """
+    Downscaled color copies of a receipt for viewing, decoded once and
+    resized largest first. Variants never upscale, and one that comes out
+    bigger than a JPEG or WebP original of the same format is the original.
+    WebP ones are skipped when Pillow was built without WebP, and without
+    Pillow (or for formats it can't read) there are none.
+
+    Returns:
+        A dict of variant name to (image_bytes, media_type).
+    """
+    if Image is None or not variants:
+        return {}
+    webp = features.check('webp')
+    sizes = sorted({edge for edge, image_format in variants.values()}, reverse=True)
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            scale = _target_scale(image.size, sizes[0], image.width * image.height)
+            if scale < 1:
+                image.draft('RGB', (int(image.width * scale) + 1, int(image.height * scale) + 1))
+            image = ImageOps.exif_transpose(image).convert('RGB')
+
+        resized = {}
+        for edge in sizes:
+            scale = _target_scale(image.size, edge, image.width * image.height)
+            if scale < 1:
+                image = image.copy()
+                image.thumbnail((int(image.width * scale), int(image.height * scale)),
+                                Image.LANCZOS, reducing_gap=3.0)
+            resized[edge] = image
+
+        views = {}
+        for name, (edge, image_format) in variants.items():
+            if image_format == 'WEBP' and not webp:
+                continue
+            buffer = io.BytesIO()
+            resized[edge].save(buffer, format=image_format, quality=VIEW_QUALITY[image_format],
+                               **({'optimize': True} if image_format == 'JPEG' else {'method': 4}))
+            data, media_type = buffer.getvalue(), MEDIA_TYPES[image_format]
+            if len(data) >= len(image_bytes) and detect_media_type(image_bytes) == media_type:
+                data = image_bytes
+            views[name] = (data, media_type)
+        return views
+    except Exception as e:
+        print(f"Error preparing view images: {e}")
+        return {}
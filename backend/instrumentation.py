@@ -0,0 +1,399 @@
+"""
+Per-invocation tracing and CloudWatch metrics for the Lambda handlers.
+
+Wrap a handler with ``@instrumentation.traced`` and time the interesting
+parts of it with ``with instrumentation.phase('base64.encode'):``. AWS calls
+made through ``aws_clients`` are timed on their own, as
+``aws.<service>.<operation>``. At the end of each invocation one line of
+CloudWatch Embedded Metric Format JSON is printed: total duration, cold
+start, bytes in and out, every phase's durations and any counters (Bedrock
+tokens, for one). CloudWatch turns those into metrics with percentiles, and
+every ``METRICS_SUMMARY_EVERY`` invocations the line also carries the
+container's own p50/p95/p99 per phase.
+
+With ``TRACE_EXPORT_PATH`` set, each invocation is also appended to that
+file as a JSON line with its individual spans, for offline profiling:
+
+    python instrumentation.py traces.jsonl
+"""
+import contextvars
+import functools
+import json
+import os
+import threading
+import time
+from collections import deque
+
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() != 'false'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'SmartReceipts')
+METRICS_SUMMARY_EVERY = int(os.environ.get('METRICS_SUMMARY_EVERY', 50))
+TRACE_EXPORT_PATH = os.environ.get('TRACE_EXPORT_PATH')
+
+# Spans kept per exported trace, and durations kept per phase for the
+# container's percentile summary.
+MAX_SPANS = 1000
+RESERVOIR_SIZE = 1024
+
+_current = contextvars.ContextVar('trace', default=None)
+_active = []
+_lock = threading.Lock()
+_cold_start = True
+_invocations = 0
+_reservoirs = {}
+
+
+class Trace:
+    """The phases and counters of one handler invocation."""
+
+    def __init__(self, function_name, cold_start, keep_spans=False):
+        self.function_name = function_name
+        self.cold_start = cold_start
+        self.timestamp = time.time()
+        self.started = time.perf_counter()
+        self.duration = None
+        self.phases = {}
+        self.counters = {}
+        self.spans = [] if keep_spans else None
+        self.status_code = None
+        self._lock = threading.Lock()
+
+    def add_phase(self, name, started, seconds):
+        with self._lock:
+            self.phases.setdefault(name, []).append(seconds)
+            if self.spans is not None and len(self.spans) < MAX_SPANS:
+                self.spans.append((name, started - self.started, seconds, threading.get_ident()))
+
+    def count(self, name, value=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def to_dict(self):
+        """The trace as exported: times in milliseconds from the invocation start."""
+        data = {
+            'function': self.function_name,
+            'timestamp': self.timestamp,
+            'cold_start': self.cold_start,
+            'duration_ms': _ms(self.duration),
+            'status_code': self.status_code,
+            'phases': {name: [_ms(seconds) for seconds in durations] for name, durations in self.phases.items()},
+            'counters': dict(self.counters),
+        }
+        if self.spans is not None:
+            data['spans'] = [{'name': name, 'start_ms': _ms(offset), 'duration_ms': _ms(seconds), 'thread': thread}
+                             for name, offset, seconds, thread in self.spans]
+        return data
+
+
+def _ms(seconds):
+    return round(seconds * 1000, 3) if seconds is not None else None
+
+
+def enabled():
+    return METRICS_ENABLED or TRACE_EXPORT_PATH is not None
+
+
+def current_trace():
+    """
+    The trace of the running invocation, or None outside one.
+
+    Threads started by a handler (the batch and worker pools) don't inherit
+    its context; Lambda runs one invocation per container at a time, so
+    when exactly one is active their phases are counted against it.
+    """
+    trace = _current.get()
+    if trace is None and len(_active) == 1:
+        try:
+            trace = _active[0]
+        except IndexError:
+            pass
+    return trace
+
+
+class phase:
+    """
+    ``with phase('name'):`` times the body as a phase of the running
+    invocation, if any. A class rather than a generator-based context
+    manager, which costs several times as much per use.
+    """
+
+    __slots__ = ('name', '_trace', '_started')
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self._trace = current_trace()
+        if self._trace is not None:
+            self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._trace is not None:
+            self._trace.add_phase(self.name, self._started, time.perf_counter() - self._started)
+        return False
+
+
+def record_phase(name, started, seconds):
+    """Record a phase timed by the caller (``started`` is a perf_counter value)."""
+    trace = current_trace()
+    if trace is not None:
+        trace.add_phase(name, started, seconds)
+
+
+def count(name, value=1):
+    """Add ``value`` to counter ``name`` of the running invocation, if any."""
+    trace = current_trace()
+    if trace is not None:
+        trace.count(name, value)
+
+
+def record_bedrock_usage(usage):
+    """Count the token usage reported in a Bedrock (Anthropic) response."""
+    if not usage:
+        return
+    if usage.get('input_tokens'):
+        count('bedrock.input_tokens', usage['input_tokens'])
+    if usage.get('output_tokens'):
+        count('bedrock.output_tokens', usage['output_tokens'])
+
+
+def _payload_bytes(payload):
+    # Only the top-level strings (a base64 image, a JSON body): cheap, and
+    # they are where the size is.
+    if isinstance(payload, dict):
+        return sum(len(value) for value in payload.values() if isinstance(value, (str, bytes)))
+    if isinstance(payload, (str, bytes)):
+        return len(payload)
+    return 0
+
+
+def traced(handler):
+    """
+    Decorator for a ``lambda_handler``: trace each invocation and emit its
+    metrics. Passes straight through when metrics and export are both off.
+    """
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global _cold_start
+        if not enabled():
+            return handler(event, context)
+        name = getattr(context, 'function_name', None) or handler.__module__
+        trace = Trace(name, _cold_start, keep_spans=TRACE_EXPORT_PATH is not None)
+        _cold_start = False
+        trace.count('bytes_in', _payload_bytes(event))
+        token = _current.set(trace)
+        with _lock:
+            _active.append(trace)
+        response = None
+        try:
+            response = handler(event, context)
+            return response
+        except Exception:
+            trace.count('errors')
+            raise
+        finally:
+            trace.duration = time.perf_counter() - trace.started
+            _current.reset(token)
+            with _lock:
+                _active.remove(trace)
+            if isinstance(response, dict):
+                trace.status_code = response.get('statusCode')
+                trace.count('bytes_out', _payload_bytes(response.get('body')))
+            finish(trace)
+    return wrapper
+
+
+def _unit(name):
+    if name.endswith('bytes_in') or name.endswith('bytes_out') or name.endswith('_bytes'):
+        return 'Bytes'
+    return 'Count'
+
+
+def to_emf(trace, summary=None):
+    """The trace as one CloudWatch Embedded Metric Format record."""
+    metrics = [{'Name': 'Duration', 'Unit': 'Milliseconds'}, {'Name': 'ColdStart', 'Unit': 'Count'}]
+    record = {
+        'FunctionName': trace.function_name,
+        'Duration': _ms(trace.duration),
+        'ColdStart': int(trace.cold_start),
+    }
+    for name, durations in trace.phases.items():
+        key = f'phase.{name}'
+        metrics.append({'Name': key, 'Unit': 'Milliseconds'})
+        # EMF takes up to 100 values per metric; CloudWatch aggregates them.
+        record[key] = [_ms(seconds) for seconds in durations[:100]]
+    for name, value in trace.counters.items():
+        metrics.append({'Name': name, 'Unit': _unit(name)})
+        record[name] = value
+    if trace.status_code is not None:
+        record['StatusCode'] = trace.status_code
+    if summary is not None:
+        record['Summary'] = summary
+    record['_aws'] = {
+        'Timestamp': int(trace.timestamp * 1000),
+        'CloudWatchMetrics': [{
+            'Namespace': METRICS_NAMESPACE,
+            'Dimensions': [['FunctionName']],
+            'Metrics': metrics,
+        }],
+    }
+    return record
+
+
+def percentiles(samples):
+    """count, p50, p95 and p99 (nearest rank) of durations in seconds, in ms."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0}
+
+    def rank(p):
+        return _ms(ordered[min(len(ordered) - 1, max(0, int(round(p / 100 * len(ordered))) - 1))])
+
+    return {'count': len(ordered), 'p50_ms': rank(50), 'p95_ms': rank(95), 'p99_ms': rank(99)}
+
+
+def summary(function_name=None):
+    """This container's recent p50/p95/p99 per (function, phase)."""
+    with _lock:
+        reservoirs = {key: list(samples) for key, samples in _reservoirs.items()
+                      if function_name is None or key[0] == function_name}
+    return {f'{function}:{name}': percentiles(samples) for (function, name), samples in reservoirs.items()}
+
+
+def finish(trace):
+    """Fold the trace into the rolling summary, then emit and export it."""
+    global _invocations
+    with _lock:
+        _invocations += 1
+        report_summary = METRICS_SUMMARY_EVERY > 0 and _invocations % METRICS_SUMMARY_EVERY == 0
+        for name, durations in [('Duration', [trace.duration])] + list(trace.phases.items()):
+            reservoir = _reservoirs.get((trace.function_name, name))
+            if reservoir is None:
+                reservoir = _reservoirs[(trace.function_name, name)] = deque(maxlen=RESERVOIR_SIZE)
+            reservoir.extend(durations)
+    try:
+        if METRICS_ENABLED:
+            print(json.dumps(to_emf(trace, summary(trace.function_name) if report_summary else None)))
+        if TRACE_EXPORT_PATH is not None:
+            export(trace, TRACE_EXPORT_PATH)
+    except Exception as e:
+        # Metrics are never worth failing a request over.
+        print(f"Error emitting metrics: {e}")
+
+
+def export(trace, path):
+    """Append the trace to a JSON lines file."""
+    line = json.dumps(trace.to_dict()) + '\n'
+    with _lock:
+        with open(path, 'a') as f:
+            f.write(line)
+
+
+def load_traces(path):
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def profile(traces):
+    """
+    Rows of where the time went across exported traces: per function and
+    phase, the calls, total and percentiles, and the share of the handler's
+    total time. Phases run on worker threads can overlap, so shares may add
+    up to more than 100%.
+    """
+    totals, phases = {}, {}
+    for trace in traces:
+        function = trace['function']
+        totals[function] = totals.get(function, 0) + (trace['duration_ms'] or 0)
+        phases.setdefault((function, 'handler'), []).append((trace['duration_ms'] or 0) / 1000)
+        for name, durations in trace['phases'].items():
+            phases.setdefault((function, name), []).extend(ms / 1000 for ms in durations)
+    rows = []
+    for (function, name), samples in phases.items():
+        total_ms = sum(samples) * 1000
+        rows.append(dict({'function': function, 'phase': name, 'total_ms': round(total_ms, 1),
+                          'share': f'{total_ms / totals[function]:.0%}' if totals[function] else '-'},
+                         **percentiles(samples)))
+    rows.sort(key=lambda row: (row['function'], row['phase'] != 'handler', -row['total_ms']))
+    return rows
+
+
+class _TimedProxy:
+    """
+    Times the public methods of a stand-in client or resource the way the
+    botocore hooks time real ones. Tables returned by ``Table()`` are
+    wrapped too.
+    """
+
+    def __init__(self, target, service_name):
+        self._target = target
+        self._service_name = service_name
+
+    def __getattr__(self, name):
+        attribute = getattr(self._target, name)
+        if name.startswith('_') or not callable(attribute):
+            return attribute
+        if name == 'Table':
+            return lambda *args, **kwargs: _TimedProxy(attribute(*args, **kwargs), self._service_name)
+        phase_name = f'aws.{self._service_name}.{name}'
+
+        def call(*args, **kwargs):
+            with phase(phase_name):
+                return attribute(*args, **kwargs)
+        return call
+
+
+def instrument_stand_in(target, service_name):
+    return _TimedProxy(target, service_name) if enabled() else target
+
+
+def _before_call(context, **kwargs):
+    context['instrumentation_started'] = time.perf_counter()
+
+
+def _after_call(model, context, http_response=None, **kwargs):
+    started = context.get('instrumentation_started')
+    if started is None:
+        return
+    trace = current_trace()
+    if trace is None:
+        return
+    service = model.service_model.service_name
+    trace.add_phase(f'aws.{service}.{_operation_name(model.name)}', started, time.perf_counter() - started)
+    length = http_response.headers.get('content-length') if http_response is not None else None
+    if length:
+        trace.count('aws_response_bytes', int(length))
+
+
+def _after_call_error(context, **kwargs):
+    trace = current_trace()
+    if trace is not None and context.get('instrumentation_started') is not None:
+        trace.count('aws_errors')
+
+
+@functools.lru_cache(maxsize=None)
+def _operation_name(name):
+    from botocore import xform_name
+    return xform_name(name)
+
+
+def instrument_botocore(client):
+    """Time every call made with a botocore client (and its retries)."""
+    events = client.meta.events
+    events.register('before-call', _before_call, unique_id='instrumentation-before-call')
+    events.register('after-call', _after_call, unique_id='instrumentation-after-call')
+    events.register('after-call-error', _after_call_error, unique_id='instrumentation-after-call-error')
+    return client
+
+
+if __name__ == '__main__':
+    import sys
+
+    if len(sys.argv) != 2:
+        sys.exit('usage: python instrumentation.py TRACES.jsonl')
+    rows = profile(load_traces(sys.argv[1]))
+    columns = ['function', 'phase', 'count', 'total_ms', 'share', 'p50_ms', 'p95_ms', 'p99_ms']
+    widths = {column: max(len(column), *(len(str(row.get(column, ''))) for row in rows)) for column in columns}
+    print('  '.join(column.ljust(widths[column]) for column in columns))
+    for row in rows:
+        print('  '.join(str(row.get(column, '')).ljust(widths[column]) for column in columns))
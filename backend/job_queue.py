@@ -0,0 +1,216 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from collections import namedtuple
+
+import aws_clients
+
+# Lower sorts first: interactive uploads jump ahead of background work.
+PRIORITIES = {'high': 0, 'normal': 1}
+DEFAULT_PRIORITY = 'normal'
+# How long a received message stays hidden before another worker may take it.
+VISIBILITY_TIMEOUT_SECONDS = int(os.environ.get('JOB_VISIBILITY_TIMEOUT_SECONDS', 180))
+
+# ``receipt`` identifies this delivery (an SQS receipt handle); ``receive_count``
+# is how many times the message has been delivered, including this one.
+Message = namedtuple('Message', ['job_id', 'priority', 'receipt', 'receive_count', 'source'])
+
+
+def _check_priority(priority):
+    if priority not in PRIORITIES:
+        raise ValueError(f"priority must be one of {', '.join(PRIORITIES)}.")
+
+
+class SQSJobQueue:
+    """
+    One SQS queue per priority, drained highest priority first.
+
+    Failed messages can be moved to ``dead_letter_url``; the queues should
+    also have a redrive policy to it as a backstop for crashed workers.
+    """
+
+    def __init__(self, queue_urls, dead_letter_url=None):
+        self.queue_urls = {priority: url for priority, url in queue_urls.items() if url}
+        if DEFAULT_PRIORITY not in self.queue_urls:
+            raise ValueError('A queue URL for the normal priority is required.')
+        self.dead_letter_url = dead_letter_url
+
+    def _url(self, priority):
+        # Priorities without their own queue share the normal one.
+        return self.queue_urls.get(priority, self.queue_urls[DEFAULT_PRIORITY])
+
+    def send(self, job_id, priority=DEFAULT_PRIORITY, delay_seconds=0):
+        _check_priority(priority)
+        aws_clients.client('sqs').send_message(
+            QueueUrl=self._url(priority),
+            MessageBody=json.dumps({'jobId': job_id, 'priority': priority}),
+            DelaySeconds=min(900, int(delay_seconds)),
+        )
+
+    def receive(self, max_messages=1, wait_seconds=0):
+        sqs = aws_clients.client('sqs')
+        for priority in sorted(self.queue_urls, key=PRIORITIES.get):
+            response = sqs.receive_message(
+                QueueUrl=self.queue_urls[priority],
+                MaxNumberOfMessages=min(10, max_messages),
+                # Only wait on the last queue, so a quiet high-priority queue
+                # does not hold up the normal one.
+                WaitTimeSeconds=wait_seconds if priority == DEFAULT_PRIORITY else 0,
+                VisibilityTimeout=VISIBILITY_TIMEOUT_SECONDS,
+                AttributeNames=['ApproximateReceiveCount'],
+            )
+            messages = response.get('Messages', [])
+            if messages:
+                return [self.from_sqs(m['Body'], m['ReceiptHandle'],
+                                      m.get('Attributes', {}).get('ApproximateReceiveCount', 1),
+                                      self.queue_urls[priority])
+                        for m in messages]
+        return []
+
+    @staticmethod
+    def from_sqs(body, receipt, receive_count, source):
+        """Build a Message from an SQS message or a Lambda SQS event record."""
+        payload = json.loads(body)
+        return Message(payload['jobId'], payload.get('priority', DEFAULT_PRIORITY), receipt,
+                       int(receive_count), source)
+
+    def delete(self, message):
+        aws_clients.client('sqs').delete_message(QueueUrl=message.source, ReceiptHandle=message.receipt)
+
+    def release(self, message, delay_seconds=0):
+        """Make a message visible again after ``delay_seconds`` for another attempt."""
+        aws_clients.client('sqs').change_message_visibility(
+            QueueUrl=message.source, ReceiptHandle=message.receipt,
+            VisibilityTimeout=min(43200, int(delay_seconds)))
+
+    def dead_letter(self, message, reason):
+        if self.dead_letter_url:
+            aws_clients.client('sqs').send_message(
+                QueueUrl=self.dead_letter_url,
+                MessageBody=json.dumps({'jobId': message.job_id, 'priority': message.priority,
+                                        'reason': reason}))
+        self.delete(message)
+
+
+class SQLiteJobQueue:
+    """
+    The same queue on SQLite, for running the worker locally and in the
+    benchmarks. ``path=':memory:'`` keeps it in memory for one process.
+
+    Messages are ordered by priority, then age; received messages are hidden
+    for the visibility timeout, and dead letters are kept in their own table.
+    """
+
+    def __init__(self, path=':memory:', visibility_timeout=VISIBILITY_TIMEOUT_SECONDS, clock=time.time):
+        self.visibility_timeout = visibility_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.executescript('''
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                job_id TEXT NOT NULL,
+                priority TEXT NOT NULL,
+                rank INTEGER NOT NULL,
+                visible_at REAL NOT NULL,
+                receipt TEXT,
+                receive_count INTEGER NOT NULL DEFAULT 0
+            );
+            CREATE INDEX IF NOT EXISTS messages_ready ON messages (rank, visible_at, id);
+            CREATE TABLE IF NOT EXISTS dead_letters (
+                id INTEGER PRIMARY KEY,
+                job_id TEXT NOT NULL,
+                priority TEXT NOT NULL,
+                receive_count INTEGER NOT NULL,
+                reason TEXT,
+                dead_at REAL NOT NULL
+            );
+        ''')
+
+    def send(self, job_id, priority=DEFAULT_PRIORITY, delay_seconds=0):
+        _check_priority(priority)
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO messages (job_id, priority, rank, visible_at) VALUES (?, ?, ?, ?)',
+                (job_id, priority, PRIORITIES[priority], self._clock() + delay_seconds))
+
+    def _receive_now(self, max_messages):
+        now = self._clock()
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                rows = self._db.execute(
+                    'SELECT id, job_id, priority, receive_count FROM messages WHERE visible_at <= ? '
+                    'ORDER BY rank, id LIMIT ?', (now, max_messages)).fetchall()
+                messages = []
+                for row_id, job_id, priority, receive_count in rows:
+                    receipt = f'{row_id}:{uuid.uuid4().hex}'
+                    self._db.execute(
+                        'UPDATE messages SET visible_at = ?, receipt = ?, receive_count = ? WHERE id = ?',
+                        (now + self.visibility_timeout, receipt, receive_count + 1, row_id))
+                    messages.append(Message(job_id, priority, receipt, receive_count + 1, 'sqlite'))
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return messages
+
+    def receive(self, max_messages=1, wait_seconds=0):
+        deadline = time.monotonic() + wait_seconds
+        while True:
+            messages = self._receive_now(max_messages)
+            if messages or time.monotonic() >= deadline:
+                return messages
+            time.sleep(0.05)
+
+    def _row_id(self, message):
+        return int(message.receipt.split(':', 1)[0])
+
+    def delete(self, message):
+        # A stale receipt (the message was redelivered since) deletes nothing, as in SQS.
+        with self._lock:
+            self._db.execute('DELETE FROM messages WHERE id = ? AND receipt = ?',
+                             (self._row_id(message), message.receipt))
+
+    def release(self, message, delay_seconds=0):
+        with self._lock:
+            self._db.execute('UPDATE messages SET visible_at = ? WHERE id = ? AND receipt = ?',
+                             (self._clock() + delay_seconds, self._row_id(message), message.receipt))
+
+    def dead_letter(self, message, reason):
+        with self._lock:
+            self._db.execute(
+                'INSERT INTO dead_letters (id, job_id, priority, receive_count, reason, dead_at) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                (self._row_id(message), message.job_id, message.priority, message.receive_count, reason,
+                 self._clock()))
+            self._db.execute('DELETE FROM messages WHERE id = ?', (self._row_id(message),))
+
+    def dead_letters(self):
+        with self._lock:
+            rows = self._db.execute(
+                'SELECT job_id, priority, receive_count, reason FROM dead_letters ORDER BY id').fetchall()
+        return [{'jobId': job_id, 'priority': priority, 'receiveCount': count, 'reason': reason}
+                for job_id, priority, count, reason in rows]
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM messages').fetchone()[0]
+
+
+def from_environment():
+    """
+    The queue configured for this deployment: SQS when EXTRACTION_QUEUE_URL
+    is set, SQLite when JOB_QUEUE_SQLITE_PATH is (local runs), otherwise None.
+    """
+    if os.environ.get('EXTRACTION_QUEUE_URL'):
+        return SQSJobQueue(
+            {'normal': os.environ['EXTRACTION_QUEUE_URL'],
+             'high': os.environ.get('EXTRACTION_HIGH_PRIORITY_QUEUE_URL')},
+            dead_letter_url=os.environ.get('EXTRACTION_DEAD_LETTER_QUEUE_URL'))
+    if os.environ.get('JOB_QUEUE_SQLITE_PATH'):
+        return SQLiteJobQueue(os.environ['JOB_QUEUE_SQLITE_PATH'])
+    return None
@@ -0,0 +1,307 @@
+import io
+import os
+import re
+from datetime import date as Date
+
+import expense_model
+
+try:
+    import pytesseract
+    from PIL import Image
+except ImportError:  # Optional; without OCR every receipt goes to the model.
+    pytesseract = None
+
+NOT_APPLICABLE = expense_model.NOT_APPLICABLE
+Category = expense_model.Category
+
+# Receipts whose weakest required field scores below this go to Bedrock.
+MIN_CONFIDENCE = float(os.environ.get('LOCAL_EXTRACTION_MIN_CONFIDENCE', 0.8))
+# Fields that must be read locally; the description is filled in from the category.
+REQUIRED_FIELDS = ('vendor', 'amount', 'category', 'date')
+OCR_TIMEOUT_SECONDS = int(os.environ.get('LOCAL_OCR_TIMEOUT_SECONDS', 10))
+
+# Chains recognised anywhere on the receipt (often only in the logo line or
+# item names), with the category their purchases fall under.
+KNOWN_VENDORS = (
+    (r'wal[\s-]?mart', 'Walmart', Category.GROCERIES),
+    (r'whole\s*foods', 'Whole Foods Market', Category.GROCERIES),
+    (r'publix', 'Publix', Category.GROCERIES),
+    (r'trader\s*joe', "Trader Joe's", Category.GROCERIES),
+    (r'kroger', 'Kroger', Category.GROCERIES),
+    (r'safeway', 'Safeway', Category.GROCERIES),
+    (r'aldi\b', 'Aldi', Category.GROCERIES),
+    (r'costco', 'Costco', Category.GROCERIES),
+    (r'target', 'Target', Category.SHOPPING),
+    (r'best\s*buy', 'Best Buy', Category.SHOPPING),
+    (r'home\s*depot', 'The Home Depot', Category.SHOPPING),
+    (r'ikea', 'IKEA', Category.SHOPPING),
+    (r'amazon', 'Amazon', Category.SHOPPING),
+    (r'cvs', 'CVS Pharmacy', Category.HEALTHCARE),
+    (r'walgreens', 'Walgreens', Category.HEALTHCARE),
+    (r'starbucks', 'Starbucks', Category.FOOD_AND_DINING),
+    (r'mcdonald', "McDonald's", Category.FOOD_AND_DINING),
+    (r'chipotle', 'Chipotle', Category.FOOD_AND_DINING),
+    (r'hamburger\s*mary', "Hamburger Mary's", Category.FOOD_AND_DINING),
+    (r'shell\b', 'Shell', Category.TRANSPORTATION),
+    (r'chevron', 'Chevron', Category.TRANSPORTATION),
+    (r'exxon', 'Exxon', Category.TRANSPORTATION),
+    (r'pertamina', 'Pertamina', Category.TRANSPORTATION),
+    (r'\buber\b', 'Uber', Category.TRANSPORTATION),
+    (r'\blyft\b', 'Lyft', Category.TRANSPORTATION),
+    (r'comcast|xfinity', 'Comcast', Category.UTILITIES),
+)
+_KNOWN_VENDORS = [(re.compile(pattern, re.IGNORECASE), name, category)
+                  for pattern, name, category in KNOWN_VENDORS]
+
+# Words that give the category away when the vendor is not known.
+_CATEGORY_HINTS = (
+    (re.compile(r'\b(fuel|gasoline|unleaded|diesel|pump|liter|litre|gallons?)\b', re.IGNORECASE),
+     Category.TRANSPORTATION),
+    (re.compile(r'\b(gratuity|tip|server|table|tbl|guests?)\b', re.IGNORECASE), Category.FOOD_AND_DINING),
+    (re.compile(r'\b(pharmacy|rx|prescription)\b', re.IGNORECASE), Category.HEALTHCARE),
+)
+_DESCRIPTIONS = {
+    Category.GROCERIES: 'Groceries',
+    Category.FOOD_AND_DINING: 'Meal',
+    Category.TRANSPORTATION: 'Fuel and transport',
+    Category.SHOPPING: 'Shopping',
+    Category.HEALTHCARE: 'Pharmacy',
+    Category.UTILITIES: 'Utility bill',
+}
+
+# 46.30, 1,234.50 or 280,800 (whole-unit currencies); a bare integer is
+# too often a quantity or a store number to count.
+_MONEY = r'(\d{1,3}(?:,\d{3})+(?:\.\d{2})?|\d+\.\d{2})(?![\d.,]*\d)'
+# Highest confidence first; the amount is the first figure after the keyword.
+_TOTAL_KEYWORDS = (
+    (re.compile(r'\b(?:grand\s+total|total\s+due|amount\s+due|balance\s+due|total\s+harga)\b[^\d\n]*' + _MONEY,
+                re.IGNORECASE), 0.95),
+    (re.compile(r'(?<!sub)(?<!sub )\btotal\b[^\d\n]*' + _MONEY, re.IGNORECASE), 0.9),
+    (re.compile(r'\b(?:bal|balance)\b[^\d\n]*' + _MONEY, re.IGNORECASE), 0.85),
+)
+# Tendered amounts confirm a total when they match it.
+_TENDER = re.compile(r'\b(?:tend|tendered|payment|cash|credit|debit|visa|mastercard|amex)\b[^\d\n]*' + _MONEY,
+                     re.IGNORECASE)
+_ANY_MONEY = re.compile(_MONEY)
+
+_MONTHS = {name: number for number, name in enumerate(
+    ('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)}
+_NUMERIC_DATE = re.compile(r'(?<![\d/])(\d{1,2})[/.-](\d{1,2})[/.-](\d{4}|\d{2})(?![\d/])')
+_ISO_DATE = re.compile(r'(?<!\d)(\d{4})-(\d{2})-(\d{2})(?!\d)')
+_MONTH_NAME_DATE = re.compile(
+    r"\b(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s*(\d{1,2})(?:st|nd|rd|th)?(?:,\s*|\s*'|\s+)(\d{4}|\d{2})\b",
+    re.IGNORECASE)
+_DAY_MONTH_DATE = re.compile(
+    r'\b(\d{1,2})\s+(jan|feb|mar|apr|may|jun|jul|aug|sep|oct|nov|dec)[a-z]*\.?\s+(\d{4})\b', re.IGNORECASE)
+
+
+def ocr_available():
+    """True if pytesseract is installed and can find the tesseract binary."""
+    if pytesseract is None:
+        return False
+    try:
+        pytesseract.get_tesseract_version()
+    except Exception:
+        return False
+    return True
+
+
+def ocr_text(image_bytes):
+    """Receipt text from Tesseract, or None if OCR is unavailable or fails."""
+    if pytesseract is None:
+        return None
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            # Single uniform column of text, the usual receipt layout.
+            return pytesseract.image_to_string(image, config='--psm 4', timeout=OCR_TIMEOUT_SECONDS)
+    except Exception as e:
+        print(f"Local OCR failed: {e}")
+        return None
+
+
+def _year(text):
+    year = int(text)
+    return year + 2000 if year < 100 else year
+
+
+def _date_or_none(year, month, day, today):
+    try:
+        value = Date(year, month, day)
+    except ValueError:
+        return None
+    # Receipts are not dated in the future or decades back.
+    if value > today or value.year < today.year - 20:
+        return None
+    return value
+
+
+def find_amount(text):
+    """The receipt total as a (Decimal, confidence) tuple, or (None, 0.0)."""
+    best = None
+    for pattern, confidence in _TOTAL_KEYWORDS:
+        candidates = [expense_model.parse_amount(match.group(1)) for match in pattern.finditer(text)]
+        if not candidates:
+            continue
+        # The last total printed is the final one (after discounts and tax).
+        amount = candidates[-1]
+        if len(set(candidates)) > 1:
+            confidence -= 0.15
+        best = (amount, confidence)
+        break
+    if best is None:
+        amounts = [expense_model.parse_amount(match.group(1)) for match in _ANY_MONEY.finditer(text)]
+        if not amounts:
+            return None, 0.0
+        return max(amounts), 0.4
+    amount, confidence = best
+    tendered = {expense_model.parse_amount(match.group(1)) for match in _TENDER.finditer(text)}
+    if amount in tendered:
+        confidence = min(1.0, confidence + 0.05)
+    return amount, round(confidence, 2)
+
+
+def find_date(text, today=None):
+    """The purchase date as a (date, confidence) tuple, or (None, 0.0)."""
+    today = today or Date.today()
+    found = []
+    for match in _ISO_DATE.finditer(text):
+        found.append(_date_or_none(int(match.group(1)), int(match.group(2)), int(match.group(3)), today))
+    for match in _NUMERIC_DATE.finditer(text):
+        first, second, year = int(match.group(1)), int(match.group(2)), _year(match.group(3))
+        # Month first, as in expense_model.parse_date, unless that cannot be a month.
+        month, day = (second, first) if first > 12 else (first, second)
+        found.append(_date_or_none(year, month, day, today))
+    for match in _MONTH_NAME_DATE.finditer(text):
+        found.append(_date_or_none(_year(match.group(3)), _MONTHS[match.group(1).lower()],
+                                   int(match.group(2)), today))
+    for match in _DAY_MONTH_DATE.finditer(text):
+        found.append(_date_or_none(int(match.group(3)), _MONTHS[match.group(2).lower()],
+                                   int(match.group(1)), today))
+    counts = {}
+    for value in found:
+        if value is not None:
+            counts[value] = counts.get(value, 0) + 1
+    if not counts:
+        return None, 0.0
+    ranked = sorted(counts.items(), key=lambda item: -item[1])
+    value, count = ranked[0]
+    if len(ranked) == 1 or count > ranked[1][1]:
+        # Printed more than once (sale and approval lines) or the only date.
+        return value, 0.95 if count > 1 or len(ranked) == 1 else 0.85
+    return value, 0.5
+
+
+def find_vendor(text):
+    """A (vendor, category, confidence) tuple; category is None if unknown."""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    # Logos are often split over several lines ("WHOLE / FOODS / MARKET").
+    header, body = ' '.join(lines[:5]), ' '.join(lines[5:])
+    for pattern, name, category in _KNOWN_VENDORS:
+        if pattern.search(header):
+            return name, category, 0.95
+    for pattern, name, category in _KNOWN_VENDORS:
+        # Further down the name may be an item ("PUBLIX GREEN BEANS") rather than the store.
+        if pattern.search(body):
+            return name, category, 0.85
+    for line in lines[:5]:
+        if sum(char.isalpha() for char in line) >= 3:
+            return line.title(), None, 0.5
+    return None, None, 0.0
+
+
+def find_category(text):
+    for pattern, category in _CATEGORY_HINTS:
+        if pattern.search(text):
+            return category, 0.7
+    return None, 0.0
+
+
+class LocalExtraction:
+    """Fields read from OCR text, each with a confidence between 0 and 1."""
+
+    def __init__(self, fields, confidence):
+        self.fields = fields
+        self.confidence = confidence
+
+    @property
+    def score(self):
+        """The weakest required field's confidence; a missing field scores 0."""
+        return min(self.confidence.get(field, 0.0) for field in REQUIRED_FIELDS)
+
+    @property
+    def missing(self):
+        return [field for field in REQUIRED_FIELDS if self.fields.get(field, NOT_APPLICABLE) == NOT_APPLICABLE]
+
+
+def find_learned_vendor(text, vendor_lookup):
+    """Match the header lines against vendors users have confirmed (see vendor_index)."""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    for line in lines[:5]:
+        match = vendor_lookup(line)
+        if match is not None:
+            return match.vendor, expense_model.parse_category(match.category), 0.9
+    return None, None, 0.0
+
+
+def extract_fields(text, today=None, vendor_lookup=None):
+    """
+    Run the rules over OCR text. ``vendor_lookup`` maps a vendor name to a
+    learned VendorMatch (or None) for chains the built-in table lacks.
+    """
+    vendor, category, vendor_confidence = find_vendor(text)
+    if category is None and vendor_lookup is not None:
+        learned = find_learned_vendor(text, vendor_lookup)
+        if learned[0] is not None:
+            vendor, category, vendor_confidence = learned
+    category_confidence = vendor_confidence
+    if category is None:
+        category, category_confidence = find_category(text)
+    amount, amount_confidence = find_amount(text)
+    date, date_confidence = find_date(text, today)
+    fields = {
+        'vendor': vendor or NOT_APPLICABLE,
+        'amount': str(amount) if amount is not None else NOT_APPLICABLE,
+        'category': category.value if category is not None else NOT_APPLICABLE,
+        'description': _DESCRIPTIONS.get(category, NOT_APPLICABLE),
+        'date': date.isoformat() if date is not None else NOT_APPLICABLE,
+    }
+    confidence = {'vendor': vendor_confidence, 'amount': amount_confidence,
+                  'category': category_confidence, 'date': date_confidence}
+    return LocalExtraction(fields, confidence)
+
+
+class LocalExtractor:
+    """
+    The fast path in front of Bedrock: OCR plus rules, accepted only when
+    every required field is found with enough confidence.
+
+    ``stats`` counts routing decisions for the life of the container:
+    'local' (answered here), 'low_confidence' and 'missing_fields' (sent to
+    the model) and 'no_ocr' (OCR unavailable or produced no text).
+    """
+
+    def __init__(self, min_confidence=MIN_CONFIDENCE, ocr=ocr_text):
+        self.min_confidence = min_confidence
+        self._ocr = ocr
+        self.stats = {'local': 0, 'low_confidence': 0, 'missing_fields': 0, 'no_ocr': 0}
+
+    def extract(self, image_bytes, vendor_lookup=None):
+        """
+        Returns:
+            A (fields, route) tuple; fields is None unless route is 'local'.
+        """
+        text = self._ocr(image_bytes)
+        if not text or not text.strip():
+            route, result = 'no_ocr', None
+        else:
+            result = extract_fields(text, vendor_lookup=vendor_lookup)
+            if result.missing:
+                route = 'missing_fields'
+            elif result.score < self.min_confidence:
+                route = 'low_confidence'
+            else:
+                route = 'local'
+        self.stats[route] += 1
+        if result is not None:
+            print(f"Local extraction route={route} score={result.score:.2f} missing={result.missing}")
+        return (result.fields if route == 'local' else None), route
@@ -0,0 +1,471 @@
+"""
+Local development server: every Lambda handler behind one HTTP process.
+
+    cd backend
+    python local_server.py [--port 8000] [--workers 32] [--model-latency 0.5]
+
+Every ``*_lambda.py`` module is imported once at startup, as in a warm
+container, and served from a single asyncio HTTP server. Handlers block on
+their AWS calls, so they run on a thread pool. DynamoDB, S3, SES, the
+extraction queue (SQLite) and Bedrock are the in-memory stand-ins from
+``benchmarks/local_aws.py``, so nothing touches AWS. The fake model answers
+with fields derived from the image, so a receipt always extracts the same
+way. Queued extraction jobs are drained in the background.
+
+Invoke a function by its deployed name on the Lambda Invoke API path, so
+the AWS CLI and boto3 work against the server with an endpoint URL:
+
+    curl -d '{"userId": "me@example.com"}' localhost:8000/2015-03-31/functions/GetExpensesLambda/invocations
+    aws lambda invoke --endpoint-url http://localhost:8000 --function-name GetExpensesLambda \\
+        --cli-binary-format raw-in-base64-out --payload '{"userId": "me@example.com"}' out.json
+
+``X-Amz-Invocation-Type: Event`` queues the call and answers 202, and a
+handler's own asynchronous self-invocations run here too.
+
+Local endpoints, for measuring the warm path:
+
+    GET  /_local/functions      per function: calls, errors, p50/p95/p99 ms
+    GET  /_local/phases         where the time went, per function and phase
+    POST /_local/profile/start  run every invocation under cProfile until stopped
+    POST /_local/profile/stop   the pstats report (?sort=cumulative&limit=40)
+    POST /_local/memory/start   start tracemalloc
+    GET  /_local/memory         current and peak traced memory, top allocation sites (?limit=25)
+    POST /_local/memory/stop
+    POST /_local/reset          clear the statistics
+
+cProfile sees the thread that runs the handler, not the pools it starts,
+and while profiling is on, invocations run one at a time.
+"""
+import argparse
+import asyncio
+import base64
+import cProfile
+import glob
+import hashlib
+import importlib
+import io
+import json
+import os
+import pstats
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+import types
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from urllib.parse import parse_qs, urlsplit
+
+from benchmarks.common import BACKEND_DIR, setup_environment
+
+setup_environment()
+os.environ.setdefault('DYNAMODB_AGGREGATES_TABLE_NAME', 'SmartReceiptsAggregates')
+os.environ.setdefault('DYNAMODB_JOBS_TABLE_NAME', 'SmartReceiptsExtractionJobs')
+os.environ.setdefault('DYNAMODB_NOTIFICATION_RUNS_TABLE_NAME', 'SmartReceiptsNotificationRuns')
+os.environ.setdefault('DYNAMODB_VENDOR_INDEX_TABLE_NAME', 'SmartReceiptsVendorIndex')
+os.environ.setdefault('EXTRACTION_CACHE_TABLE_NAME', 'SmartReceiptsExtractionCache')
+# The worker returns as soon as the queue is empty instead of long-polling.
+os.environ.setdefault('EXTRACTION_WORKER_IDLE_SECONDS', '0')
+
+import aws_clients  # noqa: E402
+import bedrock_categorization_lambda  # noqa: E402
+import expense_aggregates  # noqa: E402
+import expense_model  # noqa: E402
+import extraction_jobs  # noqa: E402
+import extraction_worker_lambda  # noqa: E402
+import get_extraction_job_lambda  # noqa: E402
+import instrumentation  # noqa: E402
+import receipt_extraction  # noqa: E402
+import receipt_fingerprints  # noqa: E402
+import recurring_expenses  # noqa: E402
+import save_expense_lambda  # noqa: E402
+import search_index  # noqa: E402
+import send_notification_lambda  # noqa: E402
+import user_preferences  # noqa: E402
+import vendor_index  # noqa: E402
+from benchmarks.local_aws import FakeBedrockRuntime, LocalDynamoDB, LocalS3, LocalSES  # noqa: E402
+from expense_pages import DATE_INDEX_NAME  # noqa: E402
+from extraction_cache import DynamoDBCacheStore, ExtractionCache  # noqa: E402
+from job_queue import SQLiteJobQueue  # noqa: E402
+
+# Lambda's limit for a synchronous request payload.
+MAX_PAYLOAD_BYTES = 6 * 1024 * 1024
+# Duplicate detection is off unless its table is configured; locally it is on.
+RECEIPT_HASH_TABLE_NAME = receipt_fingerprints.RECEIPT_HASH_TABLE_NAME or 'SmartReceiptsReceiptHashes'
+SEARCH_INDEX_TABLE_NAME = search_index.SEARCH_INDEX_TABLE_NAME or 'SmartReceiptsSearchIndex'
+RECURRING_TABLE_NAME = recurring_expenses.RECURRING_TABLE_NAME or 'SmartReceiptsRecurring'
+INVOKE_PATH_PREFIX = '/2015-03-31/functions/'
+MODEL_CATEGORIES = [category.value for category in expense_model.Category
+                    if category.value != expense_model.NOT_APPLICABLE]
+MODEL_VENDORS = ['Starbucks', 'Whole Foods Market', 'Shell', 'Uber', 'Amazon', 'Target', 'Walgreens',
+                 'Con Edison', 'Netflix', 'Delta Air Lines', 'Chipotle', 'Costco Wholesale']
+STATUS_TEXT = {200: 'OK', 202: 'Accepted', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+               411: 'Length Required', 413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+
+def model_answer(request):
+    """Receipt fields derived from the image, so a receipt always extracts the same way."""
+    image = base64.b64decode(request['messages'][0]['content'][0]['source']['data'])
+    rng = random.Random(hashlib.sha256(image).digest())
+    day = date(2024, 1, 1) + timedelta(days=rng.randrange(365))
+    return json.dumps({'vendor': rng.choice(MODEL_VENDORS), 'amount': f'{rng.randint(100, 20000) / 100:.2f}',
+                       'category': rng.choice(MODEL_CATEGORIES), 'description': 'Receipt',
+                       'date': day.isoformat()})
+
+
+def install_stand_ins(model_responder=model_answer, model_latency=0.0, token_latency=0.0, ses_rate=1000,
+                      duplicates=False):
+    """
+    Create every table, bucket and service the handlers use as an in-memory
+    stand-in, and point ``aws_clients`` and the handlers' module-level
+    singletons at them. ``duplicates`` turns on near-duplicate receipt
+    detection, whether or not its table is configured.
+
+    Returns:
+        A namespace with the dynamodb, s3, bedrock and ses stand-ins and the
+        job ``queue``.
+    """
+    dynamodb = LocalDynamoDB()
+    dynamodb.create_table(save_expense_lambda.TABLE_NAME, 'userId', 'expenseId',
+                          indexes={DATE_INDEX_NAME: ('userId', 'date')})
+    dynamodb.create_table(expense_aggregates.AGGREGATES_TABLE_NAME, 'userId', 'bucket')
+    dynamodb.create_table(extraction_jobs.JOBS_TABLE_NAME, 'jobId')
+    dynamodb.create_table(vendor_index.VENDOR_INDEX_TABLE_NAME, 'scope', 'vendorKey')
+    dynamodb.create_table(receipt_extraction.CACHE_TABLE_NAME, 'cacheKey')
+    dynamodb.create_table(user_preferences.TABLE_NAME, 'userId')
+    dynamodb.create_table(SEARCH_INDEX_TABLE_NAME, 'userId', 'change')
+    dynamodb.create_table(RECURRING_TABLE_NAME, 'userId', 'vendorKey')
+    dynamodb.create_table(send_notification_lambda.RUNS_TABLE_NAME, 'runId')
+    s3 = LocalS3()
+    bedrock = FakeBedrockRuntime(responder=model_responder, latency=model_latency, token_latency=token_latency)
+    ses = LocalSES(max_send_rate=ses_rate)
+    aws_clients.reset()
+    aws_clients.override_resource('dynamodb', dynamodb)
+    aws_clients.override_client('s3', s3)
+    aws_clients.override_client('bedrock-runtime', bedrock)
+    aws_clients.override_client('ses', ses)
+
+    extraction = receipt_extraction
+    extraction.extraction_cache = ExtractionCache(store=DynamoDBCacheStore(extraction.CACHE_TABLE_NAME))
+    extraction.local_extractor = None
+    queue = SQLiteJobQueue(visibility_timeout=30)
+    jobs = extraction_jobs.ExtractionJobs(queue=queue)
+    bedrock_categorization_lambda.extraction_jobs_store = jobs
+    extraction_worker_lambda.queue = queue
+    extraction_worker_lambda.jobs = jobs
+    get_extraction_job_lambda.jobs = jobs
+    vendor_index.index = vendor_index.VendorIndex(vendor_index.VENDOR_INDEX_TABLE_NAME)
+    receipt_fingerprints.index = None
+    if duplicates:
+        dynamodb.create_table(RECEIPT_HASH_TABLE_NAME, 'userId', 's3_key')
+        receipt_fingerprints.index = receipt_fingerprints.ReceiptIndex(RECEIPT_HASH_TABLE_NAME)
+    user_preferences.store = user_preferences.PreferenceStore()
+    search_index.index = search_index.SearchIndex(SEARCH_INDEX_TABLE_NAME)
+    recurring_expenses.detector = recurring_expenses.RecurringDetector(RECURRING_TABLE_NAME)
+    return types.SimpleNamespace(dynamodb=dynamodb, s3=s3, bedrock=bedrock, ses=ses, queue=queue)
+
+
+def function_name(module_name):
+    """The deployed name of a handler module: save_expense_lambda -> SaveExpenseLambda."""
+    return ''.join(part.capitalize() for part in module_name.split('_'))
+
+
+def load_handlers():
+    """Import every ``*_lambda.py`` module once; returns ``{function name: module}``."""
+    handlers = {}
+    for path in sorted(glob.glob(os.path.join(BACKEND_DIR, '*_lambda.py'))):
+        module_name = os.path.splitext(os.path.basename(path))[0]
+        handlers[function_name(module_name)] = importlib.import_module(module_name)
+    return handlers
+
+
+class LocalContext:
+    """The Lambda context object for one local invocation."""
+
+    memory_limit_in_mb = 1024
+
+    def __init__(self, function_name, timeout_seconds):
+        self.function_name = function_name
+        self.aws_request_id = str(uuid.uuid4())
+        self._deadline = time.monotonic() + timeout_seconds
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._deadline - time.monotonic()) * 1000))
+
+
+class LocalLambda:
+    """Stand-in for ``boto3.client('lambda')`` that invokes this server's handlers."""
+
+    def __init__(self, server):
+        self.server = server
+
+    def invoke(self, FunctionName, Payload=b'{}', InvocationType='RequestResponse', **kwargs):
+        event = json.loads(Payload or b'{}')
+        if InvocationType == 'Event':
+            self.server.pool.submit(self.server.invoke, FunctionName, event)
+            return {'StatusCode': 202}
+        response, error = self.server.invoke(FunctionName, event)
+        result = {'StatusCode': 200, 'Payload': io.BytesIO(json.dumps(response).encode('utf-8'))}
+        if error:
+            result['FunctionError'] = 'Unhandled'
+        return result
+
+
+class LocalServer:
+    """Runs the handlers for HTTP requests and keeps their statistics and profiles."""
+
+    def __init__(self, handlers, workers=32, timeout_seconds=900):
+        self.handlers = handlers
+        self.timeout_seconds = timeout_seconds
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='handler')
+        self.seconds = defaultdict(list)
+        self.errors = defaultdict(int)
+        self.profile = None
+        self.profiling = False
+        self._lock = threading.Lock()
+        self._profile_lock = threading.Lock()
+        aws_clients.override_client('lambda', LocalLambda(self))
+
+    # -- invocations ---------------------------------------------------------
+
+    def invoke(self, name, event):
+        """
+        Run one handler on the calling thread, as a Lambda invocation would.
+
+        Returns:
+            A (response, error) tuple; an unhandled exception becomes a
+            Lambda error payload with error True.
+        """
+        handler = self.handlers[name].lambda_handler
+        context = LocalContext(name, self.timeout_seconds)
+        profiler = None
+        started = time.perf_counter()
+        try:
+            if self.profiling:
+                with self._profile_lock:
+                    profiler = cProfile.Profile()
+                    started = time.perf_counter()
+                    response = profiler.runcall(handler, event, context)
+            else:
+                response = handler(event, context)
+            error = False
+        except Exception as e:
+            response, error = {'errorMessage': str(e), 'errorType': type(e).__name__}, True
+        seconds = time.perf_counter() - started
+        failed = error or (isinstance(response, dict) and response.get('statusCode', 200) >= 500)
+        with self._lock:
+            self.seconds[name].append(seconds)
+            self.errors[name] += failed
+            if profiler is not None and self.profiling:
+                if self.profile is None:
+                    self.profile = pstats.Stats(profiler)
+                else:
+                    self.profile.add(profiler)
+        return response, error
+
+    def function_stats(self):
+        with self._lock:
+            samples = {name: list(seconds) for name, seconds in self.seconds.items()}
+            errors = dict(self.errors)
+        return [dict({'function': name, 'errors': errors.get(name, 0)}, **instrumentation.percentiles(samples[name]))
+                for name in sorted(samples)]
+
+    def reset(self):
+        with self._lock:
+            self.seconds.clear()
+            self.errors.clear()
+        if instrumentation.TRACE_EXPORT_PATH and os.path.exists(instrumentation.TRACE_EXPORT_PATH):
+            with instrumentation._lock:
+                open(instrumentation.TRACE_EXPORT_PATH, 'w').close()
+
+    # -- profiling -----------------------------------------------------------
+
+    def start_profile(self):
+        with self._lock:
+            self.profile = None
+            self.profiling = True
+
+    def stop_profile(self, sort='cumulative', limit=40):
+        with self._lock:
+            self.profiling = False
+            stats, self.profile = self.profile, None
+        if stats is None:
+            return 'No invocations were profiled.\n'
+        buffer = io.StringIO()
+        stats.stream = buffer
+        stats.sort_stats(sort).print_stats(limit)
+        return buffer.getvalue()
+
+    @staticmethod
+    def memory_report(limit=25):
+        if not tracemalloc.is_tracing():
+            return {'tracing': False}
+        current, peak = tracemalloc.get_traced_memory()
+        top = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+        )).statistics('lineno')[:limit]
+        return {
+            'tracing': True,
+            'current_kb': round(current / 1024, 1),
+            'peak_kb': round(peak / 1024, 1),
+            'top': [{'site': f'{stat.traceback[0].filename}:{stat.traceback[0].lineno}',
+                     'kb': round(stat.size / 1024, 1), 'blocks': stat.count} for stat in top],
+        }
+
+    # -- HTTP ------------------------------------------------------------------
+
+    async def route(self, method, path, query, headers, body):
+        """The (status, body, extra headers) for one request."""
+        loop = asyncio.get_running_loop()
+        name = path.strip('/')
+        invoke = name in self.handlers
+        if path.startswith(INVOKE_PATH_PREFIX) and path.endswith('/invocations'):
+            name, invoke = path[len(INVOKE_PATH_PREFIX):-len('/invocations')], True
+        if invoke:
+            if method != 'POST':
+                return 405, {'message': 'Invoke with POST.'}, {}
+            if name not in self.handlers:
+                return 404, {'Type': 'User', 'message': f'Function not found: {name}'}, {
+                    'X-Amzn-ErrorType': 'ResourceNotFoundException'}
+            try:
+                event = json.loads(body or b'{}')
+            except ValueError:
+                return 400, {'Type': 'User', 'message': 'Could not parse request body into json.'}, {}
+            if headers.get('x-amz-invocation-type') == 'Event':
+                self.pool.submit(self.invoke, name, event)
+                return 202, None, {}
+            response, error = await loop.run_in_executor(self.pool, self.invoke, name, event)
+            return 200, response, {'X-Amz-Function-Error': 'Unhandled'} if error else {}
+
+        if name == '_local/functions' and method == 'GET':
+            return 200, {'functions': self.function_stats(), 'handlers': sorted(self.handlers)}, {}
+        if name == '_local/phases' and method == 'GET':
+            path = instrumentation.TRACE_EXPORT_PATH
+            traces = instrumentation.load_traces(path) if path and os.path.exists(path) else []
+            return 200, {'phases': instrumentation.profile(traces)}, {}
+        if name == '_local/profile/start' and method == 'POST':
+            self.start_profile()
+            return 200, {'profiling': True}, {}
+        if name == '_local/profile/stop' and method == 'POST':
+            sort = query.get('sort', ['cumulative'])[0]
+            limit = int(query.get('limit', ['40'])[0])
+            return 200, self.stop_profile(sort, limit), {}
+        if name == '_local/memory/start' and method == 'POST':
+            tracemalloc.start()
+            tracemalloc.reset_peak()
+            return 200, {'tracing': True}, {}
+        if name == '_local/memory' and method == 'GET':
+            return 200, self.memory_report(int(query.get('limit', ['25'])[0])), {}
+        if name == '_local/memory/stop' and method == 'POST':
+            report = self.memory_report(int(query.get('limit', ['25'])[0]))
+            tracemalloc.stop()
+            return 200, report, {}
+        if name == '_local/reset' and method == 'POST':
+            self.reset()
+            return 200, {'reset': True}, {}
+        return 404, {'message': f'No route for {method} {path}'}, {}
+
+    async def handle_connection(self, reader, writer):
+        """Serve HTTP/1.1 requests on one connection until either side closes it."""
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                method, target, version = request_line.decode('latin-1').split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    key, _, value = line.decode('latin-1').partition(':')
+                    headers[key.strip().lower()] = value.strip()
+                keep_alive = (headers.get('connection', '').lower() != 'close'
+                              and not version.strip().upper().endswith('1.0'))
+
+                if 'chunked' in headers.get('transfer-encoding', '').lower():
+                    status, payload, extra = 411, {'message': 'Send a Content-Length.'}, {}
+                    keep_alive = False
+                elif int(headers.get('content-length', 0)) > MAX_PAYLOAD_BYTES:
+                    status, payload, extra = 413, {'Type': 'User', 'message': 'Request must be smaller than '
+                                                   f'{MAX_PAYLOAD_BYTES} bytes for the InvokeFunction operation'}, {}
+                    keep_alive = False
+                else:
+                    body = await reader.readexactly(int(headers.get('content-length', 0)))
+                    url = urlsplit(target)
+                    try:
+                        status, payload, extra = await self.route(method, url.path, parse_qs(url.query),
+                                                                  headers, body)
+                    except Exception as e:
+                        status, payload, extra = 500, {'message': str(e)}, {}
+
+                if payload is None:
+                    data, content_type = b'', 'application/json'
+                elif isinstance(payload, str):
+                    data, content_type = payload.encode('utf-8'), 'text/plain; charset=utf-8'
+                else:
+                    data, content_type = json.dumps(payload).encode('utf-8'), 'application/json'
+                head = [f'HTTP/1.1 {status} {STATUS_TEXT.get(status, "")}', f'Content-Type: {content_type}',
+                        f'Content-Length: {len(data)}', f"Connection: {'keep-alive' if keep_alive else 'close'}"]
+                head += [f'{key}: {value}' for key, value in extra.items()]
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    async def drain_jobs(self, queue, interval):
+        """Run ExtractionWorkerLambda whenever queued extraction jobs are waiting."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(interval)
+            if len(queue) and 'ExtractionWorkerLambda' in self.handlers:
+                await loop.run_in_executor(self.pool, self.invoke, 'ExtractionWorkerLambda', {})
+
+
+async def serve(server, host, port, queue=None, worker_interval=1.0):
+    http = await asyncio.start_server(server.handle_connection, host, port)
+    if queue is not None and worker_interval > 0:
+        asyncio.ensure_future(server.drain_jobs(queue, worker_interval))
+    print(f'Serving {len(server.handlers)} functions on http://{host}:{port}{INVOKE_PATH_PREFIX}<name>/invocations')
+    async with http:
+        await http.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve every Lambda handler locally over HTTP.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--workers', type=int, default=32, help='handler threads')
+    parser.add_argument('--timeout', type=float, default=900, help='seconds each invocation may run')
+    parser.add_argument('--model-latency', type=float, default=0.0, help='seconds per fake Bedrock call')
+    parser.add_argument('--token-latency', type=float, default=0.0, help='seconds per fake output token')
+    parser.add_argument('--worker-interval', type=float, default=1.0,
+                        help='seconds between checks for queued extraction jobs; 0 turns it off')
+    args = parser.parse_args()
+
+    # Set before the stand-ins are installed, so their calls are timed too.
+    instrumentation.TRACE_EXPORT_PATH = os.path.join(tempfile.gettempdir(), f'smart-receipts-{os.getpid()}.jsonl')
+    stand_ins = install_stand_ins(model_latency=args.model_latency, token_latency=args.token_latency,
+                                  duplicates=True)
+    handlers = load_handlers()
+    print(f"Functions: {', '.join(handlers)}")
+    print(f'Traces: {instrumentation.TRACE_EXPORT_PATH}')
+    server = LocalServer(handlers, workers=args.workers, timeout_seconds=args.timeout)
+    try:
+        asyncio.run(serve(server, args.host, args.port, stand_ins.queue, args.worker_interval))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.pool.shutdown(wait=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,366 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from botocore.exceptions import ClientError
+
+import instrumentation
+from rate_limiter import AdaptiveLimiter, CircuitBreaker, TokenBucket
+
+DEFAULT_MODEL_ID = "anthropic.claude-3-haiku-20240307-v1:0"
+
+# The models to route between: a comma-separated list of model ids in order
+# of preference, or a JSON list of objects with "id" and optionally "cost"
+# (relative, per call), "maxImageBytes" (larger images skip the model),
+# "rps" (a request rate to stay under) and "maxConcurrency".
+MODELS = os.environ.get('BEDROCK_MODELS', DEFAULT_MODEL_ID)
+# A model whose recent latency is above this is only used when every
+# eligible model is; among those the fastest is picked.
+LATENCY_TARGET_SECONDS = float(os.environ.get('BEDROCK_LATENCY_TARGET_SECONDS', 20))
+
+# Bedrock errors worth retrying with backoff (or on another model); anything
+# else fails fast.
+RETRYABLE_ERROR_CODES = {
+    'ThrottlingException',
+    'TooManyRequestsException',
+    'ServiceUnavailableException',
+    'ModelNotReadyException',
+}
+MAX_ATTEMPTS = int(os.environ.get('BEDROCK_MAX_ATTEMPTS', 5))
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+# An attempt still running after this long is abandoned and retried.
+ATTEMPT_TIMEOUT_SECONDS = float(os.environ.get('BEDROCK_ATTEMPT_TIMEOUT_SECONDS', 20))
+# Every attempt, backoff and failover of one call together; fits the 60
+# second extraction function with time left to answer. The invocation's own
+# deadline (set_deadline) cuts it shorter.
+CALL_TIMEOUT_SECONDS = float(os.environ.get('BEDROCK_CALL_TIMEOUT_SECONDS', 50))
+# Time kept back from the Lambda deadline to store and return the result.
+DEADLINE_MARGIN_SECONDS = float(os.environ.get('BEDROCK_DEADLINE_MARGIN_SECONDS', 3))
+# How long a call waits for a concurrency slot before trying elsewhere.
+QUEUE_TIMEOUT_SECONDS = float(os.environ.get('BEDROCK_QUEUE_TIMEOUT_SECONDS', 10))
+
+# Per-model concurrency starts here and adapts between 1 and the maximum.
+INITIAL_CONCURRENCY = int(os.environ.get('BEDROCK_INITIAL_CONCURRENCY', 8))
+MAX_CONCURRENCY = int(os.environ.get('BEDROCK_MAX_CONCURRENCY', 32))
+
+# A call still running after the model's recent p90 latency or twice its
+# median, whichever is later ('auto'), or after a fixed number of seconds,
+# is raced by a second one; 'off' disables it. At most HEDGE_MAX_SHARE of
+# calls are hedged, and only into spare concurrency, so hedging can't add
+# to a throttled model's load.
+HEDGE_AFTER = os.environ.get('BEDROCK_HEDGE_AFTER_SECONDS', 'auto')
+HEDGE_MAX_SHARE = float(os.environ.get('BEDROCK_HEDGE_MAX_SHARE', 0.1))
+HEDGE_QUANTILE = 0.9
+HEDGE_MIN_SAMPLES = 20
+LATENCY_SAMPLES = 200
+
+# This many throttles in a row, spread over at least the window, open a
+# model's circuit for the reset period: its calls go to the next model, or
+# fail at once when there is none.
+BREAKER_THRESHOLD = int(os.environ.get('BEDROCK_BREAKER_THRESHOLD', 8))
+BREAKER_WINDOW_SECONDS = float(os.environ.get('BEDROCK_BREAKER_WINDOW_SECONDS', 1))
+BREAKER_RESET_SECONDS = float(os.environ.get('BEDROCK_BREAKER_RESET_SECONDS', 30))
+
+# A time.monotonic() value calls from this thread must finish by, or None.
+# A context variable, since the local server runs invocations side by side;
+# pool threads set their own (see set_deadline).
+_deadline = contextvars.ContextVar('bedrock_deadline', default=None)
+
+ModelSpec = namedtuple('ModelSpec', ['model_id', 'cost', 'max_image_bytes', 'rps', 'max_concurrency'])
+
+
+class ModelUnavailable(Exception):
+    """No model could take the call: every circuit is open, or no slot freed up in time."""
+
+
+def parse_models(value):
+    """ModelSpecs from a BEDROCK_MODELS value."""
+    value = value.strip()
+    if value.startswith('['):
+        entries = json.loads(value)
+    else:
+        entries = [{'id': model_id.strip()} for model_id in value.split(',') if model_id.strip()]
+    if not entries:
+        raise ValueError('BEDROCK_MODELS lists no models.')
+    return [ModelSpec(entry['id'], float(entry.get('cost', position)), entry.get('maxImageBytes'),
+                      entry.get('rps'), entry.get('maxConcurrency', MAX_CONCURRENCY))
+            for position, entry in enumerate(entries)]
+
+
+def error_code(error):
+    return error.response.get('Error', {}).get('Code') if isinstance(error, ClientError) else None
+
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter."""
+    return random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+
+
+class Model:
+    """One routable model and the state the router keeps for it."""
+
+    def __init__(self, spec, adaptive=True, breaker=True, clock=time.monotonic):
+        self.spec = spec
+        self.model_id = spec.model_id
+        maximum = max(1, spec.max_concurrency)
+        self.limiter = (AdaptiveLimiter(min(INITIAL_CONCURRENCY, maximum), maximum=maximum, clock=clock)
+                        if adaptive else None)
+        self.bucket = TokenBucket(spec.rps) if spec.rps else None
+        self.breaker = (CircuitBreaker(BREAKER_THRESHOLD, BREAKER_WINDOW_SECONDS, BREAKER_RESET_SECONDS, clock=clock)
+                        if breaker else None)
+        self._latencies = deque(maxlen=LATENCY_SAMPLES)
+        self._lock = threading.Lock()
+        self.stats = {'calls': 0, 'throttles': 0, 'errors': 0, 'timeouts': 0}
+
+    def fits(self, image_bytes):
+        return self.spec.max_image_bytes is None or image_bytes <= self.spec.max_image_bytes
+
+    def available(self):
+        return self.breaker is None or self.breaker.allow()
+
+    def latency(self, quantile=0.5):
+        """A recent latency quantile in seconds, or None before enough calls."""
+        with self._lock:
+            samples = sorted(self._latencies)
+        if len(samples) < HEDGE_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(quantile * len(samples)))]
+
+    def acquire(self, block=True):
+        if self.limiter is not None:
+            acquired = self.limiter.acquire(QUEUE_TIMEOUT_SECONDS) if block else self.limiter.try_acquire()
+            if not acquired:
+                raise ModelUnavailable(f'No concurrency left for {self.model_id}.')
+        if self.bucket is not None:
+            self.bucket.acquire()
+
+    def release(self, outcome, seconds=None):
+        if self.limiter is not None:
+            self.limiter.release(outcome, seconds)
+        with self._lock:
+            self.stats['calls'] += 1
+            if outcome == AdaptiveLimiter.THROTTLED:
+                self.stats['throttles'] += 1
+            elif outcome == AdaptiveLimiter.IGNORED:
+                self.stats['errors'] += 1
+            if seconds is not None:
+                self._latencies.append(seconds)
+        if self.breaker is not None:
+            if outcome == AdaptiveLimiter.SUCCESS:
+                self.breaker.record_success()
+            elif outcome == AdaptiveLimiter.THROTTLED:
+                self.breaker.record_failure()
+
+    def snapshot(self):
+        p50, p95 = self.latency(0.5), self.latency(0.95)
+        return dict(self.stats, model=self.model_id,
+                    limit=round(self.limiter.limit, 1) if self.limiter is not None else None,
+                    circuit=self.breaker.state if self.breaker is not None else None,
+                    p50_ms=round(p50 * 1000, 1) if p50 is not None else None,
+                    p95_ms=round(p95 * 1000, 1) if p95 is not None else None)
+
+
+class ModelRouter:
+    """
+    Runs model calls on the best available model.
+
+    ``invoke(call, image_bytes)`` picks, among the models that take an image
+    of that size and whose circuit is closed, the cheapest one within
+    LATENCY_TARGET_SECONDS, and runs ``call(model_id)`` there under the
+    model's adaptive concurrency limit and request rate. Throttling and
+    unavailability fail over to the next model, or are retried with
+    backoff when there is none; a call slower than the hedge delay is raced
+    by a second one.
+    """
+
+    def __init__(self, specs, adaptive=True, breaker=True, hedge_after=HEDGE_AFTER,
+                 hedge_max_share=HEDGE_MAX_SHARE, max_attempts=MAX_ATTEMPTS,
+                 attempt_timeout=ATTEMPT_TIMEOUT_SECONDS, call_timeout=CALL_TIMEOUT_SECONDS, sleep=time.sleep,
+                 clock=time.monotonic):
+        self.models = [Model(spec, adaptive, breaker, clock) for spec in specs]
+        self.hedge_after = hedge_after
+        self.hedge_max_share = hedge_max_share
+        self.max_attempts = max_attempts
+        self.attempt_timeout = attempt_timeout
+        self.call_timeout = call_timeout
+        self._sleep = sleep
+        self._pool = None
+        self._lock = threading.Lock()
+        self.stats = {'requests': 0, 'retries': 0, 'failovers': 0, 'hedged': 0, 'hedge_wins': 0, 'rejected': 0,
+                      'out_of_time': 0}
+
+    @property
+    def model_ids(self):
+        return [model.model_id for model in self.models]
+
+    @property
+    def name(self):
+        """Names the model list, e.g. in cache keys: the model id for a single model."""
+        return ','.join(self.model_ids)
+
+    def _executor(self):
+        # Created on first use so a cold start pays nothing for it.
+        with self._lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=2 * sum(max(1, m.spec.max_concurrency)
+                                                                     for m in self.models),
+                                                thread_name_prefix='bedrock')
+            return self._pool
+
+    def route(self, image_bytes=0, exclude=()):
+        """The models that take an image of ``image_bytes``, best first, untried ones ahead."""
+        eligible = [model for model in self.models if model.fits(image_bytes)] or list(self.models)
+
+        def rank(model):
+            latency = model.latency()
+            slow = latency is not None and latency > LATENCY_TARGET_SECONDS
+            return model in exclude, slow, model.spec.cost if not slow else latency
+
+        return sorted(eligible, key=rank)
+
+    def hedge_delay(self, model):
+        if self.hedge_after in (None, 'off'):
+            return None
+        if self.hedge_after == 'auto':
+            tail, median = model.latency(HEDGE_QUANTILE), model.latency(0.5)
+            return max(tail, 2 * median) if tail is not None else None
+        return float(self.hedge_after)
+
+    def _call(self, model, call, block=True):
+        model.acquire(block)
+        started = time.perf_counter()
+        try:
+            result = call(model.model_id)
+        except Exception as e:
+            throttled = error_code(e) in RETRYABLE_ERROR_CODES
+            model.release(AdaptiveLimiter.THROTTLED if throttled else AdaptiveLimiter.IGNORED)
+            raise
+        model.release(AdaptiveLimiter.SUCCESS, time.perf_counter() - started)
+        return result
+
+    def _hedge_allowed(self):
+        with self._lock:
+            if self.stats['hedged'] >= self.hedge_max_share * self.stats['requests']:
+                return False
+            self.stats['hedged'] += 1
+            return True
+
+    def _attempt(self, model, call, timeout):
+        """One attempt on ``model``, hedged once if it runs past the model's hedge delay."""
+        delay = self.hedge_delay(model)
+        primary = self._executor().submit(self._call, model, call)
+        pending = {primary}
+        deadline = time.monotonic() + timeout
+        if delay is not None and delay < timeout:
+            done, _ = wait(pending, timeout=delay)
+            if not done and self._hedge_allowed():
+                instrumentation.count('bedrock.hedged')
+                pending.add(self._executor().submit(self._call, model, call, False))
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=max(0.0, deadline - time.monotonic()),
+                                 return_when=FIRST_COMPLETED)
+            if not done:
+                break
+            for future in done:
+                if future.exception() is None:
+                    if future is not primary:
+                        with self._lock:
+                            self.stats['hedge_wins'] += 1
+                    return future.result()
+                # The hedge finding no free slot says nothing about the model.
+                if future is primary or not isinstance(future.exception(), ModelUnavailable):
+                    error = future.exception()
+        if pending:
+            # Left running; each releases its own slot when it finishes.
+            with model._lock:
+                model.stats['timeouts'] += 1
+            if model.breaker is not None:
+                model.breaker.record_failure()
+            raise ModelUnavailable(f'{model.model_id} did not answer within {timeout:g}s.')
+        raise error
+
+    def invoke(self, call, image_bytes=0, deadline=None):
+        """
+        Run ``call(model_id)`` on the best model for an image of
+        ``image_bytes`` and return ``(result, model_id)``. Raises the last
+        error once every attempt has failed or ``deadline`` (a
+        time.monotonic() value; by default this thread's, see set_deadline)
+        has passed, and non-retryable errors at once.
+        """
+        with self._lock:
+            self.stats['requests'] += 1
+        deadline = min(time.monotonic() + self.call_timeout, deadline or _deadline.get() or float('inf'))
+        tried = set()
+        error = None
+        for attempt in range(1, self.max_attempts + 1):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                with self._lock:
+                    self.stats['out_of_time'] += 1
+                instrumentation.count('bedrock.out_of_time')
+                raise error or ModelUnavailable('No time left for a Bedrock call in this invocation.')
+            # Asking a breaker uses up its half-open trial, so only until one says yes.
+            model = next((model for model in self.route(image_bytes, tried) if model.available()), None)
+            if model is None:
+                with self._lock:
+                    self.stats['rejected'] += 1
+                instrumentation.count('bedrock.rejected')
+                raise error or ModelUnavailable('Every model circuit is open.')
+            if tried:
+                with self._lock:
+                    self.stats['retries'] += 1
+                instrumentation.count('bedrock.retries')
+                if model in tried:
+                    # Every model has had a go: back off before the next round,
+                    # unless the wait would use up the time left.
+                    delay = backoff_delay(attempt - 1)
+                    if delay >= remaining:
+                        raise error
+                    print(f"Bedrock {error_code(error) or type(error).__name__} on attempt {attempt - 1}, "
+                          f"retrying {model.model_id} in {delay:.2f}s")
+                    self._sleep(delay)
+                    remaining -= delay
+                else:
+                    with self._lock:
+                        self.stats['failovers'] += 1
+                    instrumentation.count('bedrock.failovers')
+            tried.add(model)
+            try:
+                return self._attempt(model, call, min(self.attempt_timeout, remaining)), model.model_id
+            except ModelUnavailable as e:
+                error = e
+            except Exception as e:
+                if error_code(e) not in RETRYABLE_ERROR_CODES:
+                    raise
+                error = e
+        raise error
+
+    def snapshot(self):
+        return {'router': dict(self.stats), 'models': [model.snapshot() for model in self.models]}
+
+
+# Module scope, so limits, circuits and latencies carry across warm invocations.
+router = ModelRouter(parse_models(MODELS))
+
+
+def set_deadline(context=None, deadline=None):
+    """
+    Bound the Bedrock calls made from this thread by the Lambda ``context``'s
+    remaining time less DEADLINE_MARGIN_SECONDS, or by ``deadline`` (a
+    time.monotonic() value). Handlers call it per invocation, and pool
+    threads with the deadline their handler computed.
+    """
+    if deadline is None and context is not None and hasattr(context, 'get_remaining_time_in_millis'):
+        deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000.0 - DEADLINE_MARGIN_SECONDS
+    _deadline.set(deadline)
+
+
+def invoke(call, image_bytes=0):
+    return router.invoke(call, image_bytes)
@@ -0,0 +1,87 @@
+import io
+import os
+
+# S3 requires every multipart part except the last to be at least 5 MB.
+MIN_PART_BYTES = 5 * 1024 * 1024
+DEFAULT_PART_BYTES = max(MIN_PART_BYTES, int(os.environ.get('EXPORT_PART_BYTES', 8 * 1024 * 1024)))
+
+
+class MultipartUploadWriter(io.RawIOBase):
+    """
+    A write-only file object that streams into an S3 object.
+
+    Bytes are buffered until a part's worth is ready and then uploaded, so
+    memory stays at about one part however large the object grows. Objects
+    that never fill a part are sent with a single PutObject instead. Use it
+    as a context manager: a clean exit completes the upload, an exception
+    aborts it so no orphaned parts are left behind.
+    """
+
+    def __init__(self, s3_client, bucket, key, part_size=DEFAULT_PART_BYTES, **object_args):
+        if part_size < MIN_PART_BYTES:
+            raise ValueError(f'part_size must be at least {MIN_PART_BYTES} bytes.')
+        self.s3_client = s3_client
+        self.bucket = bucket
+        self.key = key
+        self.part_size = part_size
+        # Extra create/put arguments, e.g. ContentType and ContentEncoding.
+        self.object_args = object_args
+        self.upload_id = None
+        self.parts = []
+        self.bytes_written = 0
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        if self.closed:
+            raise ValueError('write to closed MultipartUploadWriter')
+        self._buffer += data
+        self.bytes_written += len(data)
+        while len(self._buffer) >= self.part_size:
+            with memoryview(self._buffer) as view:
+                self._upload_part(bytes(view[:self.part_size]))
+            del self._buffer[:self.part_size]
+        return len(data)
+
+    def _upload_part(self, body):
+        if self.upload_id is None:
+            self.upload_id = self.s3_client.create_multipart_upload(
+                Bucket=self.bucket, Key=self.key, **self.object_args)['UploadId']
+        part_number = len(self.parts) + 1
+        response = self.s3_client.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=body)
+        self.parts.append({'PartNumber': part_number, 'ETag': response['ETag']})
+
+    def complete(self):
+        """Upload whatever is buffered and finish the object."""
+        if self.upload_id is None:
+            self.s3_client.put_object(Bucket=self.bucket, Key=self.key, Body=bytes(self._buffer),
+                                      **self.object_args)
+        else:
+            if self._buffer:
+                self._upload_part(bytes(self._buffer))
+            self.s3_client.complete_multipart_upload(
+                Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+                MultipartUpload={'Parts': self.parts})
+        self._buffer = bytearray()
+        super().close()
+
+    def abort(self):
+        """Drop the buffer and any parts already uploaded."""
+        if self.upload_id is not None:
+            self.s3_client.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+            self.upload_id = None
+        self._buffer = bytearray()
+        super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.closed:
+            return False
+        if exc_type is None:
+            self.complete()
+        else:
+            self.abort()
+        return False
@@ -0,0 +1,191 @@
+import threading
+import time
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket: ``rate`` tokens per second, up to ``capacity``.
+
+    ``acquire(n)`` reserves ``n`` tokens and sleeps until they would have
+    accrued, so callers are spaced out to the rate instead of bursting and
+    being throttled. Reservations may exceed the capacity; the caller just
+    waits longer.
+    """
+
+    def __init__(self, rate, capacity=None, clock=time.monotonic, sleep=time.sleep):
+        if rate <= 0:
+            raise ValueError('rate must be positive.')
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated = clock()
+        self._lock = threading.Lock()
+        self.waited_seconds = 0.0
+
+    def acquire(self, tokens=1):
+        """Take ``tokens``, blocking until the rate allows it; returns the wait in seconds."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            self.waited_seconds += wait
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
+class AdaptiveLimiter:
+    """
+    A concurrency limit found by AIMD, as TCP finds a congestion window:
+    every successful call raises ``limit`` by ``1 / limit`` (about one per
+    round of calls) and a throttle multiplies it by ``backoff``. Successes
+    only raise it while at least half of it is in use, so a quiet period
+    can't grow it past what was ever tested. Calls that finish within one
+    round trip of a decrease (the mean latency ``release`` was given, or
+    ``cooldown_seconds`` before any) were already in flight when it
+    happened: their throttles don't decrease it again, and their successes
+    don't raise it.
+
+    ``acquire`` blocks while ``limit`` calls are in flight; every acquired
+    slot must be handed back with ``release``.
+    """
+
+    SUCCESS = 'success'
+    THROTTLED = 'throttled'
+    # Failures that say nothing about load, such as a bad request.
+    IGNORED = 'ignored'
+
+    def __init__(self, initial=4, minimum=1, maximum=64, backoff=0.5, cooldown_seconds=1.0,
+                 clock=time.monotonic):
+        if not minimum <= initial <= maximum:
+            raise ValueError('initial must be between minimum and maximum.')
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.cooldown_seconds = cooldown_seconds
+        self.in_flight = 0
+        self._clock = clock
+        self._last_decrease = None
+        self._round_trip = None
+        self._condition = threading.Condition()
+        self.stats = {'acquired': 0, 'waited': 0, 'timeouts': 0, 'decreases': 0, 'peak_in_flight': 0}
+
+    def _has_slot(self):
+        return self.in_flight < int(self.limit)
+
+    def acquire(self, timeout=None):
+        """Take a slot, waiting up to ``timeout`` seconds (forever if None); returns whether it got one."""
+        with self._condition:
+            if not self._has_slot():
+                self.stats['waited'] += 1
+                if not self._condition.wait_for(self._has_slot, timeout):
+                    self.stats['timeouts'] += 1
+                    return False
+            self.in_flight += 1
+            self.stats['acquired'] += 1
+            self.stats['peak_in_flight'] = max(self.stats['peak_in_flight'], self.in_flight)
+            return True
+
+    def try_acquire(self):
+        """Take a slot only if one is free right now."""
+        return self.acquire(timeout=0)
+
+    def release(self, outcome=SUCCESS, seconds=None):
+        """Hand back a slot with the call's outcome and, for a success, its latency."""
+        with self._condition:
+            now = self._clock()
+            if seconds is not None:
+                self._round_trip = seconds if self._round_trip is None else 0.9 * self._round_trip + 0.1 * seconds
+            cooldown = self._round_trip if self._round_trip is not None else self.cooldown_seconds
+            settling = self._last_decrease is not None and now - self._last_decrease < cooldown
+            if outcome == self.SUCCESS and not settling and 2 * self.in_flight >= self.limit:
+                self.limit = min(self.maximum, self.limit + 1 / self.limit)
+            elif outcome == self.THROTTLED and not settling:
+                self.limit = max(self.minimum, self.limit * self.backoff)
+                self._last_decrease = now
+                self.stats['decreases'] += 1
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+
+class CircuitBreaker:
+    """
+    Stops calling a dependency that keeps failing.
+
+    Closed, every call is allowed. It opens once ``failure_threshold``
+    failures have come in with no success between them, the first at least
+    ``window_seconds`` ago: sustained failure rather than one burst of
+    calls that all started at once. Open, ``allow()`` is False for
+    ``reset_seconds``; then it is half-open, one trial call is allowed, and
+    its outcome closes the breaker or opens it again.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=5, window_seconds=1.0, reset_seconds=30.0, clock=time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.window_seconds = window_seconds
+        self.reset_seconds = reset_seconds
+        self._clock = clock
+        self._failures = 0
+        self._first_failure = None
+        self._opened_at = None
+        self._trial_started = None
+        self._lock = threading.Lock()
+        self.stats = {'opened': 0, 'rejected': 0}
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state(self._clock())
+
+    def _state(self, now):
+        if self._opened_at is None:
+            return self.CLOSED
+        return self.OPEN if now - self._opened_at < self.reset_seconds else self.HALF_OPEN
+
+    def allow(self):
+        with self._lock:
+            now = self._clock()
+            state = self._state(now)
+            if state == self.CLOSED:
+                return True
+            # One trial at a time; a trial that never reports back frees the
+            # slot after another reset period.
+            if state == self.HALF_OPEN and (self._trial_started is None
+                                            or now - self._trial_started >= self.reset_seconds):
+                self._trial_started = now
+                return True
+            self.stats['rejected'] += 1
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._first_failure = None
+            self._opened_at = None
+            self._trial_started = None
+
+    def record_failure(self):
+        with self._lock:
+            now = self._clock()
+            if self._state(now) != self.CLOSED:
+                # A failed trial (or a straggler): stay open for another period.
+                self._opened_at = now
+                self._trial_started = None
+                return
+            self._failures += 1
+            if self._first_failure is None:
+                self._first_failure = now
+            if self._failures >= self.failure_threshold and now - self._first_failure >= self.window_seconds:
+                self._failures = 0
+                self._first_failure = None
+                self._opened_at = now
+                self.stats['opened'] += 1
@@ -0,0 +1,348 @@
+import contextvars
+import json
+import os
+import time
+import base64
+from concurrent.futures import ThreadPoolExecutor
+
+import aws_clients
+import instrumentation
+import extraction_parser
+import local_extraction
+import model_router
+import receipt_fingerprints
+import receipt_segments
+import vendor_index
+from extraction_cache import DynamoDBCacheStore, ExtractionCache, extraction_cache_key
+from image_preprocessing import (derivative_key, detect_media_type, is_tall, prepare_inference_image,
+                                 prepare_inference_tiles)
+
+S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
+CACHE_TABLE_NAME = os.environ.get('EXTRACTION_CACHE_TABLE_NAME')
+
+# The preferred model; BEDROCK_MODELS lists the ones calls are routed between.
+MODEL_ID = model_router.router.model_ids[0]
+
+# Define the prompt for Bedrock to extract information
+EXTRACTION_PROMPT = "Extract the vendor name, amount, category (e.g., Food, Transport, Utilities, Entertainment, Groceries, Shopping, Health, Education, Travel, Other), description, and date from this receipt image. If any information is missing or unreadable, use 'Not Applicable'. Provide the output in a JSON format with keys: vendor, amount, category, description, date."
+# Five short fields fit well within this; a runaway answer is cut off here.
+MAX_OUTPUT_TOKENS = int(os.environ.get('BEDROCK_MAX_TOKENS', 512))
+# Stream the response and stop reading once all five fields have arrived.
+STREAM_RESPONSES = os.environ.get('BEDROCK_STREAMING', 'true').lower() != 'false'
+
+NOT_APPLICABLE_RESULT = {
+    "vendor": "Not Applicable",
+    "amount": "Not Applicable",
+    "category": "Not Applicable",
+    "description": "Not Applicable",
+    "date": "Not Applicable"
+}
+
+# Module scope, so the in-memory tier survives across warm invocations.
+extraction_cache = ExtractionCache(
+    store=DynamoDBCacheStore(CACHE_TABLE_NAME) if CACHE_TABLE_NAME else None
+)
+
+# OCR plus rules answers receipts it can read with confidence; the rest, and
+# every 'refresh', go to Bedrock. Needs pytesseract and the tesseract binary.
+LOCAL_EXTRACTION = os.environ.get('LOCAL_EXTRACTION', 'true').lower() != 'false'
+local_extractor = (local_extraction.LocalExtractor()
+                   if LOCAL_EXTRACTION and local_extraction.ocr_available() else None)
+
+def read_body(response):
+    """Read an S3 object body; the transfer happens here, after get_object returns."""
+    with instrumentation.phase('s3.read_body'):
+        body = response['Body'].read()
+    instrumentation.count('s3_read_bytes', len(body))
+    return body
+
+def get_image_from_s3(s3_key):
+    try:
+        response = aws_clients.client('s3').get_object(Bucket=S3_BUCKET_NAME, Key=s3_key)
+        return read_body(response)
+    except Exception as e:
+        print(f"Error getting image from S3: {e}")
+        return None
+
+def get_inference_image(s3_key):
+    """
+    Fetch the preprocessed derivative written at upload time, falling back to
+    preprocessing the original for receipts uploaded before derivatives existed.
+
+    Returns:
+        An (image_bytes, media_type) tuple, or (None, None) if the image is missing.
+    """
+    try:
+        response = aws_clients.client('s3').get_object(
+            Bucket=S3_BUCKET_NAME, Key=derivative_key(s3_key, 'inference'))
+        image_bytes = read_body(response)
+        return image_bytes, detect_media_type(image_bytes)
+    except Exception:
+        pass
+
+    image_bytes = get_image_from_s3(s3_key)
+    if not image_bytes:
+        return None, None
+    with instrumentation.phase('preprocess'):
+        return prepare_inference_image(image_bytes)
+
+def invoke_bedrock_model(image_base64, media_type="image/jpeg", prompt=EXTRACTION_PROMPT,
+                         fields=extraction_parser.RECEIPT_FIELDS, max_tokens=MAX_OUTPUT_TOKENS):
+    try:
+        body = json.dumps({
+            "anthropic_version": "bedrock-2023-05-31",
+            "max_tokens": max_tokens,
+            "messages": [
+                {
+                    "role": "user",
+                    "content": [
+                        {
+                            "type": "image",
+                            "source": {
+                                "type": "base64",
+                                "media_type": media_type,
+                                "data": image_base64
+                            }
+                        },
+                        {
+                            "type": "text",
+                            "text": prompt
+                        }
+                    ]
+                }
+            ]
+        })
+
+        def call(model_id):
+            runtime = aws_clients.client('bedrock-runtime')
+            if STREAM_RESPONSES:
+                return read_streamed_extraction(runtime.invoke_model_with_response_stream(
+                    body=body,
+                    modelId=model_id,
+                    accept='application/json',
+                    contentType='application/json'
+                ), fields)
+            response = runtime.invoke_model(
+                body=body,
+                modelId=model_id,
+                accept='application/json',
+                contentType='application/json'
+            )
+            with instrumentation.phase('bedrock.read_body'):
+                response_body = json.loads(response.get('body').read())
+            instrumentation.record_bedrock_usage(response_body.get('usage'))
+            # Extract the text content from the response
+            bedrock_output = response_body['content'][0]['text']
+
+            # The model sometimes wraps the JSON in prose or a code fence.
+            with instrumentation.phase('parse'):
+                extracted_data = extraction_parser.parse_receipt_fields(bedrock_output, fields)
+            if extracted_data is None:
+                print(f"Bedrock output is not valid JSON: {bedrock_output}")
+                extracted_data = dict(NOT_APPLICABLE_RESULT)
+            return extracted_data
+
+        # Retries, failover between models and hedging happen in the router;
+        # a call may run more than once.
+        extracted_data, _ = model_router.invoke(call, len(image_base64) * 3 // 4)
+        return extracted_data
+
+    except Exception as e:
+        print(f"Error invoking Bedrock model: {e}")
+        return dict(NOT_APPLICABLE_RESULT)
+
+def stream_text(stream):
+    """Yield the text deltas of an invoke_model_with_response_stream event stream."""
+    for event in stream:
+        chunk = event.get('chunk')
+        if not chunk:
+            continue
+        message = json.loads(chunk['bytes'])
+        if message.get('type') == 'content_block_delta':
+            yield message['delta'].get('text', '')
+        elif message.get('type') == 'message_start':
+            instrumentation.record_bedrock_usage(message.get('message', {}).get('usage'))
+        elif message.get('type') == 'message_delta':
+            instrumentation.record_bedrock_usage(message.get('usage'))
+
+def read_streamed_extraction(response, fields=extraction_parser.RECEIPT_FIELDS):
+    """
+    Parse the receipt fields from a streamed response as the text arrives,
+    closing the stream as soon as all of them are complete so the rest of
+    the output (closing fences, commentary) is never waited on.
+    """
+    stream = response['body']
+    parser = extraction_parser.ReceiptFieldParser(fields)
+    text = []
+    started = time.perf_counter()
+    try:
+        for delta in stream_text(stream):
+            if not text:
+                instrumentation.record_phase('bedrock.first_token', started, time.perf_counter() - started)
+            text.append(delta)
+            if parser.feed(delta):
+                break
+    finally:
+        stream.close()
+        instrumentation.record_phase('bedrock.stream', started, time.perf_counter() - started)
+        # Deltas read; the usage in message_delta is missed when the stream is closed early.
+        instrumentation.count('bedrock.output_deltas', len(text))
+
+    if parser.rejected:
+        print(f"Discarded invalid fields from Bedrock output: {parser.rejected}")
+    if not parser.found_object:
+        print(f"Bedrock output is not valid JSON: {''.join(text)}")
+        return dict(NOT_APPLICABLE_RESULT)
+    return parser.result()
+
+def apply_vendor_index(extracted_data, user_id=None):
+    """
+    Replace the extracted category with the one the user (or, failing that,
+    most users) settled on for this vendor. The cache holds the model's
+    answer; this runs per request because it depends on the user.
+    """
+    match = vendor_index.lookup(extracted_data.get('vendor'), user_id)
+    if match is None or match.category == extracted_data.get('category'):
+        return extracted_data
+    print(f"Vendor index ({match.source}) recategorized {extracted_data.get('vendor')!r} as {match.category}")
+    return dict(extracted_data, category=match.category)
+
+def extract_with_cache(image_bytes, media_type="image/jpeg", refresh=False, segment=False):
+    """
+    Return the extraction for an image, calling Bedrock only on a cache miss
+    that the local OCR pass could not answer. A ``segment`` (one part of a
+    longer receipt) is asked for its line items too, and always goes to the
+    model: the local pass reads whole receipts.
+
+    Returns:
+        An (extracted_data, cache_tier) tuple; cache_tier is None when the
+        receipt was extracted by this call.
+    """
+    prompt = receipt_segments.SEGMENT_PROMPT if segment else EXTRACTION_PROMPT
+    cache_key = extraction_cache_key(image_bytes, prompt, model_router.router.name)
+    if refresh:
+        extraction_cache.invalidate(cache_key)
+    else:
+        with instrumentation.phase('cache.get'):
+            cached, tier = extraction_cache.get(cache_key)
+        if cached is not None:
+            instrumentation.count(f'cache.{tier}_hits')
+            return cached, tier
+
+    extracted_data = None
+    # A refresh means the last answer was wrong, so it always asks the model.
+    if local_extractor is not None and not refresh and not segment:
+        try:
+            with instrumentation.phase('local_extraction'):
+                extracted_data, _ = local_extractor.extract(image_bytes, vendor_lookup=vendor_index.lookup)
+        except Exception as e:
+            print(f"Error in local extraction: {e}")
+    if extracted_data is None:
+        with instrumentation.phase('base64.encode'):
+            image_base64 = base64.b64encode(image_bytes).decode('utf-8')
+        if segment:
+            extracted_data = invoke_bedrock_model(image_base64, media_type, prompt, receipt_segments.SEGMENT_FIELDS,
+                                                  receipt_segments.SEGMENT_MAX_OUTPUT_TOKENS)
+        else:
+            extracted_data = invoke_bedrock_model(image_base64, media_type)
+    # Failed calls fall back to all "Not Applicable"; don't pin that result.
+    if extracted_data != NOT_APPLICABLE_RESULT:
+        extraction_cache.put(cache_key, extracted_data)
+    return extracted_data, None
+
+def get_segments(s3_keys, pages, originals=None):
+    """
+    The images to extract one receipt from: the inference image of each
+    page, except that a page too tall to read whole is replaced by tiles cut
+    from its original (taken from ``originals`` by key, else from S3).
+
+    Returns:
+        A list of (image_bytes, media_type) tuples, in reading order.
+    """
+    segments = []
+    for s3_key, page in zip(s3_keys, pages):
+        tiles = []
+        if is_tall(page[0]):
+            original = (originals or {}).get(s3_key) or get_image_from_s3(s3_key)
+            if original:
+                with instrumentation.phase('tile'):
+                    tiles = prepare_inference_tiles(original)
+        segments.extend(tiles or [page])
+    return segments
+
+def extract_segments(segments, refresh=False):
+    """
+    Extract every segment of one receipt at once and merge the answers, so
+    the receipt takes about as long as its slowest segment. Each segment is
+    cached on its own.
+
+    Returns:
+        An (extracted_data, cache_tier, items) tuple; cache_tier is None
+        unless every segment was cached.
+    """
+    # Each segment runs in a copy of this thread's context, so it keeps the
+    # invocation's Bedrock deadline.
+    with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, extract_with_cache, image_bytes, media_type,
+                               refresh=refresh, segment=True) for image_bytes, media_type in segments]
+        results = [future.result() for future in futures]
+    answers = [extracted_data for extracted_data, _ in results]
+    if all(answer == NOT_APPLICABLE_RESULT for answer in answers):
+        return dict(NOT_APPLICABLE_RESULT), None, []
+    instrumentation.count('segments', len(segments))
+    with instrumentation.phase('merge'):
+        extracted_data, items = receipt_segments.merge(answers)
+    tiers = [tier for _, tier in results]
+    return extracted_data, tiers[0] if None not in tiers else None, items
+
+def extract_receipt(s3_keys, pages, refresh=False, originals=None):
+    """
+    Extract one receipt from the inference images of its pages: one model
+    call for a single page of ordinary height, else a call per page or tile,
+    in parallel.
+
+    Returns:
+        An (extracted_data, cache_tier, segment_count, items) tuple; items
+        (the merged line items) is None for a single call.
+    """
+    segments = get_segments(s3_keys, pages, originals)
+    if len(segments) == 1:
+        extracted_data, cache_tier = extract_with_cache(segments[0][0], segments[0][1], refresh=refresh)
+        return extracted_data, cache_tier, 1, None
+    extracted_data, cache_tier, items = extract_segments(segments, refresh)
+    return extracted_data, cache_tier, len(segments), items
+
+def extract_for_user(user_id, s3_keys, pages, policy=None, refresh=False):
+    """
+    Extract a receipt and check it against the user's earlier receipts: an
+    image copy is reused instead of extracted under the 'reuse' policy, and
+    a receipt whose fields match an earlier one is reported. The user's
+    vendor categories are applied to the result.
+
+    Returns:
+        An (extracted_data, cache_tier, segment_count, items, duplicate)
+        tuple; ``duplicate`` is the ``duplicateOf`` part of a response, or None.
+    """
+    s3_key = s3_keys[0]
+    with instrumentation.phase('fingerprint'):
+        match = receipt_fingerprints.check(user_id, s3_key, pages[0][0])
+
+    duplicate = None
+    segment_count, items = 1, None
+    policy = policy or receipt_fingerprints.DUPLICATE_POLICY
+    if match is not None and policy == 'reuse' and not refresh and 'amount' in match.entry:
+        # A copy of an image this user already had extracted: skip the model.
+        extracted_data = dict(NOT_APPLICABLE_RESULT, **{
+            field: match.entry[field] for field in receipt_fingerprints.EXTRACTED_FIELDS if field in match.entry})
+        cache_tier = None
+        duplicate = receipt_fingerprints.describe(match, reused=True)
+        instrumentation.count('duplicates.reused')
+    else:
+        extracted_data, cache_tier, segment_count, items = extract_receipt(s3_keys, pages, refresh=refresh)
+    if extracted_data != NOT_APPLICABLE_RESULT:
+        extracted_data = apply_vendor_index(extracted_data, user_id)
+        copy = receipt_fingerprints.record_extraction(user_id, s3_key, extracted_data)
+        if duplicate is None and copy is not None:
+            duplicate = receipt_fingerprints.describe(copy)
+            instrumentation.count('duplicates.flagged')
+    return extracted_data, cache_tier, segment_count, items, duplicate
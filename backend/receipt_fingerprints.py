@@ -0,0 +1,419 @@
+import io
+import os
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+import aws_clients
+import expense_model
+import vendor_index
+from image_preprocessing import find_document_box
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # Pillow is optional; without it receipts are not fingerprinted.
+    Image = None
+
+# HASH userId, RANGE s3_key. One item per receipt image with its perceptual
+# hashes and, once known, its extracted fields and the expenseId it was
+# saved as.
+RECEIPT_HASH_TABLE_NAME = os.environ.get('DYNAMODB_RECEIPT_HASH_TABLE_NAME')
+
+# Receipt images whose 256-bit hashes differ in at most this many bits are
+# the same picture: re-encoded, rescaled, screenshotted or lightly cropped.
+# Different receipts, even from the same till, are rarely within 20 bits.
+# A retake moves every pixel and lands far outside it, so retakes are only
+# caught once extraction has read the same vendor, amount and date.
+MAX_DISTANCE = int(os.environ.get('RECEIPT_HASH_MAX_DISTANCE', 12))
+# 'flag' extracts every receipt and reports the earlier one it copies.
+# 'reuse' returns the earlier receipt's extraction for an image match
+# instead of calling the model; the client can still ask for a 'refresh'.
+DUPLICATE_POLICY = os.environ.get('DUPLICATE_RECEIPTS', 'flag')
+POLICIES = ('flag', 'reuse')
+# Loaded users are kept this long in a warm container, LRU-bounded.
+CACHE_TTL_SECONDS = int(os.environ.get('RECEIPT_HASH_CACHE_TTL_SECONDS', 300))
+CACHE_MAX_USERS = int(os.environ.get('RECEIPT_HASH_CACHE_USERS', 256))
+
+# dHash: one bit per horizontal neighbour pair of a 17x16 thumbnail, set
+# where brightness increases. Text lines and edges dominate it, which is
+# what tells receipts apart.
+HASH_SIZE = 16
+HASH_DIGITS = HASH_SIZE * HASH_SIZE // 4
+# Decoding at this size is plenty for the thumbnail and lets JPEG skip most of the work.
+DECODE_SIZE = 256
+# Kept per receipt, so a copy can be answered without the model.
+EXTRACTED_FIELDS = ('vendor', 'amount', 'category', 'description', 'date')
+
+Match = namedtuple('Match', ['s3_key', 'distance', 'entry'])
+
+
+def hamming(a, b):
+    return bin(a ^ b).count('1')
+
+
+def dhash(gray):
+    """256-bit difference hash of a grayscale PIL image."""
+    pixels = gray.resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX).tobytes()
+    value = 0
+    for y in range(HASH_SIZE):
+        row = pixels[y * (HASH_SIZE + 1):(y + 1) * (HASH_SIZE + 1)]
+        for x in range(HASH_SIZE):
+            value = (value << 1) | (row[x + 1] > row[x])
+    return value
+
+
+def fingerprint(image_bytes):
+    """
+    The hashes of a receipt image: the whole frame, plus the document
+    alone when the paper stands out from a background. Comparing every pair
+    matches a photo of a receipt on a table with a tight scan of it.
+    Returns () without Pillow or for images it can't read.
+    """
+    if Image is None or not image_bytes:
+        return ()
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as image:
+            image.draft('L', (DECODE_SIZE, DECODE_SIZE))
+            gray = ImageOps.exif_transpose(image).convert('L')
+        hashes = [dhash(gray)]
+        box = find_document_box(gray)
+        if box:
+            hashes.append(dhash(gray.crop(box)))
+        return tuple(hashes)
+    except Exception as e:
+        print(f"Error fingerprinting receipt: {e}")
+        return ()
+
+
+def distance(a, b):
+    """The closest pair of two receipts' hashes."""
+    return min((hamming(x, y) for x in a for y in b), default=HASH_SIZE * HASH_SIZE)
+
+
+def _field_key(fields):
+    """(amount, date) of extracted fields, or None when either is missing."""
+    try:
+        amount = expense_model.parse_amount(fields.get('amount'))
+        day = expense_model.parse_date(fields.get('date'))
+    except ValueError:
+        return None
+    if amount is None or day is None:
+        return None
+    return amount, day
+
+
+def same_receipt(earlier, extracted):
+    """
+    The secondary check: the amount and the date agree, and so does the
+    vendor when both have one. Missing amounts or dates never match.
+    """
+    key = _field_key(earlier)
+    if key is None or key != _field_key(extracted):
+        return False
+    vendors = [vendor_index.normalize_vendor(fields.get('vendor')) for fields in (earlier, extracted)]
+    return not all(vendors) or vendors[0] == vendors[1]
+
+
+def describe(match, reused=False):
+    """
+    The ``duplicateOf`` part of a response. ``sameImage`` tells a copy of
+    the picture from a retake that only its fields give away.
+    """
+    duplicate = {'s3_key': match.s3_key, 'distance': match.distance,
+                 'sameImage': match.distance <= MAX_DISTANCE, 'reused': reused}
+    if match.entry.get('expenseId'):
+        duplicate['expenseId'] = match.entry['expenseId']
+    return duplicate
+
+
+class BKTree:
+    """
+    Hashes under Hamming distance. Each child hangs off its parent at their
+    distance, so a search for everything within ``radius`` of a hash only
+    descends into children whose edge is within ``radius`` of the parent's
+    own distance (triangle inequality) instead of comparing every hash.
+    """
+
+    def __init__(self):
+        self._root = None
+        self.size = 0
+
+    def add(self, value, item):
+        self.size += 1
+        if self._root is None:
+            self._root = (value, [item], {})
+            return
+        node = self._root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (value, [item], {})
+                return
+            node = child
+
+    def search(self, value, radius):
+        """(distance, item) pairs for every hash within ``radius`` of ``value``."""
+        found = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node_value, items, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                found.extend((distance, item) for item in items)
+            for edge, child in children.items():
+                if distance - radius <= edge <= distance + radius:
+                    stack.append(child)
+        return found
+
+
+class UserReceipts:
+    """
+    One user's receipt entries by s3_key, with their hashes in a BK-tree
+    and their s3_keys by extracted (amount, date).
+    """
+
+    def __init__(self):
+        self.entries = {}
+        self.tree = BKTree()
+        self.by_fields = {}
+
+    def add(self, s3_key, entry):
+        known = s3_key in self.entries
+        self.entries[s3_key] = entry
+        if not known:
+            for value in entry['hashes']:
+                self.tree.add(value, s3_key)
+        self.index_fields(s3_key)
+
+    def index_fields(self, s3_key):
+        for keys in self.by_fields.values():
+            keys.discard(s3_key)
+        key = _field_key(self.entries[s3_key])
+        if key is not None:
+            self.by_fields.setdefault(key, set()).add(s3_key)
+
+    def nearest(self, hashes, max_distance, exclude=None):
+        best = None
+        for value in hashes:
+            for distance, s3_key in self.tree.search(value, max_distance):
+                match = Match(s3_key, distance, self.entries[s3_key])
+                if s3_key != exclude and (best is None or _rank(match) < _rank(best)):
+                    best = match
+        return best
+
+    def same_fields(self, s3_key, extracted):
+        """The earlier receipt ``same_receipt`` matches, by ``_rank``."""
+        best = None
+        hashes = self.entries[s3_key]['hashes'] if s3_key in self.entries else ()
+        for other in self.by_fields.get(_field_key(extracted), ()):
+            entry = self.entries[other]
+            if other == s3_key or not same_receipt(entry, extracted):
+                continue
+            match = Match(other, distance(hashes, entry['hashes']), entry)
+            if best is None or _rank(match) < _rank(best):
+                best = match
+        return best
+
+
+def _rank(match):
+    # A saved receipt first, so a copy points at the expense rather than at
+    # another copy; then the closest image.
+    return not match.entry.get('expenseId'), match.distance, match.s3_key
+
+
+def _entry(item):
+    entry = {field: item[field] for field in EXTRACTED_FIELDS + ('expenseId',) if field in item}
+    entry['hashes'] = [int(value, 16) for value in item.get('hashes', [])]
+    return entry
+
+
+class ReceiptIndex:
+    """
+    Near-duplicate lookup over a user's receipt images.
+
+    Each user's entries are read from the table once and then searched in
+    memory, kept for ``CACHE_TTL_SECONDS`` in an LRU of ``CACHE_MAX_USERS``
+    users; writes update both. A receipt registered by another container
+    within the TTL is missed until the user is reloaded.
+    """
+
+    def __init__(self, table_name=RECEIPT_HASH_TABLE_NAME, ttl_seconds=CACHE_TTL_SECONDS,
+                 max_users=CACHE_MAX_USERS, clock=time.monotonic):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._clock = clock
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'checks': 0, 'image_matches': 0, 'field_matches': 0, 'loads': 0, 'errors': 0}
+
+    @property
+    def table(self):
+        return aws_clients.table(self.table_name)
+
+    def _load(self, user_id):
+        receipts = UserReceipts()
+        kwargs = {'KeyConditionExpression': Key('userId').eq(user_id)}
+        while True:
+            response = self.table.query(**kwargs)
+            for item in response.get('Items', []):
+                receipts.add(item['s3_key'], _entry(item))
+            if 'LastEvaluatedKey' not in response:
+                return receipts
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _receipts(self, user_id):
+        now = self._clock()
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached is not None and cached[1] > now:
+                self._users.move_to_end(user_id)
+                return cached[0]
+        receipts = self._load(user_id)
+        with self._lock:
+            self.stats['loads'] += 1
+            self._users[user_id] = (receipts, now + self.ttl_seconds)
+            self._users.move_to_end(user_id)
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        return receipts
+
+    def _cached(self, user_id):
+        with self._lock:
+            cached = self._users.get(user_id)
+        return cached[0] if cached is not None else None
+
+    def check(self, user_id, s3_key, image_bytes=None, hashes=None):
+        """
+        Register a receipt image and return the closest earlier one within
+        ``MAX_DISTANCE`` as a Match, or None. Hashes already registered for
+        ``s3_key`` are reused; otherwise they are ``hashes`` or computed from
+        ``image_bytes``. Never raises: the index only saves model calls.
+        """
+        try:
+            receipts = self._receipts(user_id)
+            entry = receipts.entries.get(s3_key)
+            if entry is None:
+                hashes = hashes or fingerprint(image_bytes)
+                if not hashes:
+                    return None
+                response = self.table.update_item(
+                    Key={'userId': user_id, 's3_key': s3_key},
+                    UpdateExpression='SET hashes = if_not_exists(hashes, :hashes), '
+                                     'createdAt = if_not_exists(createdAt, :now)',
+                    ExpressionAttributeValues={':hashes': [format(value, f'0{HASH_DIGITS}x') for value in hashes],
+                                               ':now': datetime.now(timezone.utc).isoformat()},
+                    ReturnValues='ALL_NEW',
+                )
+                entry = _entry(response['Attributes'])
+                with self._lock:
+                    receipts.add(s3_key, entry)
+            with self._lock:
+                self.stats['checks'] += 1
+                match = receipts.nearest(entry['hashes'], MAX_DISTANCE, exclude=s3_key)
+                if match is not None:
+                    self.stats['image_matches'] += 1
+            return match
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"Error checking receipt fingerprints for {user_id}: {e}")
+            return None
+
+    def _set(self, user_id, s3_key, values, condition=None, remove=()):
+        """SET ``values`` (and REMOVE ``remove``) on a registered entry, here and in the cache."""
+        names = {f'#f{i}': field for i, field in enumerate(list(values) + list(remove))}
+        clauses = ['SET ' + ', '.join(f'#f{i} = :v{i}' for i in range(len(values)))] if values else []
+        if remove:
+            clauses.append('REMOVE ' + ', '.join(f'#f{i}' for i in range(len(values), len(names))))
+        # Only entries an upload or extraction registered.
+        registered = Attr('hashes').exists()
+        kwargs = {
+            'Key': {'userId': user_id, 's3_key': s3_key},
+            'UpdateExpression': ' '.join(clauses),
+            'ExpressionAttributeNames': names,
+            'ConditionExpression': registered & condition if condition is not None else registered,
+        }
+        if values:
+            kwargs['ExpressionAttributeValues'] = {f':v{i}': value for i, value in enumerate(values.values())}
+        try:
+            self.table.update_item(**kwargs)
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                self.stats['errors'] += 1
+                print(f"Error updating receipt fingerprints for {user_id}: {e}")
+            return
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"Error updating receipt fingerprints for {user_id}: {e}")
+            return
+        receipts = self._cached(user_id)
+        if receipts is not None:
+            with self._lock:
+                entry = receipts.entries.get(s3_key)
+                if entry is not None:
+                    entry.update(values)
+                    for field in remove:
+                        entry.pop(field, None)
+                    receipts.index_fields(s3_key)
+
+    def record_extraction(self, user_id, s3_key, extracted_data):
+        """
+        Keep the extracted fields for reuse and for later receipts' checks,
+        and return the earlier receipt they match as a Match, or None.
+        """
+        values = {field: str(extracted_data[field]) for field in EXTRACTED_FIELDS
+                  if extracted_data.get(field) not in (None, '', expense_model.NOT_APPLICABLE)}
+        try:
+            receipts = self._receipts(user_id)
+            with self._lock:
+                match = receipts.same_fields(s3_key, extracted_data)
+                if match is not None:
+                    self.stats['field_matches'] += 1
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"Error checking receipt fields for {user_id}: {e}")
+            match = None
+        if values:
+            self._set(user_id, s3_key, values)
+        return match
+
+    def record_expense(self, user_id, s3_key, expense_id):
+        self._set(user_id, s3_key, {'expenseId': expense_id})
+
+    def forget_expense(self, user_id, s3_key, expense_id):
+        self._set(user_id, s3_key, {}, condition=Attr('expenseId').eq(expense_id), remove=('expenseId',))
+
+
+# Module scope, so loaded users survive across warm invocations. None when
+# no table is configured, which turns duplicate detection off.
+index = ReceiptIndex() if RECEIPT_HASH_TABLE_NAME else None
+
+
+def check(user_id, s3_key, image_bytes=None, hashes=None):
+    if index is None or not user_id:
+        return None
+    return index.check(user_id, s3_key, image_bytes, hashes)
+
+
+def record_extraction(user_id, s3_key, extracted_data):
+    if index is None or not user_id:
+        return None
+    return index.record_extraction(user_id, s3_key, extracted_data)
+
+
+def record_expense(user_id, s3_key, expense_id):
+    if index is not None and s3_key:
+        index.record_expense(user_id, s3_key, expense_id)
+
+
+def forget_expense(user_id, s3_key, expense_id):
+    if index is not None and s3_key:
+        index.forget_expense(user_id, s3_key, expense_id)
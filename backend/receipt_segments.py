@@ -0,0 +1,105 @@
+import difflib
+import os
+from collections import Counter
+from decimal import Decimal
+
+import expense_model
+import extraction_parser
+
+NOT_APPLICABLE = expense_model.NOT_APPLICABLE
+
+# A segment is one page of a receipt photographed in parts, or one tile of a
+# receipt too tall to read whole. Its prompt asks for the line items it
+# shows and for the amount only where it shows the final total, so that
+# item prices and subtotals on other segments are not taken for the total.
+SEGMENT_PROMPT = (
+    "This image is one part of a longer receipt: a page of it, or a section cut from it. "
+    "Extract the vendor name, category (e.g., Food, Transport, Utilities, Entertainment, Groceries, "
+    "Shopping, Health, Education, Travel, Other), description and date if this part shows them. "
+    "For amount, give the receipt's final total (Total, Amount Due, Balance) only if it appears in this part; "
+    "never a subtotal or an item price. List the purchased items this part shows, top to bottom, as items: "
+    "[{\"name\": ..., \"price\": ...}], leaving out any item whose price is cut off. "
+    "If any information is missing or unreadable, use 'Not Applicable'. "
+    "Provide the output in a JSON format with keys: vendor, amount, category, description, date, items."
+)
+SEGMENT_FIELDS = extraction_parser.RECEIPT_FIELDS + ('items',)
+# Item lists run longer than the five fields.
+SEGMENT_MAX_OUTPUT_TOKENS = int(os.environ.get('BEDROCK_SEGMENT_MAX_TOKENS', 1024))
+# Pages accepted in one request; tiles are capped by INFERENCE_MAX_TILES.
+MAX_PAGES = int(os.environ.get('EXTRACTION_MAX_PAGES', 6))
+
+# Item names read from two overlapping tiles rarely come back identical.
+NAME_SIMILARITY = 0.8
+
+
+def _same_item(a, b):
+    if a['price'] != b['price']:
+        return False
+    name_a, name_b = a['name'].lower(), b['name'].lower()
+    return name_a == name_b or difflib.SequenceMatcher(None, name_a, name_b).ratio() >= NAME_SIMILARITY
+
+
+def overlap(previous, following):
+    """
+    How many items at the start of ``following`` repeat the items at the end
+    of ``previous``: the longest such run, read twice where the two
+    segments overlap.
+    """
+    for count in range(min(len(previous), len(following)), 0, -1):
+        if all(_same_item(a, b) for a, b in zip(previous[-count:], following[:count])):
+            return count
+    return 0
+
+
+def merge_items(segments):
+    """The segments' line items in order, with the overlap between neighbours read once."""
+    items = []
+    previous = []
+    for segment in segments:
+        current = segment.get('items')
+        current = current if isinstance(current, list) else []
+        items.extend(current[overlap(previous, current):])
+        previous = current
+    return items
+
+
+def _first(segments, field):
+    return next((segment[field] for segment in segments if segment.get(field, NOT_APPLICABLE) != NOT_APPLICABLE),
+                NOT_APPLICABLE)
+
+
+def merge(segments):
+    """
+    One receipt's fields from its segments' answers, in page order.
+
+    The vendor, date and description come from the first segment that has
+    them, as receipts print them at the top. The amount is the last total
+    read, as totals are at the bottom; when no segment shows one, it is the
+    sum of the line items, if every segment listed them with prices. The
+    category is the one most segments agree on.
+
+    Returns:
+        An (extracted_data, items) tuple: the five receipt fields, and the
+        merged line items.
+    """
+    items = merge_items(segments)
+    amount = next((segment['amount'] for segment in reversed(segments)
+                   if segment.get('amount', NOT_APPLICABLE) != NOT_APPLICABLE), NOT_APPLICABLE)
+    # Only when every segment listed its items: a failed one would leave
+    # the sum short.
+    listed = all(isinstance(segment.get('items'), list) for segment in segments)
+    if amount == NOT_APPLICABLE and listed and items and all(item['price'] != NOT_APPLICABLE for item in items):
+        amount = str(sum(Decimal(item['price']) for item in items))
+
+    votes = Counter(segment['category'] for segment in segments
+                    if segment.get('category', NOT_APPLICABLE) not in (NOT_APPLICABLE, expense_model.Category.OTHER.value))
+    category = votes.most_common(1)[0][0] if votes else _first(segments, 'category')
+
+    extracted_data = {
+        'vendor': _first(segments, 'vendor'),
+        'amount': amount,
+        'category': category,
+        'description': _first(segments, 'description'),
+        'date': _first(segments, 'date'),
+    }
+    return extracted_data, items
@@ -0,0 +1,93 @@
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+import aws_clients
+import instrumentation
+from image_preprocessing import (EXTENSIONS, derivative_key, detect_media_type, prepare_inference_image,
+                                 prepare_view_images)
+
+S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
+# Each variant key only ever holds one image, so caches may keep it.
+VIEW_CACHE_CONTROL = 'private, max-age=31536000, immutable'
+
+def store_view_images(s3_key, image_bytes):
+    """
+    Store the thumbnail and medium copies of a receipt under their
+    derivative keys, in parallel.
+
+    Returns:
+        The names of the variants stored.
+    """
+    with instrumentation.phase('views'):
+        views = prepare_view_images(image_bytes)
+    if not views:
+        return []
+    s3_client = aws_clients.client('s3')
+
+    def put(variant):
+        data, media_type = views[variant]
+        s3_client.put_object(
+            Bucket=S3_BUCKET_NAME,
+            Key=derivative_key(s3_key, variant),
+            Body=data,
+            ContentType=media_type,
+            CacheControl=VIEW_CACHE_CONTROL
+        )
+
+    with ThreadPoolExecutor(max_workers=len(views)) as pool:
+        list(pool.map(put, views))
+    return sorted(views)
+
+def store_receipt_image(image_bytes, file_name=None):
+    """
+    Store an uploaded receipt, its inference derivative and its view
+    variants in S3.
+
+    Returns:
+        An (s3_key, inference_key) tuple.
+    """
+    media_type = detect_media_type(image_bytes)
+    if not file_name:
+        file_name = str(uuid.uuid4()) + EXTENSIONS.get(media_type, '.jpg')
+
+    # Generate a unique key for S3
+    s3_key = f"receipts/{file_name}"
+
+    s3_client = aws_clients.client('s3')
+
+    # Upload the original image to S3
+    s3_client.put_object(
+        Bucket=S3_BUCKET_NAME,
+        Key=s3_key,
+        Body=image_bytes,
+        ContentType=media_type
+    )
+
+    # Store a small grayscale derivative for Bedrock next to the original
+    with instrumentation.phase('preprocess'):
+        inference_bytes, inference_media_type = prepare_inference_image(image_bytes)
+    inference_key = derivative_key(s3_key, 'inference')
+    s3_client.put_object(
+        Bucket=S3_BUCKET_NAME,
+        Key=inference_key,
+        Body=inference_bytes,
+        ContentType=inference_media_type
+    )
+    store_view_images(s3_key, image_bytes)
+    return s3_key, inference_key
+
+
+if __name__ == '__main__':
+    # Backfill view variants for receipts stored before they existed:
+    # S3_BUCKET_NAME=... python receipt_storage.py
+    s3_client = aws_clients.client('s3')
+    paginator = s3_client.get_paginator('list_objects_v2')
+    existing = {obj['Key'] for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix=derivative_key('receipts/', 'thumbnail'))
+                for obj in page.get('Contents', [])}
+    for page in paginator.paginate(Bucket=S3_BUCKET_NAME, Prefix='receipts/'):
+        for obj in page.get('Contents', []):
+            if derivative_key(obj['Key'], 'thumbnail') in existing:
+                continue
+            image_bytes = s3_client.get_object(Bucket=S3_BUCKET_NAME, Key=obj['Key'])['Body'].read()
+            print(f"{obj['Key']}: {', '.join(store_view_images(obj['Key'], image_bytes)) or 'not an image'}")
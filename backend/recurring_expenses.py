@@ -0,0 +1,382 @@
+import calendar
+import os
+import sys
+import time
+from datetime import date, timedelta
+
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional; without it the same statistics run in pure Python.
+    np = None
+
+import aws_clients
+import expense_model
+from expense_pages import iter_expenses
+from vendor_index import normalize_vendor
+
+# HASH userId, RANGE vendorKey (the normalized vendor name). One item per
+# user and vendor holding its latest occurrences and the flags written back
+# for them, so a save only re-examines one vendor.
+RECURRING_TABLE_NAME = os.environ.get('DYNAMODB_RECURRING_TABLE_NAME')
+EXPENSES_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
+
+# (name, days between payments, tolerance in days). A monthly bill lands
+# 28-31 days apart, and a payment can slip a few days either way.
+PERIODS = (
+    ('weekly', 7.0, 1.5),
+    ('monthly', 30.44, 3.5),
+    ('annual', 365.25, 10.0),
+)
+# Payments to a vendor are one series while each amount is within this
+# share of the next smaller one, so a subscription's price rise continues it.
+AMOUNT_TOLERANCE = float(os.environ.get('RECURRING_AMOUNT_TOLERANCE', 0.2))
+MIN_OCCURRENCES = int(os.environ.get('RECURRING_MIN_OCCURRENCES', 3))
+# The share of a series' gaps that must match its period; a missed or
+# doubled payment does not break it.
+MIN_REGULARITY = 0.75
+# Occurrences kept per vendor for the detection on save.
+MAX_OCCURRENCES = 60
+STATE_ATTEMPTS = 3
+
+
+def add_period(day, period):
+    """The date a payment made on ``day`` is next due; month ends are clamped."""
+    if period == 'weekly':
+        return day + timedelta(days=7)
+    months = 1 if period == 'monthly' else 12
+    year, month = divmod(day.month - 1 + months, 12)
+    year += day.year
+    return date(year, month + 1, min(day.day, calendar.monthrange(year, month + 1)[1]))
+
+
+def _detect_numpy(groups, cents, days):
+    groups, cents, days = np.asarray(groups), np.asarray(cents), np.asarray(days)
+    # Split each vendor's payments into amount bands.
+    order = np.lexsort((cents, groups))
+    g, c = groups[order], cents[order]
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = (g[1:] != g[:-1]) | (c[1:] > c[:-1] * (1 + AMOUNT_TOLERANCE))
+    series = np.empty(len(order), dtype=np.int64)
+    series[order] = np.cumsum(starts) - 1
+    count = int(series.max()) + 1
+
+    # Gaps between consecutive payment days within each series.
+    order = np.lexsort((days, series))
+    s, d = series[order], days[order]
+    gaps = np.diff(d)
+    owner = s[1:]
+    counted = (owner == s[:-1]) & (gaps > 0)
+    intervals = np.bincount(owner[counted], minlength=count)
+    hits = np.stack([np.bincount(owner[counted & (np.abs(gaps - length) <= tolerance)], minlength=count)
+                     for _, length, tolerance in PERIODS])
+    best = hits.argmax(axis=0)
+    best_hits = hits[best, np.arange(count)]
+    found = ((intervals + 1 >= MIN_OCCURRENCES) & (best_hits + 1 >= MIN_OCCURRENCES)
+             & (best_hits >= MIN_REGULARITY * np.maximum(intervals, 1)))
+    ends = np.flatnonzero(np.append(s[1:] != s[:-1], True))
+    return series.tolist(), np.where(found, best, -1).tolist(), d[ends].tolist()
+
+
+def _detect_python(groups, cents, days):
+    rows = range(len(groups))
+    series = [0] * len(groups)
+    count = -1
+    previous = None
+    for row in sorted(rows, key=lambda row: (groups[row], cents[row])):
+        if (previous is None or groups[row] != groups[previous]
+                or cents[row] > cents[previous] * (1 + AMOUNT_TOLERANCE)):
+            count += 1
+        series[row] = count
+        previous = row
+    count += 1
+
+    intervals = [0] * count
+    hits = [[0] * count for _ in PERIODS]
+    last = [0] * count
+    previous = None
+    for row in sorted(rows, key=lambda row: (series[row], days[row])):
+        owner = series[row]
+        last[owner] = days[row]
+        if previous is not None and series[previous] == owner and days[row] > days[previous]:
+            gap = days[row] - days[previous]
+            intervals[owner] += 1
+            for j, (_, length, tolerance) in enumerate(PERIODS):
+                if abs(gap - length) <= tolerance:
+                    hits[j][owner] += 1
+        previous = row
+    periods = []
+    for owner in range(count):
+        best = max(range(len(PERIODS)), key=lambda j: (hits[j][owner], -j))
+        found = (intervals[owner] + 1 >= MIN_OCCURRENCES and hits[best][owner] + 1 >= MIN_OCCURRENCES
+                 and hits[best][owner] >= MIN_REGULARITY * max(intervals[owner], 1))
+        periods.append(best if found else -1)
+    return series, periods, last
+
+
+def detect(groups, cents, days, today):
+    """
+    Find the recurring payments among expenses given as parallel lists:
+    a vendor group number, the amount in cents and the date as an ordinal.
+
+    Within each group, payments are split into series by amount, and a
+    series recurs if it has ``MIN_OCCURRENCES`` payments and
+    ``MIN_REGULARITY`` of the gaps between them match one of ``PERIODS``.
+    With NumPy the interval statistics for every series are computed in one
+    pass over the arrays.
+
+    Returns:
+        A list with one (period, next_date) pair per expense: period is
+        None if it does not recur, and next_date, an ISO date, is set on a
+        series' latest payment while the next one is still expected.
+    """
+    if not groups:
+        return []
+    series, periods, last = (_detect_numpy if np is not None else _detect_python)(groups, cents, days)
+    latest = {}
+    for row, owner in enumerate(series):
+        if periods[owner] >= 0 and days[row] == last[owner]:
+            latest.setdefault(owner, row)
+    result = []
+    for row, owner in enumerate(series):
+        if periods[owner] < 0:
+            result.append((None, None))
+            continue
+        name, _, tolerance = PERIODS[periods[owner]]
+        next_date = None
+        if latest[owner] == row:
+            due = add_period(date.fromordinal(last[owner]), name)
+            if today - due.toordinal() <= tolerance:
+                next_date = due.isoformat()
+        result.append((name, next_date))
+    return result
+
+
+def occurrence(expense):
+    """(vendorKey, date ordinal, cents) for an expense, or None if it cannot recur."""
+    if not expense:
+        return None
+    key = normalize_vendor(expense.get('vendor'))
+    try:
+        day = expense_model.parse_date(expense.get('date'))
+        amount = expense_model.parse_amount(expense.get('amount'))
+    except ValueError:
+        return None
+    if not key or day is None or amount is None or amount <= 0:
+        return None
+    return key, day.toordinal(), int(amount * 100)
+
+
+class RecurringDetector:
+    """
+    Flags expenses that repeat weekly, monthly or yearly at a vendor.
+
+    Flags are written back to the expense items: ``isRecurring``, the
+    ``recurrence`` period, and ``nextExpectedDate`` on a series' latest
+    payment. Each save updates the vendor's state item (its latest
+    ``MAX_OCCURRENCES`` payments) and re-runs the detection over those alone;
+    ``rescan`` runs it over a user's whole history. Flags a user set by
+    hand are kept, and unticking a detected one stops detection for that
+    vendor.
+    """
+
+    def __init__(self, table_name=RECURRING_TABLE_NAME, expenses_table_name=EXPENSES_TABLE_NAME,
+                 today=date.today):
+        self.table_name = table_name
+        self.expenses_table_name = expenses_table_name
+        self._today = today
+        self.stats = {'changes': 0, 'flagged': 0, 'unflagged': 0, 'conflicts': 0, 'errors': 0}
+
+    @property
+    def table(self):
+        return aws_clients.table(self.table_name)
+
+    def _write_flags(self, user_id, expense_id, manual, period, next_date):
+        """Set or clear one expense's detected recurrence; a deleted expense is left deleted."""
+        names = {'#recurring': 'isRecurring', '#recurrence': 'recurrence', '#next': 'nextExpectedDate'}
+        if period is None:
+            update = 'SET #recurring = :recurring REMOVE #recurrence, #next'
+            values = {':recurring': manual}
+        else:
+            update = 'SET #recurring = :recurring, #recurrence = :recurrence'
+            values = {':recurring': True, ':recurrence': period}
+            if next_date is None:
+                update += ' REMOVE #next'
+            else:
+                update += ', #next = :next'
+                values[':next'] = next_date
+        try:
+            aws_clients.table(self.expenses_table_name).update_item(
+                Key={'userId': user_id, 'expenseId': expense_id},
+                UpdateExpression=update,
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues=values,
+                ConditionExpression=Attr('expenseId').exists(),
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                raise
+        self.stats['flagged' if period is not None else 'unflagged'] += 1
+
+    def _apply(self, user_id, key, changes):
+        """
+        Fold the (old, new) pairs touching vendor ``key`` into its state,
+        detect again and write back the flags that changed. The state is
+        swapped with a version condition, so concurrent saves retry instead
+        of losing a payment.
+        """
+        for _ in range(STATE_ATTEMPTS):
+            state = self.table.get_item(Key={'userId': user_id, 'vendorKey': key},
+                                        ConsistentRead=True).get('Item') or {}
+            # [expenseId, date ordinal, cents, set by hand, period, nextExpectedDate]
+            occurrences = {row[0]: [row[0], int(row[1]), int(row[2]), bool(row[3]), row[4], row[5]]
+                           for row in state.get('occurrences', [])}
+            dismissed = bool(state.get('dismissed'))
+            for old, new in changes:
+                expense_id = (new or old)['expenseId']
+                previous = occurrences.pop(expense_id, None)
+                found = occurrence(new)
+                if found is None or found[0] != key:
+                    continue
+                was_recurring = bool(old.get('isRecurring')) if old else False
+                recurring = bool(new.get('isRecurring'))
+                detected = (old or {}).get('recurrence')
+                if detected and was_recurring and not recurring:
+                    # The user unticked a detected flag: stop detecting here.
+                    dismissed = True
+                if recurring == was_recurring:
+                    manual = previous[3] if previous is not None else recurring and not detected
+                else:
+                    manual = recurring
+                    if recurring:
+                        dismissed = False
+                occurrences[expense_id] = [expense_id, found[1], found[2], manual,
+                                           detected, (old or {}).get('nextExpectedDate')]
+            rows = sorted(occurrences.values(), key=lambda row: row[1])[-MAX_OCCURRENCES:]
+            if dismissed:
+                flags = [(None, None)] * len(rows)
+            else:
+                flags = detect([0] * len(rows), [row[2] for row in rows], [row[1] for row in rows],
+                               self._today().toordinal())
+            writes = []
+            for row, flag in zip(rows, flags):
+                if (row[4], row[5] if row[4] else None) != flag:
+                    writes.append((row[0], row[3]) + flag)
+                    row[4], row[5] = flag
+            version = int(state.get('version', 0))
+            try:
+                if rows:
+                    self.table.put_item(
+                        Item={'userId': user_id, 'vendorKey': key, 'occurrences': rows,
+                              'dismissed': dismissed, 'version': version + 1},
+                        ConditionExpression=(Attr('version').eq(version) if state
+                                             else Attr('version').not_exists()))
+                elif state:
+                    self.table.delete_item(Key={'userId': user_id, 'vendorKey': key},
+                                           ConditionExpression=Attr('version').eq(version))
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                    raise
+                self.stats['conflicts'] += 1
+                continue
+            for write in writes:
+                self._write_flags(user_id, *write)
+            return
+        raise RuntimeError(f'The recurring state for {user_id}/{key} kept changing; try again.')
+
+    def record_changes(self, user_id, changes):
+        """
+        Re-detect the vendors touched by (old, new) expense pairs: ``old`` is
+        None for a new expense and ``new`` None for a deleted one. Failures
+        are logged: the expenses are already stored, and ``rescan`` repairs
+        the flags.
+        """
+        by_key = {}
+        for old, new in changes:
+            for expense in (old, new):
+                found = occurrence(expense)
+                if found is not None:
+                    by_key.setdefault(found[0], []).append((old, new))
+        for key, key_changes in by_key.items():
+            try:
+                # A pair whose vendor changed is listed under both keys, once each.
+                self._apply(user_id, key, list({id(pair): pair for pair in key_changes}.values()))
+                self.stats['changes'] += len(key_changes)
+            except Exception as e:
+                self.stats['errors'] += 1
+                print(f"Error detecting recurring expenses for {user_id}: {e}")
+
+    def rescan(self, user_id):
+        """
+        Re-detect a user's whole history and rewrite every vendor's state.
+        Run it as a backfill, when saves for the user are quiet.
+        """
+        dismissed, versions = set(), {}
+        kwargs = {'KeyConditionExpression': Key('userId').eq(user_id)}
+        while True:
+            response = self.table.query(**kwargs)
+            for item in response.get('Items', []):
+                versions[item['vendorKey']] = int(item.get('version', 0))
+                if item.get('dismissed'):
+                    dismissed.add(item['vendorKey'])
+            if 'LastEvaluatedKey' not in response:
+                break
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+        keys, rows = {}, []
+        for item in iter_expenses(aws_clients.table(self.expenses_table_name), user_id):
+            found = occurrence(item)
+            if found is not None:
+                rows.append((keys.setdefault(found[0], len(keys)), found[1], found[2], item))
+        started = time.perf_counter()
+        flags = detect([row[0] for row in rows], [row[2] for row in rows], [row[1] for row in rows],
+                       self._today().toordinal())
+        elapsed = time.perf_counter() - started
+
+        names = {number: key for key, number in keys.items()}
+        states = {}
+        writes = recurring = 0
+        for (group, day, cents, item), flag in zip(rows, flags):
+            key = names[group]
+            if key in dismissed:
+                flag = (None, None)
+            recurring += flag[0] is not None
+            current = (item.get('recurrence'), item.get('nextExpectedDate') if item.get('recurrence') else None)
+            manual = bool(item.get('isRecurring')) and not item.get('recurrence')
+            if current != flag:
+                self._write_flags(user_id, item['expenseId'], manual, *flag)
+                writes += 1
+            states.setdefault(key, []).append([item['expenseId'], day, cents, manual] + list(flag))
+        with self.table.batch_writer() as writer:
+            for key, occurrences in states.items():
+                occurrences.sort(key=lambda row: row[1])
+                writer.put_item(Item={'userId': user_id, 'vendorKey': key,
+                                      'occurrences': occurrences[-MAX_OCCURRENCES:],
+                                      'dismissed': key in dismissed, 'version': versions.get(key, 0) + 1})
+            for key in set(versions) - set(states):
+                writer.delete_item(Key={'userId': user_id, 'vendorKey': key})
+        return {'expenses': len(rows), 'recurring': recurring, 'writes': writes, 'detect_seconds': round(elapsed, 3)}
+
+
+# Module scope like the other indexes. None when no table is configured,
+# which turns detection off.
+detector = RecurringDetector() if RECURRING_TABLE_NAME else None
+
+
+def record_change(user_id, old, new):
+    if detector is not None:
+        detector.record_changes(user_id, [(old, new)])
+
+
+def record_changes(user_id, changes):
+    if detector is not None and changes:
+        detector.record_changes(user_id, changes)
+
+
+if __name__ == '__main__':
+    # Detect over users' existing expenses, or repair their flags:
+    #   DYNAMODB_TABLE_NAME=... DYNAMODB_RECURRING_TABLE_NAME=... python recurring_expenses.py user@example.com [...]
+    for user_id in sys.argv[1:]:
+        print(f"{user_id}: {detector.rescan(user_id)}")
@@ -1,22 +1,23 @@
 import json
 import os
-import boto3
-import uuid
-
-dynamodb = boto3.resource('dynamodb')
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+import aws_clients
+import instrumentation
+import expense_aggregates
+import receipt_fingerprints
+import recurring_expenses
+import search_index
+import vendor_index
+from expense_model import Expense, ExpenseValidationError
 
 TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
 
+@instrumentation.traced
 def lambda_handler(event, context):
     try:
         # When invoked directly, the payload is the event itself
         user_id = event.get('userId')
-        vendor = event.get('vendor', 'Not Applicable')
-        amount = str(event.get('amount', 'Not Applicable'))
-        category = event.get('category', 'Not Applicable')
-        description = event.get('description', 'Not Applicable')
-        date = event.get('date', 'Not Applicable')
-        s3_key = event.get('s3_key', None)
 
         if not user_id:
             return {
@@ -24,25 +25,43 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'userId is required.'})
             }
 
-        table = dynamodb.Table(TABLE_NAME)
-        
-        expense_id = str(uuid.uuid4())
-        
-        item = {
-            'userId': user_id,
-            'expenseId': expense_id,
-            'vendor': vendor,
-            'amount': amount,
-            'category': category,
-            'description': description,
-            'date': date,
-            'createdAt': json.dumps(context.get_remaining_time_in_millis()), # Placeholder for actual timestamp
-        }
-        
-        if s3_key:
-            item['s3_key'] = s3_key
+        try:
+            expense = Expense.from_event(event)
+        except ExpenseValidationError as e:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': str(e), 'fields': e.errors})
+            }
 
-        table.put_item(Item=item)
+        table = aws_clients.table(TABLE_NAME)
+
+        # A client retrying with the same idempotency key gets the same id back
+        # instead of a second copy of the expense.
+        idempotency_key = event.get('idempotencyKey')
+        expense_id = expense.new_id(idempotency_key)
+        item = expense.to_item()
+
+        if idempotency_key:
+            try:
+                table.put_item(Item=item, ConditionExpression=Attr('expenseId').not_exists())
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+                    raise
+                return {
+                    'statusCode': 200,
+                    'body': json.dumps({
+                        'message': 'Expense already saved',
+                        'expenseId': expense_id
+                    })
+                }
+        else:
+            table.put_item(Item=item)
+        expense_aggregates.record_change(user_id, None, item)
+        vendor_index.record_change(user_id, None, item)
+        search_index.record_change(user_id, None, item)
+        recurring_expenses.record_change(user_id, None, item)
+        # Later copies of this receipt are reported against this expense.
+        receipt_fingerprints.record_expense(user_id, expense.s3_key, expense_id)
 
         return {
             'statusCode': 200,
@@ -51,13 +70,8 @@ def lambda_handler(event, context):
                 'expenseId': expense_id
             })
         }
-    except KeyError as e:
-        return {
-            'statusCode': 400,
-            'body': json.dumps({'error': f'Missing key in request body: {e}'})
-        }
     except Exception as e:
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
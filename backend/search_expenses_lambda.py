@@ -0,0 +1,48 @@
+import json
+
+import instrumentation
+import search_index
+from expense_pages import InvalidContinuationToken, parse_page_size
+
+@instrumentation.traced
+def lambda_handler(event, context):
+    try:
+        user_id = event.get('userId')
+
+        if not user_id:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'userId is required.'})
+            }
+
+        try:
+            page_size = parse_page_size(event.get('limit'))
+            query = search_index.Query.from_event(event)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': str(e)})
+            }
+
+        try:
+            with instrumentation.phase('search'):
+                expense_ids, next_token = search_index.search(user_id, query, page_size, event.get('nextToken'))
+        except InvalidContinuationToken as e:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': str(e)})
+            }
+
+        return {
+            'statusCode': 200,
+            'body': json.dumps({
+                'message': 'Search completed',
+                'expenseIds': expense_ids,
+                'nextToken': next_token
+            })
+        }
+    except Exception as e:
+        return {
+            'statusCode': 500,
+            'body': json.dumps({'error': str(e)})
+        }
@@ -0,0 +1,592 @@
+import bisect
+import difflib
+import hashlib
+import json
+import os
+import re
+import sys
+import threading
+import time
+import unicodedata
+import uuid
+import zlib
+from collections import OrderedDict
+
+from boto3.dynamodb.conditions import Attr, Key
+from botocore.exceptions import ClientError
+
+import aws_clients
+import expense_model
+from expense_pages import decode_continuation_token, encode_continuation_token, iter_expenses
+
+# HASH userId, RANGE change. One journal item per expense write, keyed by
+# when it happened ('<microseconds>#<expenseId>') and holding the fields as
+# written, or deleted; plus the SNAPSHOT_ITEM naming the S3 snapshot the
+# journal replays onto.
+SEARCH_INDEX_TABLE_NAME = os.environ.get('DYNAMODB_SEARCH_INDEX_TABLE_NAME')
+EXPENSES_TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
+S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
+SNAPSHOT_PREFIX = 'search-index/'
+# Sorts after every change id, so a journal query returns it last.
+SNAPSHOT_ITEM = '~snapshot'
+
+# Journal entries are folded into a new snapshot once there are this many.
+COMPACT_AFTER = int(os.environ.get('SEARCH_INDEX_COMPACT_AFTER', 500))
+# Only entries older than this are folded in or deleted, so a write from a
+# container whose clock runs behind, or that lands late, is never lost.
+SETTLE_SECONDS = 60
+# Loaded users are kept this long in a warm container, LRU-bounded; every
+# search also reads the journal written since, so other containers' writes
+# show up at once.
+CACHE_TTL_SECONDS = int(os.environ.get('SEARCH_INDEX_CACHE_TTL_SECONDS', 900))
+CACHE_MAX_USERS = int(os.environ.get('SEARCH_INDEX_CACHE_USERS', 64))
+LOAD_ATTEMPTS = 3
+
+# The fields a journal entry keeps; the index is built from these alone.
+INDEXED_FIELDS = ('vendor', 'description', 'category', 'amount', 'date')
+# A query word matches the indexed words it starts ('star' finds
+# 'starbucks'), up to this many; one that starts none, and is long enough,
+# matches near misses ('strabucks').
+MAX_PREFIX_TERMS = 200
+MIN_FUZZY_LENGTH = 4
+FUZZY_CUTOFF = 0.8
+
+_DROPPED = re.compile(r"['’`.]")
+_SEPARATORS = re.compile(r'[^a-z0-9]+')
+_STOP_WORDS = frozenset(('a', 'an', 'and', 'at', 'for', 'in', 'of', 'on', 'the', 'to'))
+
+
+def tokenize(text, split_hyphens=True):
+    """
+    The search words in a piece of text: lower case, accents and
+    apostrophes dropped. Indexed hyphenated words are kept both whole and
+    split, so 'Wal-Mart' is found by 'walmart', 'wal-mart' and 'mart'.
+    """
+    if text is None or text == expense_model.NOT_APPLICABLE:
+        return set()
+    text = _DROPPED.sub('', unicodedata.normalize('NFKD', str(text)).encode('ascii', 'ignore').decode('ascii').lower())
+    words = set(_SEPARATORS.split(text.replace('-', '')))
+    if split_hyphens:
+        words |= set(_SEPARATORS.split(text))
+    return {word for word in words if word and word not in _STOP_WORDS}
+
+
+def document(fields):
+    """(date, cents, category, terms) of an expense item or journal entry."""
+    expense = expense_model.Expense.from_item(fields)
+    category = expense.category.value
+    terms = tokenize(expense.vendor) | tokenize(expense.description) | tokenize(category)
+    return (expense.date.isoformat() if expense.date is not None else '',
+            int(expense.amount * 100) if expense.amount is not None else None,
+            category, frozenset(terms))
+
+
+def change_id(seconds, expense_id=''):
+    return f'{int(seconds * 1_000_000):016d}#{expense_id}'
+
+
+class Query:
+    """
+    A parsed search: words that must all match, and optional date, amount
+    and category predicates.
+    """
+
+    def __init__(self, text='', start_date=None, end_date=None, min_cents=None, max_cents=None, category=None):
+        self.words = sorted(tokenize(text, split_hyphens=False))
+        self.start_date = start_date
+        self.end_date = end_date
+        self.min_cents = min_cents
+        self.max_cents = max_cents
+        self.category = category
+
+    @classmethod
+    def from_event(cls, event):
+        """
+        Raises:
+            ValueError: naming the first invalid parameter.
+        """
+        values = {}
+        for name, field in (('startDate', 'start_date'), ('endDate', 'end_date')):
+            try:
+                day = expense_model.parse_date(event.get(name))
+            except ValueError as e:
+                raise ValueError(f'{name}: {e}')
+            values[field] = day.isoformat() if day is not None else None
+        for name, field in (('minAmount', 'min_cents'), ('maxAmount', 'max_cents')):
+            try:
+                amount = expense_model.parse_amount(event.get(name))
+            except ValueError as e:
+                raise ValueError(f'{name}: {e}')
+            values[field] = int(amount * 100) if amount is not None else None
+        if event.get('category'):
+            values['category'] = expense_model.parse_category(event['category']).value
+        text = event.get('q') or ''
+        if not isinstance(text, str):
+            raise ValueError('q must be a string.')
+        return cls(text, **values)
+
+    def signature(self):
+        """Ties a nextToken to the query it continues."""
+        parts = [self.words, self.start_date, self.end_date, self.min_cents, self.max_cents, self.category]
+        return hashlib.sha256(json.dumps(parts).encode('utf-8')).hexdigest()[:16]
+
+
+class UserSearchIndex:
+    """
+    One user's expenses as an inverted index: each search word maps to the
+    set of expenseIds it appears in (vendor, description or category), the
+    words are kept sorted for prefix lookups, and (date, expenseId) pairs
+    are kept sorted for date ranges and newest-first results.
+    """
+
+    def __init__(self):
+        self.docs = {}
+        self.postings = {}
+        self.terms = []
+        self.by_date = []
+        # Journal position: the snapshot this was loaded from, and the
+        # entries applied on top of it.
+        self.version = None
+        self.watermark = ''
+        self.pending = set()
+        self.checked = 0.0
+
+    def __len__(self):
+        return len(self.docs)
+
+    def put(self, expense_id, doc):
+        self.remove(expense_id)
+        self.docs[expense_id] = doc
+        bisect.insort(self.by_date, (doc[0], expense_id))
+        for term in doc[3]:
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = set()
+                bisect.insort(self.terms, term)
+            posting.add(expense_id)
+
+    def remove(self, expense_id):
+        doc = self.docs.pop(expense_id, None)
+        if doc is None:
+            return
+        del self.by_date[bisect.bisect_left(self.by_date, (doc[0], expense_id))]
+        for term in doc[3]:
+            posting = self.postings[term]
+            posting.discard(expense_id)
+            if not posting:
+                del self.postings[term]
+                del self.terms[bisect.bisect_left(self.terms, term)]
+
+    def apply(self, entry):
+        """Replay one journal entry; entries hold whole expenses, so replaying twice is harmless."""
+        if entry.get('deleted'):
+            self.remove(entry['expenseId'])
+        else:
+            self.put(entry['expenseId'], document(entry))
+
+    def matching_terms(self, word):
+        """The indexed words a query word matches: those it starts, else near misses."""
+        terms = self.terms
+        i = bisect.bisect_left(terms, word)
+        matched = []
+        while i < len(terms) and terms[i].startswith(word) and len(matched) < MAX_PREFIX_TERMS:
+            matched.append(terms[i])
+            i += 1
+        if not matched and len(word) >= MIN_FUZZY_LENGTH:
+            same_initial = terms[bisect.bisect_left(terms, word[0]):bisect.bisect_left(terms, chr(ord(word[0]) + 1))]
+            matched = difflib.get_close_matches(word, same_initial, n=3, cutoff=FUZZY_CUTOFF)
+        return matched
+
+    def _accept(self, expense_id, query):
+        _, cents, category, _ = self.docs[expense_id]
+        if query.category is not None and category != query.category:
+            return False
+        if query.min_cents is not None and (cents is None or cents < query.min_cents):
+            return False
+        if query.max_cents is not None and (cents is None or cents > query.max_cents):
+            return False
+        return True
+
+    def search(self, query, limit, after=None):
+        """
+        The expenseIds matching ``query``, newest first, at most ``limit``
+        of them after the (date, expenseId) cursor ``after``.
+
+        Returns:
+            An (expense_ids, cursor) tuple; cursor is None on the last page.
+        """
+        candidates = None
+        if query.words:
+            matches = []
+            for word in query.words:
+                terms = self.matching_terms(word)
+                if not terms:
+                    return [], None
+                matches.append(self.postings[terms[0]] if len(terms) == 1
+                               else set().union(*(self.postings[term] for term in terms)))
+            matches.sort(key=len)
+            candidates = matches[0].intersection(*matches[1:]) if len(matches) > 1 else matches[0]
+
+        # Undated expenses sort first, so any date range leaves them out.
+        low = bisect.bisect_left(self.by_date, (query.start_date,)) if query.start_date else 0
+        high = bisect.bisect_right(self.by_date, (query.end_date, '\uffff')) if query.end_date else len(self.by_date)
+        if after is not None:
+            after = tuple(after)
+            high = min(high, bisect.bisect_left(self.by_date, after))
+
+        # Walking the date order costs about limit * window / matches steps,
+        # sorting the matches about len(matches); do whichever is cheaper.
+        found = []
+        window = max(high - low, 0)
+        if candidates is None or len(candidates) ** 2 > (limit + 1) * window:
+            for i in range(high - 1, low - 1, -1):
+                key = self.by_date[i]
+                if (candidates is None or key[1] in candidates) and self._accept(key[1], query):
+                    found.append(key)
+                    if len(found) > limit:
+                        break
+        else:
+            for expense_id in candidates:
+                key = (self.docs[expense_id][0], expense_id)
+                if query.start_date and key[0] < query.start_date or query.end_date and key[0] > query.end_date:
+                    continue
+                if (after is None or key < after) and self._accept(expense_id, query):
+                    found.append(key)
+            found.sort(reverse=True)
+        page = found[:limit]
+        return [expense_id for _, expense_id in page], (page[-1] if len(found) > limit else None)
+
+    def to_snapshot(self):
+        """
+        The index as zlib-compressed JSON: the expenseIds in order with
+        their dates, amounts and categories, and each word's posting list as
+        sorted positions in that order, delta-encoded.
+        """
+        ids = sorted(self.docs)
+        position = {expense_id: i for i, expense_id in enumerate(ids)}
+        postings = {}
+        for term in self.terms:
+            numbers = sorted(position[expense_id] for expense_id in self.postings[term])
+            postings[term] = numbers[:1] + [b - a for a, b in zip(numbers, numbers[1:])]
+        data = {
+            'format': 1,
+            'ids': ids,
+            'dates': [self.docs[expense_id][0] for expense_id in ids],
+            'cents': [self.docs[expense_id][1] for expense_id in ids],
+            'categories': [self.docs[expense_id][2] for expense_id in ids],
+            'postings': postings,
+        }
+        return zlib.compress(json.dumps(data, separators=(',', ':')).encode('utf-8'), 6)
+
+    @classmethod
+    def from_snapshot(cls, blob):
+        data = json.loads(zlib.decompress(blob))
+        ids = data['ids']
+        doc_terms = [[] for _ in ids]
+        index = cls()
+        for term, deltas in data['postings'].items():
+            position, members = 0, set()
+            for delta in deltas:
+                position += delta
+                doc_terms[position].append(term)
+                members.add(ids[position])
+            index.postings[term] = members
+        index.terms = sorted(index.postings)
+        for i, expense_id in enumerate(ids):
+            index.docs[expense_id] = (data['dates'][i], data['cents'][i], data['categories'][i],
+                                      frozenset(doc_terms[i]))
+        index.by_date = sorted((doc[0], expense_id) for expense_id, doc in index.docs.items())
+        return index
+
+    @classmethod
+    def from_expenses(cls, items):
+        index = cls()
+        postings = {}
+        for item in items:
+            doc = document(item)
+            index.docs[item['expenseId']] = doc
+            for term in doc[3]:
+                postings.setdefault(term, set()).add(item['expenseId'])
+        index.postings = postings
+        index.terms = sorted(postings)
+        index.by_date = sorted((doc[0], expense_id) for expense_id, doc in index.docs.items())
+        return index
+
+
+class SearchIndex:
+    """
+    Per-user search indexes, kept in memory and persisted as an S3 snapshot
+    plus a DynamoDB journal of the writes since.
+
+    A write appends one journal item; nothing is read or rewritten. A
+    user's first search in a container reads the snapshot and replays the
+    journal onto it, and later searches replay only the entries written
+    since the previous one, so searches cost one small Query however long
+    the history is. Once ``COMPACT_AFTER`` entries have piled up, the next
+    load folds them into a new snapshot; the snapshot item's version is
+    swapped with a condition, so concurrent compactions cannot lose
+    entries. A user without a snapshot is indexed from the expenses table
+    on first search.
+    """
+
+    def __init__(self, table_name=SEARCH_INDEX_TABLE_NAME, bucket=S3_BUCKET_NAME,
+                 expenses_table_name=EXPENSES_TABLE_NAME, ttl_seconds=CACHE_TTL_SECONDS,
+                 max_users=CACHE_MAX_USERS, clock=time.monotonic, wall_clock=time.time):
+        self.table_name = table_name
+        self.bucket = bucket
+        self.expenses_table_name = expenses_table_name
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._clock = clock
+        self._wall_clock = wall_clock
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'searches': 0, 'loads': 0, 'builds': 0, 'compactions': 0, 'replayed': 0, 'errors': 0}
+
+    @property
+    def table(self):
+        return aws_clients.table(self.table_name)
+
+    def _journal(self, user_id, after):
+        """The journal entries after change id ``after`` in order, and the snapshot item."""
+        kwargs = {'KeyConditionExpression': Key('userId').eq(user_id) & Key('change').gt(after),
+                  'ConsistentRead': True}
+        entries, snapshot = [], None
+        while True:
+            response = self.table.query(**kwargs)
+            for item in response.get('Items', []):
+                if item['change'] == SNAPSHOT_ITEM:
+                    snapshot = item
+                else:
+                    entries.append(item)
+            if 'LastEvaluatedKey' not in response:
+                return entries, snapshot
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _load(self, user_id, compact=False):
+        """
+        Read a user's index from the snapshot and the journal, writing a new
+        snapshot if there is none or ``compact`` is set. Retries if another
+        container swaps the snapshot meanwhile.
+        """
+        for _ in range(LOAD_ATTEMPTS):
+            started = self._wall_clock()
+            snapshot = self.table.get_item(Key={'userId': user_id, 'change': SNAPSHOT_ITEM},
+                                           ConsistentRead=True).get('Item')
+            if snapshot is None:
+                # Writes settled before the table read are in it.
+                watermark = change_id(started - SETTLE_SECONDS)
+                index = UserSearchIndex.from_expenses(
+                    iter_expenses(aws_clients.table(self.expenses_table_name), user_id))
+                self.stats['builds'] += 1
+            else:
+                watermark = snapshot['watermark']
+                try:
+                    blob = aws_clients.client('s3').get_object(
+                        Bucket=self.bucket, Key=snapshot['snapshotKey'])['Body'].read()
+                except Exception as e:
+                    print(f"Search snapshot {snapshot['snapshotKey']} unreadable, reloading: {e}")
+                    continue
+                index = UserSearchIndex.from_snapshot(blob)
+            # Without a snapshot, the whole journal is read: what the table
+            # read already holds is deleted once the first snapshot is stored.
+            entries, latest = self._journal(user_id, watermark if snapshot is not None else '')
+            if (latest or {}).get('version') != (snapshot or {}).get('version'):
+                continue
+            held = [entry for entry in entries if entry['change'] <= watermark]
+            entries = entries[len(held):]
+            index.version = snapshot['version'] if snapshot else None
+            index.watermark = snapshot['watermark'] if snapshot else ''
+            index.checked = started
+            cutoff = change_id(started - SETTLE_SECONDS)
+            settled = [entry for entry in entries if entry['change'] <= cutoff]
+            for entry in settled:
+                index.apply(entry)
+            stored = True
+            if snapshot is None or compact:
+                stored = self._compact(user_id, index, snapshot, max(cutoff, watermark), held + settled)
+            for entry in entries[len(settled):]:
+                index.apply(entry)
+            # After a failed compaction, the next is tried once as many
+            # entries have been written again.
+            if stored:
+                index.pending.update(entry['change'] for entry in entries if entry['change'] > index.watermark)
+            self.stats['loads'] += 1
+            return index
+        raise RuntimeError(f'The search index for {user_id} kept changing while it was read; try again.')
+
+    def _compact(self, user_id, index, snapshot, watermark, settled):
+        """
+        Store ``index`` as the user's snapshot up to ``watermark`` and delete
+        the journal entries it now holds; returns whether it was stored.
+        Failures are logged: the journal still has everything.
+        """
+        version = uuid.uuid4().hex
+        key = f'{SNAPSHOT_PREFIX}{user_id}/{version}.json.z'
+        s3 = aws_clients.client('s3')
+        try:
+            s3.put_object(Bucket=self.bucket, Key=key, Body=index.to_snapshot(),
+                          ContentType='application/octet-stream')
+            condition = (Attr('version').eq(snapshot['version']) if snapshot is not None
+                         else Attr('version').not_exists())
+            self.table.put_item(Item={'userId': user_id, 'change': SNAPSHOT_ITEM, 'version': version,
+                                      'watermark': watermark, 'snapshotKey': key, 'documents': len(index)},
+                                ConditionExpression=condition)
+        except Exception as e:
+            if not (isinstance(e, ClientError)
+                    and e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException'):
+                self.stats['errors'] += 1
+                print(f"Error storing the search index for {user_id}: {e}")
+            s3.delete_object(Bucket=self.bucket, Key=key)
+            return False
+        index.version, index.watermark = version, watermark
+        self.stats['compactions'] += 1
+        try:
+            with self.table.batch_writer() as writer:
+                for entry in settled:
+                    writer.delete_item(Key={'userId': user_id, 'change': entry['change']})
+            if snapshot is not None:
+                s3.delete_object(Bucket=self.bucket, Key=snapshot['snapshotKey'])
+        except Exception as e:
+            print(f"Error cleaning up the search journal for {user_id}: {e}")
+        return True
+
+    def _index(self, user_id):
+        """The user's index, current with the journal."""
+        now = self._clock()
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached is not None and cached[1] > now:
+                self._users.move_to_end(user_id)
+            else:
+                cached = None
+        index = cached[0] if cached is not None else None
+        if index is not None:
+            # Entries within the settle window may have landed after the
+            # last read, so it is read again; replaying twice is harmless.
+            started = self._wall_clock()
+            entries, snapshot = self._journal(user_id, change_id(index.checked - SETTLE_SECONDS))
+            if (snapshot or {}).get('version') != index.version:
+                index = None
+            else:
+                with self._lock:
+                    for entry in entries:
+                        index.apply(entry)
+                    index.pending.update(entry['change'] for entry in entries)
+                    index.checked = started
+                    self.stats['replayed'] += len(entries)
+        if index is None or len(index.pending) >= COMPACT_AFTER:
+            index = self._load(user_id, compact=index is not None)
+            with self._lock:
+                self._users[user_id] = (index, now + self.ttl_seconds)
+                self._users.move_to_end(user_id)
+                while len(self._users) > self.max_users:
+                    self._users.popitem(last=False)
+        return index
+
+    def search(self, user_id, query, limit, after=None):
+        index = self._index(user_id)
+        with self._lock:
+            self.stats['searches'] += 1
+            return index.search(query, limit, after)
+
+    def record_changes(self, user_id, changes):
+        """
+        Journal (old, new) expense pairs: ``old`` is None for a new expense
+        and ``new`` None for a deleted one. Failures are logged: the
+        expenses are already stored, and ``rebuild`` repairs the index.
+        """
+        now = self._wall_clock()
+        entries = []
+        for old, new in changes:
+            expense_id = (new or old or {}).get('expenseId')
+            if not expense_id:
+                continue
+            entry = {'userId': user_id, 'change': change_id(now, expense_id), 'expenseId': expense_id}
+            if new is None:
+                entry['deleted'] = True
+            else:
+                entry.update({field: new[field] for field in INDEXED_FIELDS if field in new})
+            entries.append(entry)
+        if not entries:
+            return
+        try:
+            if len(entries) == 1:
+                self.table.put_item(Item=entries[0])
+            else:
+                with self.table.batch_writer() as writer:
+                    for entry in entries:
+                        writer.put_item(Item=entry)
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"Error journaling search index changes for {user_id}: {e}")
+            return
+        with self._lock:
+            cached = self._users.get(user_id)
+            if cached is not None:
+                for entry in entries:
+                    cached[0].apply(entry)
+                cached[0].pending.update(entry['change'] for entry in entries)
+
+    def rebuild(self, user_id):
+        """Re-index a user from the expenses table, e.g. after journal writes failed."""
+        with self._lock:
+            self._users.pop(user_id, None)
+        snapshot = self.table.get_item(Key={'userId': user_id, 'change': SNAPSHOT_ITEM},
+                                       ConsistentRead=True).get('Item')
+        started = self._wall_clock()
+        index = UserSearchIndex.from_expenses(iter_expenses(aws_clients.table(self.expenses_table_name), user_id))
+        watermark = change_id(started - SETTLE_SECONDS)
+        settled = [entry for entry in self._journal(user_id, '')[0] if entry['change'] <= watermark]
+        self._compact(user_id, index, snapshot, watermark, settled)
+        return len(index)
+
+
+# Module scope, so loaded indexes survive across warm invocations. None when
+# no table is configured; searches then read the user's expenses each time.
+index = SearchIndex() if SEARCH_INDEX_TABLE_NAME else None
+
+
+def record_change(user_id, old, new):
+    if index is not None:
+        index.record_changes(user_id, [(old, new)])
+
+
+def record_changes(user_id, changes):
+    if index is not None and changes:
+        index.record_changes(user_id, changes)
+
+
+def search(user_id, query, limit, next_token=None):
+    """
+    One page of the user's expenseIds matching ``query``, newest first.
+
+    Returns:
+        An (expense_ids, next_token) tuple; next_token is None on the last page.
+
+    Raises:
+        InvalidContinuationToken: if next_token is malformed or belongs to
+            another user or query.
+    """
+    signature = query.signature()
+    after = None
+    if next_token:
+        cursor = decode_continuation_token(next_token, user_id, signature)
+        after = (cursor['date'], cursor['expenseId'])
+    if index is not None:
+        expense_ids, last = index.search(user_id, query, limit, after)
+    else:
+        user_index = UserSearchIndex.from_expenses(iter_expenses(aws_clients.table(EXPENSES_TABLE_NAME), user_id))
+        expense_ids, last = user_index.search(query, limit, after)
+    token = None
+    if last is not None:
+        token = encode_continuation_token({'userId': user_id, 'date': last[0], 'expenseId': last[1]}, signature)
+    return expense_ids, token
+
+
+if __name__ == '__main__':
+    # Index users' existing expenses, or repair their index:
+    #   DYNAMODB_TABLE_NAME=... DYNAMODB_SEARCH_INDEX_TABLE_NAME=... S3_BUCKET_NAME=... \
+    #       python search_index.py user@example.com [...]
+    for user_id in sys.argv[1:]:
+        print(f"Indexed {index.rebuild(user_id)} expenses for {user_id}")
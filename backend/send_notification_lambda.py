@@ -1,55 +1,331 @@
 import json
 import os
-import boto3
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 
-ses = boto3.client('ses')
-dynamodb = boto3.resource('dynamodb')
+from boto3.dynamodb.conditions import Attr
+from botocore.exceptions import ClientError
+
+import aws_clients
+import instrumentation
+import user_preferences
+from rate_limiter import TokenBucket
 
 TABLE_NAME = os.environ.get('DYNAMODB_USERS_TABLE_NAME', 'SmartReceiptsUsers')
+# HASH runId. With it, a run's checkpoint is stored when the run starts,
+# before each continuation, on error and when it completes, so a lost
+# continuation or a failed invocation resumes with {"runId": ...}. Without
+# it the checkpoint only travels in the continuation's payload.
+RUNS_TABLE_NAME = os.environ.get('DYNAMODB_NOTIFICATION_RUNS_TABLE_NAME')
+RUN_TTL_SECONDS = 14 * 24 * 3600
 SENDER_EMAIL = os.environ.get('SENDER_EMAIL', 'test@whattocookbot.com')
+TEMPLATE_NAME = os.environ.get('SES_TEMPLATE_NAME', 'SmartReceiptsReminder')
 
-def lambda_handler(event, context):
+# Parallel scan segments, each read and sent from its own thread.
+SCAN_SEGMENTS = int(os.environ.get('NOTIFICATION_SCAN_SEGMENTS', 4))
+# Users read per scan page. A run only stops between pages, so a page must
+# be sendable within the deadline margin.
+SCAN_PAGE_SIZE = int(os.environ.get('NOTIFICATION_SCAN_PAGE_SIZE', 250))
+# SES accepts up to 50 destinations per SendBulkTemplatedEmail call.
+MAX_BULK_DESTINATIONS = 50
+# Emails per second. Unset, the account's SES MaxSendRate is used.
+MAX_SEND_RATE = float(os.environ.get('SES_MAX_SEND_RATE', 0))
+# Hand the rest of the run to a fresh invocation this close to timing out.
+DEADLINE_MARGIN_MS = int(os.environ.get('NOTIFICATION_DEADLINE_MARGIN_MS', 30000))
+
+RETRYABLE_ERROR_CODES = {'Throttling', 'ThrottlingException', 'ServiceUnavailable'}
+MAX_ATTEMPTS = 5
+BACKOFF_BASE_SECONDS = 0.5
+BACKOFF_MAX_SECONDS = 8.0
+
+def _remaining_ms(context):
+    if context is None or not hasattr(context, 'get_remaining_time_in_millis'):
+        return float('inf')
+    return context.get_remaining_time_in_millis()
+
+def new_checkpoint(segments=None):
+    """Progress of one notification run; it is carried from invocation to invocation."""
+    segments = segments or SCAN_SEGMENTS
+    return {
+        'runId': str(uuid.uuid4()),
+        'totalSegments': segments,
+        # Per segment: the scan key to resume from and whether it is finished.
+        'segments': [{'startKey': None, 'done': False} for _ in range(segments)],
+        'scanned': 0,
+        'sent': 0,
+        'failed': 0,
+        'invocations': 0,
+        'sendSeconds': 0.0,
+        # Bumped by every save; a save from a stale copy is refused.
+        'version': 0,
+    }
+
+def load_checkpoint(run_id):
+    """The stored checkpoint and status of run ``run_id``, or (None, None)."""
+    item = aws_clients.table(RUNS_TABLE_NAME).get_item(Key={'runId': run_id}, ConsistentRead=True).get('Item')
+    if item is None:
+        return None, None
+    return json.loads(item['checkpoint']), item['status']
+
+def save_checkpoint(checkpoint, status):
+    """
+    Store the checkpoint under its runId. Returns False if another
+    invocation has saved this run since ``checkpoint`` was loaded, in which
+    case that invocation owns the run.
+    """
+    if not RUNS_TABLE_NAME:
+        return True
+    version = checkpoint.get('version', 0)
+    condition = Attr('runId').not_exists() if version == 0 else Attr('version').eq(version)
+    stored = dict(checkpoint, version=version + 1)
     try:
-        table = dynamodb.Table(TABLE_NAME)
-        
-        response = table.scan(
-            FilterExpression=boto3.dynamodb.conditions.Attr('notificationsEnabled').eq(True)
+        aws_clients.table(RUNS_TABLE_NAME).put_item(
+            Item={
+                'runId': checkpoint['runId'],
+                'checkpoint': json.dumps(stored),
+                'status': status,
+                'version': version + 1,
+                'updatedAt': int(time.time()),
+                'expiresAt': int(time.time()) + RUN_TTL_SECONDS,
+            },
+            ConditionExpression=condition,
         )
-        
-        users_to_notify = response.get('Items', [])
-        
-        for user in users_to_notify:
-            user_id = user['userId']
-            print(f"Sending notification to user: {user_id}")
-            
-            ses.send_email(
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') != 'ConditionalCheckFailedException':
+            raise
+        return False
+    checkpoint['version'] = version + 1
+    return True
+
+def send_rate(ses):
+    return MAX_SEND_RATE or float(ses.get_send_quota()['MaxSendRate'])
+
+def send_bulk(ses, recipients):
+    """Send the reminder template to ``recipients``; returns (sent, failed)."""
+    destinations = [{'Destination': {'ToAddresses': [recipient]}} for recipient in recipients]
+    for attempt in range(1, MAX_ATTEMPTS + 1):
+        try:
+            response = ses.send_bulk_templated_email(
                 Source=SENDER_EMAIL,
-                Destination={
-                    'ToAddresses': [
-                        user_id, # Assuming the userId is the user's email
-                    ]
-                },
-                Message={
-                    'Subject': {
-                        'Data': 'Reminder: Add Your Receipts!'
-                    },
-                    'Body': {
-                        'Text': {
-                            'Data': 'This is a friendly reminder to add any new receipts to the Smart Receipts Tracker.'
-                        }
-                    }
-                }
+                Template=TEMPLATE_NAME,
+                DefaultTemplateData='{}',
+                Destinations=destinations,
             )
-            
-        return {
-            'statusCode': 200,
-            'body': json.dumps({
-                'message': f'Successfully processed {len(users_to_notify)} users for notification.'
-            })
-        }
+            break
+        except ClientError as e:
+            code = e.response.get('Error', {}).get('Code')
+            if code not in RETRYABLE_ERROR_CODES or attempt == MAX_ATTEMPTS:
+                print(f"Error sending to {len(recipients)} users: {e}")
+                return 0, len(recipients)
+            delay = random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1)))
+            print(f"SES {code} on attempt {attempt}, retrying in {delay:.2f}s")
+            time.sleep(delay)
+    statuses = response.get('Status', [])
+    sent = sum(1 for status in statuses if status.get('Status') == 'Success')
+    for recipient, status in zip(recipients, statuses):
+        if status.get('Status') != 'Success':
+            print(f"Could not notify {recipient}: {status.get('Status')} {status.get('Error', '')}")
+    return sent, len(recipients) - sent
+
+class NotificationRun:
+    """
+    Sends one run's reminders from ``checkpoint`` until every segment is
+    finished or ``deadline`` (a time.monotonic() value) is near.
+    """
+
+    def __init__(self, checkpoint, deadline, table, ses, limiter, batch_size):
+        self.checkpoint = checkpoint
+        self.deadline = deadline
+        self.table = table
+        self.ses = ses
+        self.limiter = limiter
+        self.batch_size = batch_size
+        # Worst case for the pages in flight when the deadline check passes.
+        self.page_seconds = SCAN_PAGE_SIZE * checkpoint['totalSegments'] / limiter.rate
+        self.pages = 0
+        self._lock = threading.Lock()
+
+    def _add(self, **counts):
+        with self._lock:
+            for name, value in counts.items():
+                self.checkpoint[name] += value
+
+    def process_segment(self, segment):
+        state = self.checkpoint['segments'][segment]
+        while not state['done']:
+            if time.monotonic() + self.page_seconds >= self.deadline:
+                return
+            scan_kwargs = {
+                'Segment': segment,
+                'TotalSegments': self.checkpoint['totalSegments'],
+                'Limit': SCAN_PAGE_SIZE,
+                'FilterExpression': Attr('notificationsEnabled').eq(True),
+                'ProjectionExpression': 'userId',
+            }
+            if state['startKey']:
+                scan_kwargs['ExclusiveStartKey'] = state['startKey']
+            response = self.table.scan(**scan_kwargs)
+            recipients = [item['userId'] for item in response.get('Items', [])]  # userId is the email
+            for i in range(0, len(recipients), self.batch_size):
+                batch = recipients[i:i + self.batch_size]
+                self.limiter.acquire(len(batch))
+                sent, failed = send_bulk(self.ses, batch)
+                self._add(sent=sent, failed=failed)
+            self._add(scanned=response.get('ScannedCount', 0))
+            # Advance only after the whole page is sent, so a resumed run
+            # never mails the same user twice.
+            state['startKey'] = response.get('LastEvaluatedKey')
+            state['done'] = state['startKey'] is None
+            with self._lock:
+                self.pages += 1
+
+    def run(self):
+        pending = [i for i, state in enumerate(self.checkpoint['segments']) if not state['done']]
+        started = time.monotonic()
+        try:
+            if pending:
+                with ThreadPoolExecutor(max_workers=len(pending)) as pool:
+                    for future in [pool.submit(self.process_segment, i) for i in pending]:
+                        future.result()
+        finally:
+            # Counted even when a segment fails, so the stored checkpoint is complete.
+            self.checkpoint['invocations'] += 1
+            self.checkpoint['sendSeconds'] += time.monotonic() - started
+        return all(state['done'] for state in self.checkpoint['segments'])
+
+def notify_users(user_ids, ses, limiter, batch_size):
+    """
+    Send the reminder to the given users that have notifications enabled,
+    reading their preferences with BatchGetItem instead of scanning the
+    table. Returns (sent, failed, skipped).
+    """
+    preferences = user_preferences.get_many(user_ids)
+    recipients = [user_id for user_id, item in preferences.items()
+                  if item is not None and item.get('notificationsEnabled') is True]
+    sent = failed = 0
+    for i in range(0, len(recipients), batch_size):
+        batch = recipients[i:i + batch_size]
+        limiter.acquire(len(batch))
+        batch_sent, batch_failed = send_bulk(ses, batch)
+        sent += batch_sent
+        failed += batch_failed
+    return sent, failed, len(preferences) - len(recipients)
+
+def continue_run(context, checkpoint):
+    """Hand the remaining segments to a new asynchronous invocation of this function."""
+    # A stored checkpoint is the one to resume from; the payload only names it.
+    payload = {'runId': checkpoint['runId']} if RUNS_TABLE_NAME else {'checkpoint': checkpoint}
+    aws_clients.client('lambda').invoke(
+        FunctionName=context.function_name,
+        InvocationType='Event',
+        Payload=json.dumps(payload).encode('utf-8'),
+    )
+
+def run_response(message, checkpoint, complete, limiter=None):
+    seconds = checkpoint['sendSeconds']
+    return {
+        'statusCode': 200,
+        'body': json.dumps({
+            'message': message,
+            'runId': checkpoint['runId'],
+            'complete': complete,
+            'scanned': checkpoint['scanned'],
+            'sent': checkpoint['sent'],
+            'failed': checkpoint['failed'],
+            'invocations': checkpoint['invocations'],
+            'seconds': round(seconds, 2),
+            'emailsPerSecond': round(checkpoint['sent'] / seconds, 1) if seconds else 0.0,
+            'rateLimitWaitSeconds': round(limiter.waited_seconds, 2) if limiter else 0.0,
+        })
+    }
+
+@instrumentation.traced
+def lambda_handler(event, context):
+    checkpoint = None
+    try:
+        event = event or {}
+        user_ids = event.get('userIds')
+        if user_ids is not None and (not isinstance(user_ids, list) or not all(isinstance(u, str) and u for u in user_ids)):
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': 'userIds must be a list of user ids.'})
+            }
+        if event.get('runId'):
+            if not RUNS_TABLE_NAME:
+                return {
+                    'statusCode': 400,
+                    'body': json.dumps({'error': 'Resuming by runId needs DYNAMODB_NOTIFICATION_RUNS_TABLE_NAME.'})
+                }
+            stored, status = load_checkpoint(event['runId'])
+            if stored is None:
+                return {
+                    'statusCode': 404,
+                    'body': json.dumps({'error': f"No notification run {event['runId']}."})
+                }
+            if status == 'complete':
+                return run_response('Notification run already complete.', stored, True)
+        ses = aws_clients.client('ses')
+        rate = send_rate(ses)
+        # Batches no bigger than one second of quota, so a single call never
+        # exceeds the SES rate on its own.
+        batch_size = max(1, min(MAX_BULK_DESTINATIONS, int(rate)))
+        limiter = TokenBucket(rate, capacity=batch_size)
+
+        if user_ids is not None:
+            sent, failed, skipped = notify_users(user_ids, ses, limiter, batch_size)
+            print(f"Notified {sent} of {len(user_ids)} users, failed {failed}, skipped {skipped}")
+            return {
+                'statusCode': 200,
+                'body': json.dumps({
+                    'message': 'Notifications sent.',
+                    'sent': sent,
+                    'failed': failed,
+                    'skipped': skipped,
+                })
+            }
+        deadline = time.monotonic() + (_remaining_ms(context) - DEADLINE_MARGIN_MS) / 1000.0
+
+        if event.get('runId'):
+            checkpoint = stored
+        elif event.get('checkpoint'):
+            checkpoint = event['checkpoint']
+        else:
+            checkpoint = new_checkpoint()
+        # Claim the run before sending: an asynchronous event can be
+        # delivered twice, and only one copy may resume it.
+        if not save_checkpoint(checkpoint, 'running'):
+            return run_response('Notification run is already being resumed by another invocation.',
+                                checkpoint, False)
+        run = NotificationRun(checkpoint, deadline, aws_clients.table(TABLE_NAME), ses, limiter, batch_size)
+        complete = run.run()
+        if not complete:
+            if not run.pages:
+                raise RuntimeError('No scan page fits in the time left; raise the timeout or lower '
+                                   'NOTIFICATION_SCAN_PAGE_SIZE.')
+            # Saved before the hand-off, so a lost continuation can be resumed.
+            save_checkpoint(checkpoint, 'continued')
+            continue_run(context, checkpoint)
+        else:
+            save_checkpoint(checkpoint, 'complete')
+
+        print(f"Notification run {checkpoint['runId']}: sent {checkpoint['sent']}, "
+              f"failed {checkpoint['failed']}, scanned {checkpoint['scanned']} in {checkpoint['sendSeconds']:.1f}s")
+        return run_response('Notification run complete.' if complete else
+                            'Notification run continued in a new invocation.', checkpoint, complete, limiter)
     except Exception as e:
         print(f"Error: {str(e)}")
+        body = {'error': str(e)}
+        if checkpoint is not None:
+            body['runId'] = checkpoint['runId']
+            # The pages already sent stay sent; a resume starts after them.
+            try:
+                save_checkpoint(checkpoint, 'failed')
+            except Exception as save_error:
+                print(f"Error saving notification run {checkpoint['runId']}: {save_error}")
         return {
             'statusCode': 500,
-            'body': json.dumps({'error': str(e)})
+            'body': json.dumps(body)
         }
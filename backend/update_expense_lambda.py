@@ -1,22 +1,20 @@
 import json
 import os
-import boto3
-
-dynamodb = boto3.resource('dynamodb')
+import aws_clients
+import instrumentation
+import expense_aggregates
+import recurring_expenses
+import search_index
+import vendor_index
+from expense_model import EDITABLE_ATTRIBUTES, Expense, ExpenseValidationError
 
 TABLE_NAME = os.environ.get('DYNAMODB_TABLE_NAME')
 
+@instrumentation.traced
 def lambda_handler(event, context):
     try:
         user_id = event.get('userId')
         expense_id = event.get('expenseId')
-        vendor = event.get('vendor', 'Not Applicable')
-        amount = str(event.get('amount', 'Not Applicable')) # Store as string
-        category = event.get('category', 'Not Applicable')
-        description = event.get('description', 'Not Applicable')
-        date = event.get('date', 'Not Applicable')
-        s3_key = event.get('s3_key', None)
-        is_recurring = event.get('isRecurring', False)
 
         if not user_id or not expense_id:
             return {
@@ -24,24 +22,33 @@ def lambda_handler(event, context):
                 'body': json.dumps({'error': 'userId and expenseId are required.'})
             }
 
-        table = dynamodb.Table(TABLE_NAME)
-        
-        update_expression = "SET vendor = :v, amount = :a, category = :c, description = :d, #dt = :date_val, isRecurring = :ir"
-        expression_attribute_values = {
-            ':v': vendor,
-            ':a': amount,
-            ':c': category,
-            ':d': description,
-            ':date_val': date,
-            ':ir': is_recurring,
-        }
-        expression_attribute_names = {
-            '#dt': 'date' # 'date' is a reserved keyword in DynamoDB, so we use an expression attribute name
-        }
+        try:
+            expense = Expense.from_event(event)
+        except ExpenseValidationError as e:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': str(e), 'fields': e.errors})
+            }
+
+        table = aws_clients.table(TABLE_NAME)
+        item = expense.to_item()
+
+        # Every attribute goes through a name placeholder; 'date' is a reserved keyword in DynamoDB.
+        set_clauses = []
+        remove_clauses = []
+        expression_attribute_names = {}
+        expression_attribute_values = {}
+        for i, attribute in enumerate(EDITABLE_ATTRIBUTES + (('s3_key',) if expense.s3_key else ())):
+            expression_attribute_names[f'#a{i}'] = attribute
+            if attribute in item:
+                set_clauses.append(f'#a{i} = :v{i}')
+                expression_attribute_values[f':v{i}'] = item[attribute]
+            else:
+                remove_clauses.append(f'#a{i}')
 
-        if s3_key:
-            update_expression += ", s3_key = :s"
-            expression_attribute_values[':s'] = s3_key
+        update_expression = 'SET ' + ', '.join(set_clauses)
+        if remove_clauses:
+            update_expression += ' REMOVE ' + ', '.join(remove_clauses)
 
         response = table.update_item(
             Key={
@@ -51,18 +58,28 @@ def lambda_handler(event, context):
             UpdateExpression=update_expression,
             ExpressionAttributeValues=expression_attribute_values,
             ExpressionAttributeNames=expression_attribute_names,
-            ReturnValues="UPDATED_NEW"
+            # The old amount/category/date are needed to move the aggregates.
+            ReturnValues="ALL_OLD"
         )
+        expense_aggregates.record_change(user_id, response.get('Attributes'), item)
+        # A changed vendor or category is a correction worth learning from.
+        vendor_index.record_change(user_id, response.get('Attributes'), item)
+        search_index.record_change(user_id, response.get('Attributes'), item)
+        # Unticking a detected isRecurring also stops detection for the vendor.
+        recurring_expenses.record_change(user_id, response.get('Attributes'), item)
+
+        updated_attributes = {key: value for key, value in expense.to_response().items()
+                              if key in EDITABLE_ATTRIBUTES or key == 's3_key'}
 
         return {
             'statusCode': 200,
             'body': json.dumps({
                 'message': 'Expense updated successfully',
-                'updatedAttributes': response['Attributes']
+                'updatedAttributes': updated_attributes
             })
         }
     except Exception as e:
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
@@ -1,31 +1,29 @@
 import json
-import os
-import boto3
 
-dynamodb = boto3.resource('dynamodb')
-
-# Assume a new table for user preferences
-TABLE_NAME = os.environ.get('DYNAMODB_USERS_TABLE_NAME', 'SmartReceiptsUsers')
+import instrumentation
+import user_preferences
 
+@instrumentation.traced
 def lambda_handler(event, context):
     try:
         user_id = event.get('userId')
-        notifications_enabled = event.get('notificationsEnabled')
 
-        if not user_id or notifications_enabled is None:
+        if not user_id:
             return {
                 'statusCode': 400,
-                'body': json.dumps({'error': 'userId and notificationsEnabled are required.'})
+                'body': json.dumps({'error': 'userId is required.'})
             }
-
-        table = dynamodb.Table(TABLE_NAME)
-
-        table.put_item(
-            Item={
-                'userId': user_id,
-                'notificationsEnabled': notifications_enabled
+        try:
+            attributes = user_preferences.parse_update(event)
+        except ValueError as e:
+            return {
+                'statusCode': 400,
+                'body': json.dumps({'error': str(e)})
             }
-        )
+
+        # Only the given preferences are written; the rest of the user's
+        # item is left as it is.
+        user_preferences.update(user_id, attributes)
 
         return {
             'statusCode': 200,
@@ -1,42 +1,38 @@
 import json
 import base64
-import os
-import uuid
-import boto3
-
-s3_client = boto3.client('s3')
-
-S3_BUCKET_NAME = os.environ.get('S3_BUCKET_NAME')
+import instrumentation
+import receipt_fingerprints
+from receipt_storage import S3_BUCKET_NAME, store_receipt_image
 
+@instrumentation.traced
 def lambda_handler(event, context):
     try:
         # When invoked directly, the payload is the event itself
         image_data_base64 = event['image_data']
-        file_name = event.get('file_name', str(uuid.uuid4()) + '.jpg')
 
         # Decode the base64 image data
-        image_bytes = base64.b64decode(image_data_base64)
-
-        # Generate a unique key for S3
-        s3_key = f"receipts/{file_name}"
-
-        # Upload image to S3
-        s3_client.put_object(
-            Bucket=S3_BUCKET_NAME,
-            Key=s3_key,
-            Body=image_bytes,
-            ContentType='image/jpeg' # Assuming JPEG, adjust if other types are supported
-        )
+        with instrumentation.phase('base64.decode'):
+            image_bytes = base64.b64decode(image_data_base64)
+        s3_key, inference_key = store_receipt_image(image_bytes, event.get('file_name'))
 
         s3_url = f"https://{S3_BUCKET_NAME}.s3.amazonaws.com/{s3_key}"
+        body = {
+            'message': 'Image uploaded successfully',
+            's3_key': s3_key,
+            's3_url': s3_url,
+            'inference_key': inference_key
+        }
+
+        # With a userId, look the image up among the user's earlier receipts.
+        # Unconfirmed until extraction compares vendor, amount and date.
+        with instrumentation.phase('fingerprint'):
+            match = receipt_fingerprints.check(event.get('userId'), s3_key, image_bytes)
+        if match is not None:
+            body['possibleDuplicateOf'] = receipt_fingerprints.describe(match)
 
         return {
             'statusCode': 200,
-            'body': json.dumps({
-                'message': 'Image uploaded successfully',
-                's3_key': s3_key,
-                's3_url': s3_url
-            })
+            'body': json.dumps(body)
         }
     except KeyError as e:
         return {
@@ -47,4 +43,5 @@ def lambda_handler(event, context):
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
-        }
\ No newline at end of file
+        }
+
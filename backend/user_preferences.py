@@ -0,0 +1,232 @@
+import os
+import random
+import sys
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from botocore.exceptions import ClientError
+
+import aws_clients
+
+# HASH userId (the user's email). Preferences share the item with whatever
+# else is stored about the user, so writes only touch their own attributes.
+TABLE_NAME = os.environ.get('DYNAMODB_USERS_TABLE_NAME', 'SmartReceiptsUsers')
+
+# Attribute name -> accepted type. Updates may set any subset of these.
+PREFERENCE_ATTRIBUTES = {
+    'notificationsEnabled': bool,
+}
+
+# Users read are kept this long in a warm container, LRU-bounded. Another
+# container's write shows up here once the entry expires.
+CACHE_TTL_SECONDS = int(os.environ.get('PREFERENCES_CACHE_TTL_SECONDS', 60))
+CACHE_MAX_USERS = int(os.environ.get('PREFERENCES_CACHE_USERS', 4096))
+
+# BatchGetItem takes up to 100 keys per call.
+BATCH_GET_KEYS = 100
+RETRYABLE_ERROR_CODES = {'ProvisionedThroughputExceededException', 'ThrottlingException',
+                         'RequestLimitExceeded', 'InternalServerError'}
+MAX_ATTEMPTS = 8
+BACKOFF_BASE_SECONDS = 0.05
+BACKOFF_MAX_SECONDS = 2.0
+
+
+def _backoff(attempt):
+    time.sleep(random.uniform(0, min(BACKOFF_MAX_SECONDS, BACKOFF_BASE_SECONDS * 2 ** (attempt - 1))))
+
+
+def parse_update(values):
+    """
+    The preference attributes present in ``values``, type checked.
+
+    Raises:
+        ValueError: if none are present or one has the wrong type.
+    """
+    attributes = {}
+    for name, kind in PREFERENCE_ATTRIBUTES.items():
+        value = values.get(name)
+        if value is None:
+            continue
+        if not isinstance(value, kind):
+            raise ValueError(f'{name} must be a {kind.__name__}.')
+        attributes[name] = value
+    if not attributes:
+        raise ValueError(f"At least one of {', '.join(PREFERENCE_ATTRIBUTES)} is required.")
+    return attributes
+
+
+class PreferenceStore:
+    """
+    Read-through cache over the users table.
+
+    ``get`` serves a user from memory for ``CACHE_TTL_SECONDS`` (users with
+    no item are cached too), and concurrent misses for the same user share
+    one GetItem. ``get_many`` answers many users with one BatchGetItem per
+    100 uncached ones. ``update`` writes only the given attributes with
+    UpdateItem and caches the item it gets back.
+    """
+
+    def __init__(self, table_name=TABLE_NAME, ttl_seconds=CACHE_TTL_SECONDS,
+                 max_users=CACHE_MAX_USERS, clock=time.monotonic):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._clock = clock
+        self._users = OrderedDict()
+        self._loading = {}
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'coalesced': 0, 'reads': 0, 'batch_reads': 0, 'writes': 0}
+
+    @property
+    def table(self):
+        return aws_clients.table(self.table_name)
+
+    def _cached(self, user_id, now):
+        """(found, item) under the lock."""
+        cached = self._users.get(user_id)
+        if cached is None or cached[1] <= now:
+            return False, None
+        self._users.move_to_end(user_id)
+        return True, cached[0]
+
+    def _store(self, user_id, item):
+        """Cache ``item`` (None for no item), under the lock."""
+        self._users[user_id] = (item, self._clock() + self.ttl_seconds)
+        self._users.move_to_end(user_id)
+        while len(self._users) > self.max_users:
+            self._users.popitem(last=False)
+
+    def get(self, user_id):
+        """The user's item, or None if there is none."""
+        with self._lock:
+            found, item = self._cached(user_id, self._clock())
+            if found:
+                self.stats['hits'] += 1
+                return dict(item) if item is not None else None
+            loading = self._loading.get(user_id)
+            if loading is None:
+                loading = self._loading[user_id] = Future()
+                self.stats['misses'] += 1
+                owner = True
+            else:
+                self.stats['coalesced'] += 1
+                owner = False
+        if not owner:
+            item = loading.result()
+            return dict(item) if item is not None else None
+        try:
+            item = self.table.get_item(Key={'userId': user_id}).get('Item')
+        except Exception as e:
+            with self._lock:
+                del self._loading[user_id]
+            loading.set_exception(e)
+            raise
+        with self._lock:
+            self.stats['reads'] += 1
+            self._store(user_id, item)
+            del self._loading[user_id]
+        loading.set_result(item)
+        return dict(item) if item is not None else None
+
+    def _batch_read(self, client, user_ids):
+        """
+        One BatchGetItem of up to 100 users, resending UnprocessedKeys with
+        backoff. Returns the items by userId; users without one are absent.
+        """
+        found = {}
+        keys = [{'userId': user_id} for user_id in user_ids]
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                response = client.batch_get_item(RequestItems={self.table_name: {'Keys': keys}})
+                with self._lock:
+                    self.stats['batch_reads'] += 1
+                for item in response.get('Responses', {}).get(self.table_name, []):
+                    found[item['userId']] = item
+                keys = response.get('UnprocessedKeys', {}).get(self.table_name, {}).get('Keys', [])
+            except ClientError as e:
+                if e.response.get('Error', {}).get('Code') not in RETRYABLE_ERROR_CODES:
+                    raise
+            if not keys:
+                return found
+            if attempt < MAX_ATTEMPTS:
+                _backoff(attempt)
+        raise RuntimeError(f'{len(keys)} users not read after {MAX_ATTEMPTS} attempts; the table is throttling reads.')
+
+    def get_many(self, user_ids):
+        """
+        The items of many users, as ``{userId: item or None}``. Duplicates
+        are read once and cached users are not read at all.
+        """
+        result, missing = {}, []
+        with self._lock:
+            now = self._clock()
+            for user_id in dict.fromkeys(user_ids):
+                found, item = self._cached(user_id, now)
+                if found:
+                    self.stats['hits'] += 1
+                    result[user_id] = dict(item) if item is not None else None
+                else:
+                    self.stats['misses'] += 1
+                    missing.append(user_id)
+        if missing:
+            client = aws_clients.resource('dynamodb').meta.client
+            for i in range(0, len(missing), BATCH_GET_KEYS):
+                chunk = missing[i:i + BATCH_GET_KEYS]
+                found = self._batch_read(client, chunk)
+                with self._lock:
+                    for user_id in chunk:
+                        item = found.get(user_id)
+                        self._store(user_id, item)
+                        result[user_id] = dict(item) if item is not None else None
+        return result
+
+    def update(self, user_id, attributes):
+        """Set ``attributes`` on the user's item, creating it if needed; returns the item."""
+        names = {f'#a{i}': name for i, name in enumerate(attributes)}
+        try:
+            response = self.table.update_item(
+                Key={'userId': user_id},
+                UpdateExpression='SET ' + ', '.join(f'{alias} = :v{i}' for i, alias in enumerate(names)),
+                ExpressionAttributeNames=names,
+                ExpressionAttributeValues={f':v{i}': value for i, value in enumerate(attributes.values())},
+                ReturnValues='ALL_NEW',
+            )
+        except Exception:
+            # The write may still have gone through.
+            self.invalidate(user_id)
+            raise
+        item = response.get('Attributes')
+        with self._lock:
+            self.stats['writes'] += 1
+            self._store(user_id, item)
+        return dict(item) if item is not None else None
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._users.pop(user_id, None)
+
+
+# Module scope, so cached users survive across warm invocations.
+store = PreferenceStore()
+
+
+def get(user_id):
+    return store.get(user_id)
+
+
+def get_many(user_ids):
+    return store.get_many(user_ids)
+
+
+def update(user_id, attributes):
+    return store.update(user_id, attributes)
+
+
+if __name__ == '__main__':
+    # Print the preferences of the users given on the command line, one
+    # BatchGetItem per 100 users:
+    #   DYNAMODB_USERS_TABLE_NAME=... python user_preferences.py a@example.com b@example.com
+    for user_id, item in get_many(sys.argv[1:]).items():
+        print(user_id, {name: item.get(name) for name in PREFERENCE_ATTRIBUTES} if item else None)
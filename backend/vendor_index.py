@@ -0,0 +1,243 @@
+import difflib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict, namedtuple
+from decimal import Decimal
+
+from boto3.dynamodb.conditions import Key
+
+import aws_clients
+import expense_model
+
+# HASH scope (a userId, or GLOBAL_SCOPE), RANGE vendorKey (the normalized name).
+# One item per scope and vendor with a vote counter per category.
+VENDOR_INDEX_TABLE_NAME = os.environ.get('DYNAMODB_VENDOR_INDEX_TABLE_NAME')
+GLOBAL_SCOPE = '#global'
+CATEGORY_PREFIX = 'category#'
+
+# A user's own correction outweighs the votes it replaces.
+CORRECTION_WEIGHT = 3
+# The global index answers only once enough users agree.
+GLOBAL_MIN_VOTES = int(os.environ.get('VENDOR_INDEX_GLOBAL_MIN_VOTES', 2))
+MIN_SHARE = float(os.environ.get('VENDOR_INDEX_MIN_SHARE', 0.7))
+# Loaded scopes are kept this long in a warm container, LRU-bounded.
+CACHE_TTL_SECONDS = int(os.environ.get('VENDOR_INDEX_CACHE_TTL_SECONDS', 300))
+CACHE_MAX_SCOPES = int(os.environ.get('VENDOR_INDEX_CACHE_SCOPES', 256))
+FUZZY_CUTOFF = 0.85
+
+VendorMatch = namedtuple('VendorMatch', ['vendor', 'category', 'source'])
+
+_DROPPED = re.compile(r"['’`.-]")
+_SEPARATORS = re.compile(r'[^a-z0-9]+')
+_STOP_WORDS = frozenset(('the', 'inc', 'llc', 'ltd', 'co', 'corp', 'corporation', 'company', 'store', 'no'))
+
+
+def normalize_vendor(name):
+    """
+    The index key for a vendor name: lower case, accents and punctuation
+    dropped, store numbers and legal suffixes removed.
+
+    'Wal-Mart Store #5221' and 'WALMART 5221' both become 'walmart'.
+    """
+    if name is None or name == expense_model.NOT_APPLICABLE:
+        return ''
+    text = unicodedata.normalize('NFKD', str(name)).encode('ascii', 'ignore').decode('ascii').lower()
+    text = _DROPPED.sub('', text)
+    words = [word for word in _SEPARATORS.split(text)
+             if word and word not in _STOP_WORDS and not any(char.isdigit() for char in word)]
+    return ' '.join(words)
+
+
+def decide(counts, min_votes):
+    """The category the votes settle on, or None if they are too few or split."""
+    votes = {category: count for category, count in counts.items() if count > 0}
+    if not votes:
+        return None
+    category, top = max(votes.items(), key=lambda item: item[1])
+    if top < min_votes or top < MIN_SHARE * sum(votes.values()):
+        return None
+    return category
+
+
+class VendorTrie:
+    """
+    Vendor entries keyed word by word, so a longer name on a receipt
+    ('walmart supercenter') finds the entry for a known prefix ('walmart').
+    Names that match no prefix fall back to a fuzzy match against keys with
+    the same first letter, which catches OCR and spelling slips.
+    """
+
+    def __init__(self):
+        self._root = {}
+        self._by_initial = {}
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def add(self, key, category, count, vendor=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = {'vendor': vendor or key, 'counts': {}}
+            node = self._root
+            for word in key.split(' '):
+                node = node.setdefault(word, {})
+            node[None] = entry
+            self._by_initial.setdefault(key[0], []).append(key)
+        entry['counts'][category] = entry['counts'].get(category, 0) + count
+        return entry
+
+    def find(self, key):
+        """The entry for ``key``: exact, else longest known prefix, else fuzzy."""
+        node, found = self._root, None
+        for word in key.split(' '):
+            node = node.get(word)
+            if node is None:
+                break
+            found = node.get(None, found)
+        if found is not None:
+            return found
+        close = difflib.get_close_matches(key, self._by_initial.get(key[0], ()), n=1, cutoff=FUZZY_CUTOFF)
+        return self.entries[close[0]] if close else None
+
+
+class VendorIndex:
+    """
+    Vendor -> category answers learned from saved and corrected expenses.
+
+    A user's own entries win over the global ones, which need
+    ``GLOBAL_MIN_VOTES`` votes and a ``MIN_SHARE`` majority. Each scope is
+    read from the table once and then served from a trie in memory, kept
+    for ``CACHE_TTL_SECONDS`` in an LRU of ``CACHE_MAX_SCOPES`` scopes;
+    writes update both.
+    """
+
+    def __init__(self, table_name=VENDOR_INDEX_TABLE_NAME, ttl_seconds=CACHE_TTL_SECONDS,
+                 max_scopes=CACHE_MAX_SCOPES, clock=time.monotonic):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.max_scopes = max_scopes
+        self._clock = clock
+        self._scopes = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'user_hits': 0, 'global_hits': 0, 'misses': 0, 'loads': 0, 'errors': 0}
+
+    @property
+    def table(self):
+        return aws_clients.table(self.table_name)
+
+    def _load(self, scope):
+        trie = VendorTrie()
+        kwargs = {'KeyConditionExpression': Key('scope').eq(scope)}
+        while True:
+            response = self.table.query(**kwargs)
+            for item in response.get('Items', []):
+                for name, count in item.items():
+                    if name.startswith(CATEGORY_PREFIX):
+                        trie.add(item['vendorKey'], name[len(CATEGORY_PREFIX):], int(count), item.get('vendor'))
+            if 'LastEvaluatedKey' not in response:
+                return trie
+            kwargs['ExclusiveStartKey'] = response['LastEvaluatedKey']
+
+    def _trie(self, scope):
+        now = self._clock()
+        with self._lock:
+            cached = self._scopes.get(scope)
+            if cached is not None and cached[1] > now:
+                self._scopes.move_to_end(scope)
+                return cached[0]
+        trie = self._load(scope)
+        with self._lock:
+            self.stats['loads'] += 1
+            self._scopes[scope] = (trie, now + self.ttl_seconds)
+            self._scopes.move_to_end(scope)
+            while len(self._scopes) > self.max_scopes:
+                self._scopes.popitem(last=False)
+        return trie
+
+    def lookup(self, vendor, user_id=None):
+        """A VendorMatch for the vendor name, or None if the index has no answer."""
+        key = normalize_vendor(vendor)
+        if not key:
+            return None
+        try:
+            for scope, min_votes, source in ((user_id, 1, 'user'), (GLOBAL_SCOPE, GLOBAL_MIN_VOTES, 'global')):
+                if scope is None:
+                    continue
+                entry = self._trie(scope).find(key)
+                category = decide(entry['counts'], min_votes) if entry is not None else None
+                if category is not None:
+                    self.stats[f'{source}_hits'] += 1
+                    return VendorMatch(entry['vendor'], category, source)
+        except Exception as e:
+            # The index only saves model calls; never fail a request over it.
+            self.stats['errors'] += 1
+            print(f"Error reading vendor index: {e}")
+            return None
+        self.stats['misses'] += 1
+        return None
+
+    def _vote(self, scope, key, vendor, category, count):
+        self.table.update_item(
+            Key={'scope': scope, 'vendorKey': key},
+            UpdateExpression='ADD #count :count SET vendor = if_not_exists(vendor, :vendor), updatedAt = :now',
+            ExpressionAttributeNames={'#count': CATEGORY_PREFIX + category},
+            ExpressionAttributeValues={':count': Decimal(count), ':vendor': vendor,
+                                       ':now': Decimal(int(time.time()))},
+        )
+        with self._lock:
+            cached = self._scopes.get(scope)
+            if cached is not None:
+                cached[0].add(key, category, count, vendor)
+
+    def record_change(self, user_id, old, new):
+        """
+        Learn from one saved (``old`` is None) or updated expense.
+
+        A save is a vote for its vendor and category. An update that changes
+        either is a correction and counts ``CORRECTION_WEIGHT`` times for the
+        user. Old votes are left alone rather than taken back, since the old
+        value may never have been counted (e.g. a batch import) and counters
+        must not go negative. Failures are logged: the expense is already
+        stored.
+        """
+        pairs = []
+        for expense in (old, new):
+            if expense is None:
+                pairs.append(None)
+                continue
+            key = normalize_vendor(expense.get('vendor'))
+            category = expense_model.parse_category(expense.get('category')).value
+            if not key or category == expense_model.NOT_APPLICABLE:
+                pairs.append(None)
+            else:
+                pairs.append((key, str(expense.get('vendor')).strip(), category))
+        old_pair, new_pair = pairs
+        if old_pair is not None and new_pair is not None and old_pair[::2] == new_pair[::2]:
+            return
+        if new_pair is None:
+            return
+        key, vendor, category = new_pair
+        try:
+            self._vote(user_id, key, vendor, category, CORRECTION_WEIGHT if old is not None else 1)
+            self._vote(GLOBAL_SCOPE, key, vendor, category, 1)
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"Error updating vendor index for {user_id}: {e}")
+
+
+# Module scope, so loaded scopes survive across warm invocations. None when
+# no table is configured, which turns the index off.
+index = VendorIndex() if VENDOR_INDEX_TABLE_NAME else None
+
+
+def lookup(vendor, user_id=None):
+    return index.lookup(vendor, user_id) if index is not None else None
+
+
+def record_change(user_id, old, new):
+    if index is not None:
+        index.record_change(user_id, old, new)
@@ -10,7 +10,8 @@ import { Expense, UploadState } from './types/expense';
 import { User, AuthState } from './types/auth';
 import { getCurrentUser, signOutUser } from './utils/auth';
 import { saveExpenseToStorage } from './utils/storage';
-import { invokeLambda } from './utils/lambda'; // Import invokeLambda
+import { extractReceipt } from './utils/extraction';
+import { uploadReceipt } from './utils/upload';
 
 function App() {
   const [authState, setAuthState] = useState<AuthState>({
@@ -72,23 +73,16 @@ function App() {
   };
 
   // Modified handleUpload to manage processing state and call Lambdas
-  const handleUpload = async (file: File, base64data: string) => {
+  const handleUpload = async (file: File, _base64data: string) => {
     setUploadedFile(file);
     setUploadState(prev => ({ ...prev, isProcessing: true })); // Start processing
 
     try {
-      // 1. Call UploadImageLambda
-      const uploadResponse = await invokeLambda('UploadImageLambda', {
-        image_data: base64data,
-        file_name: file.name,
-      });
-      const s3Key = uploadResponse.s3_key;
+      // 1. Upload the image straight to S3 with a presigned URL
+      const s3Key = await uploadReceipt(file);
 
-      // 2. Call BedrockCategorizationLambda
-      const bedrockResponse = await invokeLambda('BedrockCategorizationLambda', {
-        s3_key: s3Key,
-      });
-      const extractedData = bedrockResponse.extracted_data;
+      // 2. Queue the extraction and wait for its result
+      const extractedData = await extractReceipt(s3Key);
 
       setUploadState({
         isUploading: false,
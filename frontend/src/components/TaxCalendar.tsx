@@ -22,7 +22,6 @@ interface CalendarData {
 export const TaxCalendar: React.FC<TaxCalendarProps> = ({ isOpen, onClose, userId }) => {
   const [currentDate, setCurrentDate] = useState(new Date());
   const [viewType, setViewType] = useState<ViewType>('month');
-  const [expenses, setExpenses] = useState<Expense[]>([]);
   const [calendarData, setCalendarData] = useState<CalendarData[]>([]);
   const [selectedDate, setSelectedDate] = useState<string | null>(null);
 
@@ -31,7 +30,6 @@ export const TaxCalendar: React.FC<TaxCalendarProps> = ({ isOpen, onClose, userI
       const fetchExpenses = async () => {
         try {
           const userExpenses = await getExpenses(userId);
-          setExpenses(userExpenses);
           generateCalendarData(userExpenses);
         } catch (error) {
           console.error("Error fetching expenses for Tax Calendar:", error);
@@ -143,7 +141,7 @@ export const TaxCalendar: React.FC<TaxCalendarProps> = ({ isOpen, onClose, userI
 
   const handleExportTaxData = async () => {
     const year = viewType === 'year' ? currentDate.getFullYear() : new Date().getFullYear();
-    await exportTaxData(expenses, year, userId);
+    await exportTaxData(year, userId);
   };
 
   const formatCellDate = (dateStr: string) => {
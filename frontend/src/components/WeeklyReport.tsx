@@ -1,8 +1,7 @@
 import React, { useState, useRef, useEffect } from 'react';
 import { Download, Mail, Calendar, TrendingUp, Target } from 'lucide-react';
 import { shareReportViaEmail, generateReportImage } from '../utils/download';
-import { getExpenses } from '../utils/dataService';
-import { Expense } from '../types/expense';
+import { getSpendingSummary, SpendingTotals } from '../utils/dataService';
 
 interface WeeklyReportProps {
   userId: string;
@@ -10,48 +9,42 @@ interface WeeklyReportProps {
 
 export const WeeklyReport: React.FC<WeeklyReportProps> = ({ userId }) => {
   const [showConfetti, setShowConfetti] = useState(false);
-  const [expenses, setExpenses] = useState<Expense[]>([]);
+  const [totalSpent, setTotalSpent] = useState(0);
+  const [categoryTotals, setCategoryTotals] = useState<Record<string, SpendingTotals>>({});
   const reportRef = useRef<HTMLDivElement>(null);
 
-  useEffect(() => {
-    const fetchExpenses = async () => {
-      try {
-        const userExpenses = await getExpenses(userId);
-        setExpenses(userExpenses);
-      } catch (error) {
-        console.error("Error fetching expenses:", error);
-      }
-    };
-    fetchExpenses();
-  }, [userId]);
-
   // Calculate weekly report data
   const now = new Date();
   const weekStart = new Date(now.getFullYear(), now.getMonth(), now.getDate() - now.getDay());
   const weekEnd = new Date(weekStart);
   weekEnd.setDate(weekStart.getDate() + 6);
 
-  const weeklyExpenses = expenses.filter(expense => {
-    const expenseDate = new Date(expense.date);
-    // Filter out expenses with invalid dates
-    if (isNaN(expenseDate.getTime())) {
-      return false;
-    }
-    return expenseDate >= weekStart && expenseDate <= weekEnd;
-  });
+  // Local calendar date as YYYY-MM-DD, matching how expense dates are stored
+  const toDateLabel = (date: Date) =>
+    `${date.getFullYear()}-${String(date.getMonth() + 1).padStart(2, '0')}-${String(date.getDate()).padStart(2, '0')}`;
+  const weekStartLabel = toDateLabel(weekStart);
+  const weekEndLabel = toDateLabel(weekEnd);
+
+  useEffect(() => {
+    const fetchSummary = async () => {
+      try {
+        // Seven precomputed day buckets instead of every expense the user has
+        const summary = await getSpendingSummary(userId, 'day', weekStartLabel, weekEndLabel);
+        setTotalSpent(summary.total);
+        setCategoryTotals(summary.categories);
+      } catch (error) {
+        console.error("Error fetching spending summary:", error);
+      }
+    };
+    fetchSummary();
+  }, [userId, weekStartLabel, weekEndLabel]);
 
-  const totalSpent = weeklyExpenses.reduce((sum, expense) => sum + (Number(expense.amount) || 0), 0);
   const budgetLimit = 500; // This could be user-configurable
   const percentUnderBudget = Math.max(0, Math.round(((budgetLimit - totalSpent) / budgetLimit) * 100));
 
   // Calculate top categories
-  const categoryTotals = weeklyExpenses.reduce((acc, expense) => {
-    acc[expense.category] = (acc[expense.category] || 0) + (Number(expense.amount) || 0);
-    return acc;
-  }, {} as Record<string, number>);
-
   const topCategories = Object.entries(categoryTotals)
-    .map(([category, amount]) => ({
+    .map(([category, { total: amount }]) => ({
       category,
       amount,
       percentage: totalSpent > 0 ? (amount / totalSpent) * 100 : 0,
@@ -6,9 +6,23 @@ export const saveExpense = async (expense: Omit<Expense, 'id'>): Promise<Expense
   return { ...expense, id: response.expenseId };
 };
 
-export const getExpenses = async (userId: string): Promise<Expense[]> => {
-  const response = await invokeLambda('GetExpensesLambda', { userId });
-  return response.expenses.map((exp: any) => ({
+export interface ExpenseFilters {
+  startDate?: string;
+  endDate?: string;
+  category?: string | string[];
+}
+
+export const getExpenses = async (userId: string, filters: ExpenseFilters = {}): Promise<Expense[]> => {
+  // GetExpensesLambda returns one page at a time; follow nextToken until the listing is complete.
+  const items: any[] = [];
+  let nextToken: string | undefined;
+  do {
+    const response = await invokeLambda('GetExpensesLambda', { userId, ...filters, limit: 1000, nextToken });
+    items.push(...response.expenses);
+    nextToken = response.nextToken || undefined;
+  } while (nextToken);
+
+  return items.map((exp: any) => ({
     id: exp.expenseId, // Map expenseId from DynamoDB to id for frontend
     receiptUrl: exp.s3_key, // Map s3_key from DynamoDB to receiptUrl
     ...exp,
@@ -16,6 +30,37 @@ export const getExpenses = async (userId: string): Promise<Expense[]> => {
   }));
 };
 
+export type SummaryPeriod = 'day' | 'week' | 'month' | 'year' | 'all';
+
+export interface SpendingTotals {
+  total: number;
+  count: number;
+}
+
+export interface SpendingBucket extends SpendingTotals {
+  period: SummaryPeriod;
+  bucket: string;
+  categories: Record<string, SpendingTotals>;
+}
+
+export interface SpendingSummary extends SpendingTotals {
+  period: SummaryPeriod;
+  buckets: SpendingBucket[];
+  categories: Record<string, SpendingTotals>;
+}
+
+// Totals precomputed server-side per day/ISO week/month/year, so dashboards
+// don't have to download every expense. start/end are bucket labels, e.g.
+// '2024-03-01' (day), '2024-W10' (week), '2024-03' (month) or '2024' (year).
+export const getSpendingSummary = async (
+  userId: string,
+  period: SummaryPeriod,
+  start?: string,
+  end?: string,
+): Promise<SpendingSummary> => {
+  return invokeLambda('GetSpendingSummaryLambda', { userId, period, start, end });
+};
+
 export const updateExpense = async (expense: Expense): Promise<Expense> => {
   await invokeLambda('UpdateExpenseLambda', expense);
   return expense;
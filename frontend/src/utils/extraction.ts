@@ -0,0 +1,48 @@
+import { invokeLambda } from './lambda';
+
+type JobStatus = 'queued' | 'running' | 'succeeded' | 'dead';
+
+interface ExtractionJob {
+  jobId: string;
+  s3_key: string;
+  status: JobStatus;
+  attempts: number;
+  extracted_data?: Record<string, any>;
+  error?: string;
+}
+
+// Long-poll window per status request; the backend caps it at 20 seconds.
+const POLL_WAIT_SECONDS = 15;
+// Give up and fall back to manual entry after this long.
+const MAX_WAIT_MS = 3 * 60 * 1000;
+
+const NOT_APPLICABLE_DATA = {
+  vendor: 'Not Applicable',
+  amount: 'Not Applicable',
+  category: 'Not Applicable',
+  description: 'Not Applicable',
+  date: 'Not Applicable',
+};
+
+// Extracts a receipt already uploaded to S3. The backend queues the model
+// call and returns at once, so this polls the job until it finishes; when
+// the job queue isn't deployed the first response already has the data.
+export const extractReceipt = async (s3Key: string): Promise<Record<string, any>> => {
+  const response = await invokeLambda('BedrockCategorizationLambda', { s3_key: s3Key, async: true });
+  if (response.extracted_data) {
+    return response.extracted_data;
+  }
+
+  let job: ExtractionJob = response.job;
+  const giveUpAt = Date.now() + MAX_WAIT_MS;
+  while (job.status !== 'succeeded' && job.status !== 'dead' && Date.now() < giveUpAt) {
+    const status = await invokeLambda('GetExtractionJobLambda', { jobId: job.jobId, wait_seconds: POLL_WAIT_SECONDS });
+    job = status.job;
+  }
+
+  if (job.status !== 'succeeded' || !job.extracted_data) {
+    console.error(`Receipt extraction did not finish (${job.status}): ${job.error ?? 'timed out'}`);
+    return NOT_APPLICABLE_DATA;
+  }
+  return job.extracted_data;
+};
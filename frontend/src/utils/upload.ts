@@ -0,0 +1,60 @@
+import { invokeLambda } from './lambda';
+
+// Files above this size go through a multipart upload so a dropped connection only retries one part.
+const MULTIPART_THRESHOLD = 8 * 1024 * 1024;
+
+const putToS3 = async (url: string, body: Blob, contentType?: string): Promise<Response> => {
+  const response = await fetch(url, {
+    method: 'PUT',
+    body,
+    headers: contentType ? { 'Content-Type': contentType } : undefined,
+  });
+  if (!response.ok) {
+    throw new Error(`S3 upload failed with status ${response.status}`);
+  }
+  return response;
+};
+
+// Uploads a receipt straight to S3 with presigned URLs and returns its S3 key.
+export const uploadReceipt = async (file: File): Promise<string> => {
+  const contentType = file.type || 'image/jpeg';
+
+  if (file.size <= MULTIPART_THRESHOLD) {
+    const upload = await invokeLambda('GetPresignedUrlLambda', {
+      action: 'upload',
+      content_type: contentType,
+      content_length: file.size,
+    });
+    await putToS3(upload.upload_url, file, contentType);
+    return upload.s3_key;
+  }
+
+  const upload = await invokeLambda('GetPresignedUrlLambda', {
+    action: 'multipart',
+    content_type: contentType,
+    content_length: file.size,
+  });
+  try {
+    const parts = await Promise.all(
+      upload.parts.map(async (part: { part_number: number; size: number; upload_url: string }) => {
+        const start = (part.part_number - 1) * upload.part_size;
+        const response = await putToS3(part.upload_url, file.slice(start, start + part.size));
+        return { part_number: part.part_number, etag: response.headers.get('ETag') };
+      })
+    );
+    await invokeLambda('GetPresignedUrlLambda', {
+      action: 'complete_multipart',
+      s3_key: upload.s3_key,
+      upload_id: upload.upload_id,
+      parts,
+    });
+  } catch (error) {
+    await invokeLambda('GetPresignedUrlLambda', {
+      action: 'abort_multipart',
+      s3_key: upload.s3_key,
+      upload_id: upload.upload_id,
+    });
+    throw error;
+  }
+  return upload.s3_key;
+};